@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Deterministic synthetic parallel corpora (reference and machine translation) for benchmarks
+
+Usage: python -m benchmarks.corpus --n_docs 1000 --output_dir /tmp/corpus
+"""
+from typing import Dict, Iterator, List, Tuple
+from xml.sax.saxutils import escape, quoteattr
+import argparse
+import os
+import numpy as np
+
+
+class SyntheticCorpus():
+    """Documents of random sentences over a Zipf-distributed vocabulary of pseudo-words,
+    and a noisy "translation" of every sentence
+
+    The corpus only depends on the constructor arguments, the same arguments always give
+    the same files.
+
+    Attributes:
+        n_docs (int): number of documents
+        sents_per_doc (int): number of sentences of every document
+        vocab_size (int): number of distinct words
+        sent_length (int): mean number of words of a sentence
+        mt_noise (float): probability that a word of the translation is replaced by a
+        random word, a quarter of it is the probability that a word is dropped
+        seed (int): random seed
+        vocabulary (list(str)): the words, most frequent first
+    """
+
+    # syllables of the pseudo-words, a word is a number written in base len(SYLLABLES)
+    SYLLABLES = ["ka", "lo", "mi", "nu", "pe", "ra", "si", "to", "vu", "ze",
+                 "ba", "de", "fi", "go", "hu", "ja"]
+
+    # Zipf exponent of the word frequencies
+    ZIPF_EXPONENT = 1.1
+
+    # number of documents generated at once
+    chunk_docs = 1000
+
+    def __init__(self, n_docs: int, sents_per_doc: int = 10, vocab_size: int = 50000,
+                 sent_length: int = 20, mt_noise: float = 0.2, seed: int = 0):
+        """constructor
+
+        Args:
+            n_docs (int): number of documents
+            sents_per_doc (int): number of sentences of every document. Default: 10
+            vocab_size (int): number of distinct words. Default: 50000
+            sent_length (int): mean number of words of a sentence. Default: 20
+            mt_noise (float): word replacement probability of the translation. Default: 0.2
+            seed (int): random seed. Default: 0
+
+        Raises:
+            ValueError: If a size is not positive or mt_noise is not between 0.0 and 1.0
+        """
+        if min(n_docs, sents_per_doc, vocab_size, sent_length) < 1:
+            raise ValueError("Corpus sizes must be positive integers.")
+        if not 0.0 <= mt_noise <= 1.0:
+            raise ValueError("mt_noise must be between 0.0 and 1.0.")
+        self.n_docs = n_docs
+        self.sents_per_doc = sents_per_doc
+        self.vocab_size = vocab_size
+        self.sent_length = sent_length
+        self.mt_noise = mt_noise
+        self.seed = seed
+        self.vocabulary = [self.get_word(i) for i in range(vocab_size)]
+        ranks = np.arange(1, vocab_size + 1, dtype=np.float64)
+        self.word_probs = ranks ** -self.ZIPF_EXPONENT
+        self.word_probs /= self.word_probs.sum()
+
+    @classmethod
+    def get_word(cls, i: int) -> str:
+        """pseudo-word number i"""
+        syllables = [cls.SYLLABLES[i % len(cls.SYLLABLES)]]
+        i //= len(cls.SYLLABLES)
+        while i:
+            syllables.append(cls.SYLLABLES[i % len(cls.SYLLABLES)])
+            i //= len(cls.SYLLABLES)
+        return "".join(syllables)
+
+    @property
+    def doc_ids(self) -> List[str]:
+        """ids of the documents"""
+        return ["doc%i" % i for i in range(self.n_docs)]
+
+    def iter_docs(self) -> Iterator[Tuple[str, List[str], List[str]]]:
+        """generate the documents one chunk of documents at a time
+
+        Yields:
+            tuple(str, list(str), list(str)): doc id, reference sentences and translated
+            sentences
+        """
+        rng = np.random.RandomState(self.seed)
+        vocabulary = np.array(self.vocabulary, dtype=object)
+        for start in range(0, self.n_docs, self.chunk_docs):
+            n_sents = min(self.chunk_docs, self.n_docs - start) * self.sents_per_doc
+            lengths = 1 + rng.poisson(self.sent_length - 1, n_sents)
+            words = rng.choice(self.vocab_size, lengths.sum(), p=self.word_probs)
+            noise = rng.random_sample(len(words))
+            replacements = rng.choice(self.vocab_size, len(words), p=self.word_probs)
+            mt_words = np.where(noise < self.mt_noise, replacements, words)
+            kept = noise >= self.mt_noise / 4
+
+            offsets = np.concatenate([[0], np.cumsum(lengths)]).tolist()
+            ref_sents, mt_sents = [], []
+            for sent_start, sent_end in zip(offsets[:-1], offsets[1:]):
+                ref_sents.append(" ".join(vocabulary[words[sent_start:sent_end]]))
+                mt_sents.append(" ".join(vocabulary[mt_words[sent_start:sent_end][
+                    kept[sent_start:sent_end]]]))
+            for i in range(0, n_sents, self.sents_per_doc):
+                yield ("doc%i" % (start + i // self.sents_per_doc),
+                       ref_sents[i:i + self.sents_per_doc], mt_sents[i:i + self.sents_per_doc])
+
+    def write(self, output_dir: str, prefix: str = "synthetic") -> Dict[str, str]:
+        """write the corpus in all input formats of evaluate.py
+
+        Args:
+            output_dir (str): directory of the files, created if necessary
+            prefix (str): prefix of the file names. Default: "synthetic"
+
+        Returns:
+            dict(str, str): paths of the files -> ref_sgm, mt_sgm, ref_txt, mt_txt and
+            doc_mapping
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        paths = {name: os.path.join(output_dir, "%s.%s" % (prefix, ext)) for name, ext in [
+            ("ref_sgm", "ref.sgm"), ("mt_sgm", "mt.sgm"), ("ref_txt", "ref.txt"),
+            ("mt_txt", "mt.txt"), ("doc_mapping", "doc_mapping.tsv")]}
+        files = {name: open(path, 'w', encoding='utf-8') for name, path in paths.items()}
+        try:
+            files["ref_sgm"].write('<refset setid="%s" srclang="any" trglang="xx">\n' % prefix)
+            files["mt_sgm"].write('<tstset setid="%s" srclang="any" trglang="xx">\n' % prefix)
+            for doc_id, ref_sents, mt_sents in self.iter_docs():
+                for name, sysid, sents in [("ref", "ref", ref_sents), ("mt", "mt", mt_sents)]:
+                    files[name + "_sgm"].write(self.format_sgml_doc(doc_id, sysid, sents))
+                    files[name + "_txt"].write("".join(sent + "\n" for sent in sents))
+                files["doc_mapping"].write("".join(
+                    "%s\t%i\n" % (doc_id, seg_id) for seg_id in range(1, len(ref_sents) + 1)))
+            files["ref_sgm"].write("</refset>\n")
+            files["mt_sgm"].write("</tstset>\n")
+        finally:
+            for corpus_f in files.values():
+                corpus_f.close()
+        return paths
+
+    @staticmethod
+    def format_sgml_doc(doc_id: str, sysid: str, sents: List[str]) -> str:
+        """one <doc> element of a WMT SGML file"""
+        segs = "".join('<seg id="%i">%s</seg>\n' % (i, escape(sent))
+                       for i, sent in enumerate(sents, 1))
+        return '<doc sysid=%s docid=%s>\n<p>\n%s</p>\n</doc>\n' % (
+            quoteattr(sysid), quoteattr(doc_id), segs)
+
+
+if __name__ == '__main__':
+    cmdline_parser = argparse.ArgumentParser(
+        description='Generate a deterministic synthetic parallel corpus (SGML, txt and doc mapping files)')
+    cmdline_parser.add_argument('--n_docs', type=int, default=1000, help='Number of documents.')
+    cmdline_parser.add_argument('--sents_per_doc', type=int, default=10,
+                                help='Number of sentences per document.')
+    cmdline_parser.add_argument('--vocab_size', type=int, default=50000,
+                                help='Number of distinct words.')
+    cmdline_parser.add_argument('--sent_length', type=int, default=20,
+                                help='Mean number of words per sentence.')
+    cmdline_parser.add_argument('--mt_noise', type=float, default=0.2,
+                                help='Probability that a word of the translation is replaced by a random word.')
+    cmdline_parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    cmdline_parser.add_argument('--prefix', type=str, default='synthetic',
+                                help='Prefix of the file names.')
+    cmdline_parser.add_argument('--output_dir', type=str, required=True,
+                                help='Directory of the generated files.')
+    args = cmdline_parser.parse_args()
+
+    corpus = SyntheticCorpus(args.n_docs, args.sents_per_doc, args.vocab_size, args.sent_length,
+                             args.mt_noise, args.seed)
+    for path in corpus.write(args.output_dir, args.prefix).values():
+        print(path)
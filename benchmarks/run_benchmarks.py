@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Time every stage of the evaluation pipeline on synthetic corpora of increasing size
+
+Usage: python -m benchmarks.run_benchmarks --sizes 1000 10000 --output_file results.json
+
+With --stand_in, the elasticsearch backend is benchmarked against an ElasticsearchStandIn
+server with injected latency, to load-test batching and concurrency without elasticsearch.
+"""
+from typing import Dict, List, Tuple
+from collections import OrderedDict
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import numpy as np
+from modules import SEARCH_BACKENDS, DocParser, ElasticsearchStandIn, NativeTrecEval, Profiler, Run
+from modules.trec_files import write_trec_file
+from benchmarks.corpus import SyntheticCorpus
+
+
+# stages of run_pipeline, in order
+STAGES = ("generate", "parse", "index", "search", "relevance", "write", "trec_eval")
+
+# span names of the stages, the pipeline has spans of the same names
+STAGE_PREFIX = "benchmark."
+
+
+def run_pipeline(corpus: SyntheticCorpus, work_dir: str,
+                 input_format: str = "sgm", max_queries: int = 0, max_judgments: int = 0,
+                 **kwargs) -> Tuple[Dict[str, float], int]:
+    """run the steps of evaluate.py on a synthetic corpus, one stage at a time
+
+    Args:
+        corpus (SyntheticCorpus): the corpus
+        work_dir (str): directory of the corpus, qrel and res files
+        input_format (str): "sgm" or "txt" (with a doc mapping file). Default: "sgm"
+        max_queries (int): search with at most max_queries queries, evenly spaced over
+        the corpus, 0 for all queries. Default: 0
+        max_judgments (int): also limit the number of queries to max_judgments divided by
+        the number of documents, 0 for no limit. Default: 0
+        **kwargs: settings of evaluate.py (backend, relv_mode, query_mode, n_ret, ...)
+
+    Note:
+        The qrels judge every document for every query (only non-zero labels with
+        qrel_nonzero_only, but jenks labels unretrieved documents 1), so the relevance,
+        write and trec_eval stages grow with the number of queries times the number of
+        documents.
+
+    Returns:
+        dict(str, float): the metrics, so that runs can be compared
+        int: number of queries
+    """
+    with Profiler.span(STAGE_PREFIX + "generate"):
+        paths = corpus.write(work_dir)
+
+    with Profiler.span(STAGE_PREFIX + "parse"):
+        if input_format == "txt":
+            ref = DocParser(paths["ref_txt"], paths["doc_mapping"])
+            mt = DocParser(paths["mt_txt"], paths["doc_mapping"])
+        else:
+            ref = DocParser(paths["ref_sgm"])
+            mt = DocParser(paths["mt_sgm"])
+        ref_docs, mt_docs = ref.get_docs(), mt.get_docs()
+        query_iterable = ref.get_queries()
+
+    search = SEARCH_BACKENDS[kwargs.get("backend", "local")].from_connection(**kwargs)
+    with Profiler.span(STAGE_PREFIX + "index"):
+        ref_index = search.index(ref_docs)
+        mt_index = search.index(mt_docs, search.INDEX + "_mt")
+        if kwargs.get("query_mode", "sentences") == "unique_terms":
+            query_iterable = search.get_terms(ref_docs, ref_index)
+        ref_queries = list(query_iterable)
+        limits = [len(ref_queries)]
+        if max_queries:
+            limits.append(max_queries)
+        if max_judgments:
+            limits.append(max(1, max_judgments // len(ref_docs)))
+        if min(limits) < len(ref_queries):
+            positions = np.linspace(0, len(ref_queries) - 1, min(limits)).round().astype(int)
+            ref_queries = [ref_queries[i] for i in positions]
+
+    with Profiler.span(STAGE_PREFIX + "search"):
+        ref_results = search.search_documents(ref_queries, ref_docs, ref_index)
+        mt_results = search.search_documents(ref_queries, mt_docs, mt_index)
+
+    with Profiler.span(STAGE_PREFIX + "relevance"):
+        qrels = search.get_qrels(ref_queries, ref_docs, ref_results, **kwargs)
+
+    qrel_file = os.path.join(work_dir, "synthetic.qrel")
+    res_file = os.path.join(work_dir, "synthetic.res")
+    with Profiler.span(STAGE_PREFIX + "write"):
+        with open(qrel_file, "w") as qrel_f:
+            write_trec_file(qrel_f, qrels)
+        with open(res_file, "w") as res_f:
+            write_trec_file(res_f, Run(mt_results))
+
+    with Profiler.span(STAGE_PREFIX + "trec_eval"):
+        metrics = NativeTrecEval.from_files(qrel_file, res_file).get_metrics()
+    return metrics, len(ref_queries)
+
+
+def get_version() -> Dict[str, str]:
+    """versions of the code and of its environment"""
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=repo_dir,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def run_benchmarks(sizes: List[int], trace_memory: bool = False,
+                   corpus_kwargs: dict = None, **kwargs) -> dict:
+    """run the pipeline on a synthetic corpus of every size
+
+    Args:
+        sizes (list(int)): numbers of documents
+        trace_memory (bool): measure the peak Python allocations of every stage.
+        Default: False
+        corpus_kwargs (dict): settings of SyntheticCorpus other than n_docs
+        **kwargs: settings of run_pipeline
+
+    Returns:
+        dict: version, settings and one run per size with the timings of every stage
+    """
+    corpus_kwargs = corpus_kwargs or {}
+    runs = []
+    for n_docs in sizes:
+        logging.info("Benchmarking %i documents...", n_docs)
+        corpus = SyntheticCorpus(n_docs, **corpus_kwargs)
+        with tempfile.TemporaryDirectory() as work_dir, Profiler(trace_memory) as profiler:
+            metrics, n_queries = run_pipeline(corpus, work_dir, **kwargs)
+        report = profiler.get_report()
+        stages = OrderedDict((stage, report["stages"].pop(STAGE_PREFIX + stage))
+                             for stage in STAGES)
+        for stage, record in stages.items():
+            logging.info("%s: %.2fs, %.1f MB", stage, record["seconds"], record["peak_rss_mb"])
+        runs.append({
+            "n_docs": n_docs,
+            "n_sents": n_docs * corpus.sents_per_doc,
+            "n_queries": n_queries,
+            "stages": stages,
+            "total_seconds": round(sum(stage["seconds"] for stage in stages.values()), 4),
+            # spans of the pipeline inside the stages, see modules.profiler
+            "spans": report["stages"],
+            "counters": report["counters"],
+            "histograms": report["histograms"],
+            "metrics": {name: metrics[name] for name in ("map", "ndcg") if name in metrics},
+        })
+    return {
+        "version": get_version(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "settings": dict(corpus_kwargs, trace_memory=trace_memory, **kwargs),
+        "runs": runs,
+        # maximum resident set size of the benchmark process (kilobytes on Linux)
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 2),
+    }
+
+
+if __name__ == '__main__':
+    cmdline_parser = argparse.ArgumentParser(
+        description='Time every stage of the evaluation pipeline on synthetic corpora')
+    cmdline_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                                help='Numbers of documents of the synthetic corpora.')
+    cmdline_parser.add_argument('--sents_per_doc', type=int, default=10,
+                                help='Number of sentences per document.')
+    cmdline_parser.add_argument('--vocab_size', type=int, default=50000,
+                                help='Number of distinct words.')
+    cmdline_parser.add_argument('--sent_length', type=int, default=20,
+                                help='Mean number of words per sentence.')
+    cmdline_parser.add_argument('--mt_noise', type=float, default=0.2,
+                                help='Probability that a word of the translation is replaced by a random word.')
+    cmdline_parser.add_argument('--seed', type=int, default=0, help='Random seed of the corpora.')
+    cmdline_parser.add_argument('--input_format', type=str, default='sgm', choices=['sgm', 'txt'],
+                                help='Parse SGML files or txt files with a doc mapping file.')
+    cmdline_parser.add_argument('--backend', type=str, default='local',
+                                choices=sorted(SEARCH_BACKENDS),
+                                help='Retrieval backend, "elasticsearch" needs a running server.')
+    cmdline_parser.add_argument('--port', type=int, default=9200, help='elasticsearch port')
+    cmdline_parser.add_argument('--stand_in', action='store_true',
+                                help='Benchmark the elasticsearch backend against a local stand-in server '
+                                     '(see es_stand_in.py) instead of elasticsearch.')
+    cmdline_parser.add_argument('--stand_in_latency_ms', type=float, default=0.0,
+                                help='Delay of every request of the stand-in server in milliseconds.')
+    cmdline_parser.add_argument('--stand_in_query_latency_ms', type=float, default=0.0,
+                                help='Delay per query of search requests of the stand-in server in milliseconds.')
+    cmdline_parser.add_argument('--search_batch_size', type=int, default=0,
+                                help='Number of queries per _msearch request, 0 to adapt it to the latency.')
+    cmdline_parser.add_argument('--concurrency', type=int, default=1,
+                                help='Maximum number of search requests in flight.')
+    cmdline_parser.add_argument('--query_mode', type=str, default='sentences',
+                                choices=['sentences', 'unique_terms'])
+    cmdline_parser.add_argument('--relv_mode', type=str, default='jenks',
+                                choices=['jenks', 'percentile'])
+    cmdline_parser.add_argument('--n_ret', type=int, default=100,
+                                help='Number of documents returned per query.')
+    cmdline_parser.add_argument('--workers', type=int, default=1,
+                                help='Number of processes which convert scores to relevance labels.')
+    cmdline_parser.add_argument('--max_queries', type=int, default=0,
+                                help='Maximum number of queries (evenly spaced over the corpus), 0 for all.')
+    cmdline_parser.add_argument('--max_judgments', type=int, default=10000000,
+                                help='Limit the number of queries to max_judgments / number of documents, '
+                                     '0 for no limit. The qrels judge every document for every query.')
+    cmdline_parser.add_argument('--qrel_nonzero_only', action='store_true',
+                                help='Only write documents with a non-zero relevance label to the qrel file.')
+    cmdline_parser.add_argument('--trace_memory', action='store_true',
+                                help='Also measure peak Python allocations (tracemalloc slows down some stages).')
+    cmdline_parser.add_argument('--output_file', type=str, default=None,
+                                help='Write the results as JSON to output_file instead of stdout.')
+    args = cmdline_parser.parse_args()
+
+    logging.basicConfig(
+        level=os.environ.get("LOGLEVEL", "INFO"),
+        format='%(asctime)s.%(msecs)03d %(levelname)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    stand_in = None
+    if args.stand_in:
+        stand_in = ElasticsearchStandIn(
+            0, latency_ms=args.stand_in_latency_ms,
+            query_latency_ms=args.stand_in_query_latency_ms).start()
+        args.backend, args.port = "elasticsearch", stand_in.port
+
+    results = run_benchmarks(
+        args.sizes, args.trace_memory,
+        corpus_kwargs={"sents_per_doc": args.sents_per_doc, "vocab_size": args.vocab_size,
+                       "sent_length": args.sent_length, "mt_noise": args.mt_noise,
+                       "seed": args.seed},
+        input_format=args.input_format, backend=args.backend, port=args.port,
+        query_mode=args.query_mode, relv_mode=args.relv_mode, n_ret=args.n_ret,
+        workers=args.workers, max_queries=args.max_queries, max_judgments=args.max_judgments,
+        qrel_nonzero_only=args.qrel_nonzero_only, search_batch_size=args.search_batch_size,
+        concurrency=args.concurrency)
+    if stand_in is not None:
+        results["stand_in"] = {"latency_ms": stand_in.latency_ms,
+                               "query_latency_ms": stand_in.query_latency_ms,
+                               "requests": stand_in.request_counts}
+        stand_in.stop()
+    output_str = json.dumps(results, indent=2)
+    if args.output_file:
+        with open(args.output_file, 'w') as output_f:
+            print(output_str, file=output_f)
+    else:
+        print(output_str)
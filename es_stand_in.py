@@ -0,0 +1,48 @@
+import argparse
+import logging
+import os
+from modules import ElasticsearchStandIn
+
+if __name__ == '__main__':
+    cmdline_parser = argparse.ArgumentParser(
+        description='Serve the subset of the elasticsearch API used by evaluate.py from in-memory BM25 indices, for offline integration and load tests')
+    cmdline_parser.add_argument('--port', type=int,
+                                default=9200,
+                                help='port (default: 9200)')
+    cmdline_parser.add_argument('--host', type=str,
+                                default='localhost',
+                                help='host name (default: localhost)')
+    cmdline_parser.add_argument('--latency_ms', type=float,
+                                default=0.0,
+                                help='Delay every request by latency_ms milliseconds (default: 0.0)')
+    cmdline_parser.add_argument('--jitter_ms', type=float,
+                                default=0.0,
+                                help='Delay every request by up to jitter_ms more milliseconds, uniformly at random (default: 0.0)')
+    cmdline_parser.add_argument('--query_latency_ms', type=float,
+                                default=0.0,
+                                help='Delay search requests by query_latency_ms milliseconds per query (default: 0.0)')
+    cmdline_parser.add_argument('--error_rate', type=float,
+                                default=0.0,
+                                help='Fail requests with probability error_rate (default: 0.0)')
+    cmdline_parser.add_argument('--error_status', type=int,
+                                default=503,
+                                help='HTTP status of failed requests, elasticsearch clients retry 502, 503 and 504 (default: 503)')
+    cmdline_parser.add_argument('--seed', type=int,
+                                default=None,
+                                help='random seed of jitter and failures')
+    args = cmdline_parser.parse_args()
+
+    logging.basicConfig(
+        level=os.environ.get("LOGLEVEL", "INFO"),
+        format='%(asctime)s.%(msecs)03d %(levelname)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    server = ElasticsearchStandIn(**vars(args))
+    logging.info("Elasticsearch stand-in listening on %s:%i" % (args.host, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,14 +1,30 @@
 import argparse
+import glob
 import os
 import shutil
+import signal
 import logging
-from modules import Search, DocParser, TrecEval
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from modules import DocParser, DocMapping, EvaluationDaemon, TrecEval, QueryMatcher, Profiler, SEARCH_BACKENDS
+from modules import SignificanceTest
+from modules.trec_files import TREC_FORMATS, TEXT, NPZ
+from modules.trec_eval import resolve_metrics
+
+
+def write_profile(profiler: Profiler, args: argparse.Namespace):
+    """stop the --profile profiler and write its report next to the metrics output"""
+    profiler.stop()
+    profile_file = args.profile_file or "%s.profile.json" % (args.output_file or "clireval")
+    profiler.write_report(profile_file, {"settings": vars(args)})
+    logging.info("Profile written to %s", profile_file)
 
 if __name__ == '__main__':
     cmdline_parser = argparse.ArgumentParser(description='MT2IR')
 
     cmdline_parser.add_argument('ref_file', help='reference file')
-    cmdline_parser.add_argument('mt_file', help='translation file')
+    cmdline_parser.add_argument('mt_file', nargs='*',
+                                help='translation file(s) or glob pattern(s). Every file is evaluated as a separate system against ref_file. Not used with --serve.')
     cmdline_parser.add_argument('--doc_mapping_file', type=str,
                                 default=None,
                                 help='Path to an optional document boundary file. Used only ref and mt files are raw text files.')
@@ -18,6 +34,12 @@ if __name__ == '__main__':
     cmdline_parser.add_argument('--port', type=int,
                                 default=9200,
                                 help='elasticsearch port (default: 9200)')
+    cmdline_parser.add_argument(
+        '--backend',
+        type=str,
+        default='elasticsearch',
+        choices=sorted(SEARCH_BACKENDS.keys()),
+        help='retrieval backend. "local" runs BM25 in-process and does not need an ElasticSearch server.')
     cmdline_parser.add_argument(
         '--query_mode',
         type=str,
@@ -26,6 +48,12 @@ if __name__ == '__main__':
             'sentences',
             'unique_terms'],
         help='method used to generate queries')
+    cmdline_parser.add_argument(
+        '--unique_terms_scoring',
+        type=str,
+        default='search',
+        choices=['search', 'term_vectors'],
+        help='How the queries of query_mode = unique_terms are scored. "search" sends one search request per term, "term_vectors" computes the BM25 scores of every term locally from the term vectors of the indexed documents.')
     cmdline_parser.add_argument(
         '--relv_mode',
         type=str,
@@ -35,11 +63,27 @@ if __name__ == '__main__':
             'percentile',
             'query_in_document'],
         help='method used to convert raw BM25 scores relevance judgment labels.')
+    cmdline_parser.add_argument(
+        '--query_match',
+        type=str,
+        default='auto',
+        choices=QueryMatcher.MATCH_MODES,
+        help='How queries are matched against documents when relv_mode = query_in_document. "sentence": a document sentence equals the query, "substring": the query occurs in a document sentence, "auto": sentence for documents split into sentences.')
     cmdline_parser.add_argument(
         '--jenks_nb_class',
         type=int,
         default=5,
         help='Number of classes for Jenks natural breaks optimization. Used only when relv_mode = jenks.')
+    cmdline_parser.add_argument(
+        '--jenks_approx_bins',
+        type=int,
+        default=0,
+        help='Compute approximate Jenks natural breaks from at most this many bins of the scores of queries with more retrieved documents. Must be 0 (exact breaks) or larger than --jenks_nb_class.')
+    cmdline_parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of processes which convert search scores to relevance labels. Queries are split into blocks which are converted in parallel.')
     cmdline_parser.add_argument(
         '--n_percentile',
         type=int,
@@ -50,12 +94,137 @@ if __name__ == '__main__':
         type=int,
         default=100,
         help='Number of documents return by ElasticSearch.')
+    cmdline_parser.add_argument(
+        '--search_batch_size',
+        type=int,
+        default=0,
+        help='Number of queries per ElasticSearch _msearch request. 1 sends one request per query, 0 auto-tunes the batch size based on response latency.')
+    cmdline_parser.add_argument(
+        '--persistent_indices',
+        action='store_true',
+        help='Name indices by a fingerprint of their documents, analyzer and mapping, and reuse them in later runs. Stale indices are deleted with gc_indices.py.')
+    cmdline_parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Keep the index of the translated documents and only re-index the documents which changed since the last run.')
+    cmdline_parser.add_argument(
+        '--index_threads',
+        type=int,
+        default=1,
+        help='Number of threads sending ElasticSearch bulk index requests.')
+    cmdline_parser.add_argument(
+        '--bulk_chunk_bytes',
+        type=int,
+        default=10 * 1024 * 1024,
+        help='Maximum size of an ElasticSearch bulk index request in bytes.')
+    cmdline_parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=1,
+        help='Maximum number of search requests in flight. When > 1, reference and translated documents are indexed and searched concurrently in separate indices.')
+    cmdline_parser.add_argument('--qrel_cache_dir', type=str,
+                                default=None,
+                                help='Cache reference qrels in this directory and reuse them when the same reference, queries and relevance settings are evaluated again.')
+    cmdline_parser.add_argument('--qrel_cache_size', type=int,
+                                default=1024,
+                                help='Maximum size of the qrel cache in MB. Least recently used entries are evicted first.')
+    cmdline_parser.add_argument('--vocab_cache_dir', type=str,
+                                default=None,
+                                help='Store the vocabulary of the reference documents (query_mode = unique_terms) in this directory and reuse it when the same documents are indexed again.')
+    cmdline_parser.add_argument('--qrel_nonzero_only', action='store_true',
+                                help='Only write documents with a non-zero relevance label to the qrel file. Other documents become unjudged, which only changes bpref, gm_bpref, infAP and num_nonrel_judged_ret.')
+    cmdline_parser.add_argument('--trec_format', type=str,
+                                default=TEXT,
+                                choices=TREC_FORMATS,
+                                help='Format of the qrel and res files. "npz" is a compact binary format read by the native engine without text parsing.')
+    cmdline_parser.add_argument('--background_writes', action='store_true',
+                                help='Write qrel and res files in a background thread while searching continues.')
     cmdline_parser.add_argument('--qrel_save_path', type=str,
                                 default=None,
                                 help='path to save qrel file')
     cmdline_parser.add_argument('--res_save_path', type=str,
                                 default=None,
-                                help='path to save res file')
+                                help='path to save res file (a directory with one res file per system when several mt files are evaluated)')
+    cmdline_parser.add_argument(
+        '--metrics',
+        type=str,
+        nargs='+',
+        default=None,
+        help='IR metrics to report: metric names (e.g. map P_10) or trec_eval measure families (e.g. P ndcg_cut). Default: all measures of trec_eval all_trec.')
+    cmdline_parser.add_argument(
+        '--significance',
+        action='store_true',
+        help='Compare every pair of systems with paired bootstrap and approximate randomization tests over the per-query metric values. Requires 2 or more mt files.')
+    cmdline_parser.add_argument(
+        '--significance_metrics',
+        type=str,
+        nargs='+',
+        default=None,
+        help='Metrics compared by --significance (default: map ndcg).')
+    cmdline_parser.add_argument(
+        '--significance_samples',
+        type=int,
+        default=10000,
+        help='Number of bootstrap samples and random swaps of --significance (default: 10000).')
+    cmdline_parser.add_argument(
+        '--significance_alpha',
+        type=float,
+        default=0.05,
+        help='Significance level of --significance, confidence intervals cover 1 - alpha (default: 0.05).')
+    cmdline_parser.add_argument(
+        '--significance_seed',
+        type=int,
+        default=None,
+        help='Random seed of --significance.')
+    cmdline_parser.add_argument(
+        '--eval_engine',
+        type=str,
+        default='native',
+        choices=TrecEval.ENGINES,
+        help='"native" computes the metrics in-process, "trec_eval" runs the external trec_eval binary.')
+    cmdline_parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write a JSON report of the time and peak memory of every stage, ElasticSearch request counts and bytes, and search latency histograms next to the metrics output.')
+    cmdline_parser.add_argument(
+        '--profile_file',
+        type=str,
+        default=None,
+        help='Path of the --profile report. Default: OUTPUT_FILE.profile.json, or clireval.profile.json if metrics are printed to stdout.')
+    cmdline_parser.add_argument(
+        '--profile_trace_memory',
+        action='store_true',
+        help='Also measure peak Python allocations of every stage with tracemalloc (slower). Used with --profile.')
+    cmdline_parser.add_argument(
+        '--cprofile_stages',
+        type=str,
+        nargs='+',
+        default=[],
+        help='Run these stages (e.g. parse bulk_index search create_qrel_file trec_eval) under cProfile and report their most expensive functions. Used with --profile.')
+    cmdline_parser.add_argument(
+        '--serve',
+        action='store_true',
+        help='Run as a daemon: build the reference qrels once, then evaluate the translations posted to http://localhost:SERVE_PORT/evaluate (or to the Unix socket SERVE_SOCKET) and return their metrics as JSON.')
+    cmdline_parser.add_argument(
+        '--serve_port',
+        type=int,
+        default=8000,
+        help='TCP port of the daemon (default: 8000). Used with --serve.')
+    cmdline_parser.add_argument(
+        '--serve_socket',
+        type=str,
+        default=None,
+        help='Listen on this Unix socket instead of SERVE_PORT. Used with --serve.')
+    cmdline_parser.add_argument(
+        '--serve_workers',
+        type=int,
+        default=2,
+        help='Number of translations which are indexed and searched at once (default: 2). Used with --serve.')
+    cmdline_parser.add_argument(
+        '--serve_queue_size',
+        type=int,
+        default=8,
+        help='Number of translations which wait for a worker, more requests are rejected with status 503 (default: 8). Used with --serve.')
     cmdline_parser.add_argument('--output_format', type=str,
                                 default='json',
                                 choices=['tsv', 'json'],
@@ -69,39 +238,140 @@ if __name__ == '__main__':
         help='Write metrics to output_file. If unspecified, metrics will print to stdout.')
 
     args = cmdline_parser.parse_args()
+    try:
+        resolve_metrics(args.metrics)
+        SignificanceTest.get_metric_names(args.significance_metrics)
+    except ValueError as e:
+        cmdline_parser.error(str(e))
+    if args.significance_samples < 1:
+        cmdline_parser.error("--significance_samples must be a positive integer")
+    if not 0.0 < args.significance_alpha < 1.0:
+        cmdline_parser.error("--significance_alpha must be between 0.0 and 1.0")
+    if args.workers < 1:
+        cmdline_parser.error("--workers must be a positive integer")
+    if args.jenks_approx_bins < 0 or 0 < args.jenks_approx_bins <= args.jenks_nb_class:
+        cmdline_parser.error("--jenks_approx_bins must be 0 or larger than --jenks_nb_class")
+    if args.trec_format == NPZ and args.eval_engine == 'trec_eval':
+        cmdline_parser.error("--trec_format npz is not supported by --eval_engine trec_eval")
+    if not args.mt_file and not args.serve:
+        cmdline_parser.error("the following arguments are required: mt_file")
+    if args.persistent_indices and args.incremental:
+        cmdline_parser.error("--persistent_indices and --incremental cannot be combined")
+    if args.serve and args.eval_engine == 'trec_eval':
+        cmdline_parser.error("--serve computes metrics with --eval_engine native")
+
     logging.basicConfig(
         level=os.environ.get("LOGLEVEL", "INFO"),
         format='%(asctime)s.%(msecs)03d %(levelname)s: %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S',
     )
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile_trace_memory, args.cprofile_stages)
+        profiler.start()
+
+    # the doc mapping is parsed once and shared by the reference and all translations
+    doc_mapping = None
+    if args.doc_mapping_file is not None:
+        doc_mapping = DocMapping.from_file(args.doc_mapping_file)
+
     logging.info('Loading ref document:  %s', (args.ref_file))
-    ref = DocParser(args.ref_file, args.doc_mapping_file, args.doc_length)
+    ref = DocParser(args.ref_file, doc_mapping, args.doc_length)
     ref.log_doc_stats()
 
-    logging.info('Loading mt document: %s', (args.mt_file))
-    mt = DocParser(args.mt_file, args.doc_mapping_file, args.doc_length)
-    mt.log_doc_stats()
+    if args.serve:
+        # the daemon keeps the reference qrels in memory and evaluates posted translations
+        daemon = EvaluationDaemon(
+            SEARCH_BACKENDS[args.backend].from_connection(**vars(args)),
+            ref.get_docs(), ref.get_queries(),
+            max_workers=args.serve_workers, queue_size=args.serve_queue_size, **vars(args))
+        server = daemon.serve(args.serve_port, socket_path=args.serve_socket)
+        logging.info("Serving %i queries on %s", len(daemon.query_iterable),
+                     args.serve_socket or "http://localhost:%i" % args.serve_port)
+        # stop on SIGTERM like on Ctrl-C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            daemon.close()
+            if profiler is not None:
+                write_profile(profiler, args)
+        raise SystemExit(0)
+
+    mt_files = []
+    for mt_pattern in args.mt_file:
+        mt_files.extend(sorted(glob.glob(mt_pattern)) or [mt_pattern])
+
+    # systems are named after their files
+    basenames = [os.path.basename(mt_file) for mt_file in mt_files]
+    system_names = basenames if len(set(basenames)) == len(basenames) else mt_files
+
+    if args.significance and len(mt_files) < 2:
+        cmdline_parser.error("--significance compares 2 or more mt files")
+
+    systems = OrderedDict()
+    for system, mt_file in zip(system_names, mt_files):
+        logging.info('Loading mt document: %s', (mt_file))
+        mt = DocParser(mt_file, doc_mapping, args.doc_length)
+        mt.log_doc_stats()
+        systems[system] = mt.get_docs()
 
     query_iterable = ref.get_queries()
 
-    es = Search(
-        ref.get_docs(),
-        mt.get_docs(),
-        query_iterable,
-        **vars(args))
-    tmp_qrel_f, tmp_res_f = es.get_qrel_and_res_files()
-    qrel_f = tmp_qrel_f
-    res_f = tmp_res_f
+    with Profiler.span("retrieval"):
+        es = SEARCH_BACKENDS[args.backend](
+            ref.get_docs(),
+            systems if len(systems) > 1 else systems[system_names[0]],
+            query_iterable,
+            **vars(args))
+    qrel_f = es.get_qrel_and_res_files()[0]
+    res_files = es.get_res_files()
 
     if args.qrel_save_path is not None:
         shutil.move(qrel_f, args.qrel_save_path)
         qrel_f = args.qrel_save_path
 
     if args.res_save_path is not None:
-        shutil.move(res_f, args.res_save_path)
-        res_f = args.res_save_path
+        if len(systems) == 1:
+            shutil.move(res_files[es.DEFAULT_SYSTEM], args.res_save_path)
+            res_files[es.DEFAULT_SYSTEM] = args.res_save_path
+        else:
+            # res_save_path is a directory with one res file per system
+            os.makedirs(args.res_save_path, exist_ok=True)
+            for i, system in enumerate(systems):
+                res_save_path = os.path.join(
+                    args.res_save_path, "%d.%s.res" % (i, os.path.basename(system)))
+                shutil.move(res_files[system], res_save_path)
+                res_files[system] = res_save_path
+
+    if len(systems) == 1:
+        metrics = TrecEval(qrel_f, res_files[es.DEFAULT_SYSTEM],
+                           metrics=args.metrics, engine=args.eval_engine)
+        metrics.print_metrics(
+            output_format=args.output_format,
+            output_file=args.output_file)
+    else:
+        # systems are scored in parallel (NumPy and the trec_eval subprocess release the GIL)
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            system_metrics = executor.map(
+                lambda system: TrecEval(qrel_f, res_files[system], metrics=args.metrics,
+                                        engine=args.eval_engine).get_metrics(), systems)
+            system_metrics = OrderedDict(zip(systems, system_metrics))
+        significance = None
+        if args.significance:
+            with Profiler.span("significance"):
+                significance = SignificanceTest.from_files(
+                    qrel_f, res_files, args.significance_metrics).get_report(
+                        args.significance_samples, args.significance_alpha,
+                        args.significance_seed)
+        TrecEval.print_system_metrics(
+            system_metrics,
+            output_format=args.output_format,
+            output_file=args.output_file,
+            significance=significance)
 
-    metrics = TrecEval(qrel_f, res_f)
-    metrics.print_metrics(
-        output_format=args.output_format,
-        output_file=args.output_file)
+    if profiler is not None:
+        write_profile(profiler, args)
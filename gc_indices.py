@@ -0,0 +1,27 @@
+import argparse
+import logging
+import os
+from modules import Search
+
+if __name__ == '__main__':
+    cmdline_parser = argparse.ArgumentParser(
+        description='Delete stale persistent indices created by evaluate.py --persistent_indices')
+    cmdline_parser.add_argument('--port', type=int,
+                                default=9200,
+                                help='elasticsearch port (default: 9200)')
+    cmdline_parser.add_argument('--max_age_days', type=float,
+                                default=30.0,
+                                help='Delete indices which were not used for more than max_age_days days. Incomplete indices are deleted one day after they were created.')
+    cmdline_parser.add_argument('--dry_run', action='store_true',
+                                help='Only list the stale indices.')
+    args = cmdline_parser.parse_args()
+
+    logging.basicConfig(
+        level=os.environ.get("LOGLEVEL", "INFO"),
+        format='%(asctime)s.%(msecs)03d %(levelname)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+
+    search = Search.from_connection(port=args.port)
+    for index in search.gc_indices(args.max_age_days, args.dry_run):
+        print(index)
@@ -1,4 +1,16 @@
-from .doc_parser import DocParser
+from .doc_parser import DocParser, SgmlReader
+from .doc_store import DocMapping, DocStore
 from .search import Search
-from .trec_eval import TrecEval
+from .local_search import LocalSearch
+from .trec_eval import TrecEval, NativeTrecEval
+from .significance import SignificanceTest
 from .relv_converter import RelvConverter
+from .bm25 import BM25Index
+from .sparse_scores import SparseScores
+from .query_matcher import QueryMatcher
+from .trec_files import Qrels, Run
+from .vocabulary import Vocabulary
+from .profiler import Profiler
+from .es_stand_in import ElasticsearchStandIn
+from .daemon import EvaluationDaemon, QueueFullError
+from .api import SEARCH_BACKENDS, evaluate
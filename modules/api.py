@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Library entry point: evaluate in-memory documents without temporary files or subprocesses
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from collections import OrderedDict
+from .doc_store import QueryView
+from .local_search import LocalSearch
+from .search import Search
+from .trec_eval import NativeTrecEval, TrecEval, resolve_metrics
+
+# retrieval backends selectable with `evaluate.py --backend`
+SEARCH_BACKENDS = {
+    'elasticsearch': Search,
+    'local': LocalSearch
+}
+
+Docs = Iterable[Tuple[str, Union[str, Sequence[str]]]]
+
+
+def get_doc_list(docs: Docs) -> List[Tuple[str, List[str]]]:
+    """documents as a list of (doc id, sentences), a text which is a single string is a
+    document of one sentence
+
+    Args:
+        docs (iterable(tuple(str, str or list(str)))): doc tuples -> (doc id, text or sentences)
+
+    Returns:
+        list(tuple(str, list(str))): List of doc tuples -> (doc id, sentences)
+    """
+    return [(str(doc_id), [text] if isinstance(text, str) else list(text))
+            for doc_id, text in docs]
+
+
+def evaluate(ref_docs: Docs, mt_docs: Union[Docs, Dict[str, Docs]],
+             queries: Optional[Iterable[Tuple[str, str]]] = None,
+             per_query: bool = False,
+             **kwargs) -> Union[Dict[str, float], Tuple[Dict[str, float], Dict[str, Dict[str, float]]]]:
+    """evaluate translated documents against reference documents, like evaluate.py
+
+    Everything stays in memory: search results, relevance judgments (Qrels) and
+    retrieval results (Run) are arrays, and the metrics are computed in-process by
+    NativeTrecEval, so no qrel or res file is written and no trec_eval process is run.
+
+    Args:
+        ref_docs (iterable(tuple(str, str or list(str)))): reference doc tuples
+        -> (doc id, sentences), e.g. DocParser(ref_file).get_docs()
+        mt_docs (iterable(tuple(str, str or list(str))) or dict): translated doc tuples
+        with the doc ids of the reference documents, or a dict which maps system names to
+        translated doc tuples
+        queries (iterable(tuple(str, str))): query tuples -> (query id, query text).
+        Default: every reference sentence, with query id `<doc_id>_<position>`
+        per_query (bool): also return the metrics of every query. Default: False
+        **backend (str): retrieval backend, see SEARCH_BACKENDS. Default: "local"
+        **metrics (list(str)): metric or family names, see resolve_metrics.
+        Default: all measures of trec_eval's all_trec
+        **kwargs: other settings of evaluate.py, e.g. query_mode, relv_mode or n_ret
+        (default: 100), see Search.__init__
+
+    Raises:
+        ValueError: If the backend or a metric is unknown, or if the settings are invalid
+
+    Returns:
+        dict(str, float): Maps metric name to metric value, rounded like TrecEval.get_metrics
+        (a dict from system name to such dicts if mt_docs is a dict)
+        dict(str, dict(str, float)): only if per_query, maps query id to a dict from metric
+        name to value (a dict from system name to such dicts if mt_docs is a dict)
+    """
+    backend = kwargs.pop('backend', 'local')
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError("Unknown backend: %s" % backend)
+    kwargs.setdefault('n_ret', 100)
+    metric_names = resolve_metrics(kwargs.get('metrics'))
+
+    ref_docs = get_doc_list(ref_docs)
+    if isinstance(mt_docs, dict):
+        systems = OrderedDict((system, get_doc_list(docs)) for system, docs in mt_docs.items())
+    else:
+        systems = OrderedDict([(Search.DEFAULT_SYSTEM, get_doc_list(mt_docs))])
+    queries = list(QueryView(ref_docs) if queries is None else queries)
+
+    search = SEARCH_BACKENDS[backend].from_connection(**kwargs)
+    queries, qrels = search.get_ref_qrels(ref_docs, queries, "%s_ref" % search.INDEX, **kwargs)
+
+    system_metrics = OrderedDict()
+    system_per_query = OrderedDict()
+    for i, (system, docs) in enumerate(systems.items()):
+        run = search.get_run(queries, docs, search.get_mt_index(
+            i, len(systems), "%s_mt" % search.INDEX))
+        trec_eval = NativeTrecEval.from_arrays(qrels, run)
+        metrics = TrecEval.round_metrics(trec_eval.get_metrics(metric_names))
+        system_metrics[system] = OrderedDict(
+            (k, metrics[k]) for k in metric_names if k in metrics)
+        if per_query:
+            system_per_query[system] = OrderedDict(
+                (query_id, TrecEval.round_metrics(values))
+                for query_id, values in trec_eval.get_per_query_metrics(metric_names).items())
+
+    if not isinstance(mt_docs, dict):
+        system_metrics = system_metrics[Search.DEFAULT_SYSTEM]
+        system_per_query = system_per_query.get(Search.DEFAULT_SYSTEM)
+    if per_query:
+        return system_metrics, system_per_query
+    return system_metrics
@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""
+An in-process BM25 retrieval engine which mimics the ElasticSearch (Lucene) BM25 similarity
+"""
+from typing import Dict, Iterable, Iterator, List, Tuple
+import re
+import time
+from collections import Counter, OrderedDict
+import numpy as np
+from .profiler import Profiler
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Lucene's SmallFloat byte4 encoding keeps document lengths < 24 exact
+NUM_FREE_VALUES = 24
+
+
+def int_to_int4(i: int) -> int:
+    """Float-like encoding for positive integers that keeps 4 significant bits
+    (port of Lucene's SmallFloat.longToInt4)"""
+    num_bits = i.bit_length()
+    if num_bits < 4:
+        return i
+    shift = num_bits - 4
+    encoded = (i >> shift) & 0x07
+    encoded |= (shift + 1) << 3
+    return encoded
+
+
+def int4_to_int(i: int) -> int:
+    """Decode a value produced by int_to_int4 (port of Lucene's SmallFloat.int4ToLong)"""
+    bits = i & 0x07
+    shift = (i >> 3) - 1
+    if shift == -1:
+        return bits
+    return (bits | 0x08) << shift
+
+
+def quantize_length(length: int) -> int:
+    """Returns the document length as seen by Lucene after it has been encoded into
+    a single byte norm (SmallFloat.intToByte4 followed by SmallFloat.byte4ToInt)
+
+    Args:
+        length (int): number of tokens in a document
+
+    Returns:
+        int: the lossy document length used by BM25 length normalization
+    """
+    if length < NUM_FREE_VALUES:
+        return length
+    return NUM_FREE_VALUES + int4_to_int(int_to_int4(length - NUM_FREE_VALUES))
+
+
+def bm25_idf(doc_freq, doc_count):
+    """Lucene BM25 inverse document frequency
+
+    Args:
+        doc_freq (int or np.ndarray): number of documents which contain the term
+        doc_count (int): number of documents in the index
+
+    Returns:
+        float or np.ndarray: idf value(s)
+    """
+    return np.log(1 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def bm25_term_score(tf, doc_len, idf, avgdl: float, k1: float = 1.2, b: float = 0.75):
+    """BM25 score contribution of a single term in a single document
+    (Lucene 7 / ElasticSearch 6 formula)
+
+    Args:
+        tf (int or np.ndarray): term frequency in the document
+        doc_len (int or np.ndarray): (quantized) length of the document
+        idf (float or np.ndarray): idf of the term
+        avgdl (float): average document length of the index
+        k1 (float): term frequency saturation parameter
+        b (float): length normalization parameter
+
+    Returns:
+        float or np.ndarray: BM25 score(s)
+    """
+    return idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len / avgdl))
+
+
+class BM25Index():
+    """An in-memory inverted index which scores queries with BM25
+
+    The index is stored as a sparse term x document matrix in CSR layout
+    (postings sorted by term id, then by document position) with precomputed
+    BM25 weights, so that a batch of queries can be scored with a handful of
+    vectorized NumPy operations.
+
+    Note:
+        Text is lower-cased and split on unicode word characters, which approximates
+        ElasticSearch's `standard` analyzer. Language specific analyzers (stemming,
+        stop words) and simple_query_string operators are not replicated, queries are
+        treated as bags of terms.
+
+    Attributes:
+        k1 (float): BM25 term frequency saturation parameter (ElasticSearch default: 1.2)
+        b (float): BM25 length normalization parameter (ElasticSearch default: 0.75)
+        max_batch_cells (int): upper bound of the number of cells in the dense
+        query x document score matrix that is materialized at once
+    """
+
+    k1 = 1.2
+    b = 0.75
+    max_batch_cells = 1 << 22
+
+    def __init__(self, **kwargs):
+        """constructor
+
+        Args:
+            **k1 (float): BM25 k1 parameter. Default: 1.2
+            **b (float): BM25 b parameter. Default: 0.75
+        """
+        self.k1 = kwargs.get('k1', self.k1)
+        self.b = kwargs.get('b', self.b)
+
+        self.doc_ids = []
+        self.vocab = {}
+        self.terms = []
+        self.doc_lens = np.zeros(0, dtype=np.int64)
+        self.avgdl = 0.0
+
+        # document-major term frequencies
+        self.doc_indptr = np.zeros(1, dtype=np.int64)
+        self.doc_term_ids = np.zeros(0, dtype=np.int64)
+        self.doc_tfs = np.zeros(0, dtype=np.int64)
+
+        # term-major postings with BM25 weights
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.postings = np.zeros(0, dtype=np.int64)
+        self.weights = np.zeros(0, dtype=np.float64)
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """split text into lower-cased terms
+
+        Args:
+            text (str): input text
+
+        Returns:
+            list(str): list of terms
+        """
+        return TOKEN_RE.findall(text.lower())
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def index(self, doc_iterable: Iterable[Tuple[str, List[str]]]) -> int:
+        """ (re)build the index with documents in doc_iterable
+
+        Args:
+            doc_iterable (list(tuple(str, list(str)))): List of document tuples -> (doc id, doc text)
+
+        Returns:
+            (int): Number of indexed documents
+        """
+        def count_terms():
+            for doc_id, doc_text in doc_iterable:
+                if not isinstance(doc_text, str):
+                    doc_text = '\n'.join(doc_text)
+                yield doc_id, Counter(self.tokenize(doc_text))
+
+        return self.index_term_freqs(count_terms())
+
+    def index_term_freqs(self, doc_term_freqs: Iterable[Tuple[str, Dict[str, int]]]) -> int:
+        """ (re)build the index with documents which are already analyzed, e.g. from
+        ElasticSearch term vectors
+
+        Note:
+            The length of a document is the sum of its term frequencies, which is the
+            length Lucene uses unless the analyzer emits tokens at the same position.
+
+        Args:
+            doc_term_freqs (iterable(tuple(str, dict(str, int)))): List of tuples
+            -> (doc id, term frequencies of the document)
+
+        Returns:
+            (int): Number of indexed documents
+        """
+        vocab = {}
+        doc_ids = []
+        doc_lens = []
+        indptr = [0]
+        term_ids = []
+        tfs = []
+
+        for doc_id, term_freqs in doc_term_freqs:
+            doc_ids.append(str(doc_id))
+            doc_lens.append(sum(term_freqs.values()))
+            term_ids.extend(vocab.setdefault(t, len(vocab)) for t in term_freqs)
+            tfs.extend(term_freqs.values())
+            indptr.append(len(term_ids))
+
+        self.doc_ids = doc_ids
+        self.vocab = vocab
+        self.terms = list(vocab.keys())
+        self.doc_indptr = np.array(indptr, dtype=np.int64)
+        self.doc_term_ids = np.array(term_ids, dtype=np.int64)
+        self.doc_tfs = np.array(tfs, dtype=np.int64)
+        self.doc_lens = np.array(doc_lens, dtype=np.int64)
+        self._build_postings()
+
+        return len(self.doc_ids)
+
+    def update(self, doc_iterable: Iterable[Tuple[str, List[str]]],
+               delete_ids: Iterable[str] = ()) -> int:
+        """ add or replace the documents in doc_iterable and delete the documents in
+        delete_ids, without analyzing the other documents again
+
+        Note:
+            The postings are rebuilt from the term frequencies of the kept and the new
+            documents, so the index is the same as an index built from scratch with
+            the resulting documents, except for their order.
+
+        Args:
+            doc_iterable (list(tuple(str, list(str)))): List of document tuples -> (doc id, doc text)
+            delete_ids (iterable(str)): ids of documents to delete
+
+        Returns:
+            (int): Number of added or replaced documents
+        """
+        new_docs = OrderedDict()
+        for doc_id, doc_text in doc_iterable:
+            if not isinstance(doc_text, str):
+                doc_text = '\n'.join(doc_text)
+            new_docs[str(doc_id)] = Counter(self.tokenize(doc_text))
+        removed = set(str(doc_id) for doc_id in delete_ids) | set(new_docs)
+
+        keep = np.array([doc_id not in removed for doc_id in self.doc_ids], dtype=bool)
+        keep_postings = np.repeat(keep, np.diff(self.doc_indptr))
+        doc_ids = [doc_id for doc_id, kept in zip(self.doc_ids, keep) if kept]
+        doc_lens = self.doc_lens[keep].tolist()
+        lengths = np.diff(self.doc_indptr)[keep].tolist()
+        term_ids = self.doc_term_ids[keep_postings].tolist()
+        tfs = self.doc_tfs[keep_postings].tolist()
+
+        vocab = dict(self.vocab)
+        for doc_id, term_freqs in new_docs.items():
+            doc_ids.append(doc_id)
+            doc_lens.append(sum(term_freqs.values()))
+            lengths.append(len(term_freqs))
+            term_ids.extend(vocab.setdefault(t, len(vocab)) for t in term_freqs)
+            tfs.extend(term_freqs.values())
+
+        # drop the terms which are only in removed documents
+        terms = list(vocab.keys())
+        used_term_ids, term_ids = np.unique(np.array(term_ids, dtype=np.int64),
+                                            return_inverse=True)
+        self.terms = [terms[t] for t in used_term_ids.tolist()]
+        self.vocab = {term: i for i, term in enumerate(self.terms)}
+        self.doc_ids = doc_ids
+        self.doc_indptr = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.doc_indptr[1:])
+        self.doc_term_ids = term_ids.astype(np.int64)
+        self.doc_tfs = np.array(tfs, dtype=np.int64)
+        self.doc_lens = np.array(doc_lens, dtype=np.int64)
+        self._build_postings()
+
+        return len(new_docs)
+
+    def _build_postings(self):
+        """ transpose document-major term frequencies into weighted term-major postings"""
+        n_docs = len(self.doc_ids)
+        n_terms = len(self.terms)
+
+        self.avgdl = float(self.doc_lens.sum()) / n_docs if n_docs else 0.0
+        norm_lens = np.array([quantize_length(int(l)) for l in self.doc_lens],
+                             dtype=np.float64)
+
+        doc_idx = np.repeat(np.arange(n_docs), np.diff(self.doc_indptr))
+        order = np.argsort(self.doc_term_ids, kind='stable')
+        term_ids = self.doc_term_ids[order]
+        self.postings = doc_idx[order]
+        tfs = self.doc_tfs[order].astype(np.float64)
+
+        doc_freqs = np.bincount(term_ids, minlength=n_terms)
+        self.indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(doc_freqs, out=self.indptr[1:])
+
+        idf = bm25_idf(doc_freqs.astype(np.float64), n_docs)
+        self.weights = bm25_term_score(
+            tfs, norm_lens[self.postings], idf[term_ids],
+            self.avgdl if self.avgdl else 1.0, self.k1, self.b)
+
+    def get_doc_freqs(self) -> Dict[str, int]:
+        """ returns the document frequency of every term in the index"""
+        doc_freqs = np.diff(self.indptr)
+        return dict(zip(self.terms, doc_freqs.tolist()))
+
+    def get_terms(self, doc_ids: List[str] = None) -> List[str]:
+        """ get unique terms of documents in the order ElasticSearch term vectors return them
+        (documents in the given order, terms of a document sorted alphabetically)
+
+        Args:
+            doc_ids (list(str)): ids of documents. Defaults to all documents in the index.
+
+        Returns:
+            list(str): unique terms
+        """
+        terms = {}
+        for doc_terms in self.iter_doc_terms(doc_ids):
+            for term in doc_terms:
+                terms[term] = 1
+        return list(terms.keys())
+
+    def iter_doc_terms(self, doc_ids: List[str] = None) -> Iterator[List[str]]:
+        """ unique terms of every document, sorted alphabetically like ElasticSearch term
+        vectors
+
+        Args:
+            doc_ids (list(str)): ids of documents. Defaults to all documents in the index.
+
+        Yields:
+            list(str): unique terms of a document
+        """
+        if doc_ids is None:
+            positions = range(len(self.doc_ids))
+        else:
+            lookup = {doc_id: i for i, doc_id in enumerate(self.doc_ids)}
+            positions = [lookup[str(doc_id)] for doc_id in doc_ids]
+
+        for i in positions:
+            doc_terms = self.doc_term_ids[self.doc_indptr[i]:self.doc_indptr[i + 1]]
+            yield sorted(self.terms[t] for t in doc_terms)
+
+    def _encode_queries(self, queries: List[str]):
+        """ convert query strings into a sparse (CSR) query x term count matrix"""
+        indptr = [0]
+        term_ids = []
+        counts = []
+        for query in queries:
+            query_counts = Counter(self.vocab[t] for t in self.tokenize(str(query))
+                                   if t in self.vocab)
+            term_ids.extend(query_counts.keys())
+            counts.extend(query_counts.values())
+            indptr.append(len(term_ids))
+        return (np.array(indptr, dtype=np.int64),
+                np.array(term_ids, dtype=np.int64),
+                np.array(counts, dtype=np.float64))
+
+    def score_batch(self, q_indptr, q_term_ids, q_counts) -> np.ndarray:
+        """ score a batch of queries against every document
+
+        Args:
+            q_indptr (np.ndarray): CSR row pointer of the query x term matrix
+            q_term_ids (np.ndarray): term ids of the query x term matrix
+            q_counts (np.ndarray): term counts of the query x term matrix
+
+        Returns:
+            np.ndarray: dense (number of queries x number of documents) score matrix
+        """
+        n_queries = len(q_indptr) - 1
+        n_docs = len(self.doc_ids)
+
+        rows = np.repeat(np.arange(n_queries), np.diff(q_indptr))
+        starts = self.indptr[q_term_ids]
+        lengths = self.indptr[q_term_ids + 1] - starts
+        total = int(lengths.sum())
+
+        # positions of all postings touched by the batch
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        positions = np.arange(total) + offsets
+
+        cells = np.repeat(rows, lengths) * n_docs + self.postings[positions]
+        weights = self.weights[positions] * np.repeat(q_counts, lengths)
+        scores = np.bincount(cells, weights=weights, minlength=n_queries * n_docs)
+        return scores.reshape(n_queries, n_docs)
+
+    def search(self, query_iterable: List[Tuple[str, str]],
+               n_ret: int) -> Tuple[List[Tuple[str, str, float]], int]:
+        """ Execute queries in query_iterable and return results
+
+        Note:
+            Hits of a query are sorted by descending score, then ascending doc id,
+            just like `sort=["_score:desc", "_uid:asc"]` in ElasticSearch.
+
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            n_ret (int): Maximum number of documents to return per query
+
+        Returns:
+            list(tuple(str, str, float)): list of result tuples -> (query id, doc id, bm25 score)
+            int: number of queries without any hit
+        """
+        query_iterable = list(query_iterable)
+        n_docs = len(self.doc_ids)
+        search_results = []
+        no_hit_count = 0
+
+        if n_docs == 0 or n_ret <= 0:
+            return search_results, len(query_iterable)
+
+        # rank of every doc id in string order, used to break score ties
+        id_rank = np.empty(n_docs, dtype=np.int64)
+        id_rank[np.argsort(np.array(self.doc_ids))] = np.arange(n_docs)
+
+        q_indptr, q_term_ids, q_counts = self._encode_queries(
+            [query for _, query in query_iterable])
+        batch_size = max(1, self.max_batch_cells // n_docs)
+
+        for start in range(0, len(query_iterable), batch_size):
+            start_time = time.perf_counter()
+            end = min(start + batch_size, len(query_iterable))
+            lo, hi = q_indptr[start], q_indptr[end]
+            scores = self.score_batch(q_indptr[start:end + 1] - lo,
+                                      q_term_ids[lo:hi], q_counts[lo:hi])
+
+            for row, (query_id, _) in zip(scores, query_iterable[start:end]):
+                hits = np.flatnonzero(row > 0)
+                if len(hits) > n_ret:
+                    threshold = np.partition(row[hits], len(hits) - n_ret)[len(hits) - n_ret]
+                    hits = hits[row[hits] >= threshold]
+                if len(hits) == 0:
+                    no_hit_count += 1
+                    continue
+                hits = hits[np.lexsort((id_rank[hits], -row[hits]))][:n_ret]
+                search_results.extend(
+                    (query_id, self.doc_ids[i], float(row[i])) for i in hits)
+            # queries of a batch are scored together, each gets the mean latency
+            Profiler.observe("search_latency_ms",
+                             (time.perf_counter() - start_time) * 1000.0 / (end - start),
+                             end - start)
+
+        Profiler.count("search_queries", len(query_iterable))
+        Profiler.count("search_hits", len(search_results))
+        return search_results, no_hit_count
+
+    def search_terms(self, query_iterable: List[Tuple[str, str]],
+                     n_ret: int) -> Tuple[List[Tuple[str, str, float]], int]:
+        """ Execute single-term queries without scoring a query x document matrix
+
+        The hits of a single-term query are the postings of the term, so every query is a
+        slice of the postings sorted by descending weight (then ascending doc id).
+
+        Note:
+            A query is looked up as an indexed term, it is not tokenized again. For the
+            terms of the index (e.g. the queries of query_mode = unique_terms) the results
+            are the same as the results of search.
+
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, term)
+            n_ret (int): Maximum number of documents to return per query
+
+        Returns:
+            list(tuple(str, str, float)): list of result tuples -> (query id, doc id, bm25 score)
+            int: number of queries without any hit
+        """
+        n_docs = len(self.doc_ids)
+        search_results = []
+        no_hit_count = 0
+
+        if n_docs == 0 or n_ret <= 0:
+            return search_results, len(query_iterable)
+
+        id_rank = np.empty(n_docs, dtype=np.int64)
+        id_rank[np.argsort(np.array(self.doc_ids))] = np.arange(n_docs)
+        posting_terms = np.repeat(np.arange(len(self.terms)), np.diff(self.indptr))
+        ranked = np.lexsort((id_rank[self.postings], -self.weights, posting_terms))
+
+        for query_id, term in query_iterable:
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                no_hit_count += 1
+                continue
+            start = self.indptr[term_id]
+            hits = ranked[start:min(self.indptr[term_id + 1], start + n_ret)]
+            search_results.extend(zip(
+                [query_id] * len(hits),
+                [self.doc_ids[i] for i in self.postings[hits].tolist()],
+                self.weights[hits].tolist()))
+
+        Profiler.count("search_queries", len(query_iterable))
+        Profiler.count("search_hits", len(search_results))
+        return search_results, no_hit_count
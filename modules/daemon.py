@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Evaluation daemon: the reference state is built once, translations are evaluated on request
+"""
+from typing import Dict, List, Optional, Tuple, Union
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from .profiler import Profiler
+from .search import Search
+from .trec_eval import NativeTrecEval, TrecEval, resolve_metrics
+
+
+class QueueFullError(RuntimeError):
+    """Raised when an evaluation is submitted while all workers are busy and the queue is full"""
+
+
+class EvaluationDaemon():
+    """Keeps the reference qrels and indices of a retrieval backend warm and evaluates
+    translated documents with a bounded pool of workers
+
+    The reference documents are indexed, searched and converted to relevance judgments
+    once, when the daemon is created (steps 1) - 5) of Search.__init__). The judgments are
+    kept in memory (see modules.trec_files.Qrels), so an evaluation only indexes and
+    searches the translated documents and computes the metrics in-process with
+    NativeTrecEval, without temporary files.
+
+    Every worker indexes translations into its own index (INDEX_worker_<i>), which is
+    reused by the next evaluation of the worker. With persistent_indices, indices are
+    named by the fingerprint of the translations instead, so a translation which was
+    evaluated before is not indexed again. At most max_workers evaluations run at once and
+    at most queue_size more wait for a worker, further submissions raise QueueFullError.
+
+    Attributes:
+        search (Search): the connected retrieval backend
+        ref_iterable (list(tuple(str, list(str)))): reference doc tuples -> (doc id, sentences)
+        query_iterable (list(tuple(str, str))): queries of the qrels (the vocabulary of the
+        reference documents if query_mode = unique_terms)
+        qrels (Qrels): relevance judgments of the reference documents
+        metric_names (list(str)): metrics reported by default, see resolve_metrics
+        max_workers (int): number of evaluations which run at once
+        queue_size (int): number of evaluations which wait for a worker
+        n_evaluated (int): number of finished evaluations
+    """
+
+    def __init__(self, search: Search,
+                 ref_iterable: List[Tuple[str, List[str]]],
+                 query_iterable: List[Tuple[str, str]],
+                 max_workers: int = 2, queue_size: int = 8, **kwargs):
+        """constructor, creates the reference qrels
+
+        Args:
+            search (Search): a retrieval backend, e.g. LocalSearch.from_connection(**kwargs)
+            ref_iterable (list(tuple(str, list(str)))): List of reference doc tuples
+            -> (doc id, sentences)
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            max_workers (int): number of evaluations which run at once. Default: 2
+            queue_size (int): number of evaluations which wait for a worker. Default: 8
+            **kwargs: relevance settings (see Search.__init__ and Search.get_qrels) and
+            **metrics (list(str)): metrics reported by default, see resolve_metrics
+
+        Raises:
+            ValueError: If max_workers or queue_size is invalid, if a metric is unknown, or if
+            query_mode = unique_terms and relv_mode = query_in_document (see
+            Search.get_ref_qrels)
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be a positive integer.")
+        if queue_size < 0:
+            raise ValueError("queue_size must be a non-negative integer.")
+        self.search = search
+        self.ref_iterable = list(ref_iterable)
+        self.metric_names = resolve_metrics(kwargs.get("metrics"))
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+
+        self.ref_doc_lengths = [len(sents) if not isinstance(sents, str) else 1
+                                for _, sents in self.ref_iterable]
+        self.query_iterable, self.qrels = search.get_ref_qrels(
+            self.ref_iterable, list(query_iterable), "%s_ref" % search.INDEX, **kwargs)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.slots = threading.BoundedSemaphore(max_workers + queue_size)
+        self.worker_indices = queue.Queue()
+        for i in range(max_workers):
+            self.worker_indices.put("%s_worker_%d" % (search.INDEX, i))
+        self.lock = threading.Lock()
+        self.n_running = 0
+        self.n_pending = 0
+        self.n_evaluated = 0
+
+    def get_mt_docs(self, payload: dict) -> List[Tuple[str, List[str]]]:
+        """translated documents of a request payload
+
+        Args:
+            payload (dict): either "docs", a list of [doc id, sentences] pairs or a dict
+            from doc id to sentences, or "sentences", the translated sentences of all
+            reference documents in order, which are split like the reference documents
+
+        Raises:
+            ValueError: If the payload has no documents, or if the number of sentences
+            differs from the number of reference sentences
+
+        Returns:
+            list(tuple(str, list(str))): List of doc tuples -> (doc id, sentences)
+        """
+        if "docs" in payload:
+            docs = payload["docs"]
+            items = docs.items() if isinstance(docs, dict) else docs
+            return [(str(doc_id), [sents] if isinstance(sents, str) else list(sents))
+                    for doc_id, sents in items]
+        if "sentences" in payload:
+            sents = payload["sentences"]
+            if isinstance(sents, str):
+                sents = sents.splitlines()
+            if len(sents) != sum(self.ref_doc_lengths):
+                raise ValueError("Expected %i sentences, got %i." % (
+                    sum(self.ref_doc_lengths), len(sents)))
+            docs = []
+            start = 0
+            for (doc_id, _), length in zip(self.ref_iterable, self.ref_doc_lengths):
+                docs.append((doc_id, list(sents[start:start + length])))
+                start += length
+            return docs
+        raise ValueError("The payload has neither docs nor sentences.")
+
+    def submit(self, mt_iterable: List[Tuple[str, List[str]]],
+               metrics: Optional[List[str]] = None) -> Future:
+        """queue an evaluation of translated documents
+
+        Args:
+            mt_iterable (list(tuple(str, list(str)))): List of translated doc tuples
+            -> (doc id, sentences), with the doc ids of the reference documents
+            metrics (list(str)): metrics to report. Default: the metrics of the daemon
+
+        Raises:
+            QueueFullError: If all workers are busy and queue_size evaluations are waiting
+            ValueError: If a metric is unknown
+
+        Returns:
+            Future: resolves to the metrics, see evaluate
+        """
+        metric_names = resolve_metrics(metrics) if metrics else self.metric_names
+        if not self.slots.acquire(blocking=False):
+            raise QueueFullError("%i evaluations are running or queued." % (
+                self.max_workers + self.queue_size))
+        with self.lock:
+            self.n_pending += 1
+        try:
+            return self.executor.submit(self.run, list(mt_iterable), metric_names)
+        except BaseException:
+            with self.lock:
+                self.n_pending -= 1
+            self.slots.release()
+            raise
+
+    def evaluate(self, mt_iterable: List[Tuple[str, List[str]]],
+                 metrics: Optional[List[str]] = None) -> Dict[str, float]:
+        """evaluate translated documents, waits for a worker if all are busy
+
+        Args:
+            mt_iterable (list(tuple(str, list(str)))): List of translated doc tuples
+            -> (doc id, sentences), with the doc ids of the reference documents
+            metrics (list(str)): metrics to report. Default: the metrics of the daemon
+
+        Returns:
+            dict(str, float): Maps metric name to metric value, like TrecEval.get_metrics
+        """
+        return self.submit(mt_iterable, metrics).result()
+
+    def run(self, mt_iterable: List[Tuple[str, List[str]]],
+            metric_names: List[str]) -> Dict[str, float]:
+        """worker: index and search the translated documents and compute the metrics"""
+        with self.lock:
+            self.n_pending -= 1
+            self.n_running += 1
+        index = self.worker_indices.get()
+        try:
+            with Profiler.span("evaluate"):
+                run = self.search.get_run(self.query_iterable, mt_iterable, index)
+                with Profiler.span("trec_eval"):
+                    all_metrics = TrecEval.round_metrics(NativeTrecEval.from_arrays(
+                        self.qrels, run).get_metrics(metric_names))
+            return OrderedDict((k, all_metrics[k]) for k in metric_names if k in all_metrics)
+        finally:
+            self.worker_indices.put(index)
+            with self.lock:
+                self.n_running -= 1
+                self.n_evaluated += 1
+            self.slots.release()
+
+    def get_status(self) -> dict:
+        """sizes of the reference state and of the work queue"""
+        with self.lock:
+            return OrderedDict([
+                ("status", "ok"), ("ref_docs", len(self.ref_iterable)),
+                ("queries", len(self.query_iterable)), ("workers", self.max_workers),
+                ("queue_size", self.queue_size), ("running", self.n_running),
+                ("queued", self.n_pending), ("evaluated", self.n_evaluated)])
+
+    def serve(self, port: int = 8000, host: str = "localhost",
+              socket_path: str = None) -> Union['DaemonHTTPServer', 'DaemonUnixServer']:
+        """create an HTTP server which evaluates the translations posted to it, call
+        serve_forever (or start) on it to serve requests
+
+        API:
+            GET /status: see get_status
+            POST /evaluate: JSON payload with docs or sentences (see get_mt_docs) and
+            optionally metrics, returns {"metrics": ..., "n_docs": ..., "seconds": ...}.
+            Status 400 for an invalid payload, 503 when the queue is full.
+
+        Args:
+            port (int): TCP port, 0 for any free port. Default: 8000
+            host (str): host name. Default: "localhost"
+            socket_path (str): path of a Unix socket to listen on instead of host:port.
+            Default: None
+
+        Returns:
+            DaemonHTTPServer or DaemonUnixServer
+        """
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            return DaemonUnixServer(socket_path, self)
+        return DaemonHTTPServer((host, port), self)
+
+    def close(self):
+        """wait for the running and queued evaluations and stop the workers"""
+        self.executor.shutdown(wait=True)
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """Routes the requests of an evaluation daemon server"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Unix socket clients have no address
+        logging.debug(format, *args)
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/status":
+            self.send_json(200, self.server.daemon.get_status())
+        else:
+            self.send_json(404, {"error": "unknown path %s" % self.path})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length)
+        if self.path.split("?")[0] != "/evaluate":
+            self.send_json(404, {"error": "unknown path %s" % self.path})
+            return
+
+        daemon = self.server.daemon
+        start_time = time.time()
+        try:
+            payload = json.loads(raw_body.decode("utf-8"))
+            mt_iterable = daemon.get_mt_docs(payload)
+            future = daemon.submit(mt_iterable, payload.get("metrics"))
+        except QueueFullError as e:
+            self.send_json(503, {"error": str(e)})
+            return
+        except (ValueError, TypeError, AttributeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        try:
+            metrics = future.result()
+        except Exception as e:
+            logging.exception("Evaluation failed")
+            self.send_json(500, {"error": str(e)})
+            return
+        self.send_json(200, OrderedDict([
+            ("metrics", metrics), ("n_docs", len(mt_iterable)),
+            ("seconds", round(time.time() - start_time, 4))]))
+
+    def send_json(self, status: int, response: dict):
+        """send a JSON response"""
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DaemonServerMixin():
+    """Serving in a background thread, for DaemonHTTPServer and DaemonUnixServer"""
+
+    daemon_threads = True
+
+    def start(self):
+        """serve requests in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """stop serving and close the socket"""
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+
+class DaemonHTTPServer(DaemonServerMixin, ThreadingHTTPServer):
+    """HTTP server of an EvaluationDaemon on a TCP port"""
+
+    def __init__(self, server_address: Tuple[str, int], daemon: EvaluationDaemon):
+        self.daemon = daemon
+        super().__init__(server_address, DaemonRequestHandler)
+
+
+class DaemonUnixServer(DaemonServerMixin, ThreadingMixIn, UnixStreamServer):
+    """HTTP server of an EvaluationDaemon on a Unix socket"""
+
+    def __init__(self, socket_path: str, daemon: EvaluationDaemon):
+        self.daemon = daemon
+        super().__init__(socket_path, DaemonRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
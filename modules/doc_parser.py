@@ -4,11 +4,12 @@ Document parser for MT SGML file or tsv file
 """
 
 
-from typing import Tuple, List
+from typing import Iterator, Sequence, Tuple, List, Union
 import logging
 from os import path
-from collections import defaultdict
-from bs4 import BeautifulSoup as bs
+from html.parser import HTMLParser
+from .doc_store import DocMapping, DocStore, FlatSentenceView, QueryView
+from .profiler import Profiler
 
 
 class DocParser():
@@ -25,23 +26,25 @@ class DocParser():
     SGML = 'sgml'
     TXT = 'txt'
 
-    def __init__(self, doc_file_path: str, doc_mapping_file_path: str = None, doc_length: int = 1):
+    def __init__(self, doc_file_path: str, doc_mapping_file_path: Union[str, DocMapping] = None, doc_length: int = 1):
         """ constructor
 
         Args:
             doc_file_path (str): path to the document
-            doc_mapping_file_path (str): path to an optional mapping file that maps
-            every line in doc_file to a doc_id and seg_id
+            doc_mapping_file_path (str or DocMapping): path to an optional mapping file that maps
+            every line in doc_file to a doc_id and seg_id. Pass a DocMapping to share one
+            parsed mapping between several files
             doc_length (int): specifies the number of sentences per document. 
                               Used only when input doc file is in raw text format and doc_mapping_file is not specified.
         """
         self.doc_file_type = self.get_file_type(doc_file_path)
 
         try:
-            if self.doc_file_type == self.SGML:
-                self.docs, self.total_sents = self.parse_sgml(doc_file_path)
-            else:
-                self.docs, self.total_sents = self.parse_txt(doc_file_path, doc_mapping_file_path, doc_length)
+            with Profiler.span("parse"):
+                if self.doc_file_type == self.SGML:
+                    self.docs, self.total_sents = self.parse_sgml(doc_file_path)
+                else:
+                    self.docs, self.total_sents = self.parse_txt(doc_file_path, doc_mapping_file_path, doc_length)
             self.total_docs = len(self.docs)
         except:
             raise Exception("Failed to parse file.")
@@ -67,6 +70,10 @@ class DocParser():
     def parse_sgml(sgml_file: str) -> Tuple[List[Tuple[str, str]], int]:
         """Method used to parse sgml files
 
+        Note:
+            Documents are read incrementally with SgmlReader, use SgmlReader.iter_docs to
+            process them one at a time.
+
         Args:
             sgml_file (str): path to sgml file
 
@@ -77,35 +84,23 @@ class DocParser():
             tuple(list(tuple(str, str)), int): A list of tuples -> (doc_id, doc_text) and
             total number of sentences
         """
-
-        total_sents = 0
-        docs = []
-        with open(sgml_file) as input_f:
-            soup = bs(input_f.read(), 'html.parser')
-            for doc in soup.find_all('doc'):
-                doc_id = doc.get('docid')
-                doc_text = []
-                for sentence in doc.find_all('seg'):
-                    total_sents += 1
-                    doc_text.append((int(sentence.get('id')), sentence.get_text()))
-
-                if doc_text:
-                    #sort by segid in ascending order
-                    doc_text = sorted(doc_text, key = lambda e: e[0])
-                    doc_text = [e[1] for e in doc_text]
-                    docs.append((doc_id, doc_text))
+        docs = list(SgmlReader.iter_docs(sgml_file))
+        total_sents = sum(len(doc_text) for _, doc_text in docs)
         return docs, total_sents
 
     @staticmethod
-    def parse_txt(txt_file: str, doc_mapping_file: str = None, doc_length: int = 1) -> Tuple[List[Tuple[str, str]], int]:
+    def parse_txt(txt_file: str, doc_mapping_file: Union[str, DocMapping] = None, doc_length: int = 1) -> Tuple[Sequence[Tuple[str, Sequence[str]]], int]:
         """ Method used to parse tsv files
 
         Note:
-            TXT file contains one sentence segment every line.
+            TXT file contains one sentence segment every line. The file is memory-mapped
+            (see DocStore) and the returned documents are lazy views which decode sentences
+            when they are accessed.
 
         Args:
             txt_file (str): path to txt file
-            doc_mapping_file (str): path to an optional doc_mapping_file
+            doc_mapping_file (str or DocMapping): path to an optional doc_mapping_file, or
+            the already parsed mapping
             doc_length (int): Number of sentences per document, used when doc_mapping_file is not specified
 
         Raises:
@@ -115,51 +110,10 @@ class DocParser():
             tuple(list(tuple(str, str)), int): A list of tuples -> (doc_id, doc_text) and
             total number of sentences
         """
-        total_sents = 0
-        docs = []
-        docs_dict = defaultdict(list)
-        doc_texts = []
-        doc_ids = [] 
-
-        with open(txt_file) as txt_f:
-            for line in txt_f:
-                try:
-                    doc_sent = line.strip()
-                    doc_texts.append(doc_sent)
-                    total_sents += 1
-                except BaseException:
-                    raise Exception("Unable to read txt file")
-
-        if doc_mapping_file is not None:
-            with open(doc_mapping_file) as doc_mapping_f:
-                for line in doc_mapping_f:
-                    try:
-                        doc_id, seg_id = line.strip().split('\t')
-                        doc_ids.append((doc_id, int(seg_id)))
-                    except BaseException:
-                        raise Exception("Doc boundary file is not formatted correctly")
-        else:
-            cur_doc_id = 1
-            cur_seg_id = 1
-            for i in range(len(doc_texts)):
-                doc_ids.append(("S%i"%cur_doc_id, cur_seg_id))
-                cur_seg_id += 1
-                if (i+1) % doc_length == 0:
-                    cur_doc_id +=1
-                    cur_seg_id = 1
-
-        #ensure the file lengths match
-        if len(doc_texts) != len(doc_ids):
-            raise ValueError("Number of lines in %s != Number of lines in %s" % (txt_file, doc_mapping_file))
-
-        for doc_text, (doc_id, doc_segid) in zip(doc_texts, doc_ids):
-            docs_dict[doc_id].append((doc_text, doc_segid))
-
-        for doc_id in docs_dict:
-            doc_text = [doc_sent for doc_sent, _ in sorted(docs_dict[doc_id], key=lambda e: e[1])]
-            docs.append((doc_id, doc_text))
-
-        return docs, total_sents
+        if doc_mapping_file is not None and not isinstance(doc_mapping_file, DocMapping):
+            doc_mapping_file = DocMapping.from_file(doc_mapping_file)
+        store = DocStore(txt_file, doc_mapping_file, doc_length)
+        return store.get_docs(), store.total_sents
 
     def get_docs(self) -> List[Tuple[str, str]]:
         """ returns list of parsed documents
@@ -175,27 +129,112 @@ class DocParser():
             self.total_docs,
             self.total_sents)
 
-    def get_sentences(self):
+    def get_sentences(self) -> FlatSentenceView:
         """ returns list of sentences
 
         Returns:
-           list(str): list of sentences
+           FlatSentenceView: lazy list of sentences
         """
-        sentences = []
-        for doc_id, doc_text in self.docs:
-            for sentence in enumerate(doc_text):
-                sentences.append(sentence)
-        return sentences
+        return FlatSentenceView(self.docs)
 
-    def get_queries(self):
+    def get_queries(self) -> QueryView:
         """ returns list of sentences as search queries
 
         Returns:
-           list(tuple(str, str)): list of tuples -> (str, str)
+           QueryView: lazy list of tuples -> (query_id, sentence), query_id is `<doc_id>_<i>`
+        """
+        return QueryView(self.docs)
+
+
+class SgmlReader(HTMLParser):
+    """Event-driven reader of MT SGML files (<doc docid="..."><seg id="...">...</seg></doc>).
+
+    The file is fed to the parser in chunks and every document is returned as soon as its
+    </doc> tag is read, so peak memory is proportional to the largest document instead of
+    the whole file. Tags are matched case-insensitively and character references are
+    unescaped, like the html.parser tree builder of BeautifulSoup.
+
+    Attributes:
+        finished_docs (list(tuple(str, list(str)))): documents which were closed since they
+        were last collected
+    """
+
+    chunk_size = 1 << 20
+
+    def __init__(self):
+        """constructor"""
+        super().__init__(convert_charrefs=True)
+        self.finished_docs = []
+        self.doc_id = None
+        self.segments = None
+        self.seg_id = None
+        self.seg_text = None
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, str]]):
+        """open a document or a segment"""
+        if tag == 'doc':
+            self.close_doc()
+            self.doc_id = dict(attrs).get('docid')
+            self.segments = []
+        elif tag == 'seg' and self.segments is not None:
+            self.close_seg()
+            self.seg_id = int(dict(attrs).get('id'))
+            self.seg_text = []
+
+    def handle_endtag(self, tag: str):
+        """close a document or a segment"""
+        if tag == 'doc':
+            self.close_doc()
+        elif tag == 'seg':
+            self.close_seg()
+
+    def handle_data(self, data: str):
+        """collect the text of the current segment"""
+        if self.seg_text is not None:
+            self.seg_text.append(data)
+
+    def close_seg(self):
+        """add the current segment to the current document"""
+        if self.seg_text is not None:
+            self.segments.append((self.seg_id, "".join(self.seg_text)))
+        self.seg_id = None
+        self.seg_text = None
+
+    def close_doc(self):
+        """finish the current document, documents without segments are dropped"""
+        self.close_seg()
+        if self.segments:
+            #sort by segid in ascending order
+            self.segments.sort(key=lambda e: e[0])
+            self.finished_docs.append((self.doc_id, [text for _, text in self.segments]))
+        self.doc_id = None
+        self.segments = None
+
+    def collect(self) -> List[Tuple[str, List[str]]]:
+        """documents closed since the last call
+
+        Returns:
+            list(tuple(str, list(str))): A list of tuples -> (doc_id, doc_text)
+        """
+        docs, self.finished_docs = self.finished_docs, []
+        return docs
+
+    @classmethod
+    def iter_docs(cls, sgml_file: str) -> Iterator[Tuple[str, List[str]]]:
+        """read the documents of a sgml file one at a time
+
+        Args:
+            sgml_file (str): path to sgml file
+
+        Returns:
+            iterator(tuple(str, list(str))): tuples -> (doc_id, sentences sorted by segment id)
         """
-        queries = []
-        for doc_id, doc_text in self.docs:
-            for i, query in enumerate(doc_text):
-                query_id = "%s_%i" % (doc_id, i)
-                queries.append((query_id, query))
-        return queries
+        reader = cls()
+        with open(sgml_file) as input_f:
+            for chunk in iter(lambda: input_f.read(cls.chunk_size), ''):
+                reader.feed(chunk)
+                yield from reader.collect()
+        reader.close()
+        # a document which is not closed ends with the file
+        reader.close_doc()
+        yield from reader.collect()
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Compact, memory-mapped storage of line-based documents and lazy views of documents,
+sentences and queries
+"""
+from typing import List, Sequence, Tuple, Union
+from collections.abc import Sequence as SequenceABC
+import mmap
+import numpy as np
+
+
+class DocMapping():
+    """Maps every line of a text file to a document and a segment id
+
+    The mapping depends only on the doc mapping file (or the document length), so one
+    instance can be shared by the parsers of the reference and the translated files.
+
+    Attributes:
+        doc_ids (list(str)): document ids, in order of first appearance
+        doc_index (np.ndarray): position in doc_ids of the document of every line
+        seg_ids (np.ndarray): segment id of every line
+    """
+
+    def __init__(self, doc_ids: List[str], doc_index: np.ndarray, seg_ids: np.ndarray):
+        """constructor
+
+        Args:
+            doc_ids (list(str)): document ids, in order of first appearance
+            doc_index (np.ndarray): position in doc_ids of the document of every line
+            seg_ids (np.ndarray): segment id of every line
+        """
+        self.doc_ids = doc_ids
+        self.doc_index = np.asarray(doc_index, dtype=np.int64)
+        self.seg_ids = np.asarray(seg_ids, dtype=np.int64)
+
+    def __len__(self) -> int:
+        """number of mapped lines"""
+        return len(self.seg_ids)
+
+    @classmethod
+    def from_file(cls, doc_mapping_file: str) -> 'DocMapping':
+        """parse a TSV file with one `doc_id<TAB>seg_id` line per sentence
+
+        Args:
+            doc_mapping_file (str): path to the doc mapping file
+
+        Raises:
+            Exception: If the file is not formatted correctly
+
+        Returns:
+            DocMapping: the mapping
+        """
+        doc_positions = {}
+        doc_index = []
+        seg_ids = []
+        with open(doc_mapping_file) as doc_mapping_f:
+            for line in doc_mapping_f:
+                try:
+                    doc_id, seg_id = line.strip().split('\t')
+                    seg_ids.append(int(seg_id))
+                except BaseException:
+                    raise Exception("Doc boundary file is not formatted correctly")
+                doc_index.append(doc_positions.setdefault(doc_id, len(doc_positions)))
+        return cls(list(doc_positions), doc_index, seg_ids)
+
+    @classmethod
+    def from_doc_length(cls, n_lines: int, doc_length: int) -> 'DocMapping':
+        """artificial documents of doc_length consecutive lines named S1, S2, ...
+
+        Args:
+            n_lines (int): number of lines
+            doc_length (int): number of sentences per document
+
+        Returns:
+            DocMapping: the mapping
+        """
+        lines = np.arange(n_lines)
+        n_docs = -(-n_lines // doc_length)
+        return cls(["S%i" % (i + 1) for i in range(n_docs)],
+                   lines // doc_length, lines % doc_length + 1)
+
+
+class DocStore():
+    """Documents of a text file with one sentence per line, kept in a memory map
+
+    Only the byte offsets of the lines and the order of the lines in the documents are
+    kept in NumPy arrays, sentences are decoded (and stripped) when they are accessed.
+
+    Attributes:
+        text (mmap.mmap): content of the text file
+        line_starts (np.ndarray): byte offset of the start of every line
+        line_ends (np.ndarray): byte offset of the end of every line (excluding the newline)
+        doc_ids (list(str)): document ids
+        line_order (np.ndarray): line numbers sorted by document and segment id
+        doc_indptr (np.ndarray): offsets of the documents in line_order
+    """
+
+    def __init__(self, txt_file: str, doc_mapping: DocMapping = None, doc_length: int = 1):
+        """constructor
+
+        Args:
+            txt_file (str): path to a text file with one sentence per line
+            doc_mapping (DocMapping): maps lines to documents. Default: documents of
+            doc_length consecutive lines
+            doc_length (int): number of sentences per document, used when doc_mapping is None
+
+        Raises:
+            ValueError: If the number of lines in txt_file and doc_mapping do not match
+        """
+        with open(txt_file, 'rb') as txt_f:
+            try:
+                self.text = mmap.mmap(txt_f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                self.text = b''
+
+        buffer = np.frombuffer(self.text, dtype=np.uint8)
+        newlines = np.flatnonzero(buffer == ord('\n'))
+        self.line_starts = np.concatenate([[0], newlines + 1])
+        self.line_ends = np.concatenate([newlines, [len(buffer)]])
+        if self.line_starts[-1] == len(buffer):
+            # the file ends with a newline
+            self.line_starts = self.line_starts[:-1]
+            self.line_ends = self.line_ends[:-1]
+
+        if doc_mapping is None:
+            doc_mapping = DocMapping.from_doc_length(self.total_sents, doc_length)
+        if len(doc_mapping) != self.total_sents:
+            raise ValueError("Number of lines in %s != Number of lines in doc mapping"
+                             % txt_file)
+
+        self.doc_ids = doc_mapping.doc_ids
+        # stable sort: lines with the same segment id keep their order
+        self.line_order = np.lexsort((doc_mapping.seg_ids, doc_mapping.doc_index))
+        self.doc_indptr = np.zeros(len(self.doc_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(doc_mapping.doc_index, minlength=len(self.doc_ids)),
+                  out=self.doc_indptr[1:])
+
+    @property
+    def total_sents(self) -> int:
+        """number of lines in the text file"""
+        return len(self.line_starts)
+
+    def get_line(self, line: int) -> str:
+        """decoded and stripped line
+
+        Args:
+            line (int): line number
+
+        Returns:
+            str: the sentence
+        """
+        return self.text[self.line_starts[line]:self.line_ends[line]].decode('utf-8').strip()
+
+    def get_docs(self) -> 'DocumentView':
+        """lazy list of documents
+
+        Returns:
+            DocumentView: sequence of tuples -> (doc_id, sentences)
+        """
+        return DocumentView(self)
+
+
+class SentenceView(SequenceABC):
+    """Lazy list of the sentences of one document in a DocStore"""
+
+    def __init__(self, store: DocStore, lines: np.ndarray):
+        """constructor
+
+        Args:
+            store (DocStore): the document store
+            lines (np.ndarray): line numbers of the sentences
+        """
+        self.store = store
+        self.lines = lines
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(i, slice):
+            return [self.store.get_line(line) for line in self.lines[i]]
+        return self.store.get_line(self.lines[i])
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SequenceABC) and list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+class DocumentView(SequenceABC):
+    """Lazy list of the (doc_id, sentences) tuples of a DocStore"""
+
+    def __init__(self, store: DocStore):
+        """constructor
+
+        Args:
+            store (DocStore): the document store
+        """
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.store.doc_ids)
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Tuple[str, SentenceView], list]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("document index out of range")
+        start, end = self.store.doc_indptr[i], self.store.doc_indptr[i + 1]
+        return (self.store.doc_ids[i], SentenceView(self.store, self.store.line_order[start:end]))
+
+
+class FlatSentenceView(SequenceABC):
+    """Lazy list of all sentences of a list of documents, in document order"""
+
+    def __init__(self, docs: Sequence[Tuple[str, Sequence[str]]]):
+        """constructor
+
+        Args:
+            docs (sequence(tuple(str, sequence(str)))): documents -> (doc_id, sentences)
+        """
+        self.docs = docs
+        self.doc_indptr = np.zeros(len(docs) + 1, dtype=np.int64)
+        np.cumsum([len(doc_text) for _, doc_text in docs], out=self.doc_indptr[1:])
+
+    def __len__(self) -> int:
+        return int(self.doc_indptr[-1])
+
+    def locate(self, i: int) -> Tuple[str, int, str]:
+        """document and position of the i-th sentence
+
+        Args:
+            i (int): sentence index
+
+        Returns:
+            tuple(str, int, str): doc_id, position of the sentence in the document, sentence
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("sentence index out of range")
+        doc = int(np.searchsorted(self.doc_indptr, i, side='right')) - 1
+        doc_id, doc_text = self.docs[doc]
+        position = i - int(self.doc_indptr[doc])
+        return doc_id, position, doc_text[position]
+
+    def __getitem__(self, i: Union[int, slice]):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self.locate(i)[2]
+
+    def __iter__(self):
+        for _, doc_text in self.docs:
+            yield from doc_text
+
+
+class QueryView(FlatSentenceView):
+    """Lazy list of (query_id, sentence) tuples, query ids are `<doc_id>_<position>`"""
+
+    def __getitem__(self, i: Union[int, slice]):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        doc_id, position, sentence = self.locate(i)
+        return ("%s_%i" % (doc_id, position), sentence)
+
+    def __iter__(self):
+        for doc_id, doc_text in self.docs:
+            for i, sentence in enumerate(doc_text):
+                yield ("%s_%i" % (doc_id, i), sentence)
@@ -0,0 +1,652 @@
+# -*- coding: utf-8 -*-
+"""
+A local HTTP server which implements the subset of the ElasticSearch API used by Search,
+with in-memory BM25 indices, for integration and load tests without an ElasticSearch install
+"""
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, unquote
+import fnmatch
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import numpy as np
+from .bm25 import BM25Index
+
+
+class StandInError(Exception):
+    """An ElasticSearch error response
+
+    Attributes:
+        status (int): HTTP status
+        error_type (str): ElasticSearch error type, e.g. index_not_found_exception
+        reason (str): error message
+    """
+
+    def __init__(self, status: int, error_type: str, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+
+    def get_body(self) -> dict:
+        """the JSON body of the error response"""
+        error = {"type": self.error_type, "reason": self.reason}
+        return {"error": dict(error, root_cause=[error]), "status": self.status}
+
+
+class StandInIndex():
+    """An index of the stand-in server: documents, mapping, settings and the BM25 index
+    of the documents, rebuilt when documents changed since the last search
+
+    Attributes:
+        name (str): name of the index
+        docs (OrderedDict(str, dict)): Maps doc id to source, in indexing order
+        doc_type (str): the mapping type, None until a mapping is put
+        mappings (dict): mapping of doc_type, including _meta
+        settings (dict): index settings
+    """
+
+    def __init__(self, name: str, settings: dict = None, mappings: dict = None):
+        """constructor
+
+        Raises:
+            StandInError: If mappings are not keyed by their type, like in ElasticSearch 6
+        """
+        self.name = name
+        self.docs = OrderedDict()
+        self.settings = settings or {}
+        self.doc_type = None
+        self.mappings = {}
+        for doc_type, mapping in (mappings or {}).items():
+            if doc_type.startswith("_") or doc_type == "properties":
+                raise StandInError(400, "mapper_parsing_exception",
+                                   "Root mapping definition has unsupported parameters: [%s]"
+                                   % doc_type)
+            self.put_mapping(doc_type, mapping)
+        self.bm25 = None
+        self.id_rank = None
+        self.lock = threading.Lock()
+
+    def put_mapping(self, doc_type: str, mapping: dict):
+        """merge the mapping of a type into the mapping
+
+        Raises:
+            StandInError: If the index has a mapping of another type (ElasticSearch 6
+            indices have a single type)
+
+        Args:
+            doc_type (str): mapping type, e.g. "doc"
+            mapping (dict): properties and/or _meta
+        """
+        if self.doc_type is not None and doc_type != self.doc_type:
+            raise StandInError(400, "illegal_argument_exception",
+                               "Rejecting mapping update to [%s] as the final mapping would "
+                               "have more than 1 type: [%s, %s]" % (
+                                   self.name, self.doc_type, doc_type))
+        self.doc_type = doc_type
+        for key, value in mapping.items():
+            if key == "properties":
+                self.mappings.setdefault("properties", {}).update(value)
+            else:
+                self.mappings[key] = value
+
+    def index_doc(self, doc_id: str, source: dict):
+        """add or replace a document"""
+        with self.lock:
+            self.docs.pop(doc_id, None)
+            self.docs[doc_id] = source
+            self.bm25 = None
+
+    def delete_doc(self, doc_id: str) -> bool:
+        """delete a document, returns whether it existed"""
+        with self.lock:
+            self.bm25 = None
+            return self.docs.pop(doc_id, None) is not None
+
+    def get_bm25(self) -> BM25Index:
+        """the BM25 index of the text fields of the documents"""
+        return self.get_ranked_bm25()[0]
+
+    def get_ranked_bm25(self) -> Tuple[BM25Index, np.ndarray]:
+        """the BM25 index and the rank of every doc id in string order (for ties)"""
+        with self.lock:
+            if self.bm25 is None:
+                bm25 = BM25Index()
+                bm25.index((doc_id, self.get_text(source))
+                           for doc_id, source in self.docs.items())
+                self.id_rank = np.empty(len(bm25.doc_ids), dtype=np.int64)
+                self.id_rank[np.argsort(np.array(bm25.doc_ids))] = np.arange(len(bm25.doc_ids))
+                self.bm25 = bm25
+            return self.bm25, self.id_rank
+
+    def get_text(self, source: dict) -> str:
+        """the searchable text of a document: its fields which are mapped as text, or all
+        its string fields if no field is mapped as text"""
+        properties = self.mappings.get("properties", {})
+        fields = [field for field, mapping in properties.items()
+                  if mapping.get("type") == "text"]
+        if not fields:
+            fields = [field for field, value in source.items() if isinstance(value, str)]
+        return "\n".join(source[field] for field in fields
+                         if isinstance(source.get(field), str))
+
+    def search(self, query: Optional[str], size: int) -> Tuple[List[Tuple[str, float]], int]:
+        """score the documents like BM25Index.search, without counting the searches in the
+        active Profiler (which measures the client when the server runs in the same process)
+
+        Args:
+            query (str): query text, None to match all documents with score 1.0
+            size (int): maximum number of hits
+
+        Returns:
+            list(tuple(str, float)): hits -> (doc id, score), by descending score then doc id
+            int: number of matching documents
+        """
+        bm25, id_rank = self.get_ranked_bm25()
+        n_docs = len(bm25.doc_ids)
+        if query is None:
+            hits = np.argsort(id_rank)[:size]
+            return [(bm25.doc_ids[i], 1.0) for i in hits], n_docs
+        if n_docs == 0:
+            return [], 0
+        scores = bm25.score_batch(*bm25._encode_queries([query]))[0]
+        hits = np.flatnonzero(scores > 0)
+        total = len(hits)
+        hits = hits[np.lexsort((id_rank[hits], -scores[hits]))][:max(size, 0)]
+        return [(bm25.doc_ids[i], float(scores[i])) for i in hits], total
+
+    def get_term_vectors(self, doc_ids: List[str]) -> List[Optional[Dict[str, int]]]:
+        """term frequencies of documents, terms sorted like ElasticSearch term vectors
+
+        Args:
+            doc_ids (list(str)): ids of documents
+
+        Returns:
+            list(dict(str, int)): term frequencies, None for documents which do not exist
+        """
+        bm25 = self.get_bm25()
+        positions = {doc_id: i for i, doc_id in enumerate(bm25.doc_ids)}
+        term_vectors = []
+        for doc_id in doc_ids:
+            i = positions.get(doc_id)
+            if i is None:
+                term_vectors.append(None)
+                continue
+            start, end = bm25.doc_indptr[i], bm25.doc_indptr[i + 1]
+            term_freqs = zip((bm25.terms[t] for t in bm25.doc_term_ids[start:end]),
+                             bm25.doc_tfs[start:end].tolist())
+            term_vectors.append(OrderedDict(sorted(term_freqs)))
+        return term_vectors
+
+
+class ElasticsearchStandIn(ThreadingHTTPServer):
+    """A threaded HTTP server which answers the ElasticSearch requests of Search
+
+    Supported APIs: info (GET /), indices exists/create/delete/get_mapping/put_mapping/
+    put_settings/refresh, _bulk (index, create and delete actions), _search and _msearch
+    with simple_query_string (or match) queries, _mtermvectors and _count. The server
+    reports version 6.5.3, the version installed by scripts/install_external_tools.sh,
+    and has its typed mappings: an index has a single mapping type, a mapping is put
+    with its type and get_mapping nests it under the type.
+
+    Documents are scored with BM25Index, i.e. the text is analyzed like the local backend
+    (lower-cased unicode words, see modules.bm25) whatever the mapping's analyzer, and
+    simple_query_string operators are not interpreted. Hits are sorted by descending
+    score, then by ascending doc id.
+
+    Latency and failures can be injected to load-test the client: every request is
+    delayed by latency_ms plus a uniform jitter of up to jitter_ms, search requests by
+    query_latency_ms per query, and a request fails with error_status (503 by default,
+    which the ElasticSearch client retries) with probability error_rate.
+
+    Attributes:
+        latency_ms (float): delay of every request in milliseconds
+        jitter_ms (float): maximum random extra delay in milliseconds
+        query_latency_ms (float): delay per query of a search request in milliseconds
+        error_rate (float): probability that a request fails
+        error_status (int): HTTP status of failed requests
+        indices (dict(str, StandInIndex)): the indices
+        request_counts (dict(str, int)): number of requests by endpoint
+    """
+
+    VERSION = "6.5.3"
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 9200, host: str = "localhost", latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, query_latency_ms: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 503, seed: int = None):
+        """constructor, binds the server to host:port
+
+        Args:
+            port (int): port, 0 for any free port (see port). Default: 9200
+            host (str): host name. Default: "localhost"
+            latency_ms (float): delay of every request. Default: 0.0
+            jitter_ms (float): maximum random extra delay of every request. Default: 0.0
+            query_latency_ms (float): delay per query of search requests. Default: 0.0
+            error_rate (float): probability that a request fails. Default: 0.0
+            error_status (int): HTTP status of failed requests. Default: 503
+            seed (int): random seed of jitter and failures. Default: None
+
+        Raises:
+            ValueError: If a latency is negative or error_rate is not between 0.0 and 1.0
+        """
+        if min(latency_ms, jitter_ms, query_latency_ms) < 0:
+            raise ValueError("Latencies must be non-negative.")
+        if not 0.0 <= error_rate <= 1.0:
+            raise ValueError("error_rate must be between 0.0 and 1.0.")
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.query_latency_ms = query_latency_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.indices = {}
+        self.indices_lock = threading.Lock()
+        self.scrolls = {}
+        self.scroll_ids = itertools.count(1)
+        self.request_counts = {}
+        self.thread = None
+        super().__init__((host, port), StandInRequestHandler)
+
+    @property
+    def port(self) -> int:
+        """the port the server listens on"""
+        return self.server_address[1]
+
+    def start(self) -> 'ElasticsearchStandIn':
+        """serve requests in a background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """stop serving and close the socket"""
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self) -> 'ElasticsearchStandIn':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def inject_latency(self, n_queries: int = 0):
+        """sleep for the configured latency of a request with n_queries queries
+
+        Raises:
+            StandInError: With probability error_rate
+        """
+        with self.indices_lock:
+            jitter = self.random.uniform(0.0, self.jitter_ms) if self.jitter_ms else 0.0
+            failed = self.error_rate > 0 and self.random.random() < self.error_rate
+        delay = self.latency_ms + jitter + self.query_latency_ms * n_queries
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if failed:
+            raise StandInError(self.error_status, "injected_failure_exception",
+                               "failure injected by the stand-in server")
+
+    def get_index(self, name: str) -> StandInIndex:
+        """an existing index
+
+        Raises:
+            StandInError: If the index does not exist
+        """
+        index = self.indices.get(name)
+        if index is None:
+            raise StandInError(404, "index_not_found_exception", "no such index [%s]" % name)
+        return index
+
+    def resolve_indices(self, expression: str) -> List[str]:
+        """names of the indices matching a comma-separated list of names or wildcards
+
+        Raises:
+            StandInError: If a name without wildcard does not exist
+        """
+        names = []
+        for pattern in expression.split(","):
+            if pattern in ("_all", "*"):
+                names.extend(sorted(self.indices))
+            elif "*" in pattern or "?" in pattern:
+                names.extend(fnmatch.filter(sorted(self.indices), pattern))
+            else:
+                self.get_index(pattern)
+                names.append(pattern)
+        return names
+
+    def create_index(self, name: str, body: dict) -> dict:
+        """PUT /index"""
+        with self.indices_lock:
+            if name in self.indices:
+                raise StandInError(400, "resource_already_exists_exception",
+                                   "index [%s] already exists" % name)
+            self.indices[name] = StandInIndex(name, body.get("settings"), body.get("mappings"))
+        return {"acknowledged": True, "shards_acknowledged": True, "index": name}
+
+    def delete_indices(self, expression: str) -> dict:
+        """DELETE /index"""
+        with self.indices_lock:
+            for name in self.resolve_indices(expression):
+                del self.indices[name]
+        return {"acknowledged": True}
+
+    def bulk(self, lines: List[str], default_index: str = None) -> dict:
+        """POST /_bulk
+
+        Args:
+            lines (list(str)): newline-delimited JSON actions and sources
+            default_index (str): index of actions without _index. Default: None
+
+        Returns:
+            dict: bulk response with one item per action
+        """
+        start_time = time.time()
+        items = []
+        errors = False
+        i = 0
+        while i < len(lines):
+            action = json.loads(lines[i])
+            op_type, meta = next(iter(action.items()))
+            i += 1
+            source = None
+            if op_type in ("index", "create"):
+                source = json.loads(lines[i])
+                i += 1
+            item = {"_index": meta.get("_index", default_index), "_type": meta.get("_type", "doc"),
+                    "_id": str(meta.get("_id", "")), "_version": 1}
+            try:
+                index = self.get_index(item["_index"])
+                if op_type in ("index", "create"):
+                    if not item["_id"]:
+                        item["_id"] = "%s_%i" % (index.name, len(index.docs))
+                    if op_type == "create" and item["_id"] in index.docs:
+                        raise StandInError(409, "version_conflict_engine_exception",
+                                           "[doc][%s]: document already exists" % item["_id"])
+                    index.index_doc(item["_id"], source)
+                    item.update(result="created", status=201)
+                elif op_type == "delete":
+                    found = index.delete_doc(item["_id"])
+                    item.update(result="deleted" if found else "not_found",
+                                status=200 if found else 404)
+                else:
+                    raise StandInError(400, "illegal_argument_exception",
+                                       "unsupported bulk action [%s]" % op_type)
+            except StandInError as e:
+                errors = True
+                item.update(status=e.status, error={"type": e.error_type, "reason": e.reason})
+            items.append({op_type: item})
+        return {"took": int((time.time() - start_time) * 1000), "errors": errors, "items": items}
+
+    def search(self, index_name: str, body: dict, params: dict = None) -> dict:
+        """POST /index/_search
+
+        Args:
+            index_name (str): name of the index
+            body (dict): request body with size, query, sort, track_scores and _source
+            params (dict): URL parameters (size, sort, scroll)
+
+        Returns:
+            dict: search response, with a _scroll_id if the scroll parameter is set
+        """
+        params = params or {}
+        start_time = time.time()
+        index = self.get_index(index_name)
+        query = self.get_query_text(body.get("query", {"match_all": {}}))
+        size = int(body.get("size", params.get("size", 10)))
+        sort = body.get("sort", params.get("sort"))
+        scroll = "scroll" in params
+        results, total = index.search(query, len(index.docs) if scroll else size)
+
+        hits = []
+        track_scores = not sort or body.get("track_scores", False)
+        source_fields = body.get("_source", True)
+        for doc_id, score in results:
+            source = index.docs.get(doc_id, {})
+            if isinstance(source_fields, list):
+                source = {field: source[field] for field in source_fields if field in source}
+            hit = {"_index": index.name, "_type": "doc", "_id": doc_id,
+                   "_score": float(np.float32(score)) if track_scores else None}
+            if source_fields is not False:
+                hit["_source"] = source
+            if sort:
+                hit["sort"] = [float(np.float32(score)), "doc#%s" % doc_id]
+            hits.append(hit)
+        max_score = hits[0]["_score"] if hits and track_scores else None
+        response = {"took": int((time.time() - start_time) * 1000), "timed_out": False,
+                    "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+                    "hits": {"total": total, "max_score": max_score, "hits": hits[:size]}}
+        if scroll:
+            scroll_id = "scroll#%i" % next(self.scroll_ids)
+            with self.indices_lock:
+                self.scrolls[scroll_id] = (hits[size:], size, total)
+            response["_scroll_id"] = scroll_id
+        return response
+
+    def scroll(self, body: dict, params: dict) -> dict:
+        """POST /_search/scroll, the next page of hits of a scrolled search
+
+        Raises:
+            StandInError: If the scroll id is unknown
+        """
+        scroll_id = body.get("scroll_id", params.get("scroll_id"))
+        with self.indices_lock:
+            if scroll_id not in self.scrolls:
+                raise StandInError(404, "search_context_missing_exception",
+                                   "No search context found for id [%s]" % scroll_id)
+            hits, size, total = self.scrolls[scroll_id]
+            self.scrolls[scroll_id] = (hits[size:], size, total)
+        return {"_scroll_id": scroll_id, "took": 0, "timed_out": False,
+                "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+                "hits": {"total": total, "max_score": None, "hits": hits[:size]}}
+
+    def clear_scroll(self, body: dict, params: dict) -> dict:
+        """DELETE /_search/scroll"""
+        scroll_ids = body.get("scroll_id", params.get("scroll_id", []))
+        if isinstance(scroll_ids, str):
+            scroll_ids = scroll_ids.split(",")
+        with self.indices_lock:
+            freed = [self.scrolls.pop(scroll_id, None) for scroll_id in scroll_ids]
+        n_freed = len([scroll for scroll in freed if scroll is not None])
+        return {"succeeded": True, "num_freed": n_freed}
+
+    @staticmethod
+    def get_query_text(query: dict) -> Optional[str]:
+        """text of a simple_query_string or match query, None for match_all
+
+        Raises:
+            StandInError: If the query type is not supported
+        """
+        if "simple_query_string" in query:
+            return query["simple_query_string"]["query"]
+        if "query_string" in query:
+            return query["query_string"]["query"]
+        if "match" in query:
+            value = next(iter(query["match"].values()))
+            return value["query"] if isinstance(value, dict) else value
+        if "match_all" in query:
+            return None
+        raise StandInError(400, "parsing_exception",
+                           "unsupported query [%s]" % ",".join(query))
+
+    def msearch(self, lines: List[str], default_index: str = None) -> dict:
+        """POST /_msearch
+
+        Args:
+            lines (list(str)): newline-delimited JSON headers and bodies
+            default_index (str): index of searches without index in their header
+
+        Returns:
+            dict: one search response (or error) per search
+        """
+        start_time = time.time()
+        responses = []
+        for header_line, body_line in zip(lines[0::2], lines[1::2]):
+            header = json.loads(header_line)
+            try:
+                response = self.search(header.get("index", default_index), json.loads(body_line))
+                response["status"] = 200
+            except StandInError as e:
+                response = e.get_body()
+            responses.append(response)
+        return {"took": int((time.time() - start_time) * 1000), "responses": responses}
+
+    def mtermvectors(self, index_name: str, body: dict, params: dict) -> dict:
+        """POST /index/_mtermvectors, with ids in the body or in the URL parameters"""
+        index = self.get_index(index_name)
+        doc_ids = body.get("ids") or [doc["_id"] for doc in body.get("docs", [])]
+        if not doc_ids and params.get("ids"):
+            doc_ids = params["ids"].split(",")
+        docs = []
+        for doc_id, term_freqs in zip(doc_ids, index.get_term_vectors(doc_ids)):
+            doc = {"_index": index.name, "_type": "doc", "_id": doc_id, "_version": 1,
+                   "found": term_freqs is not None, "took": 0}
+            if term_freqs is not None:
+                doc["term_vectors"] = {"doc_text": {"terms": OrderedDict(
+                    (term, {"term_freq": tf}) for term, tf in term_freqs.items())}}
+            docs.append(doc)
+        return {"docs": docs}
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    """Routes the requests of an ElasticsearchStandIn server"""
+
+    # keep-alive connections, like ElasticSearch
+    protocol_version = "HTTP/1.1"
+    server_version = "ElasticsearchStandIn"
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_HEAD(self):
+        self.handle_request("HEAD")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def handle_request(self, method: str):
+        """parse the request, inject latency and failures, route it and send the response"""
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length).decode("utf-8") if length else ""
+        endpoint = ([part for part in parts if part.startswith("_")] or ["_index"])[-1]
+        server = self.server
+        with server.indices_lock:
+            server.request_counts[endpoint] = server.request_counts.get(endpoint, 0) + 1
+
+        try:
+            n_queries = 0
+            if endpoint == "_msearch":
+                n_queries = len([line for line in raw_body.split("\n") if line.strip()]) // 2
+            elif endpoint == "_search":
+                n_queries = 1
+            server.inject_latency(n_queries)
+            status, response = self.route(method, parts, params, raw_body)
+        except StandInError as e:
+            status, response = e.status, e.get_body()
+        except (ValueError, KeyError, TypeError) as e:
+            status, response = 400, StandInError(400, "parse_exception", str(e)).get_body()
+
+        body = b"" if response is None else json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if method != "HEAD":
+            self.wfile.write(body)
+
+    def route(self, method: str, parts: List[str], params: dict,
+              raw_body: str) -> Tuple[int, Optional[dict]]:
+        """dispatch a request to the server
+
+        Returns:
+            int: HTTP status
+            dict: JSON response, None for HEAD requests
+        """
+        server = self.server
+        body = json.loads(raw_body) if raw_body.strip() and not parts[-1:] in (
+            ["_bulk"], ["_msearch"]) else {}
+        lines = [line for line in raw_body.split("\n") if line.strip()]
+        index_name = parts[0] if parts and not parts[0].startswith("_") else None
+        action = parts[-1] if parts and parts[-1].startswith("_") else None
+
+        if not parts:
+            if method in ("GET", "HEAD"):
+                return 200, {
+                    "name": "stand-in", "cluster_name": "clireval",
+                    "version": {"number": server.VERSION, "build_flavor": "default",
+                                "lucene_version": "7.5.0"},
+                    "tagline": "You Know, for Search"}
+        elif parts == ["_search", "scroll"]:
+            if method in ("POST", "GET"):
+                return 200, server.scroll(body, params)
+            if method == "DELETE":
+                return 200, server.clear_scroll(body, params)
+        elif action is None and len(parts) == 1:
+            if method == "HEAD":
+                return (200 if index_name in server.indices else 404), None
+            if method == "PUT":
+                return 200, server.create_index(index_name, body)
+            if method == "DELETE":
+                return 200, server.delete_indices(index_name)
+        elif action == "_mapping" or (len(parts) == 3 and parts[1] == "_mapping"):
+            # /index/type/_mapping or /index/_mapping/type, typed like ElasticSearch 6
+            doc_type = parts[1] if action == "_mapping" and len(parts) == 3 else \
+                parts[2] if len(parts) == 3 else None
+            if method in ("PUT", "POST"):
+                if doc_type is None:
+                    raise StandInError(400, "action_request_validation_exception",
+                                       "Validation Failed: 1: mapping type is missing;")
+                for name in server.resolve_indices(index_name):
+                    server.get_index(name).put_mapping(doc_type, body)
+                return 200, {"acknowledged": True}
+            if method == "GET":
+                names = server.resolve_indices(index_name or "_all")
+                indices = [server.get_index(name) for name in names]
+                return 200, {index.name: {"mappings": {index.doc_type: index.mappings}
+                                          if index.doc_type is not None else {}}
+                             for index in indices}
+        elif action == "_settings" and method in ("PUT", "POST"):
+            for name in server.resolve_indices(index_name):
+                server.get_index(name).settings.update(body.get("index", body))
+            return 200, {"acknowledged": True}
+        elif action == "_refresh" and method in ("POST", "GET"):
+            names = server.resolve_indices(index_name or "_all")
+            for name in names:
+                server.get_index(name).get_bm25()
+            return 200, {"_shards": {"total": len(names), "successful": len(names), "failed": 0}}
+        elif action == "_forcemerge" and method == "POST":
+            # segments are not modelled, deleted documents never count in the statistics
+            names = server.resolve_indices(index_name or "_all")
+            return 200, {"_shards": {"total": len(names), "successful": len(names), "failed": 0}}
+        elif action == "_bulk" and method in ("POST", "PUT"):
+            return 200, server.bulk(lines, index_name)
+        elif action == "_search" and method in ("POST", "GET"):
+            return 200, server.search(index_name, body, params)
+        elif action == "_msearch" and method in ("POST", "GET"):
+            return 200, server.msearch(lines, index_name)
+        elif action == "_mtermvectors" and method in ("POST", "GET"):
+            return 200, server.mtermvectors(index_name, body, params)
+        elif action == "_count" and method in ("POST", "GET"):
+            return 200, {"count": len(server.get_index(index_name).get_bm25()),
+                         "_shards": {"total": 1, "successful": 1, "failed": 0}}
+        raise StandInError(400, "illegal_argument_exception",
+                           "unsupported request [%s /%s]" % (method, "/".join(parts)))
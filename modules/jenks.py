@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+Jenks natural breaks of score vectors which are mostly zeros, identical to jenkspy
+"""
+from typing import List, Sequence
+import jenkspy
+import numpy as np
+
+
+class JenksBreaks():
+    """Jenks natural breaks (https://github.com/mthh/jenkspy) of many score vectors
+
+    Search scores of a query are 0.0 for most documents. jenkspy runs its O(n^2)
+    dynamic program over every element, so the zeros dominate the cost. The dynamic
+    program over the zeros has a closed form: every class made of zeros costs exactly
+    0.0 and the sums of a class do not change when zeros are added, only its size
+    does. The zeros are therefore kept as a count and the program runs over the
+    positive scores only, with the same floating point operations in the same order
+    and the same tie breaking as jenkspy, so the breaks are identical.
+
+    Breaks are memoized by score profile (the sorted scores), so queries with identical
+    search results are only computed once.
+
+    With approx_bins > 0, the positive scores of vectors with more than approx_bins of
+    them are grouped into at most approx_bins bins of consecutive distinct scores (see
+    get_approximate_breaks) and the dynamic program runs over the bins, weighted by their
+    counts. Every break is a real score, the largest score of its class. The goodness of
+    variance fit (GVF) of the approximate breaks on the original scores is recorded in
+    gvfs.
+
+    Attributes:
+        nb_class (int): number of classes
+        approx_bins (int): maximum number of bins of approximate mode, 0 for exact breaks
+        cache (dict): breaks of the score profiles seen so far
+        gvfs (list(float)): GVF of the breaks of every approximated score vector
+    """
+
+    # jenkspy initializes the costs of its dynamic program with FLT_MAX
+    FLT_MAX = float(np.finfo(np.float32).max)
+
+    # number of elements of the temporary cost matrices
+    block_size = 1 << 20
+
+    # jenkspy is used when n_values ** 2 < min_speedup * n_positives ** 2 + min_cost:
+    # its cost grows with n_values ** 2, the cost of NumPy calls with n_positives
+    min_speedup = 16
+    min_cost = 1 << 16
+
+    def __init__(self, nb_class: int, approx_bins: int = 0):
+        """constructor
+
+        Args:
+            nb_class (int): number of classes
+            approx_bins (int): maximum number of bins for approximate breaks, 0 for exact
+            breaks. Default: 0
+        """
+        self.nb_class = nb_class
+        self.approx_bins = approx_bins
+        self.cache = {}
+        self.gvfs = []
+
+    def get_breaks(self, scores: Sequence[float]) -> List[float]:
+        """breaks of a score vector, the same as jenkspy.jenks_breaks(scores, nb_class)
+
+        Args:
+            scores (sequence(float)): non-negative scores
+
+        Raises:
+            ValueError: If nb_class is not smaller than the number of scores
+
+        Returns:
+            list(float): nb_class + 1 break values
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        positives = scores[scores != 0.0]
+        return self.get_sparse_breaks(positives, len(scores))
+
+    def get_sparse_breaks(self, values: np.ndarray, n_values: int) -> List[float]:
+        """breaks of a score vector given by its non-zero scores
+
+        Args:
+            values (np.ndarray): the stored scores, may contain zeros
+            n_values (int): length of the score vector, the other scores are 0.0
+
+        Raises:
+            ValueError: If nb_class is not smaller than n_values
+
+        Returns:
+            list(float): nb_class + 1 break values
+        """
+        positives = np.sort(np.asarray(values, dtype=np.float64))
+        positives = positives[positives != 0.0]
+        n_zeros = n_values - len(positives)
+        key = (n_zeros, positives.tobytes())
+        if key not in self.cache:
+            if self.approx_bins and len(positives) > self.approx_bins:
+                self.cache[key] = self.get_approximate_breaks(positives, n_zeros)
+            else:
+                self.cache[key] = self.get_exact_breaks(positives, n_zeros)
+        return list(self.cache[key])
+
+    def get_exact_breaks(self, positives: np.ndarray, n_zeros: int) -> List[float]:
+        """jenkspy breaks of n_zeros zeros and the sorted positive scores
+
+        Args:
+            positives (np.ndarray): sorted positive scores
+            n_zeros (int): number of zeros
+
+        Returns:
+            list(float): nb_class + 1 break values
+        """
+        n_values = n_zeros + len(positives)
+        if n_zeros >= self.nb_class and not len(positives):
+            return [0.0] * (self.nb_class + 1)
+        if (n_zeros < self.nb_class or positives[0] < 0.0 or not np.all(np.isfinite(positives))
+                or n_values ** 2 < self.min_speedup * len(positives) ** 2 + self.min_cost):
+            # few zeros (or a small vector): jenkspy itself
+            return list(jenkspy.jenks_breaks(
+                np.concatenate([np.zeros(n_zeros), positives]).tolist(), self.nb_class))
+
+        # costs[t, j]: cost of the best j + 1 classes of the zeros and positives[:t],
+        # starts[t, j]: size of the last of these classes in positives. costs[0] is the
+        # last zero, jenkspy assigns 0.0 to all its classes given enough zeros.
+        n_positives = len(positives)
+        costs = np.zeros((n_positives + 1, self.nb_class))
+        starts = np.zeros((n_positives + 1, self.nb_class), dtype=np.int64)
+        block_rows = max(1, self.block_size // n_positives)
+        for start in range(1, n_positives + 1, block_rows):
+            rows = np.arange(start, min(start + block_rows, n_positives + 1))
+            self.fill_costs(positives, n_zeros, rows, costs, starts)
+
+        # backtrack, a class which starts in the zeros has a break value of 0.0
+        breaks = [0.0] * (self.nb_class + 1)
+        breaks[-1] = float(positives[-1])
+        row = n_positives
+        for j in range(self.nb_class - 1, 0, -1):
+            row -= starts[row, j]
+            if row == 0:
+                break
+            breaks[j] = float(positives[row - 1])
+        return breaks
+
+    @classmethod
+    def fill_costs(cls, positives: np.ndarray, n_zeros: int, rows: np.ndarray,
+                   costs: np.ndarray, starts: np.ndarray):
+        """compute some rows of the dynamic program (see get_exact_breaks), the rows
+        before them must be complete
+
+        Note:
+            jenkspy grows the last class of row t downwards from positives[t - 1] one
+            element at a time, so its sums are cumulative sums of the reversed scores.
+            Among candidates of equal cost it keeps the largest last class.
+        """
+        width = rows[-1]
+        # reversed_scores[r, m - 1] = positives[t - m], 0.0 beyond the first positive
+        index = rows[:, None] - np.arange(1, width + 1)
+        valid = index >= 0
+        index = np.maximum(index, 0)
+        reversed_scores = np.where(valid, positives[index], 0.0)
+        sums = np.cumsum(reversed_scores, axis=1)
+        squares = np.cumsum(reversed_scores * reversed_scores, axis=1)
+
+        # one class of all zeros and positives[:t]
+        block = np.arange(len(rows))
+        sum_t, square_t = sums[block, rows - 1], squares[block, rows - 1]
+        costs[rows, 0] = square_t - (sum_t * sum_t) / (n_zeros + rows)
+
+        variances = squares - (sums * sums) / np.arange(1, width + 1, dtype=np.float64)
+        for j in range(1, costs.shape[1]):
+            candidates = np.where(valid, variances + costs[index, j - 1], np.inf)
+            # argmin of the reversed columns: the largest class among equal costs
+            last_min = width - 1 - np.argmin(candidates[:, ::-1], axis=1)
+            best = candidates[block, last_min]
+            costs[rows, j] = np.minimum(best, cls.FLT_MAX)
+            starts[rows, j] = last_min + 1
+
+    def get_approximate_breaks(self, positives: np.ndarray, n_zeros: int) -> List[float]:
+        """breaks of the positive scores grouped into at most approx_bins bins
+
+        A bin is a run of consecutive distinct scores, so equal scores are never split.
+        Half of the bins hold about the same number of scores (they resolve dense
+        regions), the other half span about the same range of scores (they keep outliers
+        apart). The zeros are one more bin. The dynamic program uses the exact count, sum
+        and sum of squares of every bin, so the cost of a class is exact, and the break
+        of a class is the largest score of its last bin. The breaks are then moved to the
+        best distinct score between their neighbouring breaks (see refine_breaks).
+
+        Args:
+            positives (np.ndarray): sorted positive scores
+            n_zeros (int): number of zeros
+
+        Returns:
+            list(float): nb_class + 1 break values
+        """
+        # distinct scores and their counts
+        firsts = np.flatnonzero(np.concatenate([[True], positives[1:] != positives[:-1]]))
+        values = positives[firsts]
+        counts = np.diff(np.append(firsts, len(positives)))
+
+        # ends (exclusive) of the bins in values
+        n_count_bins = self.approx_bins // 2
+        cumulative = np.cumsum(counts)
+        count_ends = np.searchsorted(
+            cumulative, np.linspace(0, cumulative[-1], n_count_bins + 1)[1:], side='left') + 1
+        width_ends = np.searchsorted(
+            values, np.linspace(values[0], values[-1], self.approx_bins - n_count_bins + 1)[1:],
+            side='right')
+        ends = np.unique(np.concatenate([count_ends, width_ends, [len(values)]]))
+        ends = ends[(ends > 0) & (ends <= len(values))]
+        starts = np.concatenate([[0], ends[:-1]])
+
+        weights = np.add.reduceat(counts.astype(np.float64), starts)
+        sums = np.add.reduceat(values * counts, starts)
+        squares = np.add.reduceat(values * values * counts, starts)
+        tops = values[ends - 1]
+        if n_zeros:
+            weights, sums = np.append(n_zeros, weights), np.append(0.0, sums)
+            squares, tops = np.append(0.0, squares), np.append(0.0, tops)
+
+        breaks = self.get_weighted_breaks(weights, sums, squares, tops)
+        if n_zeros:
+            values, counts = np.append(0.0, values), np.append(n_zeros, counts)
+        breaks = self.refine_breaks(values, counts, breaks)
+        breaks[0] = float(values[0])
+        self.gvfs.append(self.goodness_of_variance_fit(positives, n_zeros, breaks))
+        return breaks
+
+    def get_weighted_breaks(self, weights: np.ndarray, sums: np.ndarray, squares: np.ndarray,
+                            tops: np.ndarray) -> List[float]:
+        """jenks breaks of sorted bins of scores, every class is a run of whole bins
+
+        Args:
+            weights (np.ndarray): number of scores of every bin
+            sums (np.ndarray): sum of the scores of every bin
+            squares (np.ndarray): sum of the squared scores of every bin
+            tops (np.ndarray): largest score of every bin
+
+        Returns:
+            list(float): nb_class + 1 break values, the first one is tops[0]
+        """
+        n_bins = len(weights)
+        if n_bins <= self.nb_class:
+            # a class per bin, the lowest classes are empty
+            return [float(tops[0])] * (self.nb_class + 1 - n_bins) + tops.tolist()
+
+        # prefix sums: the class of bins i to j - 1 costs
+        # squares[j] - squares[i] - (sums[j] - sums[i]) ** 2 / (weights[j] - weights[i])
+        weights, sums, squares = (np.concatenate([[0.0], np.cumsum(a)])
+                                  for a in (weights, sums, squares))
+        # costs[j, c]: cost of the best c + 1 classes of bins[:j], previous[j, c]: the
+        # first bin of the last of these classes
+        costs = np.full((n_bins + 1, self.nb_class), np.inf)
+        previous = np.zeros((n_bins + 1, self.nb_class), dtype=np.int64)
+        ends = np.arange(1, n_bins + 1)
+        costs[ends, 0] = squares[ends] - sums[ends] ** 2 / weights[ends]
+        block_rows = max(1, self.block_size // n_bins)
+        for c in range(1, self.nb_class):
+            for start in range(c + 1, n_bins + 1, block_rows):
+                rows = np.arange(start, min(start + block_rows, n_bins + 1))
+                firsts = np.arange(n_bins)
+                class_weights = weights[rows, None] - weights[firsts]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    class_costs = squares[rows, None] - squares[firsts] \
+                        - (sums[rows, None] - sums[firsts]) ** 2 / class_weights
+                candidates = np.where(firsts < rows[:, None], costs[firsts, c - 1] + class_costs,
+                                      np.inf)
+                previous[rows, c] = np.argmin(candidates, axis=1)
+                costs[rows, c] = candidates[np.arange(len(rows)), previous[rows, c]]
+
+        breaks = [float(tops[0])] * (self.nb_class + 1)
+        end = n_bins
+        for c in range(self.nb_class - 1, -1, -1):
+            breaks[c + 1] = float(tops[end - 1])
+            end = previous[end, c]
+        return breaks
+
+    @staticmethod
+    def refine_breaks(values: np.ndarray, counts: np.ndarray, breaks: List[float],
+                      max_passes: int = 100) -> List[float]:
+        """move every inner break to the distinct score between its neighbouring breaks
+        which minimizes the squared deviations of the two classes it separates, until no
+        break moves. Every move lowers the total cost, so the fit only improves.
+
+        Args:
+            values (np.ndarray): sorted distinct scores
+            counts (np.ndarray): number of occurrences of every score
+            breaks (list(float)): break values, scores in values
+            max_passes (int): maximum number of passes over the breaks. Default: 100
+
+        Returns:
+            list(float): refined break values
+        """
+        # ends[k]: end (exclusive) of class k in values
+        ends = np.searchsorted(values, breaks[1:], side='right')
+        if np.any(np.diff(np.concatenate([[0], ends])) <= 0):
+            # empty classes, there is nothing to move
+            return list(breaks)
+        weights, sums, squares = (np.concatenate([[0.0], np.cumsum(a)]) for a in (
+            counts.astype(np.float64), values * counts, values * values * counts))
+
+        def cost(first, end):
+            return squares[end] - squares[first] \
+                - (sums[end] - sums[first]) ** 2 / (weights[end] - weights[first])
+
+        for _ in range(max_passes):
+            moved = False
+            for k in range(len(ends) - 1):
+                first = ends[k - 1] if k else 0
+                candidates = np.arange(first + 1, ends[k + 1])
+                costs = cost(first, candidates) + cost(candidates, ends[k + 1])
+                best = candidates[np.argmin(costs)]
+                if costs[best - first - 1] < costs[ends[k] - first - 1] - 1e-12:
+                    ends[k] = best
+                    moved = True
+            if not moved:
+                break
+        return [float(breaks[0])] + values[ends - 1].tolist()
+
+    @staticmethod
+    def goodness_of_variance_fit(positives: np.ndarray, n_zeros: int,
+                                 breaks: List[float]) -> float:
+        """goodness of variance fit of breaks: 1 - (squared deviations from the class
+        means) / (squared deviations from the mean)
+
+        Args:
+            positives (np.ndarray): positive scores
+            n_zeros (int): number of zeros
+            breaks (list(float)): break values
+
+        Returns:
+            float: GVF between 0.0 and 1.0, 1.0 if all scores are equal
+        """
+        scores = np.concatenate([[0.0], positives])
+        weights = np.concatenate([[n_zeros], np.ones(len(positives))])
+        # a class contains the scores up to (and including) its upper break
+        classes = np.searchsorted(np.asarray(breaks[1:-1]), scores, side='left')
+        n_classes = len(breaks) - 1
+        counts = np.bincount(classes, weights, minlength=n_classes)
+        means = np.bincount(classes, weights * scores, minlength=n_classes) / np.maximum(counts, 1)
+        class_deviations = np.sum(weights * (scores - means[classes]) ** 2)
+        mean = np.sum(weights * scores) / np.sum(weights)
+        deviations = np.sum(weights * (scores - mean) ** 2)
+        return 1.0 - class_deviations / deviations if deviations > 0 else 1.0
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Search backend which runs BM25 retrieval in-process instead of on an ElasticSearch server
+"""
+from typing import Dict, List, Optional, Tuple
+import logging
+from .bm25 import BM25Index
+from .search import Search
+from .vocabulary import Vocabulary
+
+
+class LocalSearch(Search):
+    """ Drop-in replacement of Search which indexes and searches with an in-memory
+    BM25 index (see modules.bm25.BM25Index), so no ElasticSearch server is needed.
+
+    Note:
+        ElasticSearch language analyzers are not available, every target language is
+        tokenized with a lower-casing unicode word tokenizer.
+    """
+
+    def connect(self, **kwargs):
+        """create an empty collection of in-memory indices
+
+        Args:
+            **bm25_k1 (float): BM25 k1 parameter
+            **bm25_b (float): BM25 b parameter
+        """
+        self.bm25_params = {}
+        if kwargs.get('bm25_k1') is not None:
+            self.bm25_params['k1'] = kwargs['bm25_k1']
+        if kwargs.get('bm25_b') is not None:
+            self.bm25_params['b'] = kwargs['bm25_b']
+        self.indices = {}
+        self.index_meta = {}
+        self.doc_hashes = {}
+
+    def get_qrel_settings(self, **kwargs) -> dict:
+        """ settings which the reference qrels depend on, including BM25 parameters
+
+        Returns:
+            dict: backend, analyzer, BM25 and relevance settings
+        """
+        settings = super().get_qrel_settings(**kwargs)
+        settings.update(self.bm25_params)
+        return settings
+
+    def get_index_settings(self) -> dict:
+        """ settings which the content of an index depends on, including BM25 parameters
+
+        Returns:
+            dict: backend, analyzer and BM25 settings
+        """
+        settings = super().get_index_settings()
+        settings.update(self.bm25_params)
+        return settings
+
+    def get_index_meta(self, index: str) -> Optional[dict]:
+        """ metadata of a persistent in-memory index
+
+        Args:
+            index (str): name of the index
+
+        Returns:
+            dict: metadata, None if the index does not exist or has no metadata
+        """
+        if index not in self.indices:
+            return None
+        return self.index_meta.get(index)
+
+    def put_index_meta(self, index: str, meta: dict):
+        """ store the metadata of a persistent in-memory index
+
+        Args:
+            index (str): name of the index
+            meta (dict): metadata
+        """
+        self.index_meta[index] = dict(meta)
+
+    def get_index_doc_count(self, index: str) -> int:
+        """ number of documents in an in-memory index
+
+        Args:
+            index (str): name of the index
+
+        Returns:
+            int: number of documents
+        """
+        return len(self.indices[index])
+
+    def list_persistent_indices(self) -> Dict[str, dict]:
+        """ persistent in-memory indices, with their metadata
+
+        Returns:
+            dict(str, dict): Maps index name to metadata
+        """
+        return {index: meta for index, meta in self.index_meta.items() if index in self.indices}
+
+    def delete_index(self, index: str):
+        """ delete an in-memory index
+
+        Args:
+            index (str): name of the index
+        """
+        self.indices.pop(index, None)
+        self.index_meta.pop(index, None)
+        self.doc_hashes.pop(index, None)
+
+    def recreate_index(self, analyzer: str, index: str = None):
+        """ deletes previous index and create a new index
+
+        args:
+            analzyer (str): ignored, the local backend has a single built-in analyzer
+            index (str): name of the index. Default: self.INDEX
+        """
+        self.indices[index or self.INDEX] = BM25Index(**self.bm25_params)
+        self.doc_hashes.pop(index or self.INDEX, None)
+
+    def bulk_index(self, doc_iterable: List[Tuple[str, str]], index: str = None) -> int:
+        """ index documents into the in-memory BM25 index
+
+        args:
+            doc_iterable (list(tuple(str, str))): List of document tuples -> (doc id, doc text)
+            index (str): name of the index. Default: self.INDEX
+
+        returns:
+            (int): Number of indexed documents
+        """
+        index = index or self.INDEX
+        if self.incremental:
+            self.doc_hashes.setdefault(index, {}).update(
+                (str(doc_id), self.get_doc_hash(doc_text)) for doc_id, doc_text in doc_iterable)
+        return self.indices[index].index(doc_iterable)
+
+    def get_doc_hashes(self, index: str) -> Optional[Dict[str, str]]:
+        """ content hashes of the documents of an incremental in-memory index
+
+        Note:
+            In-memory indices only live as long as the LocalSearch object, so documents
+            are only reused by later passes of the same object (see modules.api and
+            modules.daemon).
+
+        Args:
+            index (str): name of the index
+
+        Returns:
+            dict(str, str): Maps doc id to content hash, None if the index does not exist
+        """
+        if index not in self.indices:
+            return None
+        return dict(self.doc_hashes.get(index, {}))
+
+    def update_docs(self, doc_iterable: List[Tuple[str, str]], delete_ids: List[str],
+                    index: str):
+        """ upsert and delete documents of an incremental in-memory index
+
+        Args:
+            doc_iterable (list(tuple(str, str))): documents to add or replace
+            delete_ids (list(str)): ids of documents to delete
+            index (str): name of the index
+        """
+        self.indices[index].update(doc_iterable, delete_ids)
+        doc_hashes = self.doc_hashes.setdefault(index, {})
+        for doc_id in delete_ids:
+            doc_hashes.pop(str(doc_id), None)
+        doc_hashes.update(
+            (str(doc_id), self.get_doc_hash(doc_text)) for doc_id, doc_text in doc_iterable)
+
+    def get_vocabulary(
+            self, doc_iterable: List[Tuple[str, str]],
+            index: str = None) -> Vocabulary:
+        """ get unique terms and document frequencies of all documents
+
+        args:
+            doc_iterable (list(tuple(str, str))): List of doc tuples -> (doc id, doc text)
+            index (str): name of the index. Default: self.INDEX
+
+        returns:
+            Vocabulary: unique terms and their document frequencies
+        """
+        doc_ids = [doc_id for doc_id, _ in doc_iterable]
+        vocabulary = Vocabulary()
+        vocabulary.add_docs(self.indices[index or self.INDEX].iter_doc_terms(doc_ids))
+        return vocabulary
+
+    def search(
+            self, query_iterable: List[Tuple[str, str]],
+            index: str = None) -> List[Tuple[str, str, float]]:
+        """ Execute all queries in query_iterable with vectorized BM25 scoring
+
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            index (str): name of the index. Default: self.INDEX
+
+        Returns:
+            list(tuple(str, str, float)): list of result tuples -> (query id, doc id, bm25 score)
+        """
+        logging.info(
+            "Getting search results from local BM25 index (%i queries)...",
+            len(query_iterable))
+        search_results, no_hit_count = self.search_chunk(query_iterable, index)
+
+        if no_hit_count:
+            logging.warning("%d queries have 0 search hit", no_hit_count)
+
+        return search_results
+
+    def search_terms(
+            self, query_iterable: List[Tuple[str, str]],
+            doc_iterable: List[Tuple[str, str]],
+            index: str = None) -> List[Tuple[str, str, float]]:
+        """ Execute single-term queries by looking up the postings of the terms
+
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, term)
+            doc_iterable (list(tuple(str, str))): ignored, the documents are in the index
+            index (str): name of the index. Default: self.INDEX
+
+        Returns:
+            list(tuple(str, str, float)): list of result tuples -> (query id, doc id, bm25 score)
+        """
+        search_results, no_hit_count = self.indices[index or self.INDEX].search_terms(
+            query_iterable, self.n_ret)
+        if no_hit_count:
+            logging.warning("%d queries have 0 search hit", no_hit_count)
+        return search_results
+
+    def search_chunk(self, query_batch: List[Tuple[str, str]],
+                     index: str = None) -> Tuple[List[Tuple[str, str, float]], int]:
+        """ execute a chunk of queries without progress reporting
+
+        Args:
+            query_batch (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            index (str): name of the index. Default: self.INDEX
+
+        Returns:
+            list(tuple(str, str, float)): list of result tuples -> (query id, doc id, bm25 score)
+            int: number of queries without any hit
+        """
+        return self.indices[index or self.INDEX].search(query_batch, self.n_ret)
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the evaluation pipeline: timed spans, counters and histograms
+"""
+from typing import Callable, Dict, Iterable, List, Optional
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+import cProfile
+import io
+import json
+import pstats
+import resource
+import threading
+import time
+import tracemalloc
+import numpy as np
+
+
+class Profiler():
+    """Collects timed spans, counters and histograms of the active profiler
+
+    Code registers spans on the profiler with Profiler.span (a context manager which
+    also works as a decorator), counts events with Profiler.count and records values
+    with Profiler.observe. These are class methods which do nothing unless a profiler
+    is active, i.e. inside `with profiler:`, so instrumented code costs nothing when
+    profiling is off (see start and stop).
+
+    Spans with the same name are aggregated: number of calls, total seconds, peak
+    resident set size while a call was running and, with trace_memory, peak Python
+    allocations (tracemalloc). Spans of several threads may overlap, so the seconds
+    of nested or concurrent spans do not add up to the wall time. A span named in
+    cprofile_stages also runs under cProfile (in the thread which opened it) and
+    reports its most expensive functions.
+
+    Listeners registered with add_listener are called with the name and the record of
+    every finished span.
+
+    Attributes:
+        trace_memory (bool): whether peak Python allocations are measured
+        cprofile_stages (set(str)): names of the spans which run under cProfile
+        sample_interval (float): seconds between two RSS samples
+        top_functions (int): number of functions reported per cProfile'd span
+        stages (OrderedDict(str, dict)): aggregated spans in order of first use
+        counters (OrderedDict(str, float)): counters
+        histograms (OrderedDict(str, array)): observed values
+    """
+
+    STATM = "/proc/self/statm"
+
+    # the profiler which records spans, None if profiling is off
+    active = None
+
+    def __init__(self, trace_memory: bool = False, cprofile_stages: Iterable[str] = (),
+                 sample_interval: float = 0.01, top_functions: int = 25):
+        """constructor
+
+        Args:
+            trace_memory (bool): measure peak Python allocations of every span with
+            tracemalloc, which slows down allocation-heavy code. Default: False
+            cprofile_stages (iterable(str)): names of the spans which run under cProfile.
+            Default: ()
+            sample_interval (float): seconds between two RSS samples. Default: 0.01
+            top_functions (int): number of functions reported per cProfile'd span.
+            Default: 25
+        """
+        self.trace_memory = trace_memory
+        self.cprofile_stages = set(cprofile_stages)
+        self.sample_interval = sample_interval
+        self.top_functions = top_functions
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self.histograms = OrderedDict()
+        self.listeners = []
+        self.lock = threading.Lock()
+        # peak RSS and peak traced memory of every running span
+        self.open_spans = {}
+        self.thread_state = threading.local()
+        self.sampler = None
+        self.done = None
+        self.start_time = None
+        self.wall_seconds = None
+
+    def start(self):
+        """make this profiler the active profiler and start measuring memory
+
+        Raises:
+            RuntimeError: If another profiler is active
+        """
+        if Profiler.active is not None:
+            raise RuntimeError("Another profiler is active.")
+        if self.trace_memory:
+            tracemalloc.start()
+        self.done = threading.Event()
+        self.sampler = threading.Thread(target=self.sample_rss, daemon=True)
+        self.sampler.start()
+        self.start_time = time.perf_counter()
+        Profiler.active = self
+
+    def stop(self):
+        """stop profiling"""
+        Profiler.active = None
+        self.wall_seconds = time.perf_counter() - self.start_time
+        self.done.set()
+        self.sampler.join()
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    def __enter__(self) -> 'Profiler':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @classmethod
+    @contextmanager
+    def span(cls, name: str):
+        """measure the code of a with block (or of a decorated function) as span name
+
+        Args:
+            name (str): name of the span
+        """
+        profiler = cls.active
+        if profiler is None:
+            yield
+            return
+        with profiler.measure(name):
+            yield
+
+    @classmethod
+    def count(cls, name: str, value: float = 1):
+        """add value to counter name of the active profiler
+
+        Args:
+            name (str): name of the counter
+            value (float): increment. Default: 1
+        """
+        profiler = cls.active
+        if profiler is not None:
+            with profiler.lock:
+                profiler.counters[name] = profiler.counters.get(name, 0) + value
+
+    @classmethod
+    def observe(cls, name: str, value: float, count: int = 1):
+        """record a value in histogram name of the active profiler
+
+        Args:
+            name (str): name of the histogram
+            value (float): observed value
+            count (int): number of times the value was observed, e.g. the amortized
+            latency of every query of a batch. Default: 1
+        """
+        profiler = cls.active
+        if profiler is not None:
+            with profiler.lock:
+                profiler.histograms.setdefault(name, array('d')).extend([value] * count)
+
+    def add_listener(self, listener: Callable[[str, dict], None]):
+        """call listener(name, record) whenever a span ends
+
+        Args:
+            listener (callable): receives the span name and a dict with seconds,
+            peak_rss_mb and peak_memory_mb of the call
+        """
+        self.listeners.append(listener)
+
+    @classmethod
+    def get_rss(cls) -> int:
+        """current resident set size in bytes"""
+        try:
+            with open(cls.STATM) as statm_f:
+                return int(statm_f.read().split()[1]) * resource.getpagesize()
+        except OSError:
+            # kilobytes on Linux, only grows
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def sample_rss(self):
+        """sampler thread: update the peak RSS of the running spans"""
+        while not self.done.wait(self.sample_interval):
+            self.update_peaks()
+
+    def update_peaks(self, reset_traced_peak: bool = False):
+        """update the peak RSS (and peak traced memory) of the running spans
+
+        Note:
+            tracemalloc has a single peak, it is reset whenever a span starts or ends,
+            so the peak since the last reset is added to every running span first.
+
+        Args:
+            reset_traced_peak (bool): reset the peak of tracemalloc. Default: False
+        """
+        rss = self.get_rss()
+        with self.lock:
+            traced = None
+            if self.trace_memory and tracemalloc.is_tracing():
+                traced = tracemalloc.get_traced_memory()[1]
+                if reset_traced_peak:
+                    tracemalloc.reset_peak()
+            for peaks in self.open_spans.values():
+                peaks[0] = max(peaks[0], rss)
+                if traced is not None:
+                    peaks[1] = max(peaks[1], traced)
+
+    @contextmanager
+    def measure(self, name: str):
+        """measure a span of this profiler, see span
+
+        Args:
+            name (str): name of the span
+        """
+        peaks = [0, 0]
+        self.update_peaks(reset_traced_peak=True)
+        with self.lock:
+            self.open_spans[id(peaks)] = peaks
+        self.update_peaks()
+
+        profile = None
+        if name in self.cprofile_stages and not getattr(self.thread_state, "profiling", False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                self.thread_state.profiling = True
+            except ValueError:
+                # another profiler (e.g. a debugger) is active
+                profile = None
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                self.thread_state.profiling = False
+            self.update_peaks(reset_traced_peak=True)
+            with self.lock:
+                del self.open_spans[id(peaks)]
+            record = {"seconds": seconds,
+                      "peak_rss_mb": peaks[0] / float(1 << 20),
+                      "peak_memory_mb": peaks[1] / float(1 << 20) if self.trace_memory else None}
+            self.add_record(name, record, profile)
+            for listener in self.listeners:
+                listener(name, record)
+
+    def add_record(self, name: str, record: dict, profile: Optional[cProfile.Profile] = None):
+        """aggregate a finished span
+
+        Args:
+            name (str): name of the span
+            record (dict): seconds, peak_rss_mb and peak_memory_mb of the call
+            profile (cProfile.Profile): cProfile of the call, None if not profiled
+        """
+        with self.lock:
+            stage = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0,
+                                                  "peak_rss_mb": 0.0, "peak_memory_mb": None})
+            stage["calls"] += 1
+            stage["seconds"] += record["seconds"]
+            stage["peak_rss_mb"] = max(stage["peak_rss_mb"], record["peak_rss_mb"])
+            if record["peak_memory_mb"] is not None:
+                stage["peak_memory_mb"] = max(stage["peak_memory_mb"] or 0.0,
+                                              record["peak_memory_mb"])
+            if profile is not None:
+                stage.setdefault("profiles", []).append(profile)
+
+    def get_top_functions(self, profiles: List[cProfile.Profile]) -> List[dict]:
+        """most expensive functions (by cumulative time) of cProfile'd calls of a span"""
+        stats = pstats.Stats(profiles[0], stream=io.StringIO())
+        for profile in profiles[1:]:
+            stats.add(profile)
+        functions = []
+        for (file_name, line, func), (_, ncalls, tottime, cumtime, _) in sorted(
+                stats.stats.items(), key=lambda item: -item[1][3])[:self.top_functions]:
+            functions.append({"function": "%s:%i(%s)" % (file_name, line, func),
+                              "ncalls": ncalls, "tottime": round(tottime, 6),
+                              "cumtime": round(cumtime, 6)})
+        return functions
+
+    @staticmethod
+    def get_histogram(values: np.ndarray) -> dict:
+        """summary of observed values: count, mean, percentiles and power-of-two buckets
+
+        Args:
+            values (np.ndarray): observed values
+
+        Returns:
+            dict: count, sum, mean, min, p50, p90, p99, max, and buckets which map the
+            upper bound of every bucket (1, 2, 4, ...) to the number of values in
+            (previous bound, bound]
+        """
+        if not len(values):
+            return {"count": 0}
+        bounds = 2.0 ** np.ceil(np.log2(np.maximum(values, 1.0)))
+        unique_bounds, counts = np.unique(bounds, return_counts=True)
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        return OrderedDict([
+            ("count", len(values)), ("sum", float(values.sum())),
+            ("mean", float(values.mean())), ("min", float(values.min())),
+            ("p50", float(p50)), ("p90", float(p90)), ("p99", float(p99)),
+            ("max", float(values.max())),
+            ("buckets", OrderedDict(("%g" % bound, int(count))
+                                    for bound, count in zip(unique_bounds, counts)))])
+
+    def get_report(self) -> dict:
+        """the measurements as a JSON-serializable dict
+
+        Returns:
+            dict: wall_seconds, max_rss_mb, stages (calls, seconds, peak_rss_mb,
+            peak_memory_mb and cprofile of every span), counters and histograms
+        """
+        stages = OrderedDict()
+        with self.lock:
+            for name, stage in self.stages.items():
+                report = OrderedDict([
+                    ("calls", stage["calls"]), ("seconds", round(stage["seconds"], 4)),
+                    ("peak_rss_mb", round(stage["peak_rss_mb"], 2)),
+                    ("peak_memory_mb", None if stage["peak_memory_mb"] is None
+                     else round(stage["peak_memory_mb"], 2))])
+                if "profiles" in stage:
+                    report["cprofile"] = self.get_top_functions(stage["profiles"])
+                stages[name] = report
+            counters = OrderedDict(self.counters)
+            histograms = OrderedDict(
+                (name, self.get_histogram(np.frombuffer(values, dtype=np.float64)))
+                for name, values in self.histograms.items())
+        return OrderedDict([
+            ("wall_seconds", None if self.wall_seconds is None else round(self.wall_seconds, 4)),
+            # maximum resident set size of the process (kilobytes on Linux)
+            ("max_rss_mb", round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 2)),
+            ("stages", stages), ("counters", counters), ("histograms", histograms)])
+
+    def write_report(self, report_file: str, extra: Dict = None):
+        """write the report as JSON
+
+        Args:
+            report_file (str): path of the JSON file
+            extra (dict): additional top-level entries, e.g. settings. Default: None
+        """
+        report = self.get_report()
+        if extra:
+            report.update(extra)
+        with open(report_file, 'w') as report_f:
+            json.dump(report, report_f, indent=2)
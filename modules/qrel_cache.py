@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent, content-addressed cache of reference qrel files
+"""
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+
+class QrelCache():
+    """ On-disk cache of qrel files (and the queries used to build them)
+
+    Qrels only depend on the reference documents, the queries and the relevance
+    settings, so an entry is addressed by a sha256 fingerprint of those. Every entry
+    is stored as two files in cache_dir: `<key>.qrel` and `<key>.queries.json`.
+    When the total size of the cache exceeds max_size bytes, the least recently
+    used entries (by file modification time, refreshed on every hit) are evicted.
+
+    Attributes:
+        cache_dir (str): directory which contains the cached entries
+        max_size (int): maximum size of the cache in bytes
+    """
+
+    # bump when the qrel generation changes in a way that invalidates old entries
+    VERSION = 1
+
+    QREL_EXT = '.qrel'
+    QUERIES_EXT = '.queries.json'
+
+    def __init__(self, cache_dir: str, max_size_mb: int = 1024):
+        """ constructor
+
+        Args:
+            cache_dir (str): directory which contains the cached entries, created if missing
+            max_size_mb (int): maximum size of the cache in megabytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb * 1024 * 1024
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def get_key(cls,
+                doc_iterable: List[Tuple[str, List[str]]],
+                query_iterable: List[Tuple[str, str]],
+                settings: Dict) -> str:
+        """ compute the fingerprint of a qrel file
+
+        Args:
+            doc_iterable (list(tuple(str, list(str)))): List of reference doc tuples -> (doc id, doc text)
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            settings (dict): relevance settings which the qrels depend on
+
+        Returns:
+            str: hex digest
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps([cls.VERSION, settings], sort_keys=True).encode('utf-8'))
+        for doc_id, doc_text in doc_iterable:
+            if not isinstance(doc_text, str):
+                doc_text = list(doc_text)
+            h.update(json.dumps([str(doc_id), doc_text]).encode('utf-8'))
+            h.update(b'\n')
+        h.update(b'\0')
+        for query_id, query in query_iterable:
+            h.update(json.dumps([str(query_id), query]).encode('utf-8'))
+            h.update(b'\n')
+        return h.hexdigest()
+
+    def get_paths(self, key: str) -> Tuple[str, str]:
+        """ paths of the qrel file and the query file of a cache entry"""
+        return (os.path.join(self.cache_dir, key + self.QREL_EXT),
+                os.path.join(self.cache_dir, key + self.QUERIES_EXT))
+
+    def load(self, key: str, qrel_f) -> Optional[List[Tuple[str, str]]]:
+        """ copy a cached qrel file into qrel_f
+
+        Args:
+            key (str): fingerprint returned by get_key
+            qrel_f (file-like object): A file-like object to write the qrels to
+
+        Returns:
+            list(tuple(str, str)): the cached query tuples, or None on a cache miss
+        """
+        qrel_path, queries_path = self.get_paths(key)
+        try:
+            with open(queries_path) as queries_f:
+                queries = [tuple(query) for query in json.load(queries_f)]
+            with open(qrel_path, 'rb') as cached_qrel_f:
+                # copy bytes, qrel files can be text or npz files
+                shutil.copyfileobj(cached_qrel_f, getattr(qrel_f, 'buffer', qrel_f))
+        except (IOError, ValueError):
+            return None
+
+        # refresh modification times, used as LRU timestamps
+        os.utime(qrel_path, None)
+        os.utime(queries_path, None)
+        logging.info("Loaded cached qrels %s", qrel_path)
+        return queries
+
+    def store(self, key: str, qrel_file: str, query_iterable: List[Tuple[str, str]]):
+        """ add a qrel file to the cache and evict old entries if the cache is full
+
+        Args:
+            key (str): fingerprint returned by get_key
+            qrel_file (str): path of the qrel file
+            query_iterable (list(tuple(str, str))): List of query tuples used to create the qrels
+        """
+        qrel_path, queries_path = self.get_paths(key)
+
+        # write to temporary files first so readers never see partial entries
+        with tempfile.NamedTemporaryFile(mode='w', dir=self.cache_dir, delete=False) as tmp_f:
+            json.dump([list(query) for query in query_iterable], tmp_f)
+        os.replace(tmp_f.name, queries_path)
+        with tempfile.NamedTemporaryFile(mode='wb', dir=self.cache_dir, delete=False) as tmp_f:
+            with open(qrel_file, 'rb') as qrel_f:
+                shutil.copyfileobj(qrel_f, tmp_f)
+        os.replace(tmp_f.name, qrel_path)
+
+        logging.info("Stored qrels in cache %s", qrel_path)
+        self.evict()
+
+    def evict(self):
+        """ delete least recently used entries until the cache fits in max_size bytes"""
+        entries = {}
+        for file_name in os.listdir(self.cache_dir):
+            for ext in (self.QREL_EXT, self.QUERIES_EXT):
+                if file_name.endswith(ext):
+                    key = file_name[:-len(ext)]
+                    stat = os.stat(os.path.join(self.cache_dir, file_name))
+                    size, mtime = entries.get(key, (0, 0))
+                    entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+
+        total_size = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda e: e[1][1]):
+            if total_size <= self.max_size:
+                break
+            for path in self.get_paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            total_size -= size
+            logging.info("Evicted qrel cache entry %s", key)
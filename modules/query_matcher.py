@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-pattern matching of queries against documents, used by relv_mode = query_in_document
+"""
+from typing import List, Tuple, Union
+from collections import defaultdict
+import numpy as np
+from .sparse_scores import SparseScores
+
+
+class SubstringIndex():
+    """Hash index which finds all patterns occurring in a text with one pass over the text
+    per window length
+
+    Note:
+        Patterns are indexed by their first `window` characters (shorter patterns by all of
+        their characters). Every window of the text is looked up in the index and the
+        candidate patterns are verified with str.startswith. Unlike an Aho-Corasick
+        automaton, the index needs one dict entry per pattern instead of one state per
+        pattern character, so it builds in a fraction of the time on large query sets.
+
+    Attributes:
+        patterns (list(str)): indexed patterns
+        windows (dict(int, dict(str, list(int)))): window length -> window text -> ids of
+        the patterns which start with it
+    """
+
+    window = 16
+
+    def __init__(self, patterns: List[str]):
+        """constructor
+
+        Args:
+            patterns (list(str)): patterns, identified by their position in the list
+        """
+        self.patterns = patterns
+        self.windows = defaultdict(lambda: defaultdict(list))
+        for pattern_id, pattern in enumerate(patterns):
+            length = min(len(pattern), self.window)
+            self.windows[length][pattern[:length]].append(pattern_id)
+
+    def find(self, text: str) -> set:
+        """ids of all patterns which occur in text
+
+        Args:
+            text (str): text to scan
+
+        Returns:
+            set(int): pattern ids
+        """
+        found = set()
+        for length, index in self.windows.items():
+            if not length:
+                # empty patterns occur in every text
+                for pattern_ids in index.values():
+                    found.update(pattern_ids)
+                continue
+            for start in range(len(text) - length + 1):
+                candidates = index.get(text[start:start + length])
+                if candidates:
+                    found.update(pattern_id for pattern_id in candidates
+                                 if text.startswith(self.patterns[pattern_id], start))
+        return found
+
+
+class QueryMatcher():
+    """QueryMatcher finds the documents which contain a query
+
+    Attributes:
+        match_mode (str): "sentence", "substring" or "auto"
+            "sentence": a document matches a query if one of its sentences equals the query.
+            Sentences are looked up in a hash table of the queries.
+            "substring": a document matches a query if the query occurs in one of its
+            sentences (matches do not cross sentence boundaries). Sentences are scanned with
+            a SubstringIndex over all queries.
+            "auto": the semantics of `query in doc`, i.e. "sentence" for documents which are
+            lists of sentences and "substring" for documents which are a single string.
+        query_ids (dict(str, list(int))): positions of the queries with a given text
+    """
+
+    MATCH_MODES = ('auto', 'sentence', 'substring')
+
+    def __init__(self, query_iterable: List[Tuple[str, str]], match_mode: str = 'auto'):
+        """constructor
+
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            match_mode (str): "auto", "sentence" or "substring". Default: "auto"
+
+        Raises:
+            ValueError: If match_mode is not supported.
+        """
+        if match_mode not in self.MATCH_MODES:
+            raise ValueError("Unknown match mode: %s" % match_mode)
+        self.match_mode = match_mode
+
+        query_ids = defaultdict(list)
+        for i, (_, query) in enumerate(query_iterable):
+            query_ids[query].append(i)
+        self.query_ids = dict(query_ids)
+        self.query_texts = list(self.query_ids)
+        self.substring_index = None
+
+    def get_substring_index(self) -> SubstringIndex:
+        """index over all query texts, built on first use
+
+        Returns:
+            SubstringIndex: index whose pattern ids index self.query_texts
+        """
+        if self.substring_index is None:
+            self.substring_index = SubstringIndex(self.query_texts)
+        return self.substring_index
+
+    def match(self, doc: Union[str, List[str]]) -> List[int]:
+        """positions of the queries which match a document
+
+        Args:
+            doc (str or list(str)): document text or list of sentences
+
+        Returns:
+            list(int): sorted query positions
+        """
+        sentences = [doc] if isinstance(doc, str) else doc
+        match_mode = self.match_mode
+        if match_mode == 'auto':
+            match_mode = 'substring' if isinstance(doc, str) else 'sentence'
+
+        if match_mode == 'sentence':
+            texts = {sentence for sentence in sentences if sentence in self.query_ids}
+        else:
+            substring_index = self.get_substring_index()
+            texts = set()
+            for sentence in sentences:
+                texts.update(self.query_texts[i] for i in substring_index.find(sentence))
+
+        return sorted(i for text in texts for i in self.query_ids[text])
+
+    def get_match_matrix(self, doc_iterable: List[Tuple[str, str]]) -> SparseScores:
+        """query x document matrix which is 1.0 where a document matches a query
+
+        Args:
+            doc_iterable (list(tuple(str, str))): List of doc tuples -> (doc id, doc text)
+
+        Returns:
+            SparseScores: Q x D matrix
+        """
+        rows, cols = [], []
+        for j, (_, doc) in enumerate(doc_iterable):
+            matches = self.match(doc)
+            rows.extend(matches)
+            cols.extend([j] * len(matches))
+
+        n_queries = sum(len(query_ids) for query_ids in self.query_ids.values())
+        return SparseScores.from_coo(rows, cols, np.ones(len(rows)),
+                                     (n_queries, len(doc_iterable)))
@@ -2,9 +2,14 @@
 """
 This module takes in a list of scores and distribute them into discrete classes (relevance labels).
 """
-from typing import List, Tuple
-import jenkspy
+from typing import Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import logging
+import multiprocessing
 import numpy as np
+from .jenks import JenksBreaks
+from .sparse_scores import SparseScores
 
 
 class RelvConverter():
@@ -22,13 +27,19 @@ class RelvConverter():
             "percentile": assigns scores in the top `n_percentile` percentile a label of 1,
             0 otherwise.
         jenks_nb_class (int): Specifies the number of intervals when mode = "jenks"
+        jenks_approx_bins (int): Maximum number of bins of the approximate jenks breaks of
+        a query with more retrieved documents, 0 for exact breaks
         n_percentile (int): Specifies the threshold for percentile mode
     """
 
     relv_mode = 'jenks'
     jenks_nb_class = 5
+    jenks_approx_bins = 0
     n_percentile = 25
 
+    # row blocks per worker process of get_sparse_relevance_labels, for load balancing
+    blocks_per_worker = 4
+
     def __init__(
             self,
             scores: List[float],
@@ -58,31 +69,408 @@ class RelvConverter():
         if not normalized:
             self.scores = self.normalize(scores)
 
-        relv_mode = kwargs.get('relv_mode', self.relv_mode).lower()
+        relv_mode, mode_param = self.get_mode_settings(**kwargs)
         if relv_mode == "jenks":
-            jenks_nb_class = kwargs.get('jenks_nb_class', self.jenks_nb_class)
+            # A hack which ensures that the first interval starts from 0.0
+            np.append(self.scores, [0.0, 1.0])
+            self.intervals = self.get_jenks_intervals(self.scores, mode_param)
+        else:
+            self.intervals = self.get_percentile_intervals(
+                self.scores, mode_param)
+
+    @classmethod
+    def get_mode_settings(cls, **kwargs) -> Tuple[str, int]:
+        """validate the relevance mode and its parameter
+
+        Args:
+            **relv_mode (str): "jenks" or "percentile". Default: "jenks"
+            **jenks_nb_class (int): Number of intervals for "jenks" mode. Default: 5
+            **n_percentile (int): cutoff percentile for "percentile" mode. Default: 25
+
+        Raises:
+            TypeError: If jenks_nb_class is not an integer.
+            ValueError: If jenks_nb_class is less than 2
+            TypeError: If n_percentile is not integer.
+            ValueError: If n_percentile > 100 or < 0.
+            Exception: If an unsupported relv_mode is specified.
+
+        Returns:
+            str: relevance mode
+            int: jenks_nb_class for "jenks" mode, n_percentile for "percentile" mode
+        """
+        relv_mode = kwargs.get('relv_mode', cls.relv_mode).lower()
+        if relv_mode == "jenks":
+            jenks_nb_class = kwargs.get('jenks_nb_class', cls.jenks_nb_class)
 
             if not isinstance(jenks_nb_class, int):
                 raise TypeError("jenks_nb_class has to be a positive integer.")
             if jenks_nb_class < 2:
                 raise ValueError("Number of classes must be at least 2.")
+            return relv_mode, jenks_nb_class
 
-            # A hack which ensures that the first interval starts from 0.0
-            np.append(self.scores, [0.0, 1.0])
-            self.intervals = self.get_jenks_intervals(self.scores, jenks_nb_class)
-
-        elif relv_mode == "percentile":
-            n_percentile = kwargs.get('n_percentile', self.n_percentile)
+        if relv_mode == "percentile":
+            n_percentile = kwargs.get('n_percentile', cls.n_percentile)
 
             if not isinstance(n_percentile, int):
                 raise TypeError("n_percentile has to be a positive integer.")
             if n_percentile > 100 or n_percentile < 0:
                 raise ValueError("n_percentile must be between 0 - 100.")
+            return relv_mode, n_percentile
 
-            self.intervals = self.get_percentile_intervals(
-                self.scores, n_percentile)
+        raise Exception("Mode: %s not supported" % relv_mode)
+
+    @classmethod
+    def get_jenks_breaks(cls, nb_class: int, **kwargs) -> JenksBreaks:
+        """validate the approximation setting of "jenks" mode
+
+        Args:
+            nb_class (int): Number of intervals
+            **jenks_approx_bins (int): Maximum number of bins of the approximate breaks of a
+            query with more retrieved documents, 0 for exact breaks. Default: 0
+
+        Raises:
+            TypeError: If jenks_approx_bins is not an integer.
+            ValueError: If jenks_approx_bins is negative or smaller than nb_class + 1
+
+        Returns:
+            JenksBreaks: computes (and memoizes) the breaks of many queries
+        """
+        approx_bins = kwargs.get('jenks_approx_bins', cls.jenks_approx_bins)
+        if not isinstance(approx_bins, int):
+            raise TypeError("jenks_approx_bins has to be a non-negative integer.")
+        if approx_bins < 0 or 0 < approx_bins <= nb_class:
+            raise ValueError("jenks_approx_bins must be 0 or larger than the number of classes.")
+        return JenksBreaks(nb_class, approx_bins)
+
+    @staticmethod
+    def log_approximation(gvfs: List[float], n_queries: int):
+        """report the goodness of variance fit of approximate jenks breaks on the original
+        scores (exact breaks have the highest GVF of all breaks)
+
+        Args:
+            gvfs (list(float)): GVF of the approximate breaks of every approximated query
+            n_queries (int): number of queries
+        """
+        if gvfs:
+            logging.info(
+                "Approximate jenks breaks for %i of %i queries: GVF on the original scores "
+                "mean %.4f, min %.4f", len(gvfs), n_queries, np.mean(gvfs), np.min(gvfs))
+
+    @classmethod
+    def get_relevance_label_matrix(
+            cls,
+            score_matrix: np.ndarray,
+            normalized: bool = False,
+            **kwargs) -> np.ndarray:
+        """convert a whole query x document score matrix into relevance labels at once
+
+        Note:
+            Rows are converted independently and get the same labels as
+            RelvConverter(row, normalized, **kwargs).get_relevance_labels(). Scores are
+            normalized row-wise and mapped to labels with one comparison per interval
+            boundary (a row-wise searchsorted). Percentile thresholds come from a single
+            np.percentile call; jenks breaks are computed per row by JenksBreaks, which
+            skips the zeros and memoizes identical rows.
+
+        Args:
+            score_matrix (np.ndarray): Q x D matrix of search scores (usually BM25 scores)
+            normalized (bool): indicates whether rows were normalized to [0.0, 1.0]. Default: False
+            **relv_mode (str): "jenks" or "percentile". Default: "jenks"
+            **jenks_nb_class (int): Number of intervals for "jenks" mode. Default: 5
+            **jenks_approx_bins (int): Maximum number of bins of approximate jenks breaks,
+            0 for exact breaks. Default: 0
+            **n_percentile (int): cutoff percentile for "percentile" mode. Default: 25
+
+        Raises:
+            TypeError: If score_matrix does not contain floats.
+            ValueError: If normalized scores are not between 0.0 and 1.0
+
+        Returns:
+            np.ndarray: Q x D int8 matrix of relevance labels
+        """
+        relv_mode, mode_param = cls.get_mode_settings(**kwargs)
+
+        scores = np.asarray(score_matrix)
+        if scores.ndim != 2:
+            raise ValueError("score_matrix must be a 2-D array.")
+        if not np.issubdtype(scores.dtype, np.floating):
+            raise TypeError("Scores can only contain float values")
+
+        if not scores.size:
+            return np.zeros(scores.shape, dtype=np.int8)
+        if not normalized:
+            scores = cls.normalize_matrix(scores)
+        if np.any(scores < 0.0) or np.any(scores > 1.0):
+            raise ValueError("Scores must be between 0.0 and 1.0.")
+
+        if relv_mode == "jenks":
+            jenks = cls.get_jenks_breaks(mode_param, **kwargs)
+            intervals = np.array([jenks.get_breaks(row) for row in scores])
+            cls.log_approximation(jenks.gvfs, len(scores))
+        else:
+            thresholds = np.percentile(scores, 100 - mode_param, axis=1)
+            intervals = np.stack([np.zeros(len(scores)), thresholds, np.ones(len(scores))],
+                                 axis=1)
+
+        return cls.get_labels_from_intervals(
+            scores, [intervals[:, i, None] for i in range(intervals.shape[1])])
+
+    @classmethod
+    def get_sparse_relevance_labels(
+            cls,
+            score_matrix: SparseScores,
+            normalized: bool = False,
+            **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+        """convert a sparse query x document score matrix into relevance labels
+
+        Note:
+            Produces the same labels as get_relevance_label_matrix(score_matrix.toarray())
+            without materializing the dense matrix. Documents that were not retrieved have a
+            score of 0.0, which always maps to the same label of its row (usually the lowest
+            label, but a percentile threshold of 0.0 makes it 1), so only one label per row
+            is computed for them. Percentile thresholds are interpolated from two order
+            statistics per row exactly like np.percentile; jenks breaks only need the
+            stored scores and the number of zeros of a row.
+
+            Rows are independent, so with workers > 1 blocks of rows are converted by a
+            process pool (see convert_rows_in_parallel). The labels do not depend on the
+            number of workers.
+
+        Args:
+            score_matrix (SparseScores): Q x D matrix of search scores
+            normalized (bool): indicates whether rows were normalized to [0.0, 1.0]. Default: False
+            **relv_mode (str): "jenks" or "percentile". Default: "jenks"
+            **jenks_nb_class (int): Number of intervals for "jenks" mode. Default: 5
+            **jenks_approx_bins (int): Maximum number of bins of approximate jenks breaks,
+            0 for exact breaks. Default: 0
+            **n_percentile (int): cutoff percentile for "percentile" mode. Default: 25
+            **workers (int): Number of worker processes. Default: 1
+
+        Raises:
+            TypeError: If score_matrix does not contain floats.
+            ValueError: If normalized scores are not between 0.0 and 1.0
+            ValueError: If workers is not a positive integer
+
+        Returns:
+            np.ndarray: label of a zero score, one per row (int8)
+            np.ndarray: labels of the stored scores, aligned with score_matrix.data (int8)
+        """
+        relv_mode, mode_param = cls.get_mode_settings(**kwargs)
+
+        n_queries, n_docs = score_matrix.shape
+        if not np.issubdtype(score_matrix.data.dtype, np.floating):
+            raise TypeError("Scores can only contain float values")
+        if not n_queries or not n_docs:
+            return np.zeros(n_queries, dtype=np.int8), np.zeros(score_matrix.nnz, dtype=np.int8)
+        if not normalized:
+            score_matrix = score_matrix.normalize()
+        if np.any(score_matrix.data < 0.0) or np.any(score_matrix.data > 1.0):
+            raise ValueError("Scores must be between 0.0 and 1.0.")
+
+        workers = kwargs.get('workers', 1)
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("workers must be a positive integer.")
+        jenks = cls.get_jenks_breaks(mode_param, **kwargs) if relv_mode == "jenks" else None
+
+        if workers > 1 and n_queries > 1:
+            zero_labels, labels, gvfs = cls.convert_rows_in_parallel(
+                score_matrix, relv_mode, mode_param, jenks, workers)
         else:
-            raise Exception("Mode: %s not supported")
+            zero_labels, labels = cls.convert_sparse_rows(score_matrix, relv_mode, mode_param, jenks)
+            gvfs = jenks.gvfs if jenks is not None else []
+        cls.log_approximation(gvfs, n_queries)
+        return zero_labels, labels
+
+    @classmethod
+    def convert_sparse_rows(
+            cls,
+            score_matrix: SparseScores,
+            relv_mode: str,
+            mode_param: int,
+            jenks: JenksBreaks = None) -> Tuple[np.ndarray, np.ndarray]:
+        """labels of a validated and normalized sparse score matrix, see
+        get_sparse_relevance_labels
+
+        Args:
+            score_matrix (SparseScores): Q x D matrix of normalized scores
+            relv_mode (str): "jenks" or "percentile"
+            mode_param (int): jenks_nb_class or n_percentile
+            jenks (JenksBreaks): computes the breaks of "jenks" mode
+
+        Returns:
+            np.ndarray: label of a zero score, one per row (int8)
+            np.ndarray: labels of the stored scores, aligned with score_matrix.data (int8)
+        """
+        n_queries, n_docs = score_matrix.shape
+        if relv_mode == "jenks":
+            indptr = score_matrix.indptr
+            intervals = np.array([
+                jenks.get_sparse_breaks(score_matrix.data[indptr[i]:indptr[i + 1]], n_docs)
+                for i in range(n_queries)])
+        else:
+            # np.percentile interpolates between two neighbouring order statistics, which
+            # are the same for every row. Interpolating them with np.quantile at the same
+            # fraction reproduces np.percentile bit for bit.
+            virtual_index = (n_docs - 1) * np.true_divide(100 - mode_param, 100)
+            lower = int(np.floor(virtual_index))
+            upper = min(lower + 1, n_docs - 1)
+            neighbours = np.stack([score_matrix.get_order_statistics(lower),
+                                   score_matrix.get_order_statistics(upper)], axis=1)
+            thresholds = np.quantile(neighbours, virtual_index - lower, axis=1)
+            intervals = np.stack([np.zeros(n_queries), thresholds, np.ones(n_queries)], axis=1)
+
+        zero_labels = cls.get_labels_from_intervals(
+            np.zeros(n_queries), [intervals[:, i] for i in range(intervals.shape[1])])
+        row_ids = score_matrix.get_row_ids()
+        labels = cls.get_labels_from_intervals(
+            score_matrix.data, [intervals[row_ids, i] for i in range(intervals.shape[1])])
+        return zero_labels, labels
+
+    @classmethod
+    def convert_rows_in_parallel(
+            cls,
+            score_matrix: SparseScores,
+            relv_mode: str,
+            mode_param: int,
+            jenks: JenksBreaks,
+            workers: int) -> Tuple[np.ndarray, np.ndarray, List[float]]:
+        """convert_sparse_rows with a pool of worker processes
+
+        Note:
+            The score matrix and the labels are kept in one shared memory block, so only
+            the row ranges are sent to the workers. Every worker writes the labels of its
+            rows at their final position, so the result does not depend on the order in
+            which blocks finish.
+
+        Args:
+            score_matrix (SparseScores): Q x D matrix of normalized scores
+            relv_mode (str): "jenks" or "percentile"
+            mode_param (int): jenks_nb_class or n_percentile
+            jenks (JenksBreaks): settings of "jenks" mode
+            workers (int): number of worker processes
+
+        Returns:
+            np.ndarray: label of a zero score, one per row (int8)
+            np.ndarray: labels of the stored scores, aligned with score_matrix.data (int8)
+            list(float): GVFs of approximate jenks breaks
+        """
+        n_queries, nnz = score_matrix.shape[0], score_matrix.nnz
+        approx_bins = jenks.approx_bins if jenks is not None else 0
+        size = sum(size for _, _, size in cls.get_shared_layout(n_queries, nnz).values())
+        shared = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        try:
+            arrays = cls.get_shared_arrays(shared.buf, n_queries, nnz)
+            arrays['indptr'][:] = score_matrix.indptr
+            arrays['indices'][:] = score_matrix.indices
+            arrays['data'][:] = score_matrix.data
+
+            n_blocks = min(n_queries, workers * cls.blocks_per_worker)
+            bounds = np.linspace(0, n_queries, n_blocks + 1).astype(np.int64).tolist()
+            # worker processes must not inherit the threads of the search pipeline
+            start_method = ('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                            else 'spawn')
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context(start_method)) as pool:
+                futures = [pool.submit(RelvConverter.convert_shared_rows, shared.name,
+                                       score_matrix.shape, nnz, start, end, relv_mode,
+                                       mode_param, approx_bins)
+                           for start, end in zip(bounds[:-1], bounds[1:])]
+                gvfs = [gvf for future in futures for gvf in future.result()]
+            zero_labels, labels = arrays['zero_labels'].copy(), arrays['labels'].copy()
+            del arrays
+        finally:
+            shared.close()
+            shared.unlink()
+        return zero_labels, labels, gvfs
+
+    @staticmethod
+    def convert_shared_rows(
+            shared_name: str,
+            shape: Tuple[int, int],
+            nnz: int,
+            start: int,
+            end: int,
+            relv_mode: str,
+            mode_param: int,
+            approx_bins: int) -> List[float]:
+        """worker of convert_rows_in_parallel: convert rows start to end - 1 of the shared
+        score matrix and write their labels to the shared label arrays
+
+        Returns:
+            list(float): GVFs of approximate jenks breaks
+        """
+        shared = shared_memory.SharedMemory(name=shared_name)
+        try:
+            arrays = RelvConverter.get_shared_arrays(shared.buf, shape[0], nnz)
+            indptr = arrays['indptr']
+            score_matrix = SparseScores(indptr, arrays['indices'], arrays['data'], shape)
+            jenks = JenksBreaks(mode_param, approx_bins) if relv_mode == "jenks" else None
+            zero_labels, labels = RelvConverter.convert_sparse_rows(
+                score_matrix.get_rows(start, end), relv_mode, mode_param, jenks)
+            arrays['zero_labels'][start:end] = zero_labels
+            arrays['labels'][indptr[start]:indptr[end]] = labels
+            # release the views before the shared memory is closed
+            del arrays, indptr, score_matrix
+            return jenks.gvfs if jenks is not None else []
+        finally:
+            shared.close()
+
+    @staticmethod
+    def get_shared_layout(n_queries: int, nnz: int) -> Dict[str, Tuple[type, int, int]]:
+        """layout of the shared memory block of convert_rows_in_parallel
+
+        Returns:
+            dict(str, tuple(type, int, int)): Maps array name to dtype, length and size
+            in bytes, in the order of the arrays in the block
+        """
+        layout = {}
+        for name, dtype, length in [('indptr', np.int64, n_queries + 1),
+                                    ('indices', np.int64, nnz),
+                                    ('data', np.float64, nnz),
+                                    ('labels', np.int8, nnz),
+                                    ('zero_labels', np.int8, n_queries)]:
+            layout[name] = (dtype, length, length * np.dtype(dtype).itemsize)
+        return layout
+
+    @classmethod
+    def get_shared_arrays(cls, buffer, n_queries: int, nnz: int) -> Dict[str, np.ndarray]:
+        """NumPy views of the arrays in a shared memory block
+
+        Args:
+            buffer (memoryview): the shared memory
+            n_queries (int): number of rows of the score matrix
+            nnz (int): number of stored scores
+
+        Returns:
+            dict(str, np.ndarray): indptr, indices, data, labels and zero_labels
+        """
+        arrays, offset = {}, 0
+        for name, (dtype, length, size) in cls.get_shared_layout(n_queries, nnz).items():
+            arrays[name] = np.ndarray(length, dtype=dtype, buffer=buffer, offset=offset)
+            offset += size
+        return arrays
+
+    @staticmethod
+    def get_labels_from_intervals(scores: np.ndarray, boundaries: List[np.ndarray]) -> np.ndarray:
+        """map scores to relevance labels with the same rule as _get_relevance
+
+        Args:
+            scores (np.ndarray): normalized scores
+            boundaries (list(np.ndarray)): interval boundaries in increasing order, each one
+            broadcastable to scores
+
+        Returns:
+            np.ndarray: int8 relevance labels with the shape of scores
+        """
+        # index of the last interval boundary <= score, i.e. searchsorted(side="right")
+        n_below = np.zeros(np.shape(scores), dtype=np.int8)
+        for boundary in boundaries:
+            n_below += scores >= boundary
+
+        # same rule as _get_relevance: scores outside [intervals[0], intervals[-1]) get the top label
+        top_label = len(boundaries) - 2
+        return np.where((n_below >= 1) & (n_below <= top_label + 1),
+                        n_below - 1, top_label).astype(np.int8)
 
     @staticmethod
     def normalize(scores: List[float]) -> List[float]:
@@ -107,10 +495,24 @@ class RelvConverter():
         max_score = max(scores)
         return [score if score == 0 else score/max_score for score in scores]
 
+    @staticmethod
+    def normalize_matrix(score_matrix: np.ndarray) -> np.ndarray:
+        """normalize every row of a score matrix to the range 0.0 to 1.0
+
+        Args:
+            score_matrix (np.ndarray): Q x D matrix of search scores
+
+        Returns:
+            np.ndarray: Q x D matrix of normalized scores, rows whose maximum is 0 are unchanged
+        """
+        max_scores = score_matrix.max(axis=1, keepdims=True)
+        return np.divide(score_matrix, max_scores, out=score_matrix.astype(np.float64),
+                         where=max_scores != 0)
+
     @staticmethod
     def get_jenks_intervals(scores: List[float], nb_class: int) -> Tuple[float]:
-        """A wrapper static method which uses jenkspy (https://github.com/mthh/jenkspy)
-        to get natural breaks
+        """A static method which returns the natural breaks of jenkspy
+        (https://github.com/mthh/jenkspy), computed by JenksBreaks
 
         Args:
             scores (list(float)): A list which contains search scores of retrieved documents.
@@ -129,7 +531,7 @@ class RelvConverter():
             if score < 0.0 or score > 1.0:
                 raise ValueError("Scores must be between 0.0 and 1.0.")
 
-        return jenkspy.jenks_breaks(scores, nb_class)
+        return JenksBreaks(nb_class).get_breaks(scores)
 
     @staticmethod
     def get_percentile_intervals(
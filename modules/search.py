@@ -2,15 +2,32 @@
 """
 CLIREVAL
 """
-from typing import List, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextlib
+import functools
+import hashlib
 import json
 import logging
+import os
 import tempfile
+import threading
+import time
 import numpy as np
 from elasticsearch import Elasticsearch
 from elasticsearch import helpers
+from elasticsearch.connection import Urllib3HttpConnection
 from tqdm import tqdm
+from .bm25 import BM25Index
+from .profiler import Profiler
+from .query_matcher import QueryMatcher
 from .relv_converter import RelvConverter
+from .sparse_scores import SparseScores
+from .trec_files import TEXT, NPZ, Qrels, Run, write_trec_file
+from .qrel_cache import QrelCache
+from .vocabulary import Vocabulary
 from .utils import get_analyzer
 
 
@@ -18,12 +35,61 @@ from .utils import get_analyzer
 logging.getLogger('elasticsearch').setLevel(50)
 
 
+class ProfiledConnection(Urllib3HttpConnection):
+    """ HTTP connection to ElasticSearch which counts requests and bytes, and records the
+    latency of every request, on the active profiler (see modules.profiler.Profiler)
+    """
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None,
+                        ignore=(), headers=None):
+        """ send a request, see Urllib3HttpConnection.perform_request """
+        start_time = time.perf_counter()
+        status, response_headers, raw_data = super().perform_request(
+            method, url, params, body, timeout, ignore, headers)
+        if Profiler.active is not None:
+            Profiler.observe("es_request_latency_ms", (time.perf_counter() - start_time) * 1000.0)
+            # requests are counted by endpoint, e.g. es_requests._msearch
+            endpoint = ([part for part in url.split('?')[0].split('/')
+                         if part.startswith('_')] or ['_index'])[-1]
+            Profiler.count("es_requests")
+            Profiler.count("es_requests.%s" % endpoint)
+            request_body = body.encode('utf-8') if isinstance(body, str) else body
+            Profiler.count("es_request_bytes", len(request_body or b''))
+            response_body = raw_data.encode('utf-8', 'surrogatepass') \
+                if isinstance(raw_data, str) else raw_data
+            Profiler.count("es_response_bytes", len(response_body or b''))
+        return status, response_headers, raw_data
+
+
 class Search():
     """ Contains methods to index and search a ElasticSearch server"""
 
     # a default index name used for all elasticsearch operations
     INDEX = 'clireval'
 
+    # system name used when a single list of translated documents is evaluated
+    DEFAULT_SYSTEM = 'mt'
+
+    # auto-tuning of _msearch batch sizes (search_batch_size = 0)
+    MSEARCH_START_BATCH_SIZE = 16
+    MSEARCH_MAX_BATCH_SIZE = 1024
+    MSEARCH_TARGET_LATENCY = 1.0
+
+    # persistent indices are named INDEX_<fingerprint prefix>; bump INDEX_VERSION when the
+    # index settings or mapping change, so that old indices are not reused
+    INDEX_VERSION = 1
+    FINGERPRINT_LENGTH = 24
+
+    # number of documents per _mtermvectors request
+    TERMVECTOR_CHUNK_SIZE = 1000
+
+    # how the single-term queries of query_mode = unique_terms are scored
+    UNIQUE_TERMS_SCORING = ('search', 'term_vectors')
+
+    # bulk requests are limited by size in bytes rather than by number of documents
+    BULK_CHUNK_SIZE = 10000
+    BULK_CHUNK_BYTES = 10 * 1024 * 1024
+
     def __init__(
             self,
             ref_iterable: List[Tuple[str, str]],
@@ -43,102 +109,652 @@ class Search():
             7) Execulte queries in query_iterable
             8) Write results to a tmp res file
 
+        Steps 6) - 8) are repeated for every system if mt_iterable maps system names to
+        translated documents. Every system is indexed into its own index.
+
         Args:
             ref_iterable (list(tuple(str, str))): List of reference doc tuples -> (doc id, doc text)
-            mt_iterable (list(tuple(str, str))): List of translated doc tuples -> (doc id, doc text)
+            mt_iterable (list(tuple(str, str)) or dict(str, list(tuple(str, str)))): List of
+            translated doc tuples -> (doc id, doc text), or a dict which maps system names to
+            such lists
             query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
             **port (int): ElasticSearch server port
+            **index_threads (int): Number of threads sending bulk index requests. Default: 1
+            **bulk_chunk_bytes (int): Maximum size of a bulk index request in bytes.
+            Default: BULK_CHUNK_BYTES
             **analyzer (str): ElasticSearch analyzer
             **n_ret (int): Maximum number of documents to return per query
+            **search_batch_size (int): Number of queries per _msearch request.
+            1 sends one search request per query, 0 auto-tunes the batch size. Default: 0
+            **concurrency (int): Maximum number of search requests in flight. If > 1,
+            the reference and translation passes run concurrently in separate indices
+            (see run_async_pipeline). Default: 1
+            **qrel_cache_dir (str): If set, reference qrels are cached in this directory and
+            step 1) - 5) are skipped when the same reference and relevance settings were
+            used before. Default: None
+            **qrel_cache_size (int): Maximum size of the qrel cache in megabytes. Default: 1024
+            **trec_format (str): format of the qrel and res files, "text" (trec_eval's
+            format) or "npz" (see modules.trec_files). Default: "text"
+            **background_writes (bool): write qrel and res files in a background thread
+            while the next documents are indexed and searched. Only used when
+            concurrency = 1, the concurrent pipeline always overlaps writes. Default: False
+            **persistent_indices (bool): name indices by a fingerprint of their documents,
+            analyzer and mapping and reuse them when they already exist and are complete,
+            instead of recreating INDEX for every pass (see index). Default: False
+            **incremental (bool): keep the translation indices between runs and only upsert
+            the documents whose content changed and delete the documents which are gone,
+            instead of indexing all translated documents again (see update_index).
+            Default: False
+            **unique_terms_scoring (str): "search" sends every term of query_mode =
+            unique_terms as a search request, "term_vectors" scores the terms locally with
+            BM25 from the term vectors of the indexed documents (see search_terms).
+            Default: "search"
+            **vocab_cache_dir (str): If set, the vocabulary of the reference documents
+            (query_mode = unique_terms) is stored in this directory and reused when the
+            same documents are indexed with the same settings. Default: None
+            **workers (int): Number of processes which convert scores to relevance labels
+            (see RelvConverter.get_sparse_relevance_labels). Default: 1
         """
-        port = kwargs.get('port', 9200)
-        self.es = Elasticsearch(port=port, timeout=500)
-        self.analyzer = get_analyzer(kwargs.get('target_langcode', None))
-        self.n_ret = kwargs.get('n_ret', 0)
+        self.configure(**kwargs)
+
+        if isinstance(mt_iterable, dict):
+            systems = OrderedDict(mt_iterable)
+        else:
+            systems = OrderedDict([(self.DEFAULT_SYSTEM, mt_iterable)])
 
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp_qrel_f, \
-                tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp_res_f:
+        with contextlib.ExitStack() as stack:
+            # npz files are binary
+            trec_format = kwargs.get('trec_format', TEXT)
+            file_kwargs = {'mode': 'w', 'delete': False}
+            if trec_format == NPZ:
+                file_kwargs.update(mode='wb', suffix='.npz')
+            tmp_qrel_f = stack.enter_context(tempfile.NamedTemporaryFile(**file_kwargs))
+            tmp_res_fs = OrderedDict(
+                (system, stack.enter_context(tempfile.NamedTemporaryFile(**file_kwargs)))
+                for system in systems)
+
+            # qrel and res files are written by a background thread while searching goes on
+            self.writer = None
+            self.pending_writes = []
+            if kwargs.get('background_writes', False) and self.concurrency == 1:
+                self.writer = stack.enter_context(ThreadPoolExecutor(max_workers=1))
             self.tmp_qrel_f = tmp_qrel_f.name
-            self.tmp_res_f = tmp_res_f.name
+            self.tmp_res_files = OrderedDict(
+                (system, tmp_res_f.name) for system, tmp_res_f in tmp_res_fs.items())
+            self.tmp_res_f = next(iter(self.tmp_res_files.values()))
 
             # query_mode and relv_mode
             query_mode = kwargs.get("query_mode", "sentences").lower()
             relv_mode = kwargs.get("relv_mode", "jenks").lower()
 
-            logging.info(
-                    "Step 1: generating qrels file using reference translations (mode: %s, analyzer: %s)",
-                relv_mode, self.analyzer)
-
-            # if mode is not query_in_document then get search results from
-            # ElasticSearch
-            if relv_mode != "query_in_document":
-                self.index(ref_iterable)
-                if query_mode == "unique_terms":
-                    query_iterable = self.get_terms(ref_iterable)
-                ref_search_results = self.search(query_iterable)
-            elif relv_mode == "query_in_document" and query_mode == "unique_terms":
+            if relv_mode == "query_in_document" and query_mode == "unique_terms":
                 raise Exception(
                     "query_mode: unique_term is not supported when relv_mode = query_in_document")
+
+            # reuse the reference qrels of a previous run if possible
+            qrel_cache = None
+            cached_queries = None
+            if kwargs.get('qrel_cache_dir'):
+                qrel_cache = QrelCache(kwargs['qrel_cache_dir'],
+                                       kwargs.get('qrel_cache_size', 1024))
+                cache_key = qrel_cache.get_key(
+                    ref_iterable, query_iterable, self.get_qrel_settings(**kwargs))
+                cached_queries = qrel_cache.load(cache_key, tmp_qrel_f)
+            ref_cached = cached_queries is not None
+            if ref_cached:
+                query_iterable = cached_queries
+
+            if self.concurrency > 1:
+                query_iterable = asyncio.run(self.run_async_pipeline(
+                    ref_iterable, systems, query_iterable,
+                    tmp_qrel_f, tmp_res_fs, ref_cached=ref_cached, **kwargs))
             else:
-                ref_search_results = None
+                if ref_cached:
+                    logging.info("Step 1: using cached qrels (%i queries)", len(query_iterable))
+                else:
+                    query_iterable = self.create_ref_qrels(
+                        ref_iterable, query_iterable, tmp_qrel_f, **kwargs)
 
-            # create the relevance file
-            logging.info(
-                "Calculating relevance judgments and writing to %s",
-                tmp_qrel_f.name)
-            self.create_qrel_file(
-                query_iterable,
-                ref_iterable,
-                ref_search_results,
-                tmp_qrel_f,
-                **kwargs)
+                for i, (system, mt_iterable) in enumerate(systems.items()):
+                    logging.info(
+                            "Step 2: generating results file using translated documents (system: %s, analyzer: %s)",
+                        system, self.analyzer)
+                    # Step 2, generate result file with machine translated documents
+                    # incremental translation indices are not overwritten by the reference
+                    mt_search_results = self.index_and_search(
+                        query_iterable, mt_iterable,
+                        self.get_mt_index(i, len(systems), "%s_mt" % self.INDEX
+                                          if self.incremental else self.INDEX))
+                    logging.info(
+                        "Writing search results to %s",
+                        tmp_res_fs[system].name)
+                    self.submit_write(self.create_res_file, mt_search_results,
+                                      tmp_res_fs[system], **kwargs)
+
+                # wait for the background writer, exceptions are raised here
+                for pending_write in self.pending_writes:
+                    pending_write.result()
+
+            if qrel_cache is not None and not ref_cached:
+                tmp_qrel_f.flush()
+                qrel_cache.store(cache_key, tmp_qrel_f.name, query_iterable)
+
+    def create_ref_qrels(
+            self,
+            ref_iterable: List[Tuple[str, str]],
+            query_iterable: List[Tuple[str, str]],
+            tmp_qrel_f,
+            **kwargs) -> List[Tuple[str, str]]:
+        """ Step 1 of __init__: search the reference documents and write relevance judgments
+
+        Args:
+            ref_iterable (list(tuple(str, str))): List of reference doc tuples -> (doc id, doc text)
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            tmp_qrel_f (file-like object): A file-like object to the qrel file
+
+        Returns:
+            list(tuple(str, str)): the queries used to create the qrels (the vocabulary
+            of the reference documents if query_mode = unique_terms)
+        """
+        query_mode = kwargs.get("query_mode", "sentences").lower()
+        relv_mode = kwargs.get("relv_mode", "jenks").lower()
+
+        logging.info(
+                "Step 1: generating qrels file using reference translations (mode: %s, analyzer: %s)",
+            relv_mode, self.analyzer)
+
+        # if mode is not query_in_document then get search results from
+        # ElasticSearch
+        if relv_mode != "query_in_document":
+            ref_index = self.index(ref_iterable)
+            if query_mode == "unique_terms":
+                query_iterable = self.get_terms(ref_iterable, ref_index)
+            ref_search_results = self.search_documents(query_iterable, ref_iterable, ref_index)
+        else:
+            ref_search_results = None
+
+        # create the relevance file
+        logging.info(
+            "Calculating relevance judgments and writing to %s",
+            tmp_qrel_f.name)
+        self.submit_write(
+            self.create_qrel_file,
+            query_iterable,
+            ref_iterable,
+            ref_search_results,
+            tmp_qrel_f,
+            **kwargs)
+        return query_iterable
+
+    def get_ref_qrels(
+            self,
+            ref_iterable: List[Tuple[str, str]],
+            query_iterable: List[Tuple[str, str]],
+            index: str = None,
+            **kwargs) -> Tuple[List[Tuple[str, str]], Qrels]:
+        """ Step 1 of __init__ without a qrel file: search the reference documents and
+        return the relevance judgments
+
+        Args:
+            ref_iterable (list(tuple(str, str))): List of reference doc tuples -> (doc id, doc text)
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            index (str): name of the reference index. Default: self.INDEX
+            **kwargs: query_mode, relv_mode and relevance settings, see get_qrels
+
+        Raises:
+            ValueError: If query_mode = unique_terms and relv_mode = query_in_document
+
+        Returns:
+            list(tuple(str, str)): the queries of the qrels (the vocabulary of the reference
+            documents if query_mode = unique_terms)
+            Qrels: the relevance judgments
+        """
+        query_mode = kwargs.get("query_mode", "sentences").lower()
+        relv_mode = kwargs.get("relv_mode", "jenks").lower()
+        if relv_mode == "query_in_document" and query_mode == "unique_terms":
+            raise ValueError(
+                "query_mode: unique_term is not supported when relv_mode = query_in_document")
+
+        logging.info("Generating qrels of %i reference documents (mode: %s, analyzer: %s)",
+                     len(ref_iterable), relv_mode, self.analyzer)
+        ref_search_results = None
+        if relv_mode != "query_in_document":
+            ref_index = self.index(ref_iterable, index)
+            if query_mode == "unique_terms":
+                query_iterable = self.get_terms(ref_iterable, ref_index)
+            ref_search_results = self.search_documents(query_iterable, ref_iterable, ref_index)
+        with Profiler.span("relevance_labels"):
+            qrels = self.get_qrels(query_iterable, ref_iterable, ref_search_results, **kwargs)
+        return query_iterable, qrels
+
+    def get_run(
+            self,
+            query_iterable: List[Tuple[str, str]],
+            doc_iterable: List[Tuple[str, str]],
+            index: str = None) -> Run:
+        """ Step 2 of __init__ without a res file: index and search translated documents
+
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            doc_iterable (list(tuple(str, str))): A list of tuples -> (doc id, doc text)
+            index (str): name of the index. Default: self.INDEX
+
+        Returns:
+            Run: the search results
+        """
+        return Run(self.index_and_search(query_iterable, doc_iterable, index))
+
+    def get_qrel_settings(self, **kwargs) -> dict:
+        """ settings which the reference qrels depend on, used as part of the qrel cache key
+
+        Returns:
+            dict: backend, analyzer and relevance settings
+        """
+        relv_mode = kwargs.get("relv_mode", "jenks").lower()
+        settings = {
+            "backend": type(self).__name__,
+            "analyzer": self.analyzer,
+            "query_mode": kwargs.get("query_mode", "sentences").lower(),
+            "relv_mode": relv_mode,
+            "n_ret": self.n_ret
+        }
+        if relv_mode == "jenks":
+            settings["jenks_nb_class"] = kwargs.get("jenks_nb_class", RelvConverter.jenks_nb_class)
+            if kwargs.get("jenks_approx_bins", RelvConverter.jenks_approx_bins):
+                settings["jenks_approx_bins"] = kwargs["jenks_approx_bins"]
+        elif relv_mode == "percentile":
+            settings["n_percentile"] = kwargs.get("n_percentile", RelvConverter.n_percentile)
+        elif relv_mode == "query_in_document" and kwargs.get("query_match", "auto") != "auto":
+            settings["query_match"] = kwargs["query_match"]
+        if kwargs.get("qrel_nonzero_only", False):
+            settings["qrel_nonzero_only"] = True
+        if kwargs.get("trec_format", TEXT) != TEXT:
+            settings["trec_format"] = kwargs["trec_format"]
+        if self.term_vector_scoring:
+            settings["unique_terms_scoring"] = "term_vectors"
+        return settings
+
+    def get_mt_index(self, system_idx: int, n_systems: int, default: str) -> str:
+        """ name of the index of a translation system
+
+        Args:
+            system_idx (int): position of the system
+            n_systems (int): number of evaluated systems
+            default (str): index name used when a single system is evaluated
+
+        Returns:
+            str: index name
+        """
+        if n_systems == 1:
+            return default
+        return "%s_mt_%d" % (self.INDEX, system_idx)
+
+    async def run_async_pipeline(
+            self,
+            ref_iterable: List[Tuple[str, str]],
+            systems: Dict[str, List[Tuple[str, str]]],
+            query_iterable: List[Tuple[str, str]],
+            tmp_qrel_f,
+            tmp_res_fs,
+            ref_cached: bool = False,
+            **kwargs) -> List[Tuple[str, str]]:
+        """ Concurrent version of the steps in __init__
+
+        The reference and the translated documents of every system are indexed into
+        separate indices (INDEX_ref, INDEX_mt or INDEX_mt_<i>) at the same time. Queries are split into chunks
+        of search_batch_size queries (MSEARCH_START_BATCH_SIZE if auto-tuned), and at most
+        `concurrency` chunks are searched at once. Relevance judgments are computed as soon
+        as all reference searches are done, while translation searches are still running.
+
+        Note:
+            Blocking client calls run in a thread pool, so the pipeline works with any
+            synchronous backend (ElasticSearch client or the local BM25 index).
+
+        Args:
+            ref_iterable (list(tuple(str, str))): List of reference doc tuples -> (doc id, doc text)
+            systems (dict(str, list(tuple(str, str)))): Maps system names to lists of
+            translated doc tuples -> (doc id, doc text)
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            tmp_qrel_f (file-like object): A file-like object to the qrel file
+            tmp_res_fs (dict(str, file-like object)): Maps system names to res files
+            ref_cached (bool): whether tmp_qrel_f already contains cached qrels, in which
+            case only the translated documents are indexed and searched
+
+        Returns:
+            list(tuple(str, str)): the queries used in the pipeline
+        """
+        query_mode = kwargs.get("query_mode", "sentences").lower()
+        relv_mode = kwargs.get("relv_mode", "jenks").lower()
+        ref_index = "%s_ref" % self.INDEX
+        mt_indices = [self.get_mt_index(i, len(systems), "%s_mt" % self.INDEX)
+                      for i in range(len(systems))]
+        chunk_size = self.search_batch_size or self.MSEARCH_START_BATCH_SIZE
+
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency + 2) as executor:
+
+            def run(func, *args, **func_kwargs):
+                return loop.run_in_executor(
+                    executor, functools.partial(func, *args, **func_kwargs))
+
+            def profiled_search_chunk(query_batch, index):
+                with Profiler.span("search"):
+                    return self.search_chunk(query_batch, index)
+
+            async def search_chunk(query_batch, index):
+                async with semaphore:
+                    return await run(profiled_search_chunk, query_batch, index)
+
+            async def search_all(queries, index, docs):
+                if self.term_vector_scoring:
+                    return await run(self.search_documents, queries, docs, index)
+                chunks = [queries[i:i + chunk_size]
+                          for i in range(0, len(queries), chunk_size)]
+                outputs = await asyncio.gather(
+                    *[search_chunk(chunk, index) for chunk in chunks])
+                search_results = []
+                no_hit_count = 0
+                for chunk_results, chunk_no_hit_count in outputs:
+                    search_results.extend(chunk_results)
+                    no_hit_count += chunk_no_hit_count
+                if no_hit_count:
+                    logging.warning("%d queries have 0 search hit in %s",
+                                    no_hit_count, index)
+                return search_results
 
             logging.info(
-                    "Step 2: generating results file using translated documents (analyzer: %s)",
-                self.analyzer)
-            # Step 2, generate result file with machine translated documents
-            mt_search_results = self.index_and_search(
-                query_iterable, mt_iterable)
-            logging.info(
-                "Writing search results to %s",
-                tmp_res_f.name)
-            self.create_res_file(mt_search_results, tmp_res_f)
+                "Indexing reference and translated documents concurrently "
+                "(mode: %s, analyzer: %s, concurrency: %d)",
+                relv_mode, self.analyzer, self.concurrency)
+            mt_indexed = [run(self.index, mt_iterable, mt_index)
+                          for mt_iterable, mt_index in zip(systems.values(), mt_indices)]
+
+            ref_searched = None
+            if relv_mode != "query_in_document" and not ref_cached:
+                ref_index = await run(self.index, ref_iterable, ref_index)
+                if query_mode == "unique_terms":
+                    query_iterable = await run(self.get_terms, ref_iterable, ref_index)
+                logging.info("Searching %i queries in %s", len(query_iterable), ref_index)
+                ref_searched = asyncio.ensure_future(
+                    search_all(query_iterable, ref_index, ref_iterable))
+
+            mt_indices = await asyncio.gather(*mt_indexed)
+            mt_searched = []
+            for mt_index, mt_iterable in zip(mt_indices, systems.values()):
+                logging.info("Searching %i queries in %s", len(query_iterable), mt_index)
+                mt_searched.append(asyncio.ensure_future(
+                    search_all(query_iterable, mt_index, mt_iterable)))
+
+            if ref_cached:
+                qrels_written = asyncio.sleep(0)
+            else:
+                ref_search_results = await ref_searched if ref_searched is not None else None
+                logging.info(
+                    "Calculating relevance judgments and writing to %s",
+                    tmp_qrel_f.name)
+                qrels_written = run(
+                    self.create_qrel_file,
+                    query_iterable,
+                    ref_iterable,
+                    ref_search_results,
+                    tmp_qrel_f,
+                    **kwargs)
+
+            res_written = []
+            for system, searched in zip(systems, mt_searched):
+                mt_search_results = await searched
+                logging.info(
+                    "Writing search results of %s to %s",
+                    system, tmp_res_fs[system].name)
+                res_written.append(
+                    run(self.create_res_file, mt_search_results, tmp_res_fs[system], **kwargs))
+            await asyncio.gather(qrels_written, *res_written)
+
+        return query_iterable
+
+    @classmethod
+    def from_connection(cls, **kwargs) -> 'Search':
+        """ a Search object which is connected to the retrieval backend, without indexing
+        or searching anything. Used for index maintenance (see gc_indices) and to run the
+        steps of __init__ one at a time (see benchmarks).
+
+        Args:
+            **kwargs: settings, see __init__
+
+        Returns:
+            Search
+        """
+        self = cls.__new__(cls)
+        self.configure(**kwargs)
+        return self
+
+    def configure(self, **kwargs):
+        """validate the settings of __init__ and connect to the retrieval backend
+
+        Raises:
+            ValueError: If concurrency, search_batch_size or unique_terms_scoring is invalid,
+            or if both persistent_indices and incremental are set
+        """
+        self.concurrency = kwargs.get('concurrency', 1)
+        if self.concurrency < 1:
+            raise ValueError("concurrency must be a positive integer.")
+        self.connect(**kwargs)
+        self.analyzer = get_analyzer(kwargs.get('target_langcode', None))
+        self.n_ret = kwargs.get('n_ret', 0)
+        self.search_batch_size = kwargs.get('search_batch_size', 0)
+        if self.search_batch_size < 0:
+            raise ValueError("search_batch_size must be a non-negative integer.")
+        self.persistent_indices = kwargs.get('persistent_indices', False)
+        self.incremental = kwargs.get('incremental', False)
+        if self.persistent_indices and self.incremental:
+            raise ValueError("persistent_indices and incremental cannot be combined.")
+        self.vocab_cache_dir = kwargs.get('vocab_cache_dir')
+        unique_terms_scoring = kwargs.get('unique_terms_scoring', 'search')
+        if unique_terms_scoring not in self.UNIQUE_TERMS_SCORING:
+            raise ValueError("Unknown unique_terms_scoring: %s" % unique_terms_scoring)
+        self.term_vector_scoring = unique_terms_scoring == 'term_vectors' and \
+            kwargs.get("query_mode", "sentences").lower() == "unique_terms"
+        # concurrent passes with the same documents load a persistent index once
+        self.index_locks = {}
+        self.index_locks_lock = threading.Lock()
+
+    def connect(self, **kwargs):
+        """connect to the retrieval backend (an ElasticSearch server)
+
+        Args:
+            **port (int): ElasticSearch server port
+            **index_threads (int): Number of threads sending bulk index requests. Default: 1
+            **bulk_chunk_bytes (int): Maximum size of a bulk index request in bytes.
+            Default: BULK_CHUNK_BYTES
+
+        Raises:
+            ValueError: If index_threads or bulk_chunk_bytes is not positive
+        """
+        port = kwargs.get('port', 9200)
+        self.index_threads = kwargs.get('index_threads', 1)
+        self.bulk_chunk_bytes = kwargs.get('bulk_chunk_bytes', self.BULK_CHUNK_BYTES)
+        if self.index_threads < 1:
+            raise ValueError("index_threads must be a positive integer.")
+        if self.bulk_chunk_bytes < 1:
+            raise ValueError("bulk_chunk_bytes must be a positive integer.")
+        self.es = Elasticsearch(port=port, timeout=500,
+                                maxsize=max(10, self.concurrency, self.index_threads),
+                                connection_class=ProfiledConnection)
 
     def get_qrel_and_res_files(self):
         """get qrel and res file objects
 
         returns:
             (file-like object): temp qrel file
-            (file-like object): temp res file
+            (file-like object): temp res file (of the first system)
         """
         return self.tmp_qrel_f, self.tmp_res_f
 
+    def get_res_files(self) -> Dict[str, str]:
+        """get the res file of every system
+
+        returns:
+            dict(str, str): Maps system names to temp res files
+        """
+        return self.tmp_res_files
+
     def get_terms(
-            self, doc_iterable: List[Tuple[str, str]]) -> List[Tuple[int, str]]:
+            self, doc_iterable: List[Tuple[str, str]],
+            index: str = None) -> List[Tuple[int, str]]:
         """ get unique terms across all documents
 
+        The vocabulary is read from vocab_cache_dir if it was stored there before,
+        under the fingerprint of the documents and the index settings.
+
+        args:
+            doc_iterable (list(tuple(str, str))): List of doc tuples -> (doc id, doc text)
+            index (str): name of the index. Default: self.INDEX
+
+        returns:
+            list(tuple(int, str)): List of query tuples -> (query id, term), terms in the
+            order ElasticSearch term vectors return them
+        """
+        vocab_file = None
+        if self.vocab_cache_dir:
+            os.makedirs(self.vocab_cache_dir, exist_ok=True)
+            vocab_file = os.path.join(self.vocab_cache_dir,
+                                      self.get_index_fingerprint(doc_iterable) + '.vocab.json')
+            if os.path.exists(vocab_file):
+                logging.info("Using cached vocabulary %s", vocab_file)
+                return Vocabulary.load(vocab_file).get_queries()
+
+        with Profiler.span("get_terms"):
+            vocabulary = self.get_vocabulary(doc_iterable, index)
+        logging.info("Vocabulary of %i documents: %i terms", len(doc_iterable), len(vocabulary))
+        if vocab_file is not None:
+            vocabulary.save(vocab_file)
+        return vocabulary.get_queries()
+
+    def get_vocabulary(
+            self, doc_iterable: List[Tuple[str, str]],
+            index: str = None) -> Vocabulary:
+        """ stream the term vectors of all documents into a vocabulary
+
+        Term vectors are requested in chunks of TERMVECTOR_CHUNK_SIZE documents, at most
+        `concurrency` chunks at a time, and only the terms of a chunk are kept until it is
+        added to the vocabulary. Positions, offsets and statistics are not requested.
+
         args:
             doc_iterable (list(tuple(str, str))): List of doc tuples -> (doc id, doc text)
+            index (str): name of the index. Default: self.INDEX
+
+        returns:
+            Vocabulary: unique terms and their document frequencies
+        """
+        vocabulary = Vocabulary()
+        for chunk in self.iter_term_vectors(doc_iterable, index):
+            vocabulary.add_docs(term_freqs for _, term_freqs in chunk)
+        return vocabulary
+
+    def iter_term_vectors(
+            self, doc_iterable: List[Tuple[str, str]],
+            index: str = None) -> Iterator[List[Tuple[str, Dict[str, int]]]]:
+        """ stream the term vectors of all documents
+
+        Term vectors are requested in chunks of TERMVECTOR_CHUNK_SIZE documents, at most
+        `concurrency` chunks at a time. Positions, offsets and statistics are not requested.
+
+        args:
+            doc_iterable (list(tuple(str, str))): List of doc tuples -> (doc id, doc text)
+            index (str): name of the index. Default: self.INDEX
+
+        yields:
+            list(tuple(str, dict(str, int))): term frequencies of a chunk of documents, in
+            document order -> (doc id, term frequencies). Terms are sorted like ElasticSearch
+            returns them.
         """
-        terms = {}
         doc_ids = [doc_id for doc_id, _ in doc_iterable]
-        tfs = self.es.mtermvectors(
-            index=self.INDEX,
-            doc_type="doc",
-            ids=doc_ids,
-            fields="doc_text",
-            field_statistics=False,
-            term_statistics=False)
 
-        for doc in tfs['docs']:
-            for term in doc['term_vectors']['doc_text']['terms']:
-                terms[term] = 1
-        terms = terms.keys()
+        def get_chunk_terms(chunk_ids):
+            tfs = self.es.mtermvectors(
+                index=index or self.INDEX,
+                doc_type="doc",
+                ids=chunk_ids,
+                fields="doc_text",
+                positions=False,
+                offsets=False,
+                payloads=False,
+                field_statistics=False,
+                term_statistics=False)
+            return [(doc_id, {term: term_info.get('term_freq', 1) for term, term_info
+                              in doc['term_vectors'].get('doc_text', {}).get('terms', {}).items()})
+                    for doc_id, doc in zip(chunk_ids, tfs['docs'])]
 
-        return list(zip(range(len(terms)), terms))
+        chunks = (doc_ids[i:i + self.TERMVECTOR_CHUNK_SIZE]
+                  for i in range(0, len(doc_ids), self.TERMVECTOR_CHUNK_SIZE))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # chunks are yielded in document order, so terms keep their order of appearance
+            pending = deque()
+            for chunk_ids in chunks:
+                pending.append(executor.submit(get_chunk_terms, chunk_ids))
+                if len(pending) >= self.concurrency:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
 
-    @staticmethod
+    def search_documents(
+            self, query_iterable: List[Tuple[str, str]],
+            doc_iterable: List[Tuple[str, str]],
+            index: str = None) -> List[Tuple[str, str, float]]:
+        """ Execute queries in query_iterable against the indexed documents in doc_iterable,
+        with search_terms if unique terms are scored from term vectors, with search otherwise
+
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            doc_iterable (list(tuple(str, str))): A list of tuples -> (doc id, doc text)
+            index (str): name of the index. Default: self.INDEX
+
+        Returns:
+            list(tuple(str, str, float)): list of result tuples -> (query id, doc id, bm25 score)
+        """
+        with Profiler.span("search"):
+            if self.term_vector_scoring:
+                return self.search_terms(query_iterable, doc_iterable, index)
+            return self.search(query_iterable, index)
+
+    def search_terms(
+            self, query_iterable: List[Tuple[str, str]],
+            doc_iterable: List[Tuple[str, str]],
+            index: str = None) -> List[Tuple[str, str, float]]:
+        """ score single-term queries locally instead of sending one search per term
+
+        The BM25 score of a single term only depends on its term frequency, the document
+        length and the document frequency, which are all in the term vectors of the
+        documents. They are loaded into a BM25Index (with ElasticSearch's default
+        similarity parameters), and every query is looked up as an indexed term.
+
+        Note:
+            A term is not analyzed again like by simple_query_string, which only matters
+            for analyzers whose output changes when it is analyzed twice.
+
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, term)
+            doc_iterable (list(tuple(str, str))): A list of tuples -> (doc id, doc text)
+            index (str): name of the index. Default: self.INDEX
+
+        Returns:
+            list(tuple(str, str, float)): list of result tuples -> (query id, doc id, bm25 score)
+        """
+        logging.info("Scoring %i terms with term vectors of %i documents...",
+                     len(query_iterable), len(doc_iterable))
+        term_index = BM25Index()
+        term_index.index_term_freqs(
+            doc for chunk in self.iter_term_vectors(doc_iterable, index) for doc in chunk)
+        search_results, no_hit_count = term_index.search_terms(query_iterable, self.n_ret)
+        if no_hit_count:
+            logging.warning("%d queries have 0 search hit", no_hit_count)
+        return search_results
+
+    @classmethod
     def create_qrel_file(
+            cls,
             query_iterable: List[Tuple[str, str]],
             doc_iterable: List[Tuple[str, str]],
             search_results: List[Tuple[str, str, float]],
@@ -152,190 +768,567 @@ class Search():
             search_results (list(tuple(str, str, float))): List of result tuples
             -> (query id, doc id, score)
             tmp_f (file-like object): A file-like object to temporary file
+            **kwargs: relevance settings, see get_qrels
+            **trec_format (str): "text" (trec_eval's format) or "npz". Default: "text"
+        """
+        with Profiler.span("create_qrel_file"):
+            with Profiler.span("relevance_labels"):
+                qrels = cls.get_qrels(query_iterable, doc_iterable, search_results, **kwargs)
+            write_trec_file(tmp_f, qrels, kwargs.get("trec_format", TEXT))
+
+    @staticmethod
+    def get_qrels(
+            query_iterable: List[Tuple[str, str]],
+            doc_iterable: List[Tuple[str, str]],
+            search_results: List[Tuple[str, str, float]],
+            **kwargs) -> Qrels:
+        """Convert search results to relevance judgments
+
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            doc_iterable (list(tuple(str, str))): List of doc tuples -> (doc id, doc text)
+            search_results (list(tuple(str, str, float))): List of result tuples
+            -> (query id, doc id, score)
+            **workers (int): Number of processes which convert scores to relevance labels.
+            Default: 1
+            **qrel_nonzero_only (bool): only write documents with a non-zero relevance label.
+            Documents which are left out are unjudged for trec_eval, which only changes
+            measures that count judged non-relevant documents (bpref, gm_bpref, infAP and
+            num_nonrel_judged_ret). A query without relevant documents keeps a single
+            zero-label line so that it is still evaluated. Default: False
+            **query_match (str): how queries are matched against documents when
+            relv_mode = query_in_document, see QueryMatcher. Default: "auto"
+
+        Note:
+            Scores are kept in a sparse query x document matrix (see SparseScores), documents
+            which were not retrieved by a query have a score of 0.0.
+
+        Returns:
+            Qrels: the relevance judgments
         """
 
         relv_mode = kwargs.get("relv_mode", "jenks")
+        nonzero_only = kwargs.get("qrel_nonzero_only", False)
+        doc_ids = [doc_id for doc_id, _ in doc_iterable]
         if relv_mode == "query_in_document":
-            for query_id, query in tqdm(query_iterable):
-                for doc_id, doc in doc_iterable:
-                    relv = 1 if query in doc else 0
-                    # output to qrel file
-                    print(
-                        "%s\t0\t%s\t%s" %
-                        (query_id, doc_id, relv), file=tmp_f)
-
+            # a document is relevant (label 1) to every query it contains
+            matcher = QueryMatcher(query_iterable, kwargs.get("query_match", "auto"))
+            scores = matcher.get_match_matrix(doc_iterable)
+            zero_labels = np.zeros(len(query_iterable), dtype=np.int8)
+            relv_labels = np.ones(scores.nnz, dtype=np.int8)
         else:
-            search_results_d = {(str(query_id), str(doc_id)): score
-                                for query_id, doc_id, score in search_results}
-            doc_ids = [doc_id for doc_id, _ in doc_iterable]
-
-            for query_id, query in tqdm(query_iterable):
-                query_id = str(query_id)
-
-                scores = np.array([search_results_d.get(
-                    (query_id, str(doc_id)), 0.0) for doc_id in doc_ids])
-
-                try:
-                    relv_converter = RelvConverter(scores, **kwargs)
-                    relv_labels = relv_converter.get_relevance_labels()
-                except:
-                    print(query_id, query)
-                    print(scores)
-                    import sys
-                    sys.exit(0)
-
-                for relv, doc_id in zip(relv_labels, doc_ids):
-                    # output to qrel file
-                    print(
-                        "%s\t0\t%s\t%s" %
-                        (query_id, doc_id, relv), file=tmp_f)
+            scores = SparseScores.from_results(
+                search_results, [query_id for query_id, _ in query_iterable], doc_ids)
+            zero_labels, relv_labels = RelvConverter.get_sparse_relevance_labels(scores, **kwargs)
+
+        default_labels = zero_labels
+        labels = SparseScores(scores.indptr, scores.indices, relv_labels, scores.shape)
+        if nonzero_only:
+            # documents which are not written are unjudged for trec_eval, a single zero
+            # label keeps queries without relevant documents evaluated
+            unjudged = zero_labels == 0
+            row_ids = scores.get_row_ids()
+            keep = ~unjudged[row_ids] | (relv_labels > 0)
+            rows, cols, data = row_ids[keep], scores.indices[keep], relv_labels[keep]
+            empty = unjudged & (np.bincount(rows, minlength=len(query_iterable)) == 0)
+            if doc_ids:
+                rows = np.concatenate([rows, np.flatnonzero(empty)])
+                cols = np.concatenate([cols, np.zeros(empty.sum(), dtype=np.int64)])
+                data = np.concatenate([data, np.zeros(empty.sum(), dtype=np.int8)])
+            labels = SparseScores.from_coo(rows, cols, data, scores.shape)
+            default_labels = np.where(unjudged, -1, zero_labels)
+
+        return Qrels([query_id for query_id, _ in query_iterable], doc_ids,
+                     default_labels, labels)
 
     @staticmethod
-    def create_res_file(results: List[Tuple[str, str, float]], tmp_f):
+    def create_res_file(results: List[Tuple[str, str, float]], tmp_f, **kwargs):
         """Creates trec_eval results file
 
         Args:
             results (list(tuple(str, str, float))): List of result tuples
             -> (query id, doc id, bm25 scores)
             tmp_f (file-like object): A file-like object to temporary file
+            **trec_format (str): "text" (trec_eval's format) or "npz". Default: "text"
+        """
+        with Profiler.span("create_res_file"):
+            write_trec_file(tmp_f, Run(results), kwargs.get("trec_format", TEXT))
+
+    def submit_write(self, func, *args, **kwargs):
+        """ call a function which writes a qrel or res file, in the background writer thread
+        if there is one (background_writes), right away otherwise
+
+        Args:
+            func (callable): create_qrel_file or create_res_file
         """
-        current_qid = ''
-        rank = 0
-        for query_id, doc_id, score in results:
-            if query_id != current_qid:
-                rank = 0
-            print(
-                "%s\tQ0\t%s\t%s\t%.5f\tSTANDARD" %
-                (query_id, doc_id, rank, score), file=tmp_f)
-            rank += 1
-
-    def recreate_index(self, analyzer: str):
+        writer = getattr(self, 'writer', None)
+        if writer is None:
+            func(*args, **kwargs)
+        else:
+            self.pending_writes.append(writer.submit(func, *args, **kwargs))
+
+    def recreate_index(self, analyzer: str, index: str = None):
         """ deletes previous index and create a new index
 
         args:
             analzyer (str): ElasticSearch Analyzer
+            index (str): name of the index. Default: self.INDEX
         """
+        index = index or self.INDEX
+        # refreshes are disabled while loading, bulk_index refreshes once at the end
         index_settings = '''{
         "settings" : {
             "index" : {
                 "number_of_shards" : 1,
-                "number_of_replicas" : 0
+                "number_of_replicas" : 0,
+                "refresh_interval" : "-1"
                 }
             }
         }'''
 
-        mapping = '''{
-          "properties": {
-            "doc_text": {
-              "type": "text",
-              "analyzer": \"%s\",
-              "search_analyzer": \"%s\"
+        mapping = {
+            "properties": {
+                "doc_text": {
+                    "type": "text",
+                    "analyzer": analyzer,
+                    "search_analyzer": analyzer
+                }
             }
-          }
-        }''' % (analyzer, analyzer)
+        }
+        if self.incremental:
+            # content hashes of incremental indices are stored, not searched
+            mapping["properties"]["doc_hash"] = {"type": "keyword", "index": False}
 
         # delete the existing index
-        if self.es.indices.exists(index=self.INDEX):
-            self.es.indices.delete(index=self.INDEX)
+        if self.es.indices.exists(index=index):
+            self.es.indices.delete(index=index)
 
-        # create a elasticsearch index with the name self.INDEX
-        self.es.indices.create(index=self.INDEX, body=index_settings)
+        # create a elasticsearch index with the name index
+        self.es.indices.create(index=index, body=index_settings)
 
         # put index mapping
         self.es.indices.put_mapping(
-            index=self.INDEX, doc_type='doc', body=mapping)
+            index=index, doc_type='doc', body=json.dumps(mapping))
 
     # add all documents in doc_iterables to elasticsearch index
 
-    def bulk_index(self, doc_iterable: List[Tuple[str, str]]) -> int:
+    def bulk_index(self, doc_iterable: List[Tuple[str, str]], index: str = None) -> int:
         """ bulk index documents into ElasticSearch Server
 
+        Documents are sent as plain index operations in requests of at most
+        bulk_chunk_bytes, by index_threads threads. The index is not refreshed while
+        loading (see recreate_index), it is refreshed once all documents are indexed.
+
         args:
             doc_iterable (list(tuple(str, str))): List of document tuples -> (doc id, doc text)
+            index (str): name of the index. Default: self.INDEX
 
         returns:
             (int): Number of successful index operations
         """
+        index = index or self.INDEX
 
-        # helper function to create bulk json string
-        def make_bulk_json(doc_iterable):
-            json_l = []
-            for doc_id, doc_text in doc_iterable:
-                j = {
-                    "doc": {
-                        "doc_text": '\n'.join(doc_text)
-                    },
-                    "_id": doc_id,
-                    "_index": self.INDEX,
-                    "_type": "doc",
-                    "_op_type": "update",
-                    "doc_as_upsert": True
-                }
-                json_l.append(j)
-            return json_l
-
-        # tuple of number-successes (int) and a list of errors
-        # to do: handle errors
-        errors = helpers.bulk(
-            self.es,
-            make_bulk_json(doc_iterable),
-            refresh=True,
-            request_timeout=60)
-        return errors[0]
+        # the index is new, so plain index operations replace the read-modify-write of
+        # updates with doc_as_upsert; a repeated doc id keeps the last document only with
+        # index_threads = 1, parallel_bulk sends chunks concurrently and any copy may win
+        actions = (self.get_index_action(doc_id, doc_text, index)
+                   for doc_id, doc_text in doc_iterable)
+        success_counts = self.send_bulk(actions)
+
+        # restore the default refresh interval and make the documents searchable
+        self.es.indices.put_settings(
+            index=index, body={"index": {"refresh_interval": None}})
+        self.es.indices.refresh(index=index)
+        return success_counts
+
+    def get_index_action(self, doc_id: str, doc_text: List[str], index: str) -> dict:
+        """ bulk index operation of a document, with its content hash if incremental
+
+        Args:
+            doc_id (str): doc id
+            doc_text (list(str)): sentences of the document
+            index (str): name of the index
+
+        Returns:
+            dict: action of helpers.streaming_bulk
+        """
+        source = {"doc_text": '\n'.join(doc_text)}
+        if self.incremental:
+            source["doc_hash"] = self.get_doc_hash(doc_text)
+        return {"_id": doc_id, "_index": index, "_type": "doc", "_source": source}
+
+    def send_bulk(self, actions: Iterable[dict]) -> int:
+        """ send bulk operations in requests of at most bulk_chunk_bytes, with
+        index_threads threads
+
+        Args:
+            actions (iterable(dict)): actions of helpers.streaming_bulk
+
+        Returns:
+            (int): Number of successful operations
+        """
+        bulk_kwargs = {"chunk_size": self.BULK_CHUNK_SIZE,
+                       "max_chunk_bytes": self.bulk_chunk_bytes,
+                       "request_timeout": 60}
+        if self.index_threads > 1:
+            results = helpers.parallel_bulk(
+                self.es, actions, thread_count=self.index_threads, **bulk_kwargs)
+        else:
+            results = helpers.streaming_bulk(self.es, actions, **bulk_kwargs)
+        return sum(1 for ok, _ in results if ok)
+
+    def get_query_body(self, query: str) -> dict:
+        """ build the ElasticSearch request body of a query
+
+        Args:
+            query (str): query text
+
+        Returns:
+            dict: search request body
+        """
+        j = {}
+        j['size'] = self.n_ret
+        j['query'] = {
+            "simple_query_string": {
+                "query": "%s" % query,
+                "fields": ["doc_text"]
+            }
+        }
+        j['track_scores'] = True
+        return j
 
     def search(
-            self, query_iterable: List[Tuple[str, str]]) -> List[Tuple[str, str, float]]:
+            self, query_iterable: List[Tuple[str, str]],
+            index: str = None) -> List[Tuple[str, str, float]]:
         """ Execute queries in query_iterable and return results
 
+        Note:
+            Unless search_batch_size = 1, queries are grouped into _msearch requests.
+            Results are returned in the order of query_iterable in both cases.
+
         Args:
             query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            index (str): name of the index. Default: self.INDEX
 
         Returns:
             list(tuple(str, str, float)): list of result tuples -> (query id, doc id, bm25 score)
         """
-        no_hit_count = 0
         logging.info(
             "Getting search results from ElasticSearch (%i queries)...",
             len(query_iterable))
-        search_results = []
-        for query_id, query in tqdm(query_iterable):
-            j = {}
-            j['size'] = self.n_ret
-            j['query'] = {
-                "simple_query_string": {
-                    "query": "%s" % query,
-                    "fields": ["doc_text"]
-                }
-            }
-            j['track_scores'] = True
-            response = self.es.search(index=self.INDEX,
-                                      body=json.dumps(j),
-                                      sort=["_score:desc", "_uid:asc"],
-                                      request_timeout=500)
 
+        if self.search_batch_size == 1:
+            responses = self.search_sequential(query_iterable, index)
+        else:
+            responses = self.search_batched(query_iterable, self.search_batch_size, index)
+
+        search_results, no_hit_count = self.get_hits(query_iterable, responses)
+
+        if no_hit_count:
+            logging.warning("%d queries have 0 search hit", no_hit_count)
+
+        return search_results
+
+    @staticmethod
+    def get_hits(query_iterable: List[Tuple[str, str]], responses) -> Tuple[List[Tuple[str, str, float]], int]:
+        """ convert ElasticSearch responses to result tuples
+
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            responses (iterable(dict)): ElasticSearch response of every query
+
+        Returns:
+            list(tuple(str, str, float)): list of result tuples -> (query id, doc id, bm25 score)
+            int: number of queries without any hit
+        """
+        no_hit_count = 0
+        search_results = []
+        n_queries = 0
+        for (query_id, _), response in zip(query_iterable, responses):
+            n_queries += 1
             if len(response['hits']['hits']) == 0:
                 no_hit_count += 1
             for hit in response['hits']['hits']:
                 search_results.append((query_id, hit['_id'], hit['_score']))
+            if 'took' in response:
+                Profiler.observe("search_latency_ms", response['took'])
+        Profiler.count("search_queries", n_queries)
+        Profiler.count("search_hits", len(search_results))
+        return search_results, no_hit_count
 
-        if no_hit_count:
-            logging.warning("%d queries have 0 search hit", no_hit_count)
+    def search_sequential(self, query_iterable: List[Tuple[str, str]], index: str = None):
+        """ send one search request per query
 
-        return search_results
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            index (str): name of the index. Default: self.INDEX
+
+        Yields:
+            dict: ElasticSearch response of every query
+        """
+        for _, query in tqdm(query_iterable):
+            yield self.es.search(index=index or self.INDEX,
+                                 body=json.dumps(self.get_query_body(query)),
+                                 sort=["_score:desc", "_uid:asc"],
+                                 request_timeout=500)
+
+    def msearch(self, query_batch: List[Tuple[str, str]], index: str = None) -> List[dict]:
+        """ execute a batch of queries with a single _msearch request
+
+        Args:
+            query_batch (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            index (str): name of the index. Default: self.INDEX
+
+        Raises:
+            Exception: If ElasticSearch fails to execute a query
+
+        Returns:
+            list(dict): ElasticSearch response of every query, in the order of query_batch
+        """
+        body = []
+        for _, query in query_batch:
+            j = self.get_query_body(query)
+            j['sort'] = [{"_score": "desc"}, {"_uid": "asc"}]
+            body.append({})
+            body.append(j)
+
+        responses = self.es.msearch(body=body,
+                                    index=index or self.INDEX,
+                                    request_timeout=500)['responses']
 
-    def index(self, doc_iterable: List[Tuple[str, str]]):
+        for (query_id, _), response in zip(query_batch, responses):
+            if 'error' in response:
+                raise Exception("Query %s failed: %s" % (query_id, response['error']))
+        return responses
+
+    def search_batched(self, query_iterable: List[Tuple[str, str]], batch_size: int = 0,
+                       index: str = None):
+        """ group queries into _msearch requests
+
+        Note:
+            If batch_size is 0, the batch size starts at MSEARCH_START_BATCH_SIZE and is
+            doubled while a request takes less than half of MSEARCH_TARGET_LATENCY seconds,
+            or halved when a request takes longer than MSEARCH_TARGET_LATENCY seconds.
+
+        Args:
+            query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            batch_size (int): Number of queries per _msearch request, 0 to auto-tune
+            index (str): name of the index. Default: self.INDEX
+
+        Yields:
+            dict: ElasticSearch response of every query, in the order of query_iterable
+        """
+        auto_tune = batch_size == 0
+        if auto_tune:
+            batch_size = self.MSEARCH_START_BATCH_SIZE
+
+        with tqdm(total=len(query_iterable)) as pbar:
+            start = 0
+            while start < len(query_iterable):
+                batch = query_iterable[start:start + batch_size]
+
+                start_time = time.time()
+                responses = self.msearch(batch, index)
+                latency = time.time() - start_time
+
+                for response in responses:
+                    yield response
+
+                start += len(batch)
+                pbar.update(len(batch))
+
+                if auto_tune:
+                    if latency < self.MSEARCH_TARGET_LATENCY / 2:
+                        batch_size = min(batch_size * 2, self.MSEARCH_MAX_BATCH_SIZE)
+                    elif latency > self.MSEARCH_TARGET_LATENCY:
+                        batch_size = max(batch_size // 2, 1)
+
+    def search_chunk(self, query_batch: List[Tuple[str, str]],
+                     index: str = None) -> Tuple[List[Tuple[str, str, float]], int]:
+        """ execute a chunk of queries without progress reporting (used by the async pipeline)
+
+        Args:
+            query_batch (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            index (str): name of the index. Default: self.INDEX
+
+        Returns:
+            list(tuple(str, str, float)): list of result tuples -> (query id, doc id, bm25 score)
+            int: number of queries without any hit
+        """
+        return self.get_hits(query_batch, self.msearch(query_batch, index))
+
+    def index(self, doc_iterable: List[Tuple[str, str]], index: str = None) -> str:
         """ bulk index documents in doc_iterable
 
+        If persistent_indices is set, the documents are indexed into an index named by
+        their fingerprint (see get_index_fingerprint) instead of `index`. The index is
+        reused if it exists and is complete: its metadata has the same fingerprint and
+        the same number of documents as doc_iterable.
+
         Raises:
             Exception: If number of successfully indexed documents != number of documents
             in doc_iterable
 
         Args:
             doc_iterable (list(tuple(str, str))): A list of tuples -> (doc id, doc text)
+            index (str): name of the index. Default: self.INDEX
+
+        Returns:
+            str: name of the index which contains the documents
+        """
+        index = index or self.INDEX
+        if self.incremental:
+            self.update_index(doc_iterable, index)
+            return index
+        if not self.persistent_indices:
+            self.load_index(doc_iterable, index)
+            return index
+
+        fingerprint = self.get_index_fingerprint(doc_iterable)
+        index = "%s_%s" % (self.INDEX, fingerprint[:self.FINGERPRINT_LENGTH])
+        with self.index_locks_lock:
+            index_lock = self.index_locks.setdefault(index, threading.Lock())
+
+        with index_lock:
+            meta = self.get_index_meta(index)
+            if meta is not None and meta.get("complete") \
+                    and meta.get("fingerprint") == fingerprint \
+                    and meta.get("n_docs") == len(doc_iterable) \
+                    and self.get_index_doc_count(index) == len(doc_iterable):
+                logging.info("Reusing index %s (%i documents)", index, len(doc_iterable))
+            else:
+                # an interrupted load leaves an incomplete index, which gc_indices removes
+                meta = {"fingerprint": fingerprint, "n_docs": len(doc_iterable),
+                        "complete": False, "created": time.time()}
+                self.load_index(doc_iterable, index, meta)
+                meta["complete"] = True
+            meta["last_used"] = time.time()
+            self.put_index_meta(index, meta)
+        return index
+
+    def update_index(self, doc_iterable: List[Tuple[str, str]], index: str):
+        """ bring an incremental index up to date with the documents in doc_iterable
+
+        The content hash of every document (see get_doc_hash) is stored with the document.
+        If the index was created incrementally with the same settings, only documents
+        whose hash changed (or which are new) are upserted and documents which are not
+        in doc_iterable are deleted (see update_docs). The index is loaded from scratch
+        otherwise.
+
+        Raises:
+            Exception: If a document cannot be indexed or deleted
+
+        Args:
+            doc_iterable (list(tuple(str, str))): A list of tuples -> (doc id, doc text)
+            index (str): name of the index
+        """
+        settings = self.get_index_settings()
+        meta = self.get_index_meta(index)
+        old_hashes = None
+        if meta is not None and meta.get("incremental") and meta.get("complete") \
+                and meta.get("settings") == settings:
+            old_hashes = self.get_doc_hashes(index)
+        if old_hashes is None:
+            # documents are only diffed against a completely loaded index
+            meta = {"incremental": True, "settings": settings, "complete": False}
+            self.load_index(doc_iterable, index, meta)
+            meta["complete"] = True
+            self.put_index_meta(index, meta)
+            return
+
+        doc_hashes = OrderedDict((str(doc_id), self.get_doc_hash(doc_text))
+                                 for doc_id, doc_text in doc_iterable)
+        changed_docs = [(doc_id, doc_text) for doc_id, doc_text in doc_iterable
+                        if old_hashes.get(str(doc_id)) != doc_hashes[str(doc_id)]]
+        deleted_ids = [doc_id for doc_id in old_hashes if doc_id not in doc_hashes]
+        logging.info("Updating index %s: %i changed, %i deleted, %i unchanged documents",
+                     index, len(changed_docs), len(deleted_ids),
+                     len(doc_hashes) - len(changed_docs))
+        if changed_docs or deleted_ids:
+            with Profiler.span("update_index"):
+                self.update_docs(changed_docs, deleted_ids, index)
+        Profiler.count("indexed_docs", len(changed_docs))
+
+    @staticmethod
+    def get_doc_hash(doc_text: List[str]) -> str:
+        """ content hash of a document, the hash of the indexed text
+
+        Args:
+            doc_text (list(str)): sentences of the document
+
+        Returns:
+            str: hex digest
+        """
+        if not isinstance(doc_text, str):
+            doc_text = '\n'.join(doc_text)
+        return hashlib.sha256(doc_text.encode('utf-8')).hexdigest()[:32]
+
+    def get_doc_hashes(self, index: str) -> Optional[Dict[str, str]]:
+        """ content hashes of the documents of an incremental index
+
+        Args:
+            index (str): name of the index
+
+        Returns:
+            dict(str, str): Maps doc id to content hash, None if the index does not exist
+        """
+        if not self.es.indices.exists(index=index):
+            return None
+        return {hit["_id"]: hit["_source"].get("doc_hash") for hit in helpers.scan(
+            self.es, index=index, query={"_source": ["doc_hash"]}, size=5000,
+            request_timeout=500)}
+
+    def update_docs(self, doc_iterable: List[Tuple[str, str]], delete_ids: List[str],
+                    index: str):
+        """ upsert and delete documents of an incremental index
+
+        Note:
+            Replaced and deleted documents still count in the BM25 statistics of
+            ElasticSearch until their segments are merged, so the index is force-merged
+            into a single segment to score like an index built from scratch.
+
+        Raises:
+            Exception: If a document cannot be indexed or deleted
+
+        Args:
+            doc_iterable (list(tuple(str, str))): documents to add or replace
+            delete_ids (list(str)): ids of documents to delete
+            index (str): name of the index
+        """
+        actions = [self.get_index_action(doc_id, doc_text, index)
+                   for doc_id, doc_text in doc_iterable]
+        actions.extend({"_op_type": "delete", "_id": doc_id, "_index": index, "_type": "doc"}
+                       for doc_id in delete_ids)
+        success_counts = self.send_bulk(actions)
+        if success_counts != len(actions):
+            raise Exception("Only %i of %i updates of index %s succeeded" % (
+                success_counts, len(actions), index))
+        self.es.indices.forcemerge(index=index, max_num_segments=1, request_timeout=500)
+        self.es.indices.refresh(index=index)
+
+    def load_index(self, doc_iterable: List[Tuple[str, str]], index: str, meta: dict = None):
+        """ recreate an index and bulk index documents in doc_iterable
+
+        Raises:
+            Exception: If number of successfully indexed documents != number of documents
+            in doc_iterable
+
+        Args:
+            doc_iterable (list(tuple(str, str))): A list of tuples -> (doc id, doc text)
+            index (str): name of the index
+            meta (dict): metadata of a persistent index, stored before loading
         """
         logging.info("Bulk indexing %i documents...", len(doc_iterable))
-        self.recreate_index(self.analyzer)
-        success_counts = self.bulk_index(doc_iterable)
+        self.recreate_index(self.analyzer, index)
+        if meta is not None:
+            self.put_index_meta(index, meta)
+        start_time = time.time()
+        with Profiler.span("bulk_index"):
+            success_counts = self.bulk_index(doc_iterable, index)
+        Profiler.count("indexed_docs", success_counts)
+        elapsed = time.time() - start_time
+        logging.info("Indexed %i documents in %.2fs (%.0f docs/sec)", success_counts,
+                     elapsed, success_counts / max(elapsed, 1e-9))
 
         # raise exception if index operation fails"
         if success_counts != len(doc_iterable):
@@ -344,16 +1337,146 @@ class Search():
                 != Number of documents provided (%s)""" %
                 (success_counts, len(doc_iterable)))
 
+    def get_index_settings(self) -> dict:
+        """ settings which the content of an index depends on, besides its documents
+
+        Returns:
+            dict: backend and analyzer
+        """
+        return {"backend": type(self).__name__, "analyzer": self.analyzer}
+
+    def get_index_fingerprint(self, doc_iterable: List[Tuple[str, str]]) -> str:
+        """ sha256 fingerprint of the documents and the settings of an index
+
+        Args:
+            doc_iterable (list(tuple(str, str))): A list of tuples -> (doc id, doc text)
+
+        Returns:
+            str: hex digest
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps([self.INDEX_VERSION, self.get_index_settings()],
+                            sort_keys=True).encode('utf-8'))
+        for doc_id, doc_text in doc_iterable:
+            if not isinstance(doc_text, str):
+                doc_text = list(doc_text)
+            h.update(json.dumps([str(doc_id), doc_text]).encode('utf-8'))
+            h.update(b'\n')
+        return h.hexdigest()
+
+    def get_index_meta(self, index: str) -> Optional[dict]:
+        """ metadata of a persistent index, stored in the `_meta` field of its mapping
+
+        Args:
+            index (str): name of the index
+
+        Returns:
+            dict: metadata, None if the index does not exist or has no metadata
+        """
+        if not self.es.indices.exists(index=index):
+            return None
+        return self.get_mapping_meta(self.es.indices.get_mapping(index=index).get(index, {}))
+
+    @staticmethod
+    def get_mapping_meta(mapping: dict) -> Optional[dict]:
+        """ `_meta` field of the mapping of an index, as returned by get_mapping
+
+        Note:
+            ElasticSearch 6 nests the mapping under its type (`doc`), ElasticSearch 7
+            mappings are typeless.
+
+        Args:
+            mapping (dict): mapping of one index -> {"mappings": ...}
+
+        Returns:
+            dict: metadata, None if the mapping has no metadata
+        """
+        mappings = mapping.get("mappings", {})
+        return mappings.get("doc", mappings).get("_meta")
+
+    def put_index_meta(self, index: str, meta: dict):
+        """ store the metadata of a persistent index
+
+        Args:
+            index (str): name of the index
+            meta (dict): metadata
+        """
+        self.es.indices.put_mapping(index=index, doc_type='doc', body={"_meta": meta})
+
+    def get_index_doc_count(self, index: str) -> int:
+        """ number of documents in an index
+
+        Args:
+            index (str): name of the index
+
+        Returns:
+            int: number of documents
+        """
+        return self.es.count(index=index)["count"]
+
+    def list_persistent_indices(self) -> Dict[str, dict]:
+        """ persistent indices created by index, with their metadata
+
+        Returns:
+            dict(str, dict): Maps index name to metadata
+        """
+        mappings = self.es.indices.get_mapping(index="%s_*" % self.INDEX)
+        indices = {}
+        for index, mapping in mappings.items():
+            meta = self.get_mapping_meta(mapping)
+            if meta and "fingerprint" in meta:
+                indices[index] = meta
+        return indices
+
+    def delete_index(self, index: str):
+        """ delete an index
+
+        Args:
+            index (str): name of the index
+        """
+        self.es.indices.delete(index=index)
+
+    def gc_indices(self, max_age_days: float = 30.0, dry_run: bool = False) -> List[str]:
+        """ delete stale persistent indices
+
+        An index is stale if it was not used for more than max_age_days, or if it is
+        incomplete (its load was interrupted) and was created more than a day ago.
+
+        Args:
+            max_age_days (float): maximum number of days since the last use
+            dry_run (bool): only return the stale indices
+
+        Returns:
+            list(str): names of the stale indices
+        """
+        now = time.time()
+        stale = []
+        for index, meta in sorted(self.list_persistent_indices().items()):
+            last_used = meta.get("last_used", meta.get("created", 0))
+            if not meta.get("complete"):
+                is_stale = now - meta.get("created", 0) > 86400
+            else:
+                is_stale = now - last_used > max_age_days * 86400
+            if is_stale:
+                stale.append(index)
+                if not dry_run:
+                    logging.info("Deleting index %s", index)
+                    self.delete_index(index)
+        return stale
+
     def index_and_search(
             self, query_iterable: List[Tuple[str, str]],
-            doc_iterable: List[Tuple[str, str]]) -> List[Tuple[str, str, float]]:
+            doc_iterable: List[Tuple[str, str]],
+            index: str = None) -> List[Tuple[str, str, float]]:
         """ index with documents in doc_iterable and search with queries in query_iterable
 
         Args:
             query_iterable (list(tuple(str, str))): List of query tuples -> (query id, query text)
+            doc_iterable (list(tuple(str, str))): A list of tuples -> (doc id, doc text)
+            index (str): name of the index. Default: self.INDEX
 
         Returns:
             (list(tuple(str, str, float))): returns results from self.search
         """
-        self.index(doc_iterable)
-        return self.search(query_iterable)
+        index = self.index(doc_iterable, index)
+        return self.search_documents(query_iterable, doc_iterable, index)
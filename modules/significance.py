@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Paired significance tests of the per-query metric values of two or more systems
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import OrderedDict
+import itertools
+import numpy as np
+from .profiler import Profiler
+from .trec_eval import GEO_MEAN_MEASURES, SUM_MEASURES, NativeTrecEval, resolve_metrics
+
+
+class SignificanceTest():
+    """ Paired bootstrap resampling and approximate randomization over the queries
+
+    Every pair of systems and every metric is compared on the per-query differences of
+    the metric values. Both tests draw one random matrix per chunk of samples which is
+    shared by all pairs and metrics: a matrix of resampled query indices (bootstrap) and
+    a matrix of random bits which swap the two values of a query (randomization). The
+    sample statistics are then computed with NumPy gathers and matrix products.
+
+    Attributes:
+        systems (list(str)): system names
+        query_ids (list(str)): compared queries, the union of the evaluated queries of all
+        systems (a query which a system retrieved nothing for has the value 0.0)
+        values (dict(str, np.ndarray)): Maps metric name to a systems x queries matrix
+    """
+
+    DEFAULT_METRICS = ["map", "ndcg"]
+
+    # number of values gathered at once by the bootstrap, bounds the size of the
+    # intermediate matrices (and keeps them cache-friendly)
+    bootstrap_block = 1 << 20
+    # number of random bits drawn at once by the randomization test
+    randomization_block = 1 << 22
+
+    def __init__(self, system_values: Dict[str, Dict[str, Dict[str, float]]],
+                 metrics: Optional[Iterable[str]] = None):
+        """ constructor
+
+        Args:
+            system_values (dict(str, dict(str, dict(str, float)))): Maps system name to a
+            dict from query id to a dict from metric name to value, e.g. the per_query
+            result of modules.evaluate
+            metrics (list(str), optional): metric or family names, see resolve_metrics.
+            Default: DEFAULT_METRICS (map and ndcg)
+
+        Raises:
+            ValueError: If there are less than 2 systems, if a metric is unknown or is a
+            count or geometric mean, or if no query was evaluated
+        """
+        self.systems = list(system_values)
+        self.metric_names = self.get_metric_names(metrics)
+        if len(self.systems) < 2:
+            raise ValueError("Significance tests need at least 2 systems.")
+        self.query_ids = sorted(set(itertools.chain.from_iterable(system_values.values())))
+        if not self.query_ids:
+            raise ValueError("No query was evaluated.")
+
+        self.values = OrderedDict()
+        for metric_name in self.metric_names:
+            self.values[metric_name] = np.array(
+                [[per_query.get(query_id, {}).get(metric_name, 0.0)
+                  for query_id in self.query_ids]
+                 for per_query in system_values.values()], dtype=np.float64)
+
+    @staticmethod
+    def get_metric_names(metrics: Optional[Iterable[str]] = None) -> List[str]:
+        """ resolve metric names which can be compared query by query
+
+        Raises:
+            ValueError: If a metric is unknown or is a count or geometric mean
+        """
+        metric_names = resolve_metrics(SignificanceTest.DEFAULT_METRICS
+                                       if metrics is None else metrics)
+        for metric_name in metric_names:
+            if metric_name in SUM_MEASURES or metric_name in GEO_MEAN_MEASURES:
+                raise ValueError("%s is not a mean over queries" % metric_name)
+        return metric_names
+
+    @classmethod
+    def from_trec_evals(cls, trec_evals: Dict[str, NativeTrecEval],
+                        metrics: Optional[Iterable[str]] = None) -> 'SignificanceTest':
+        """ compare systems which are evaluated with the same qrels
+
+        Args:
+            trec_evals (dict(str, NativeTrecEval)): Maps system name to its evaluation
+            metrics (list(str), optional): metric or family names, see __init__
+
+        Returns:
+            SignificanceTest
+        """
+        metric_names = cls.get_metric_names(metrics)
+        return cls(OrderedDict((system, trec_eval.get_per_query_metrics(metric_names))
+                               for system, trec_eval in trec_evals.items()), metric_names)
+
+    @classmethod
+    def from_files(cls, qrel_f: str, res_files: Dict[str, str],
+                   metrics: Optional[Iterable[str]] = None) -> 'SignificanceTest':
+        """ compare the results files of several systems
+
+        Args:
+            qrel_f (str): path of the qrel file
+            res_files (dict(str, str)): Maps system name to the path of its results file
+            metrics (list(str), optional): metric or family names, see __init__
+
+        Returns:
+            SignificanceTest
+        """
+        return cls.from_trec_evals(OrderedDict(
+            (system, NativeTrecEval.from_files(qrel_f, res_f))
+            for system, res_f in res_files.items()), metrics)
+
+    def get_pairs(self) -> List[Tuple[int, int]]:
+        """ indices of the compared systems, every system against every later system """
+        return list(itertools.combinations(range(len(self.systems)), 2))
+
+    def run(self, n_samples: int = 10000, alpha: float = 0.05,
+            seed: Optional[int] = None) -> List[Dict]:
+        """ run both tests for every pair of systems and every metric
+
+        Args:
+            n_samples (int): number of bootstrap samples and of random swaps. Default: 10000
+            alpha (float): significance level, the confidence intervals cover 1 - alpha.
+            Default: 0.05
+            seed (int): random seed. Default: None
+
+        Raises:
+            ValueError: If n_samples < 1 or alpha is not between 0.0 and 1.0
+
+        Returns:
+            list(dict): one comparison per metric and pair of systems, with the means of
+            both systems, their difference (system_a - system_b), the bootstrap confidence
+            interval of the difference and the two-sided p-values of both tests. Both
+            p-values count the observed sample as one more sample, (count + 1) /
+            (n_samples + 1), so they are never below 1 / (n_samples + 1)
+        """
+        if n_samples < 1:
+            raise ValueError("n_samples must be a positive integer.")
+        if not 0.0 < alpha < 1.0:
+            raise ValueError("alpha must be between 0.0 and 1.0.")
+
+        pairs = self.get_pairs()
+        # P x Q matrix of per-query differences, one row per metric and pair
+        diffs = np.concatenate([values[[a for a, _ in pairs]] - values[[b for _, b in pairs]]
+                                for values in self.values.values()])
+        rng = np.random.default_rng(seed)
+        with Profiler.span("bootstrap"):
+            boot_means = self.bootstrap(diffs, n_samples, rng)
+        with Profiler.span("randomization"):
+            rand_means = self.randomization(diffs, n_samples, rng)
+
+        observed = diffs.mean(axis=1)
+        ci_low, ci_high = np.quantile(boot_means, [alpha / 2, 1 - alpha / 2], axis=1)
+        # bootstrap: the sample means shifted to the null hypothesis (no difference)
+        boot_p = (np.sum(np.abs(boot_means - observed[:, None]) >= np.abs(observed)[:, None]
+                         - 1e-12, axis=1) + 1) / (n_samples + 1)
+        rand_p = (np.sum(np.abs(rand_means) >= np.abs(observed)[:, None] - 1e-12, axis=1)
+                  + 1) / (n_samples + 1)
+
+        comparisons = []
+        row = 0
+        for metric_name, values in self.values.items():
+            means = values.mean(axis=1)
+            for a, b in pairs:
+                comparisons.append(OrderedDict([
+                    ("metric", metric_name),
+                    ("system_a", self.systems[a]),
+                    ("system_b", self.systems[b]),
+                    ("mean_a", float(means[a])),
+                    ("mean_b", float(means[b])),
+                    ("difference", float(observed[row])),
+                    ("ci_low", float(ci_low[row])),
+                    ("ci_high", float(ci_high[row])),
+                    ("bootstrap_p", float(boot_p[row])),
+                    ("randomization_p", float(rand_p[row]))]))
+                row += 1
+        return comparisons
+
+    def get_report(self, n_samples: int = 10000, alpha: float = 0.05,
+                   seed: Optional[int] = None) -> Dict:
+        """ the comparisons of run, with the settings of the tests
+
+        Returns:
+            dict: samples, confidence, number of queries and comparisons (see run)
+        """
+        return OrderedDict([("samples", n_samples), ("confidence", 1 - alpha),
+                            ("n_queries", len(self.query_ids)),
+                            ("comparisons", self.run(n_samples, alpha, seed))])
+
+    @classmethod
+    def bootstrap(cls, diffs: np.ndarray, n_samples: int,
+                  rng: np.random.Generator) -> np.ndarray:
+        """ paired bootstrap: mean difference of samples of Q queries drawn with replacement
+
+        Args:
+            diffs (np.ndarray): P x Q per-query differences
+            n_samples (int): number of samples
+            rng (np.random.Generator): random generator
+
+        Returns:
+            np.ndarray: P x n_samples sample means
+        """
+        n_rows, n_queries = diffs.shape
+        means = np.empty((n_rows, n_samples))
+        chunk_size = max(1, cls.bootstrap_block // (n_queries * n_rows))
+        for start in range(0, n_samples, chunk_size):
+            end = min(start + chunk_size, n_samples)
+            indices = rng.integers(0, n_queries, size=(end - start, n_queries))
+            means[:, start:end] = np.take(diffs, indices, axis=1).mean(axis=2)
+        return means
+
+    @classmethod
+    def randomization(cls, diffs: np.ndarray, n_samples: int,
+                      rng: np.random.Generator) -> np.ndarray:
+        """ approximate randomization: mean difference after swapping the values of the
+        two systems in a random subset of the queries (which negates their differences)
+
+        Args:
+            diffs (np.ndarray): P x Q per-query differences
+            n_samples (int): number of random swaps
+            rng (np.random.Generator): random generator
+
+        Returns:
+            np.ndarray: P x n_samples means
+        """
+        n_queries = diffs.shape[1]
+        means = np.empty((diffs.shape[0], n_samples))
+        totals = diffs.sum(axis=1)
+        chunk_size = max(1, cls.randomization_block // n_queries)
+        for start in range(0, n_samples, chunk_size):
+            end = min(start + chunk_size, n_samples)
+            n_bits = (end - start) * n_queries
+            swaps = np.unpackbits(np.frombuffer(rng.bytes((n_bits + 7) // 8), dtype=np.uint8),
+                                  count=n_bits).reshape(end - start, n_queries)
+            # sum of the differences with the swapped ones negated
+            means[:, start:end] = (totals[:, None] - 2 * (diffs @ swaps.T.astype(np.float64))) \
+                / n_queries
+        return means
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Sparse (compressed sparse row) query x document score matrix used to build qrels
+"""
+from typing import Iterable, List, Tuple
+import numpy as np
+
+
+class SparseScores():
+    """Query x document score matrix in compressed sparse row (CSR) format.
+
+    Only the scores of retrieved documents are stored, every other document implicitly
+    has a score of 0.0. Row i holds the scores of query i, the stored scores of row i are
+    data[indptr[i]:indptr[i + 1]] and their document (column) ids are
+    indices[indptr[i]:indptr[i + 1]], sorted by document id.
+
+    Attributes:
+        indptr (np.ndarray): Q + 1 row offsets into indices and data
+        indices (np.ndarray): integer document id of every stored score
+        data (np.ndarray): stored scores
+        shape (tuple(int, int)): (number of queries, number of documents)
+    """
+
+    def __init__(
+            self,
+            indptr: np.ndarray,
+            indices: np.ndarray,
+            data: np.ndarray,
+            shape: Tuple[int, int]):
+        """constructor
+
+        Args:
+            indptr (np.ndarray): Q + 1 row offsets into indices and data
+            indices (np.ndarray): document id of every stored score, sorted within a row
+            data (np.ndarray): stored scores
+            shape (tuple(int, int)): (number of queries, number of documents)
+
+        Raises:
+            ValueError: If the arrays do not describe a Q x D CSR matrix.
+        """
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data)
+        self.shape = tuple(shape)
+
+        if len(self.indptr) != self.shape[0] + 1 or len(self.indices) != len(self.data) \
+                or self.indptr[-1] != len(self.data):
+            raise ValueError("indptr, indices and data do not describe a %d x %d matrix."
+                             % self.shape)
+
+    @classmethod
+    def from_results(
+            cls,
+            search_results: Iterable[Tuple[str, str, float]],
+            query_ids: List[str],
+            doc_ids: List[str]) -> 'SparseScores':
+        """build the score matrix of a list of search results
+
+        Note:
+            Results of unknown queries or documents are ignored. When a (query, document)
+            pair occurs several times, the last score is kept.
+
+        Args:
+            search_results (iterable(tuple(str, str, float))): List of result tuples
+            -> (query id, doc id, score)
+            query_ids (list(str)): query ids, in row order
+            doc_ids (list(str)): document ids, in column order
+
+        Returns:
+            SparseScores: Q x D score matrix
+        """
+        query_idx = {str(query_id): i for i, query_id in enumerate(query_ids)}
+        doc_idx = {str(doc_id): i for i, doc_id in enumerate(doc_ids)}
+
+        rows, cols, data = [], [], []
+        for query_id, doc_id, score in search_results:
+            i = query_idx.get(str(query_id))
+            j = doc_idx.get(str(doc_id))
+            if i is not None and j is not None:
+                rows.append(i)
+                cols.append(j)
+                data.append(score)
+
+        return cls.from_coo(rows, cols, np.array(data, dtype=np.float64),
+                            (len(query_ids), len(doc_ids)))
+
+    @classmethod
+    def from_coo(
+            cls,
+            rows: List[int],
+            cols: List[int],
+            data: np.ndarray,
+            shape: Tuple[int, int]) -> 'SparseScores':
+        """build the score matrix of (row, column, score) triplets in any order
+
+        Note:
+            When a (row, column) pair occurs several times, the last score is kept.
+
+        Args:
+            rows (list(int)): row (query) ids
+            cols (list(int)): column (document) ids
+            data (np.ndarray): scores
+            shape (tuple(int, int)): (number of queries, number of documents)
+
+        Returns:
+            SparseScores: Q x D score matrix
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        data = np.asarray(data)
+
+        # stable sort by (row, column), keep the last of repeated pairs
+        order = np.lexsort((cols, rows))
+        rows, cols, data = rows[order], cols[order], data[order]
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols, data = rows[last], cols[last], data[last]
+
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return cls(indptr, cols, data, shape)
+
+    @classmethod
+    def from_dense(cls, score_matrix: np.ndarray) -> 'SparseScores':
+        """store the non-zero scores of a dense Q x D matrix
+
+        Args:
+            score_matrix (np.ndarray): Q x D matrix of scores
+
+        Returns:
+            SparseScores: Q x D score matrix
+        """
+        score_matrix = np.asarray(score_matrix)
+        rows, cols = np.nonzero(score_matrix)
+        indptr = np.zeros(score_matrix.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=score_matrix.shape[0]), out=indptr[1:])
+        return cls(indptr, cols, score_matrix[rows, cols], score_matrix.shape)
+
+    @property
+    def nnz(self) -> int:
+        """number of stored scores"""
+        return len(self.data)
+
+    def get_row_ids(self) -> np.ndarray:
+        """row (query) id of every stored score
+
+        Returns:
+            np.ndarray: array aligned with self.data
+        """
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def normalize(self) -> 'SparseScores':
+        """normalize every row to the range 0.0 to 1.0 by dividing it by its maximum
+
+        Returns:
+            SparseScores: normalized matrix, rows whose maximum is 0 are unchanged
+        """
+        row_ids = self.get_row_ids()
+        max_scores = np.zeros(self.shape[0])
+        np.maximum.at(max_scores, row_ids, self.data)
+        max_scores = max_scores[row_ids]
+        data = np.divide(self.data, max_scores, out=self.data.astype(np.float64),
+                         where=max_scores != 0)
+        return SparseScores(self.indptr, self.indices, data, self.shape)
+
+    def get_order_statistics(self, k: int) -> np.ndarray:
+        """k-th smallest value of every row, counting the implicit zeros
+
+        Note:
+            Stored scores are assumed to be non-negative, so the implicit zeros
+            come first in a sorted row.
+
+        Args:
+            k (int): position in the sorted row, 0 <= k < number of documents
+
+        Returns:
+            np.ndarray: one value per row
+        """
+        row_ids = self.get_row_ids()
+        sorted_data = self.data[np.lexsort((self.data, row_ids))]
+
+        n_stored = np.diff(self.indptr)
+        position = k - (self.shape[1] - n_stored)
+        values = np.zeros(self.shape[0], dtype=sorted_data.dtype)
+        stored = position >= 0
+        values[stored] = sorted_data[self.indptr[:-1][stored] + position[stored]]
+        return values
+
+    def get_rows(self, start: int, end: int) -> 'SparseScores':
+        """rows start to end - 1, sharing the arrays of this matrix
+
+        Args:
+            start (int): first row id
+            end (int): row id after the last row
+
+        Returns:
+            SparseScores: (end - start) x D score matrix
+        """
+        data_start, data_end = self.indptr[start], self.indptr[end]
+        return SparseScores(self.indptr[start:end + 1] - data_start,
+                            self.indices[data_start:data_end], self.data[data_start:data_end],
+                            (end - start, self.shape[1]))
+
+    def get_row(self, i: int) -> np.ndarray:
+        """dense copy of row i
+
+        Args:
+            i (int): row id
+
+        Returns:
+            np.ndarray: D scores
+        """
+        row = np.zeros(self.shape[1], dtype=self.data.dtype)
+        start, end = self.indptr[i], self.indptr[i + 1]
+        row[self.indices[start:end]] = self.data[start:end]
+        return row
+
+    def toarray(self) -> np.ndarray:
+        """dense copy of the whole matrix
+
+        Returns:
+            np.ndarray: Q x D matrix
+        """
+        matrix = np.zeros(self.shape, dtype=self.data.dtype)
+        matrix[self.get_row_ids(), self.indices] = self.data
+        return matrix
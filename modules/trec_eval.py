@@ -1,33 +1,662 @@
 # -*- coding: utf-8 -*-
 """
-This module contains a wrapper class for trec_eval
+This module computes trec_eval's IR metrics, either in-process with NumPy or with the
+external trec_eval binary
 """
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional
+from collections import OrderedDict
 import subprocess
 import os
 import json
 import logging
+import numpy as np
+from .profiler import Profiler
+from .trec_files import Qrels, Run, is_npz_file
+
+
+# trec_eval's label of retrieved documents that are not in the qrels (RELVALUE_NONPOOL)
+RELVALUE_NONPOOL = -1
+
+# floor of per-query values before taking the log for geometric means (MIN_GEO_MEAN)
+MIN_GEO_MEAN = 0.00001
+
+# smoothing constant of infAP (INFAP_EPSILON)
+INFAP_EPSILON = 0.00001
+
+# default parameters of trec_eval's all_trec measures
+CUTOFFS = (5, 10, 15, 20, 30, 100, 200, 500, 1000)
+SUCCESS_CUTOFFS = (1, 5, 10)
+IPREC_RECALL_LEVELS = tuple(i / 10 for i in range(11))
+RPREC_MULTIPLIERS = tuple(i / 5 for i in range(1, 11))
+
+# families of measures, in the order trec_eval prints them with `-m all_trec`
+MEASURE_FAMILIES = OrderedDict([
+    ('num_q', ['num_q']),
+    ('num_ret', ['num_ret']),
+    ('num_rel', ['num_rel']),
+    ('num_rel_ret', ['num_rel_ret']),
+    ('map', ['map']),
+    ('gm_map', ['gm_map']),
+    ('Rprec', ['Rprec']),
+    ('bpref', ['bpref']),
+    ('recip_rank', ['recip_rank']),
+    ('iprec_at_recall', ['iprec_at_recall_%.2f' % x for x in IPREC_RECALL_LEVELS]),
+    ('P', ['P_%d' % k for k in CUTOFFS]),
+    ('recall', ['recall_%d' % k for k in CUTOFFS]),
+    ('infAP', ['infAP']),
+    ('gm_bpref', ['gm_bpref']),
+    ('Rprec_mult', ['Rprec_mult_%.2f' % x for x in RPREC_MULTIPLIERS]),
+    ('utility', ['utility']),
+    ('11pt_avg', ['11pt_avg']),
+    ('binG', ['binG']),
+    ('G', ['G']),
+    ('ndcg', ['ndcg']),
+    ('ndcg_rel', ['ndcg_rel']),
+    ('Rndcg', ['Rndcg']),
+    ('ndcg_cut', ['ndcg_cut_%d' % k for k in CUTOFFS]),
+    ('map_cut', ['map_cut_%d' % k for k in CUTOFFS]),
+    ('relative_P', ['relative_P_%d' % k for k in CUTOFFS]),
+    ('success', ['success_%d' % k for k in SUCCESS_CUTOFFS]),
+    ('set_P', ['set_P']),
+    ('set_relative_P', ['set_relative_P']),
+    ('set_recall', ['set_recall']),
+    ('set_map', ['set_map']),
+    ('set_F', ['set_F']),
+    ('num_nonrel_judged_ret', ['num_nonrel_judged_ret']),
+])
+
+# summary values of these measures are sums over queries instead of means
+SUM_MEASURES = ('num_q', 'num_ret', 'num_rel', 'num_rel_ret', 'num_nonrel_judged_ret')
+
+# summary values of these measures are geometric means, per-query values are logs
+GEO_MEAN_MEASURES = ('gm_map', 'gm_bpref')
+
+# measures reported by default (the evaluation measures of all_trec, without counts)
+DEFAULT_METRICS = [metric_name
+                   for family, metric_names in MEASURE_FAMILIES.items()
+                   if family not in SUM_MEASURES
+                   for metric_name in metric_names]
+
+
+def resolve_metrics(selectors: Optional[Iterable[str]] = None) -> List[str]:
+    """ expand metric selectors into metric names
+
+    Args:
+        selectors (list(str), optional): metric names (e.g. "P_10") or family names
+            (e.g. "P", which selects P_5 ... P_1000). Default: DEFAULT_METRICS
+
+    Returns:
+        list(str): selected metric names in trec_eval's output order
+
+    Raises:
+        ValueError: If a selector is neither a metric name nor a family name
+    """
+    if selectors is None:
+        return list(DEFAULT_METRICS)
+
+    selected = set()
+    for selector in selectors:
+        if selector in MEASURE_FAMILIES:
+            selected.update(MEASURE_FAMILIES[selector])
+        elif any(selector in metric_names for metric_names in MEASURE_FAMILIES.values()):
+            selected.add(selector)
+        else:
+            raise ValueError("Unknown metric: %s" % selector)
+
+    return [metric_name
+            for metric_names in MEASURE_FAMILIES.values()
+            for metric_name in metric_names if metric_name in selected]
+
+
+def _divide(numerator, denominator) -> np.ndarray:
+    """element-wise division which returns 0 where the denominator is 0"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.broadcast_to(np.asarray(denominator, dtype=np.float64), numerator.shape)
+    return np.divide(numerator, denominator,
+                     out=np.zeros(numerator.shape), where=denominator != 0)
+
+
+def _at(cumulative: np.ndarray, k) -> np.ndarray:
+    """ value of a cumulative sum over the first k ranks of every query
+
+    Args:
+        cumulative (np.ndarray): Q x L matrix of cumulative sums along the ranks
+        k (int or np.ndarray): cutoff, either for all queries or one per query
+
+    Returns:
+        np.ndarray: Q values, 0 where k is 0
+    """
+    padded = np.concatenate([np.zeros((cumulative.shape[0], 1)), cumulative], axis=1)
+    k = np.clip(np.broadcast_to(k, (cumulative.shape[0],)), 0, cumulative.shape[1])
+    return np.take_along_axis(padded, k.astype(np.int64)[:, None], axis=1)[:, 0]
+
+
+class NativeTrecEval():
+    """ Vectorized NumPy implementation of trec_eval's all_trec measures
+
+    Every query is stored as a row of a Q x L label matrix, where L is the length of the
+    longest ranking. Rankings are ordered like trec_eval (by decreasing score, ties broken
+    by decreasing docno) and truncated to max_retrieved documents (trec_eval -M1000).
+    Retrieved documents which are not in the qrels are labeled RELVALUE_NONPOOL, and only
+    queries which are in both the qrels and the results are evaluated.
+
+    Note:
+        Per-query values of gm_map and gm_bpref are logs (as printed by trec_eval -q),
+        their summary values are geometric means.
+
+    Attributes:
+        query_ids (list(str)): evaluated queries, sorted like trec_eval
+        labels (np.ndarray): Q x L relevance labels of the retrieved documents
+        num_ret (np.ndarray): number of retrieved documents of every query
+        num_rel (np.ndarray): number of relevant documents of every query
+        num_nonrel (np.ndarray): number of judged non-relevant documents of every query
+        ideal_gains (np.ndarray): Q x M gains of the judged documents, sorted decreasingly
+    """
+
+    max_retrieved = 1000
+    relevance_level = 1
+
+    # number of queries evaluated at once, bounds the size of the intermediate matrices
+    block_size = 1024
+
+    def __init__(self,
+                 qrels: Dict[str, Dict[str, int]],
+                 run: Dict[str, Dict[str, float]]):
+        """ constructor
+
+        Args:
+            qrels (dict(str, dict(str, int))): Maps query id to a dict from docno to relevance label
+            run (dict(str, dict(str, float))): Maps query id to a dict from docno to retrieval score
+        """
+        self.query_ids = sorted(set(qrels) & set(run))
+
+        rankings = []
+        for query_id in self.query_ids:
+            # score descending, ties broken by docno descending
+            ranking = sorted(run[query_id].items(), key=lambda r: (r[1], r[0]), reverse=True)
+            query_qrels = qrels[query_id]
+            rankings.append([query_qrels.get(docno, RELVALUE_NONPOOL)
+                             for docno, _ in ranking[:self.max_retrieved]])
+
+        n_queries = len(self.query_ids)
+        self.num_ret = np.array([len(ranking) for ranking in rankings], dtype=np.int64)
+        self.labels = np.full((n_queries, self.num_ret.max(initial=0)),
+                              RELVALUE_NONPOOL, dtype=np.int64)
+        for row, ranking in enumerate(rankings):
+            self.labels[row, :len(ranking)] = ranking
+
+        judged = [np.array(list(qrels[query_id].values()), dtype=np.int64)
+                  for query_id in self.query_ids]
+        self.num_rel = np.array([np.sum(j >= self.relevance_level) for j in judged],
+                                dtype=np.int64)
+        self.num_nonrel = np.array([np.sum((j >= 0) & (j < self.relevance_level)) for j in judged],
+                                   dtype=np.int64)
+        self.ideal_gains = np.zeros((n_queries, self.num_rel.max(initial=0)))
+        for row, j in enumerate(judged):
+            gains = np.sort(j[j >= self.relevance_level])[::-1]
+            self.ideal_gains[row, :len(gains)] = gains
+
+    @classmethod
+    def from_files(cls, qrel_f: str, res_f: str) -> 'NativeTrecEval':
+        """ read a qrel file and a results file in trec_eval's formats or in the npz
+        format (see modules.trec_files)
+
+        Args:
+            qrel_f (str): path of file with lines "query_id iteration docno relevance"
+            res_f (str): path of file with lines "query_id Q0 docno rank score run_id"
+
+        Returns:
+            NativeTrecEval
+        """
+        qrels = Qrels.load_npz(qrel_f) if is_npz_file(qrel_f) else None
+        run = Run.load_npz(res_f) if is_npz_file(res_f) else None
+        if qrels is not None and run is not None:
+            return cls.from_arrays(qrels, run)
+
+        if qrels is not None:
+            qrels = qrels.to_dict()
+        else:
+            qrels = {}
+            with open(qrel_f) as f_qrel:
+                for line in f_qrel:
+                    fields = line.split()
+                    if fields:
+                        qrels.setdefault(fields[0], {})[fields[2]] = int(fields[3])
+
+        if run is not None:
+            run = run.to_dict()
+        else:
+            run = {}
+            with open(res_f) as f_res:
+                for line in f_res:
+                    fields = line.split()
+                    if fields:
+                        run.setdefault(fields[0], {})[fields[2]] = float(fields[4])
+
+        return cls(qrels, run)
+
+    @classmethod
+    def from_arrays(cls, qrels: Qrels, run: Run) -> 'NativeTrecEval':
+        """ build the label matrix directly from array qrels and results, without
+        creating a dict entry per judged document
+
+        Args:
+            qrels (Qrels): relevance judgments
+            run (Run): retrieval results
+
+        Returns:
+            NativeTrecEval: same state as NativeTrecEval(qrels.to_dict(), run.to_dict())
+        """
+        self = cls.__new__(cls)
+        run_query_ids, run_doc_ids, scores = run.get_arrays()
+        qrel_rows = {query_id: i for i, query_id in enumerate(qrels.query_ids)}
+        run_rows = {query_id: i for i, query_id in enumerate(run_query_ids)}
+
+        # queries without any judged document are not in the qrel file
+        n_docs = len(qrels.doc_ids)
+        n_explicit = np.diff(qrels.labels.indptr)
+        n_implicit = np.where(qrels.default_labels >= 0, n_docs - n_explicit, 0)
+        judged = {query_id for query_id, i in qrel_rows.items()
+                  if n_explicit[i] + n_implicit[i] > 0}
+        self.query_ids = sorted(judged & set(run_rows))
+        n_queries = len(self.query_ids)
+        qrel_idx = np.array([qrel_rows[query_id] for query_id in self.query_ids], dtype=np.int64)
+        run_idx = np.array([run_rows[query_id] for query_id in self.query_ids], dtype=np.int64)
+
+        # retrieved documents of the evaluated queries
+        lengths = np.diff(scores.indptr)[run_idx]
+        rows = np.repeat(np.arange(n_queries), lengths)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.arange(offsets[-1]) - offsets[rows] + scores.indptr[run_idx][rows]
+        cols, values = scores.indices[positions], scores.data[positions]
+
+        # score descending, ties broken by docno descending
+        doc_rank = np.empty(len(run_doc_ids), dtype=np.int64)
+        doc_rank[np.argsort(np.array(run_doc_ids, dtype=str))] = np.arange(len(run_doc_ids))
+        order = np.lexsort((-doc_rank[cols], -values, rows))
+        rows, cols = rows[order], cols[order]
+        ranks = np.arange(len(rows)) - offsets[rows]
+        kept = ranks < self.max_retrieved
+        rows, cols, ranks = rows[kept], cols[kept], ranks[kept]
+        self.num_ret = np.minimum(lengths, self.max_retrieved)
+
+        # labels of the retrieved documents: explicit label, default label or unjudged
+        doc_columns = {doc_id: j for j, doc_id in enumerate(qrels.doc_ids)}
+        qrel_cols = np.array([doc_columns.get(doc_id, -1) for doc_id in run_doc_ids],
+                             dtype=np.int64)[cols]
+        explicit_keys = qrels.labels.get_row_ids() * n_docs + qrels.labels.indices
+        keys = qrel_idx[rows] * n_docs + qrel_cols
+        found = np.searchsorted(explicit_keys, keys)
+        found = np.minimum(found, len(explicit_keys) - 1)
+        is_explicit = (qrel_cols >= 0) & (len(explicit_keys) > 0)
+        is_explicit[is_explicit] = explicit_keys[found[is_explicit]] == keys[is_explicit]
+        labels = np.where(qrel_cols >= 0, qrels.default_labels[qrel_idx[rows]], RELVALUE_NONPOOL)
+        labels = labels.astype(np.int64)
+        labels[is_explicit] = qrels.labels.data[found[is_explicit]]
+
+        self.labels = np.full((n_queries, self.num_ret.max(initial=0)),
+                              RELVALUE_NONPOOL, dtype=np.int64)
+        self.labels[rows, ranks] = labels
+
+        # judged documents: explicit labels plus n_implicit copies of the default label
+        explicit_rows = qrels.labels.get_row_ids()
+        explicit_labels = qrels.labels.data.astype(np.int64)
+        gain_rows = np.concatenate([explicit_rows,
+                                    np.repeat(np.arange(len(qrels.query_ids)), n_implicit)])
+        gain_labels = np.concatenate([explicit_labels,
+                                      np.repeat(qrels.default_labels.astype(np.int64), n_implicit)])
+        row_map = np.full(len(qrels.query_ids), -1, dtype=np.int64)
+        row_map[qrel_idx] = np.arange(n_queries)
+        gain_rows = row_map[gain_rows]
+        evaluated = gain_rows >= 0
+        gain_rows, gain_labels = gain_rows[evaluated], gain_labels[evaluated]
+
+        relevant = gain_labels >= self.relevance_level
+        self.num_rel = np.bincount(gain_rows[relevant], minlength=n_queries)
+        self.num_nonrel = np.bincount(gain_rows[~relevant & (gain_labels >= 0)],
+                                      minlength=n_queries)
+
+        gain_rows, gain_labels = gain_rows[relevant], gain_labels[relevant]
+        order = np.lexsort((-gain_labels, gain_rows))
+        gain_rows, gain_labels = gain_rows[order], gain_labels[order]
+        gain_offsets = np.concatenate([[0], np.cumsum(self.num_rel)])
+        self.ideal_gains = np.zeros((n_queries, self.num_rel.max(initial=0)))
+        self.ideal_gains[gain_rows, np.arange(len(gain_rows)) - gain_offsets[gain_rows]] = \
+            gain_labels
+        return self
+
+    def get_per_query_metrics(self, metrics: Optional[Iterable[str]] = None
+                              ) -> Dict[str, Dict[str, float]]:
+        """ compute metrics for every query
+
+        Args:
+            metrics (list(str), optional): metric or family names, see resolve_metrics
+
+        Returns:
+            dict(str, dict(str, float)): Maps query id to a dict from metric name to value
+        """
+        values = self.compute(metrics)
+        return OrderedDict(
+            (query_id, OrderedDict((name, float(v[row])) for name, v in values.items()))
+            for row, query_id in enumerate(self.query_ids))
+
+    def get_metrics(self, metrics: Optional[Iterable[str]] = None) -> Dict[str, float]:
+        """ compute summary metrics over all queries (like trec_eval without -q)
+
+        Args:
+            metrics (list(str), optional): metric or family names, see resolve_metrics
+
+        Returns:
+            dict(str, float): Maps metric name to metric value
+        """
+        if not self.query_ids:
+            logging.warning("No query is both in the qrels and in the results")
+
+        summary = OrderedDict()
+        for name, values in self.compute(metrics).items():
+            if name in SUM_MEASURES:
+                summary[name] = int(np.sum(values))
+            elif not len(values):
+                summary[name] = 0.0
+            elif name in GEO_MEAN_MEASURES:
+                summary[name] = float(np.exp(np.mean(values)))
+            else:
+                summary[name] = float(np.mean(values))
+        return summary
+
+    def compute(self, metrics: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+        """ compute per-query values of the selected metrics, one block of queries at a time
+
+        Args:
+            metrics (list(str), optional): metric or family names, see resolve_metrics
+
+        Returns:
+            dict(str, np.ndarray): Maps metric name to an array with a value per query
+        """
+        metric_names = resolve_metrics(metrics)
+        families = [family for family, names in MEASURE_FAMILIES.items()
+                    if any(name in metric_names for name in names)]
+
+        blocks = []
+        for start in range(0, len(self.query_ids), self.block_size):
+            block = slice(start, start + self.block_size)
+            rankings = _RankedBlock(self.labels[block], self.num_ret[block],
+                                    self.num_rel[block], self.num_nonrel[block],
+                                    self.ideal_gains[block], self.relevance_level)
+            values = {}
+            for family in families:
+                values.update(getattr(rankings, 'get_' + family)())
+            blocks.append(values)
+
+        return OrderedDict(
+            (name, np.concatenate([values[name] for values in blocks]) if blocks
+             else np.zeros(0))
+            for name in metric_names)
+
+
+class _RankedBlock():
+    """ measures of a block of ranked lists; shared intermediate matrices are computed
+    on first use, so only the requested measure families are paid for"""
+
+    def __init__(self, labels, num_ret, num_rel, num_nonrel, ideal_gains, relevance_level):
+        self.labels = labels
+        self.num_ret = num_ret
+        self.num_rel = num_rel
+        self.num_nonrel = num_nonrel
+        self.ideal_gains = ideal_gains
+        # 1-based ranks
+        self.ranks = np.arange(1, labels.shape[1] + 1)
+        self.rel = labels >= relevance_level
+        self.cum_rel = np.cumsum(self.rel, axis=1)
+        self.num_rel_ret = self.rel.sum(axis=1)
+        self._cache = {}
+
+    def _cached(self, key, func):
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    @property
+    def prec_at_rel(self) -> np.ndarray:
+        """precision at every relevant document, 0 elsewhere"""
+        return self._cached('prec_at_rel', lambda: np.where(
+            self.rel, self.cum_rel / self.ranks, 0.0))
+
+    @property
+    def gains(self) -> np.ndarray:
+        """gain of every retrieved document (its relevance label, 0 if not relevant)"""
+        return self._cached('gains', lambda: np.where(
+            self.rel, self.labels, 0).astype(np.float64))
+
+    @property
+    def discounts(self) -> np.ndarray:
+        """DCG discount 1 / log2(rank + 1) up to the longest ideal or retrieved list"""
+        return self._cached('discounts', lambda: 1.0 / np.log2(
+            np.arange(max(self.labels.shape[1], self.ideal_gains.shape[1])) + 2))
+
+    @property
+    def dcg(self) -> np.ndarray:
+        """cumulative DCG along the ranks"""
+        return self._cached('dcg', lambda: np.cumsum(
+            self.gains * self.discounts[:self.labels.shape[1]], axis=1))
+
+    @property
+    def ideal_dcg(self) -> np.ndarray:
+        """cumulative DCG of the ideal ranking, at least as long as the retrieved lists"""
+        def ideal_dcg():
+            n_ranks = len(self.discounts)
+            ideal_gains = np.zeros((self.labels.shape[0], n_ranks))
+            ideal_gains[:, :self.ideal_gains.shape[1]] = self.ideal_gains
+            return np.cumsum(ideal_gains * self.discounts, axis=1)
+        return self._cached('ideal_dcg', ideal_dcg)
+
+    def get_num_q(self):
+        return {'num_q': np.ones(len(self.num_ret), dtype=np.int64)}
+
+    def get_num_ret(self):
+        return {'num_ret': self.num_ret}
+
+    def get_num_rel(self):
+        return {'num_rel': self.num_rel}
+
+    def get_num_rel_ret(self):
+        return {'num_rel_ret': self.num_rel_ret}
+
+    def get_num_nonrel_judged_ret(self):
+        return {'num_nonrel_judged_ret': np.sum(
+            (self.labels >= 0) & ~self.rel, axis=1)}
+
+    def get_map(self):
+        return {'map': _divide(self.prec_at_rel.sum(axis=1), self.num_rel)}
+
+    def get_gm_map(self):
+        return {'gm_map': np.log(np.maximum(self.get_map()['map'], MIN_GEO_MEAN))}
+
+    def get_Rprec(self):
+        return {'Rprec': _divide(_at(self.cum_rel, self.num_rel), self.num_rel)}
+
+    def get_bpref(self):
+        # judged non-relevant documents ranked above every relevant document
+        nonrel_above = np.cumsum((self.labels >= 0) & ~self.rel, axis=1)
+        bound = np.minimum(self.num_nonrel, self.num_rel)[:, None]
+        penalty = _divide(np.minimum(nonrel_above, self.num_rel[:, None]), bound)
+        return {'bpref': _divide(np.sum(self.rel * (1.0 - penalty), axis=1), self.num_rel)}
+
+    def get_gm_bpref(self):
+        return {'gm_bpref': np.log(np.maximum(self.get_bpref()['bpref'], MIN_GEO_MEAN))}
+
+    def get_recip_rank(self):
+        first_rel = np.argmax(self.rel, axis=1) + 1
+        return {'recip_rank': np.where(self.num_rel_ret > 0, 1.0 / first_rel, 0.0)}
+
+    def get_iprec_at_recall(self):
+        # interpolated precision is the best precision at or after a rank
+        best_prec = np.maximum.accumulate(self.prec_at_rel[:, ::-1], axis=1)[:, ::-1]
+        values = OrderedDict()
+        for level in IPREC_RECALL_LEVELS:
+            # trec_eval converts recall levels to a number of relevant documents
+            needed = (level * self.num_rel + 0.9).astype(np.int64)
+            reached = self.cum_rel >= needed[:, None]
+            first = np.argmax(reached, axis=1)[:, None]
+            values['iprec_at_recall_%.2f' % level] = np.where(
+                reached.any(axis=1),
+                np.take_along_axis(best_prec, first, axis=1)[:, 0] if best_prec.size else 0.0,
+                0.0)
+        return values
+
+    def get_11pt_avg(self):
+        return {'11pt_avg': np.mean(list(self.get_iprec_at_recall().values()), axis=0)}
+
+    def get_P(self):
+        return OrderedDict(('P_%d' % k, _at(self.cum_rel, k) / k) for k in CUTOFFS)
+
+    def get_recall(self):
+        return OrderedDict(('recall_%d' % k, _divide(_at(self.cum_rel, k), self.num_rel))
+                           for k in CUTOFFS)
+
+    def get_infAP(self):
+        ranks = self.ranks - 1
+        rel_above = self.cum_rel - 1
+        nonrel_above = np.cumsum((self.labels >= 0) & ~self.rel, axis=1)
+        pooled_above = ranks - np.cumsum(self.labels == RELVALUE_NONPOOL, axis=1)
+        precision = 1.0 / self.ranks + (ranks / self.ranks) * _divide(pooled_above, ranks) * (
+            (rel_above + INFAP_EPSILON) / (rel_above + nonrel_above + 2 * INFAP_EPSILON))
+        return {'infAP': _divide(np.sum(self.rel * precision, axis=1), self.num_rel)}
+
+    def get_Rprec_mult(self):
+        values = OrderedDict()
+        for multiplier in RPREC_MULTIPLIERS:
+            cutoff = (multiplier * self.num_rel + 0.9).astype(np.int64)
+            values['Rprec_mult_%.2f' % multiplier] = _divide(_at(self.cum_rel, cutoff), cutoff)
+        return values
+
+    def get_utility(self):
+        return {'utility': (2 * self.num_rel_ret - self.num_ret).astype(np.float64)}
+
+    def get_binG(self):
+        # non-relevant (or unjudged) documents ranked above every relevant document
+        nonrel_above = self.ranks - self.cum_rel
+        return {'binG': _divide(np.sum(self.rel / np.log2(2 + nonrel_above), axis=1),
+                                self.num_rel)}
+
+    def get_G(self):
+        n_ranks = self.labels.shape[1]
+        ideal_gains = np.zeros((self.labels.shape[0], n_ranks))
+        n_ideal = min(n_ranks, self.ideal_gains.shape[1])
+        ideal_gains[:, :n_ideal] = self.ideal_gains[:, :n_ideal]
+        # ranks after the ideal ranking runs out of relevant documents add 1 each
+        beyond_ideal = np.maximum(0, self.ranks[None, :] - self.num_rel[:, None])
+        gain_gap = np.cumsum(ideal_gains, axis=1) - np.cumsum(self.gains, axis=1) + beyond_ideal
+        return {'G': _divide(np.sum(self.gains / np.log2(2 + gain_gap), axis=1),
+                             self.ideal_gains.sum(axis=1))}
+
+    def get_ndcg(self):
+        return {'ndcg': _divide(_at(self.dcg, self.num_ret),
+                                _at(self.ideal_dcg, self.num_rel))}
+
+    def get_ndcg_rel(self):
+        n_ranks = self.labels.shape[1]
+        ndcg_at_rel = np.sum(self.rel * _divide(self.dcg, self.ideal_dcg[:, :n_ranks]), axis=1)
+        # relevant documents which were not retrieved count with the final ndcg
+        not_retrieved = (self.num_rel - self.num_rel_ret) * self.get_ndcg()['ndcg']
+        return {'ndcg_rel': _divide(ndcg_at_rel + not_retrieved, self.num_rel)}
+
+    def get_Rndcg(self):
+        # ndcg is measured where the ideal gain changes (at most once per gain level) ...
+        ideal_gains = self.ideal_gains
+        next_gains = np.concatenate([ideal_gains[:, 1:], np.zeros((len(ideal_gains), 1))], axis=1)
+        levels = (ideal_gains > 0) & (next_gains != ideal_gains)
+        cutoffs = np.arange(1, ideal_gains.shape[1] + 1)
+        dcg = np.concatenate([np.zeros((len(ideal_gains), 1)), self.dcg], axis=1)
+        dcg = np.take_along_axis(dcg, np.broadcast_to(
+            np.minimum(cutoffs, self.labels.shape[1]), ideal_gains.shape), axis=1)
+        ndcg_sum = np.sum(levels * _divide(dcg, self.ideal_dcg[:, :ideal_gains.shape[1]]),
+                          axis=1)
+        n_levels = levels.sum(axis=1)
+        # ... and once more at the end of the ranking (trec_eval skips this last point
+        # when exactly one document is retrieved after the last relevant rank)
+        final = self.num_ret > self.num_rel + 1
+        ndcg_sum += final * self.get_ndcg()['ndcg']
+        return {'Rndcg': _divide(ndcg_sum, n_levels + final)}
+
+    def get_ndcg_cut(self):
+        return OrderedDict(('ndcg_cut_%d' % k, _divide(_at(self.dcg, k), _at(self.ideal_dcg, k)))
+                           for k in CUTOFFS)
+
+    def get_map_cut(self):
+        cum_prec = np.cumsum(self.prec_at_rel, axis=1)
+        return OrderedDict(('map_cut_%d' % k, _divide(_at(cum_prec, k), self.num_rel))
+                           for k in CUTOFFS)
+
+    def get_relative_P(self):
+        return OrderedDict(
+            ('relative_P_%d' % k,
+             _divide(_at(self.cum_rel, k), np.minimum(k, self.num_rel)))
+            for k in CUTOFFS)
+
+    def get_success(self):
+        return OrderedDict(('success_%d' % k, (_at(self.cum_rel, k) > 0).astype(np.float64))
+                           for k in SUCCESS_CUTOFFS)
+
+    def get_set_P(self):
+        return {'set_P': _divide(self.num_rel_ret, self.num_ret)}
+
+    def get_set_relative_P(self):
+        return {'set_relative_P': _divide(self.num_rel_ret,
+                                          np.minimum(self.num_ret, self.num_rel))}
+
+    def get_set_recall(self):
+        return {'set_recall': _divide(self.num_rel_ret, self.num_rel)}
+
+    def get_set_map(self):
+        return {'set_map': self.get_set_P()['set_P'] * self.get_set_recall()['set_recall']}
+
+    def get_set_F(self):
+        precision = self.get_set_P()['set_P']
+        recall = self.get_set_recall()['set_recall']
+        return {'set_F': _divide(2 * precision * recall, precision + recall)}
 
 
 class TrecEval():
-    """ A wrapper class for trec_eval"""
+    """ Computes trec_eval's IR metrics of a qrel file and a results file
+
+    By default the metrics are computed in-process by NativeTrecEval. The external
+    trec_eval binary can still be used with engine="trec_eval".
+    """
     script_path = os.path.dirname(os.path.abspath(__file__))
     trec_eval_bin = os.path.join(script_path, "../external_tools/trec_eval/trec_eval")
 
-    def __init__(self, qrel_f: str, res_f: str):
+    ENGINES = ('native', 'trec_eval')
+
+    def __init__(self, qrel_f: str, res_f: str,
+                 metrics: Optional[List[str]] = None,
+                 engine: str = 'native'):
         """ Constructor which takes a qrel file and a results file
         Args:
             qrel_f (str): path of file with list of relevant documents for each query
             res_f (str): path of file with list of documents retrieved by ElasticSearch
+            metrics (list(str), optional): metric or family names to report (e.g. ["map", "P"]).
+                Default: all measures of trec_eval's all_trec except counts
+            engine (str): "native" (in-process) or "trec_eval" (external binary). Default: "native"
 
         Raises:
-            Exception: If trec_eval binary file does not exists.
+            ValueError: If engine or a metric is not supported, or if engine is trec_eval
+            and a file is in the npz format.
+            Exception: If engine is trec_eval and the trec_eval binary file does not exists.
         """
         self.qrel_f = qrel_f
         self.res_f = res_f
+        self.metric_names = resolve_metrics(metrics)
+        self.engine = engine
         self.metrics = None
 
-        if not os.path.exists(self.trec_eval_bin):
+        if engine not in self.ENGINES:
+            raise ValueError("Unsupported engine: %s" % engine)
+
+        if engine == 'trec_eval' and (is_npz_file(qrel_f) or is_npz_file(res_f)):
+            raise ValueError("trec_eval cannot read npz files, use the native engine")
+
+        if engine == 'trec_eval' and not os.path.exists(self.trec_eval_bin):
             raise Exception(
                 """trec_eval binary file does not exists.
                 Please download using ./scripts/install_external_tools.sh""")
@@ -41,28 +670,63 @@ class TrecEval():
         self.trec_eval_bin = bin_path
 
     def get_metrics(self) -> Dict[str, float]:
-        """ Get IR metrics using trec_eval (https://github.com/usnistgov/trec_eval)
+        """ Get IR metrics of trec_eval (https://github.com/usnistgov/trec_eval)
+
+        Note:
+            values are rounded to 4 decimals, as printed by trec_eval
 
         Returns:
             dict(str, float): Maps metric name to metric value
         """
 
         if not self.metrics:
-            trec_eval_output = subprocess.check_output(
-                [self.trec_eval_bin, "-m", "all_trec", "-M1000", self.qrel_f, self.res_f]
-            ).decode('ascii')
-
-            self.metrics = {}
-            # remove first 5 items and last item
-            for metric in trec_eval_output.split('\n')[5:-2]:
-                metric = metric.split('\t')
-                metric_name, _, metric_value = metric
-                metric_name = metric_name.strip()
-                metric_value = float(metric_value)
-                self.metrics[metric_name] = metric_value
+            with Profiler.span("trec_eval"):
+                if self.engine == 'trec_eval':
+                    all_metrics = self.run_trec_eval()
+                else:
+                    all_metrics = self.round_metrics(NativeTrecEval.from_files(
+                        self.qrel_f, self.res_f).get_metrics(self.metric_names))
+
+            self.metrics = OrderedDict(
+                (k, all_metrics[k]) for k in self.metric_names if k in all_metrics)
 
         return self.metrics
 
+    @staticmethod
+    def round_metrics(metrics: Dict[str, float]) -> Dict[str, float]:
+        """ round metric values to 4 decimals, as printed by trec_eval (counts stay integers)
+
+        Args:
+            metrics (dict(str, float)): Maps metric name to metric value
+
+        Returns:
+            dict(str, float): Maps metric name to rounded metric value, in the same order
+        """
+        return OrderedDict((k, v if isinstance(v, int) else float("%6.4f" % v))
+                           for k, v in metrics.items())
+
+    def run_trec_eval(self) -> Dict[str, float]:
+        """ Get IR metrics from the output of the trec_eval binary
+
+        Returns:
+            dict(str, float): Maps metric name to metric value
+        """
+        trec_eval_output = subprocess.check_output(
+            [self.trec_eval_bin, "-m", "all_trec", "-M1000", self.qrel_f, self.res_f]
+        ).decode('ascii')
+
+        metrics = {}
+        # remove first item (runid) and last item
+        for metric in trec_eval_output.split('\n')[1:-1]:
+            metric = metric.split('\t')
+            metric_name, _, metric_value = metric
+            metric_name = metric_name.strip()
+            metric_value = float(metric_value)
+            if metric_name in SUM_MEASURES:
+                metric_value = int(metric_value)
+            metrics[metric_name] = metric_value
+        return metrics
+
     def print_metrics(self, output_format: str = "tsv",
                       output_file: Optional[str] = None):
         """ print IR metrics to either a file or stdout
@@ -78,6 +742,61 @@ class TrecEval():
             output_str = "\n".join(["%s\t%s" % (k, v)
                                     for k, v in self.get_metrics().items()])
 
+        self.write_output(output_str, output_file)
+
+    @staticmethod
+    def print_system_metrics(system_metrics: Dict[str, Dict[str, float]],
+                             output_format: str = "tsv",
+                             output_file: Optional[str] = None,
+                             significance: Optional[dict] = None):
+        """ print IR metrics of several systems as one table
+
+        Note:
+            json output maps system names to metric dicts, tsv output has one row per
+            metric and one column per system. With significance, json output has the
+            keys "metrics" and "significance", and tsv output is followed by a table
+            with one row per comparison.
+
+        Args:
+            system_metrics (dict(str, dict(str, float))): Maps system names to metrics
+            output_format (str): json or tsv
+            output_file (str, optional): path to write output
+            significance (dict, optional): significance tests of the systems, see
+            modules.significance.SignificanceTest.get_report
+        """
+        if output_format.lower() == 'json':
+            if significance is not None:
+                system_metrics = OrderedDict([("metrics", system_metrics),
+                                              ("significance", significance)])
+            output_str = json.dumps(system_metrics)
+        else:
+            systems = list(system_metrics.keys())
+            metric_names = []
+            for metrics in system_metrics.values():
+                metric_names.extend(k for k in metrics if k not in metric_names)
+            rows = ["\t".join(["metric"] + systems)]
+            for metric_name in metric_names:
+                rows.append("\t".join(
+                    [metric_name] + ["%s" % system_metrics[system].get(metric_name, "")
+                                     for system in systems]))
+            if significance is not None and significance["comparisons"]:
+                columns = list(significance["comparisons"][0])
+                rows.append("")
+                rows.append("\t".join(columns))
+                rows.extend("\t".join("%s" % comparison[column] for column in columns)
+                            for comparison in significance["comparisons"])
+            output_str = "\n".join(rows)
+
+        TrecEval.write_output(output_str, output_file)
+
+    @staticmethod
+    def write_output(output_str: str, output_file: Optional[str] = None):
+        """ write output_str to either a file or stdout
+
+        Args:
+            output_str (str): formatted metrics
+            output_file (str, optional): path to write output
+        """
         if output_file:
             with open(output_file, 'w') as fout:
                 print(output_str, file=fout)
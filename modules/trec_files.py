@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Relevance judgments (qrels) and retrieval results (runs) in compact array form, and
+writers for trec_eval's text formats and a binary npz format
+"""
+from typing import Dict, Iterator, List, Tuple
+import zipfile
+import numpy as np
+from .sparse_scores import SparseScores
+
+
+# file formats selectable with `evaluate.py --trec_format`
+TEXT = 'text'
+NPZ = 'npz'
+TREC_FORMATS = (TEXT, NPZ)
+
+
+def is_npz_file(file_path: str) -> bool:
+    """whether a qrel or res file is in the npz format (a zip archive)"""
+    return zipfile.is_zipfile(file_path)
+
+
+class Qrels():
+    """Relevance labels of Q queries over D documents
+
+    Every query has a default label which applies to all documents without an explicit
+    label. A default label of -1 means that these documents are not judged (not written
+    to the qrel file).
+
+    Attributes:
+        query_ids (list(str)): query ids, in the order of the qrel file
+        doc_ids (list(str)): document ids, in the order of the qrel file
+        default_labels (np.ndarray): default label of every query (int8)
+        labels (SparseScores): explicit labels (int8), written in document order
+    """
+
+    # number of characters formatted before a chunk is handed to the file
+    chunk_size = 1 << 22
+
+    def __init__(self, query_ids: List[str], doc_ids: List[str],
+                 default_labels: np.ndarray, labels: SparseScores):
+        """constructor
+
+        Args:
+            query_ids (list(str)): query ids
+            doc_ids (list(str)): document ids
+            default_labels (np.ndarray): default label of every query, -1 for unjudged
+            labels (SparseScores): Q x D explicit labels
+        """
+        self.query_ids = [str(query_id) for query_id in query_ids]
+        self.doc_ids = [str(doc_id) for doc_id in doc_ids]
+        self.default_labels = np.asarray(default_labels, dtype=np.int8)
+        self.labels = labels
+
+    def iter_text(self) -> Iterator[str]:
+        """format the qrels as trec_eval qrel file lines "query_id 0 docno relevance"
+
+        Note:
+            A line is `query_id + suffix`, where the suffix only depends on the document and
+            the label. Suffixes of the default label are formatted once per label value, so
+            a query with a default label costs a list copy and one str.join.
+
+        Yields:
+            str: chunks of complete lines
+        """
+        if not self.doc_ids:
+            return
+
+        suffixes = {}
+
+        def get_suffixes(label):
+            if label not in suffixes:
+                suffixes[label] = ["\t0\t%s\t%d\n" % (doc_id, label) for doc_id in self.doc_ids]
+            return suffixes[label]
+
+        indptr, indices = self.labels.indptr, self.labels.indices
+        labels = self.labels.data.tolist()
+        chunk, chunk_len = [], 0
+        for i, query_id in enumerate(self.query_ids):
+            start, end = indptr[i], indptr[i + 1]
+            default_label = int(self.default_labels[i])
+            if default_label < 0:
+                query_suffixes = ["\t0\t%s\t%d\n" % (self.doc_ids[j], label) for j, label
+                                  in zip(indices[start:end].tolist(), labels[start:end])]
+            else:
+                query_suffixes = list(get_suffixes(default_label))
+                for j, label in zip(indices[start:end].tolist(), labels[start:end]):
+                    query_suffixes[j] = get_suffixes(label)[j]
+            if query_suffixes:
+                chunk.append(query_id + query_id.join(query_suffixes))
+                chunk_len += len(chunk[-1])
+            if chunk_len >= self.chunk_size:
+                yield "".join(chunk)
+                chunk, chunk_len = [], 0
+        if chunk:
+            yield "".join(chunk)
+
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+        """qrels as nested dicts, the input of NativeTrecEval
+
+        Returns:
+            dict(str, dict(str, int)): Maps query id to a dict from docno to relevance label
+        """
+        qrels = {}
+        for i, query_id in enumerate(self.query_ids):
+            start, end = self.labels.indptr[i], self.labels.indptr[i + 1]
+            default_label = int(self.default_labels[i])
+            query_qrels = {} if default_label < 0 else dict.fromkeys(self.doc_ids, default_label)
+            for j, label in zip(self.labels.indices[start:end].tolist(),
+                                self.labels.data[start:end].tolist()):
+                query_qrels[self.doc_ids[j]] = label
+            if query_qrels:
+                qrels.setdefault(query_id, {}).update(query_qrels)
+        return qrels
+
+    def save_npz(self, npz_f):
+        """write the qrels in the npz format
+
+        Args:
+            npz_f (str or file-like object): path or binary file object
+        """
+        np.savez(npz_f, kind='qrels', query_ids=np.array(self.query_ids, dtype=str),
+                 doc_ids=np.array(self.doc_ids, dtype=str),
+                 default_labels=self.default_labels, indptr=self.labels.indptr,
+                 indices=self.labels.indices, labels=self.labels.data)
+
+    @classmethod
+    def load_npz(cls, npz_f) -> 'Qrels':
+        """read qrels written by save_npz
+
+        Args:
+            npz_f (str or file-like object): path or binary file object
+
+        Raises:
+            ValueError: If the file does not contain qrels
+
+        Returns:
+            Qrels
+        """
+        with np.load(npz_f) as data:
+            if str(data['kind']) != 'qrels':
+                raise ValueError("%s does not contain qrels" % npz_f)
+            query_ids, doc_ids = data['query_ids'].tolist(), data['doc_ids'].tolist()
+            labels = SparseScores(data['indptr'], data['indices'], data['labels'],
+                                  (len(query_ids), len(doc_ids)))
+            return cls(query_ids, doc_ids, data['default_labels'], labels)
+
+
+class Run():
+    """Retrieval results, kept in the order of the search results
+
+    Attributes:
+        results (list(tuple(str, str, float))): result tuples -> (query id, doc id, score),
+        None if the results were loaded from a npz file
+    """
+
+    # trec_eval results line, the rank column is not used by trec_eval
+    LINE_FORMAT = "%s\tQ0\t%s\t0\t%.5f\tSTANDARD\n"
+
+    # number of lines formatted at once
+    chunk_size = 1 << 16
+
+    def __init__(self, results: List[Tuple[str, str, float]] = None,
+                 arrays: Tuple[List[str], List[str], SparseScores] = None):
+        """constructor
+
+        Args:
+            results (list(tuple(str, str, float))): result tuples -> (query id, doc id, score)
+            arrays (tuple(list(str), list(str), SparseScores)): query ids, doc ids and
+            scores as returned by get_arrays, used when results is None
+        """
+        self.results = results
+        self.arrays = arrays
+
+    def iter_text(self) -> Iterator[str]:
+        """format the results as trec_eval results lines
+        "query_id Q0 docno rank score STANDARD"
+
+        Yields:
+            str: chunks of complete lines
+        """
+        results = self.results
+        if results is None:
+            query_ids, doc_ids, scores = self.arrays
+            results = [(query_ids[i], doc_ids[j], score) for i, j, score in zip(
+                scores.get_row_ids().tolist(), scores.indices.tolist(), scores.data.tolist())]
+
+        line_format = self.LINE_FORMAT.__mod__
+        for start in range(0, len(results), self.chunk_size):
+            yield "".join(map(line_format, results[start:start + self.chunk_size]))
+
+    def get_arrays(self) -> Tuple[List[str], List[str], SparseScores]:
+        """results as a sparse query x document score matrix
+
+        Note:
+            Scores are rounded like in the text format, so both formats give the same
+            rankings.
+
+        Returns:
+            list(str): query ids, in order of first appearance
+            list(str): doc ids, in order of first appearance
+            SparseScores: Q x D scores
+        """
+        if self.arrays is None:
+            query_idx, doc_idx = {}, {}
+            rows, cols, scores = [], [], []
+            for query_id, doc_id, score in self.results:
+                rows.append(query_idx.setdefault(str(query_id), len(query_idx)))
+                cols.append(doc_idx.setdefault(str(doc_id), len(doc_idx)))
+                scores.append(float("%.5f" % score))
+            matrix = SparseScores.from_coo(rows, cols, np.array(scores, dtype=np.float64),
+                                           (len(query_idx), len(doc_idx)))
+            self.arrays = (list(query_idx), list(doc_idx), matrix)
+        return self.arrays
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        """results as nested dicts, the input of NativeTrecEval
+
+        Returns:
+            dict(str, dict(str, float)): Maps query id to a dict from docno to score
+        """
+        query_ids, doc_ids, scores = self.get_arrays()
+        run = {}
+        for i, j, score in zip(scores.get_row_ids().tolist(), scores.indices.tolist(),
+                               scores.data.tolist()):
+            run.setdefault(query_ids[i], {})[doc_ids[j]] = score
+        return run
+
+    def save_npz(self, npz_f):
+        """write the results in the npz format
+
+        Args:
+            npz_f (str or file-like object): path or binary file object
+        """
+        query_ids, doc_ids, scores = self.get_arrays()
+        np.savez(npz_f, kind='run', query_ids=np.array(query_ids, dtype=str),
+                 doc_ids=np.array(doc_ids, dtype=str), indptr=scores.indptr,
+                 indices=scores.indices, scores=scores.data)
+
+    @classmethod
+    def load_npz(cls, npz_f) -> 'Run':
+        """read results written by save_npz
+
+        Args:
+            npz_f (str or file-like object): path or binary file object
+
+        Raises:
+            ValueError: If the file does not contain results
+
+        Returns:
+            Run
+        """
+        with np.load(npz_f) as data:
+            if str(data['kind']) != 'run':
+                raise ValueError("%s does not contain results" % npz_f)
+            query_ids, doc_ids = data['query_ids'].tolist(), data['doc_ids'].tolist()
+            scores = SparseScores(data['indptr'], data['indices'], data['scores'],
+                                  (len(query_ids), len(doc_ids)))
+            return cls(arrays=(query_ids, doc_ids, scores))
+
+
+def write_trec_file(tmp_f, trec_data, trec_format: str = TEXT):
+    """write qrels or results to a file
+
+    Args:
+        tmp_f (file-like object): A file-like object opened in text mode, or in binary mode
+        for the npz format
+        trec_data (Qrels or Run): qrels or results
+        trec_format (str): "text" (trec_eval's format) or "npz". Default: "text"
+
+    Raises:
+        ValueError: If trec_format is not supported.
+    """
+    if trec_format == TEXT:
+        for chunk in trec_data.iter_text():
+            tmp_f.write(chunk)
+    elif trec_format == NPZ:
+        trec_data.save_npz(tmp_f)
+    else:
+        raise ValueError("Unknown trec file format: %s" % trec_format)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Vocabulary of a document collection (the queries of query_mode = unique_terms)
+"""
+from typing import Iterable, List, Tuple
+import json
+import os
+import tempfile
+import numpy as np
+
+
+class Vocabulary():
+    """Unique terms of a collection in order of first appearance, with the number of
+    documents which contain every term
+
+    Terms are added one chunk of documents at a time, so term vectors of a large
+    collection never have to be kept in memory at once.
+
+    Attributes:
+        term_ids (dict(str, int)): Maps term to its position (order of first appearance)
+        doc_freqs (np.ndarray): document frequency of every term
+    """
+
+    def __init__(self, terms: List[str] = None, doc_freqs: Iterable[int] = None):
+        """constructor
+
+        Args:
+            terms (list(str)): unique terms. Default: empty vocabulary
+            doc_freqs (iterable(int)): document frequency of every term. Default: 0
+        """
+        terms = terms or []
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        if doc_freqs is None:
+            self.doc_freqs = np.zeros(len(terms), dtype=np.int64)
+        else:
+            self.doc_freqs = np.array(doc_freqs, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.term_ids)
+
+    def add_docs(self, docs_terms: Iterable[Iterable[str]]):
+        """add the terms of a chunk of documents
+
+        Args:
+            docs_terms (iterable(iterable(str))): unique terms of every document
+        """
+        ids = []
+        for doc_terms in docs_terms:
+            for term in doc_terms:
+                ids.append(self.term_ids.setdefault(term, len(self.term_ids)))
+        doc_freqs = np.zeros(len(self.term_ids), dtype=np.int64)
+        doc_freqs[:len(self.doc_freqs)] = self.doc_freqs
+        doc_freqs += np.bincount(np.array(ids, dtype=np.int64), minlength=len(self.term_ids))
+        self.doc_freqs = doc_freqs
+
+    def get_terms(self) -> List[str]:
+        """unique terms in order of first appearance"""
+        return list(self.term_ids)
+
+    def get_queries(self) -> List[Tuple[int, str]]:
+        """one query per term
+
+        Returns:
+            list(tuple(int, str)): List of query tuples -> (query id, term)
+        """
+        return list(enumerate(self.term_ids))
+
+    def save(self, vocab_file: str):
+        """write the vocabulary to a JSON file, atomically
+
+        Args:
+            vocab_file (str): path of the file
+        """
+        with tempfile.NamedTemporaryFile(mode='w', dir=os.path.dirname(vocab_file) or '.',
+                                         delete=False) as tmp_f:
+            json.dump({"terms": self.get_terms(), "doc_freqs": self.doc_freqs.tolist()}, tmp_f)
+        os.replace(tmp_f.name, vocab_file)
+
+    @classmethod
+    def load(cls, vocab_file: str) -> 'Vocabulary':
+        """read a vocabulary written by save
+
+        Args:
+            vocab_file (str): path of the file
+
+        Returns:
+            Vocabulary
+        """
+        with open(vocab_file) as vocab_f:
+            vocab = json.load(vocab_f)
+        return cls(vocab["terms"], vocab["doc_freqs"])
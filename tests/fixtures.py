@@ -0,0 +1,7 @@
+# reference and translated documents shared by the tests of the evaluation pipeline
+REF_DOCS = [("d1", ["the cat sat", "on the mat"]), ("d2", ["a dog barked"]),
+            ("d3", ["the cat and the dog"]), ("d4", ["nothing in common"]),
+            ("d5", ["cat cat cat"]), ("d6", ["a mat for the dog"])]
+MT_DOCS = [("d1", ["a cat sat", "on a mat"]), ("d2", ["the dog barked"]),
+           ("d3", ["cat and dog"]), ("d4", ["nothing in common"]),
+           ("d5", ["cat"]), ("d6", ["the dog mat"])]
@@ -0,0 +1,56 @@
+import unittest
+from unittest import mock
+from context import modules
+from fixtures import MT_DOCS, REF_DOCS
+from modules import LocalSearch, NativeTrecEval, TrecEval, evaluate
+
+
+class TestEvaluate(unittest.TestCase):
+    def setUp(self):
+        self.ref_docs = REF_DOCS
+        self.mt_docs = MT_DOCS
+        self.queries = [("%s_%i" % (doc_id, i), sent) for doc_id, sents in self.ref_docs
+                        for i, sent in enumerate(sents)]
+        self.settings = {"n_ret": 4, "relv_mode": "percentile"}
+
+    def get_expected(self, mt_docs, **kwargs):
+        """metrics of the file-based pipeline of evaluate.py"""
+        search = LocalSearch(self.ref_docs, mt_docs, self.queries,
+                             **dict(self.settings, **kwargs))
+        trec_eval = TrecEval(*search.get_qrel_and_res_files(), metrics=kwargs.get("metrics"))
+        return search, trec_eval.get_metrics()
+
+    def test_evaluate(self):
+        """metrics are the same as evaluate.py's, without temporary files"""
+        for kwargs in [{}, {"query_mode": "unique_terms"}, {"relv_mode": "query_in_document"},
+                       {"metrics": ["map", "P_5"]}]:
+            _, expected = self.get_expected(self.mt_docs, **kwargs)
+            with mock.patch("tempfile.NamedTemporaryFile", side_effect=AssertionError):
+                metrics = evaluate(iter(self.ref_docs), iter(self.mt_docs),
+                                   **dict(self.settings, **kwargs))
+            self.assertEqual(metrics, expected)
+
+        # a text which is a single string is a document of one sentence
+        mt_texts = [(doc_id, " ".join(sents)) for doc_id, sents in self.mt_docs]
+        _, expected = self.get_expected([(doc_id, [text]) for doc_id, text in mt_texts])
+        self.assertEqual(evaluate(self.ref_docs, mt_texts, **self.settings), expected)
+
+    def test_per_query_and_systems(self):
+        """per-query metrics and several systems"""
+        search, expected = self.get_expected({"a": self.mt_docs, "b": self.ref_docs})
+        metrics, per_query = evaluate(self.ref_docs, {"a": self.mt_docs, "b": self.ref_docs},
+                                      queries=self.queries, per_query=True, **self.settings)
+        self.assertEqual(list(metrics), ["a", "b"])
+        for system, res_file in search.get_res_files().items():
+            self.assertEqual(metrics[system], TrecEval(search.get_qrel_and_res_files()[0],
+                                                       res_file).get_metrics())
+            native = NativeTrecEval.from_files(search.get_qrel_and_res_files()[0], res_file)
+            self.assertEqual(per_query[system], {
+                query_id: TrecEval.round_metrics(values)
+                for query_id, values in native.get_per_query_metrics().items()})
+        self.assertEqual(len(per_query["a"]), len(self.queries))
+
+        with self.assertRaises(ValueError):
+            evaluate(self.ref_docs, self.mt_docs, backend="unknown")
+        with self.assertRaises(ValueError):
+            evaluate(self.ref_docs, self.mt_docs, metrics=["unknown"])
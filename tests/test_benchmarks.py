@@ -0,0 +1,44 @@
+import tempfile
+import unittest
+from context import modules
+from modules import DocParser
+from benchmarks.corpus import SyntheticCorpus
+from benchmarks.run_benchmarks import STAGES, run_benchmarks
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_corpus(self):
+        """corpora are deterministic and parse the same in sgm and txt format"""
+        corpus = SyntheticCorpus(12, sents_per_doc=3, vocab_size=200, sent_length=5)
+        self.assertEqual(list(corpus.iter_docs()), list(SyntheticCorpus(
+            12, sents_per_doc=3, vocab_size=200, sent_length=5).iter_docs()))
+        self.assertNotEqual(list(corpus.iter_docs()), list(SyntheticCorpus(
+            12, sents_per_doc=3, vocab_size=200, sent_length=5, seed=1).iter_docs()))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = corpus.write(tmp_dir)
+            for name in ["ref", "mt"]:
+                sgm_docs = list(DocParser(paths[name + "_sgm"]).get_docs())
+                txt_docs = list(DocParser(paths[name + "_txt"], paths["doc_mapping"]).get_docs())
+                self.assertEqual(sgm_docs, txt_docs)
+                self.assertEqual([doc_id for doc_id, _ in sgm_docs], corpus.doc_ids)
+
+        with self.assertRaises(ValueError):
+            SyntheticCorpus(0)
+        with self.assertRaises(ValueError):
+            SyntheticCorpus(10, mt_noise=1.5)
+
+    def test_run_benchmarks(self):
+        """every stage is timed with the local backend"""
+        results = run_benchmarks(
+            [8, 12], corpus_kwargs={"sents_per_doc": 2, "vocab_size": 100, "sent_length": 4},
+            backend="local", n_ret=10, max_queries=8, max_judgments=40)
+        self.assertEqual([run["n_docs"] for run in results["runs"]], [8, 12])
+        for run in results["runs"]:
+            self.assertEqual(tuple(run["stages"]), STAGES)
+            for stage in run["stages"].values():
+                self.assertGreaterEqual(stage["seconds"], 0.0)
+                self.assertGreater(stage["peak_rss_mb"], 0.0)
+                self.assertIsNone(stage["peak_memory_mb"])
+            self.assertGreater(run["metrics"]["map"], 0.0)
+        self.assertEqual([run["n_queries"] for run in results["runs"]], [5, 3])
@@ -0,0 +1,182 @@
+import os
+import math
+import unittest
+from unittest import mock
+from context import modules
+from modules import bm25
+
+
+class TestBM25Index(unittest.TestCase):
+    @classmethod
+    def setUp(self):
+        self.docs = [("1", ["the cat sat"]),
+                     ("2", ["the dog", "sat on the mat"]),
+                     ("3", ["a bird"])]
+        self.index = modules.BM25Index()
+        self.index.index(self.docs)
+
+    def test_quantize_length(self):
+        """document lengths are quantized like Lucene norms"""
+        for length in range(24):
+            self.assertEqual(bm25.quantize_length(length), length)
+        self.assertEqual(bm25.quantize_length(24), 24)
+        self.assertEqual(bm25.quantize_length(40), 40)
+        self.assertEqual(bm25.quantize_length(41), 40)
+        self.assertEqual(bm25.quantize_length(1000), 984)
+
+    def test_index(self):
+        """test document lengths, vocabulary and document frequencies"""
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(list(self.index.doc_lens), [3, 6, 2])
+        doc_freqs = self.index.get_doc_freqs()
+        self.assertEqual(doc_freqs["the"], 2)
+        self.assertEqual(doc_freqs["sat"], 2)
+        self.assertEqual(doc_freqs["bird"], 1)
+
+    def test_search(self):
+        """scores follow the BM25 formula and hits are sorted by score then doc id"""
+        results, no_hit_count = self.index.search(
+            [("q1", "cat"), ("q2", "sat"), ("q3", "fish")], n_ret=10)
+        self.assertEqual(no_hit_count, 1)
+
+        avgdl = 11 / 3
+        idf = math.log(1 + (3 - 1 + 0.5) / (1 + 0.5))
+        cat_score = idf * 2.2 / (1 + 1.2 * (0.25 + 0.75 * 3 / avgdl))
+        self.assertEqual(results[0][:2], ("q1", "1"))
+        self.assertAlmostEqual(results[0][2], cat_score)
+
+        sat_hits = [r for r in results if r[0] == "q2"]
+        self.assertEqual([doc_id for _, doc_id, _ in sat_hits], ["1", "2"])
+        self.assertGreater(sat_hits[0][2], sat_hits[1][2])
+
+    def test_search_n_ret(self):
+        """only the top n_ret hits are returned and ties are broken by doc id"""
+        index = modules.BM25Index()
+        index.index([("b", ["x"]), ("a", ["x"]), ("c", ["x"])])
+        results, _ = index.search([("q", "x")], n_ret=2)
+        self.assertEqual([doc_id for _, doc_id, _ in results], ["a", "b"])
+
+    def test_search_terms(self):
+        """postings lookups give the same results as searching every single term"""
+        queries = list(enumerate(self.index.terms + ["unknown"]))
+        for n_ret in [1, 2, 10]:
+            self.assertEqual(self.index.search_terms(queries, n_ret),
+                             self.index.search(queries, n_ret))
+
+    def test_get_terms(self):
+        """terms are returned document by document, sorted within a document"""
+        self.assertEqual(self.index.get_terms(),
+                         ["cat", "sat", "the", "dog", "mat", "on", "a", "bird"])
+
+    def test_update(self):
+        """an updated index scores like an index built from the resulting documents"""
+        self.assertEqual(self.index.update([("2", ["the dog barked"]), ("4", ["a cat"])],
+                                           delete_ids=["3"]), 2)
+        expected = modules.BM25Index()
+        expected.index([("1", ["the cat sat"]), ("2", ["the dog barked"]), ("4", ["a cat"])])
+        self.assertEqual(self.index.doc_ids, ["1", "2", "4"])
+        self.assertEqual(self.index.get_doc_freqs(), expected.get_doc_freqs())
+        queries = [("q1", "cat"), ("q2", "the dog"), ("q3", "bird mat")]
+        self.assertEqual(self.index.search(queries, 10), expected.search(queries, 10))
+
+        self.index.update([], delete_ids=["1", "2", "4"])
+        self.assertEqual(len(self.index), 0)
+        self.assertEqual(self.index.search(queries, 10), ([], 3))
+
+
+class TestLocalSearch(unittest.TestCase):
+
+    def test_init(self):
+        """the local backend writes qrel and res files without ElasticSearch"""
+        docs = [("1", ["sent"]), ("2", ["sent"]), ("3", ["sent 2"])]
+        search = modules.LocalSearch(docs, docs, docs, n_ret=10,
+                                     relv_mode="percentile")
+        qrel_file, res_file = search.get_qrel_and_res_files()
+
+        with open(qrel_file) as f_qrel, open(res_file) as f_res:
+            qrels = [line.split() for line in f_qrel]
+            res = [line.split() for line in f_res]
+        os.remove(qrel_file)
+        os.remove(res_file)
+
+        self.assertEqual(len(qrels), 9)
+        self.assertEqual(len(res), 9)
+        # every doc contains "sent", doc 3 scores highest for query 3
+        self.assertEqual([r[2] for r in res if r[0] == "3"][0], "3")
+
+    def test_concurrent_pipeline(self):
+        """the concurrent pipeline writes the same files as the sequential one"""
+        docs = [("1", ["a b c"]), ("2", ["b c d"]), ("3", ["c d e"]), ("4", ["e f"])]
+        outputs = []
+        for concurrency in [1, 3]:
+            search = modules.LocalSearch(docs, docs, docs, n_ret=10, relv_mode="percentile",
+                                         concurrency=concurrency, search_batch_size=1)
+            files = search.get_qrel_and_res_files()
+            contents = []
+            for file_path in files:
+                with open(file_path) as f:
+                    contents.append(f.read())
+                os.remove(file_path)
+            outputs.append(contents)
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_persistent_indices(self):
+        """documents are indexed once per fingerprint and stale indices are deleted"""
+        docs = [("1", ["a b c"]), ("2", ["b c d"]), ("3", ["c d e"]), ("4", ["e f"])]
+        outputs = []
+        for kwargs in [{}, {"persistent_indices": True},
+                       {"persistent_indices": True, "concurrency": 3}]:
+            with mock.patch.object(modules.LocalSearch, "bulk_index", autospec=True,
+                                   side_effect=modules.LocalSearch.bulk_index) as bulk_index:
+                search = modules.LocalSearch(docs, docs, docs, n_ret=10,
+                                             relv_mode="percentile", **kwargs)
+            # the reference and the translation have the same documents
+            self.assertEqual(bulk_index.call_count, 1 if kwargs else 2)
+            files = search.get_qrel_and_res_files()
+            contents = []
+            for file_path in files:
+                with open(file_path) as f:
+                    contents.append(f.read())
+                os.remove(file_path)
+            outputs.append(contents)
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0], outputs[2])
+
+        indices = search.list_persistent_indices()
+        self.assertEqual(len(indices), 1)
+        index, meta = next(iter(indices.items()))
+        self.assertTrue(index.startswith(modules.LocalSearch.INDEX + "_"))
+        self.assertTrue(meta["complete"])
+        self.assertEqual(meta["n_docs"], len(docs))
+
+        self.assertEqual(search.gc_indices(max_age_days=1), [])
+        search.index_meta[index]["last_used"] -= 2 * 86400
+        self.assertEqual(search.gc_indices(max_age_days=1, dry_run=True), [index])
+        self.assertEqual(search.gc_indices(max_age_days=1), [index])
+        self.assertEqual(search.list_persistent_indices(), {})
+
+    def test_incremental(self):
+        """only changed documents are re-indexed, results equal a fresh index"""
+        docs = [("1", ["a b c"]), ("2", ["b c d"]), ("3", ["c d e"]), ("4", ["e f"])]
+        edited = [("1", ["a b c"]), ("2", ["b b x"]), ("4", ["e f"]), ("5", ["f a"])]
+        queries = [("q1", "a b"), ("q2", "c x"), ("q3", "f")]
+        search = modules.LocalSearch.from_connection(n_ret=10, incremental=True)
+        self.assertEqual(search.index_and_search(queries, docs, "clireval_mt"),
+                         modules.LocalSearch.from_connection(n_ret=10).index_and_search(
+                             queries, docs))
+        with mock.patch.object(modules.LocalSearch, "update_docs", autospec=True,
+                               side_effect=modules.LocalSearch.update_docs) as update_docs:
+            results = search.index_and_search(queries, edited, "clireval_mt")
+        update_docs.assert_called_once_with(
+            search, [("2", ["b b x"]), ("5", ["f a"])], ["3"], "clireval_mt")
+        self.assertEqual(results, modules.LocalSearch.from_connection(n_ret=10).index_and_search(
+            queries, edited))
+
+        # another analyzer (here: BM25 parameters) rebuilds the index
+        search.bm25_params["k1"] = 1.5
+        with mock.patch.object(modules.LocalSearch, "update_docs") as update_docs:
+            search.index(edited, "clireval_mt")
+        update_docs.assert_not_called()
+
+        with self.assertRaises(ValueError):
+            modules.LocalSearch.from_connection(persistent_indices=True, incremental=True)
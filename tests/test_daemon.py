@@ -0,0 +1,117 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from http.client import HTTPConnection
+from unittest import mock
+from context import modules
+from fixtures import MT_DOCS, REF_DOCS
+from modules import EvaluationDaemon, LocalSearch, QueueFullError, TrecEval
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """HTTP connection over a Unix socket"""
+
+    def __init__(self, socket_path):
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+class TestEvaluationDaemon(unittest.TestCase):
+    def setUp(self):
+        self.ref_docs = REF_DOCS
+        self.mt_docs = MT_DOCS
+        self.queries = [("q%i" % i, sent) for i, sent in enumerate(
+            sent for _, sents in self.ref_docs for sent in sents)]
+        self.settings = {"backend": "local", "n_ret": 4, "relv_mode": "percentile"}
+
+    def get_daemon(self, **kwargs):
+        return EvaluationDaemon(LocalSearch.from_connection(**self.settings),
+                                self.ref_docs, self.queries, **dict(self.settings, **kwargs))
+
+    def test_evaluate(self):
+        """the daemon computes the same metrics as evaluate.py"""
+        search = LocalSearch(self.ref_docs, self.mt_docs, self.queries, **self.settings)
+        expected = TrecEval(*search.get_qrel_and_res_files()).get_metrics()
+
+        daemon = self.get_daemon()
+        self.assertEqual(daemon.evaluate(self.mt_docs), expected)
+        # the reference state is reused by every evaluation
+        self.assertEqual(daemon.evaluate(self.mt_docs), expected)
+        self.assertEqual(daemon.evaluate(self.mt_docs, ["map"]), {"map": expected["map"]})
+        self.assertEqual(daemon.get_status()["evaluated"], 3)
+
+        sents = [sent for _, sents in self.mt_docs for sent in sents]
+        self.assertEqual(daemon.get_mt_docs({"sentences": sents}), self.mt_docs)
+        self.assertEqual(daemon.get_mt_docs({"docs": dict(self.mt_docs)}), self.mt_docs)
+        with self.assertRaises(ValueError):
+            daemon.get_mt_docs({"sentences": sents[1:]})
+        with self.assertRaises(ValueError):
+            daemon.evaluate(self.mt_docs, ["no_such_metric"])
+        daemon.close()
+
+        with self.assertRaises(ValueError):
+            self.get_daemon(max_workers=0)
+        with self.assertRaises(ValueError):
+            self.get_daemon(relv_mode="query_in_document", query_mode="unique_terms")
+
+    def test_queue(self):
+        """submissions beyond the workers and the queue are rejected"""
+        daemon = self.get_daemon(max_workers=1, queue_size=1)
+        release = threading.Event()
+        search_documents = daemon.search.search_documents
+
+        def blocking_search(*args):
+            release.wait()
+            return search_documents(*args)
+
+        with mock.patch.object(daemon.search, "search_documents", side_effect=blocking_search):
+            running = daemon.submit(self.mt_docs)
+            queued = daemon.submit(self.mt_docs)
+            with self.assertRaises(QueueFullError):
+                daemon.submit(self.mt_docs)
+            release.set()
+            self.assertEqual(running.result(), queued.result())
+        # slots are free again
+        self.assertEqual(daemon.evaluate(self.mt_docs), running.result())
+        daemon.close()
+
+    def test_serve(self):
+        """translations are evaluated over HTTP and over a Unix socket"""
+        daemon = self.get_daemon()
+        expected = daemon.evaluate(self.mt_docs, ["map", "P_5"])
+
+        def post(connection, path, payload):
+            connection.request("POST", path, json.dumps(payload))
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, "daemon.sock")
+            for server, connection in [
+                    (lambda: daemon.serve(0), lambda server: HTTPConnection(
+                        "localhost", server.server_address[1])),
+                    (lambda: daemon.serve(socket_path=socket_path),
+                     lambda server: UnixHTTPConnection(socket_path))]:
+                server = server().start()
+                connection = connection(server)
+                status, response = post(connection, "/evaluate",
+                                        {"docs": self.mt_docs, "metrics": ["map", "P_5"]})
+                self.assertEqual(status, 200)
+                self.assertEqual(response["metrics"], expected)
+                self.assertEqual(response["n_docs"], 6)
+                self.assertEqual(post(connection, "/evaluate", {"sentences": ["x"]})[0], 400)
+                self.assertEqual(post(connection, "/evaluate", {})[0], 400)
+                self.assertEqual(post(connection, "/unknown", {})[0], 404)
+                connection.request("GET", "/status")
+                self.assertEqual(json.loads(connection.getresponse().read())["ref_docs"], 6)
+                connection.close()
+                server.stop()
+            self.assertFalse(os.path.exists(socket_path))
+        daemon.close()
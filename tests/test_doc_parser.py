@@ -1,5 +1,7 @@
 import os
+import tempfile
 import unittest
+from unittest import mock
 from collections import defaultdict
 from context import modules
 
@@ -73,6 +75,19 @@ class TestDocParser(unittest.TestCase):
         for doc_id, doc in docs:
             self.assertEqual("\n".join(self.docs[doc_id]), "\n".join(doc))
 
+    def test_iter_sgml(self):
+        """documents are read in chunks and returned when they are closed"""
+        with mock.patch.object(modules.SgmlReader, 'chunk_size', 64):
+            docs = list(modules.SgmlReader.iter_docs(self.sgm_doc_path))
+        self.assertEqual(docs, modules.DocParser.parse_sgml(self.sgm_doc_path)[0])
+
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.sgm', delete=False) as sgm_f:
+            sgm_f.write('<DOC docid="a"><SEG id="2">x &amp; y</SEG>\n<seg id="1">a <b>b</b></seg></DOC>'
+                        '<doc docid="empty"></doc><doc docid="b"><seg id="10">t</seg><seg id="9">u')
+        docs = list(modules.SgmlReader.iter_docs(sgm_f.name))
+        os.remove(sgm_f.name)
+        self.assertEqual(docs, [("a", ["a b", "x & y"]), ("b", ["u", "t"])])
+
     def test_parse_txt(self):
         """Test txt parser"""
         docs, total_sents = modules.DocParser.parse_txt(self.txt_doc_path, self.txt_doc_mapping_path)
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+from context import modules
+from modules.doc_store import FlatSentenceView, QueryView
+
+
+class TestDocStore(unittest.TestCase):
+    @classmethod
+    def setUp(self):
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as txt_f:
+            txt_f.write(" b1 \nä2\n\na3\r\nb2")
+            self.txt_file = txt_f.name
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.tsv', delete=False) as tsv_f:
+            tsv_f.write("b\t1\na\t2\na\t1\na\t3\nb\t2\n")
+            self.doc_mapping_file = tsv_f.name
+
+    def tearDown(self):
+        os.remove(self.txt_file)
+        os.remove(self.doc_mapping_file)
+
+    def test_doc_mapping(self):
+        """documents are numbered in order of first appearance"""
+        doc_mapping = modules.DocMapping.from_file(self.doc_mapping_file)
+        self.assertEqual(doc_mapping.doc_ids, ["b", "a"])
+        self.assertEqual(doc_mapping.doc_index.tolist(), [0, 1, 1, 1, 0])
+        self.assertEqual(doc_mapping.seg_ids.tolist(), [1, 2, 1, 3, 2])
+
+        doc_mapping = modules.DocMapping.from_doc_length(5, 2)
+        self.assertEqual(doc_mapping.doc_ids, ["S1", "S2", "S3"])
+        self.assertEqual(doc_mapping.doc_index.tolist(), [0, 0, 1, 1, 2])
+        self.assertEqual(doc_mapping.seg_ids.tolist(), [1, 2, 1, 2, 1])
+
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.tsv') as tsv_f:
+            tsv_f.write("a\tx\n")
+            tsv_f.flush()
+            with self.assertRaises(Exception):
+                modules.DocMapping.from_file(tsv_f.name)
+
+    def test_get_docs(self):
+        """sentences are stripped and sorted by segment id"""
+        store = modules.DocStore(self.txt_file, modules.DocMapping.from_file(self.doc_mapping_file))
+        self.assertEqual(store.total_sents, 5)
+
+        docs = store.get_docs()
+        self.assertEqual(len(docs), 2)
+        self.assertEqual([(doc_id, list(doc_text)) for doc_id, doc_text in docs],
+                         [("b", ["b1", "b2"]), ("a", ["", "ä2", "a3"])])
+        self.assertEqual(docs[-1][0], "a")
+        self.assertEqual(docs[1][1][1:], ["ä2", "a3"])
+        with self.assertRaises(IndexError):
+            docs[2]
+
+        with self.assertRaises(ValueError):
+            modules.DocStore(self.txt_file, modules.DocMapping.from_doc_length(4, 1))
+
+    def test_views(self):
+        """sentence and query views of parsed documents"""
+        docs = modules.DocStore(self.txt_file, doc_length=2).get_docs()
+        sentences = FlatSentenceView(docs)
+        self.assertEqual(list(sentences), ["b1", "ä2", "", "a3", "b2"])
+        self.assertEqual(sentences[-1], "b2")
+
+        queries = QueryView(docs)
+        self.assertEqual(len(queries), 5)
+        self.assertEqual(list(queries), [("S1_0", "b1"), ("S1_1", "ä2"), ("S2_0", ""),
+                                         ("S2_1", "a3"), ("S3_0", "b2")])
+        self.assertEqual(queries[2:4], [("S2_0", ""), ("S2_1", "a3")])
@@ -0,0 +1,140 @@
+import time
+import unittest
+from elasticsearch import Elasticsearch, TransportError, helpers
+from context import modules
+from fixtures import REF_DOCS
+from modules import ElasticsearchStandIn, LocalSearch, Search
+
+
+class TestElasticsearchStandIn(unittest.TestCase):
+    def setUp(self):
+        """start a stand-in server on a free port"""
+        self.server = ElasticsearchStandIn(0).start()
+        self.es = Elasticsearch(port=self.server.port)
+        self.docs = REF_DOCS
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_search_backend(self):
+        """Search against the stand-in writes the same files as LocalSearch"""
+        def read_files(search):
+            qrel_file, res_file = search.get_qrel_and_res_files()
+            with open(qrel_file) as qrel_f, open(res_file) as res_f:
+                return qrel_f.read(), res_f.read()
+
+        for kwargs in [{"query_mode": "sentences"},
+                       {"query_mode": "unique_terms", "concurrency": 2},
+                       {"query_mode": "sentences", "concurrency": 2, "search_batch_size": 2},
+                       {"query_mode": "sentences", "persistent_indices": True},
+                       {"query_mode": "sentences", "persistent_indices": True}]:
+            kwargs.update(n_ret=4, relv_mode="percentile")
+            expected = read_files(LocalSearch(self.docs, self.docs, self.docs, **kwargs))
+            self.assertEqual(read_files(Search(self.docs, self.docs, self.docs,
+                                               port=self.server.port, **kwargs)), expected)
+        # the reference and translated documents share one persistent index, reused by the
+        # second run
+        self.assertEqual(len(list(Search.from_connection(
+            port=self.server.port).gc_indices(0, dry_run=True))), 1)
+
+    def test_incremental(self):
+        """only changed and deleted documents are sent, results equal LocalSearch"""
+        queries = [("q1", "cat dog"), ("q2", "mat"), ("q3", "bird")]
+        edited = [doc for doc in self.docs if doc[0] != "d4"]
+        edited[0] = ("d1", ["a bird on the mat"])
+        search = Search.from_connection(port=self.server.port, n_ret=4, incremental=True)
+        for docs, n_sent in [(self.docs, 6), (edited, 2), (edited, 0)]:
+            self.server.request_counts.clear()
+            results = search.index_and_search(queries, docs, "clireval_mt")
+            expected = LocalSearch.from_connection(n_ret=4).index_and_search(queries, docs)
+            self.assertEqual([hit[:2] for hit in results], [hit[:2] for hit in expected])
+            for (_, _, score), (_, _, expected_score) in zip(results, expected):
+                self.assertAlmostEqual(score, expected_score, places=5)
+            self.assertEqual(self.server.request_counts.get("_bulk", 0), min(n_sent, 1))
+        self.assertEqual(search.get_doc_hashes("clireval_mt"),
+                         {doc_id: Search.get_doc_hash(text) for doc_id, text in edited})
+        # content hashes are stored, not searched
+        self.assertEqual(self.es.search(index="clireval_mt", body={
+            "query": {"simple_query_string": {"query": Search.get_doc_hash(edited[0][1])}}}
+        )["hits"]["total"], 0)
+
+    def test_api(self):
+        """indices, bulk, search, msearch, term vectors and count"""
+        self.es.indices.create(index="test", body={"mappings": {"doc": {"_meta": {"n": 1}}}})
+        self.assertTrue(self.es.indices.exists(index="test"))
+        with self.assertRaises(TransportError):
+            self.es.indices.create(index="test")
+        body = []
+        for doc_id, sents in self.docs:
+            body.append({"index": {"_index": "test", "_type": "doc", "_id": doc_id}})
+            body.append({"doc_text": "\n".join(sents)})
+        self.assertFalse(self.es.bulk(body=body)["errors"])
+        self.es.indices.refresh(index="test")
+        self.assertEqual(self.es.count(index="test")["count"], 6)
+        # mappings are typed like ElasticSearch 6.5
+        self.assertEqual(self.es.indices.get_mapping(index="tes*")["test"]["mappings"],
+                         {"doc": {"_meta": {"n": 1}}})
+        self.es.indices.put_mapping(index="test", doc_type="doc", body={"_meta": {"n": 2}})
+        self.assertEqual(self.es.indices.get_mapping(index="test")["test"]["mappings"],
+                         {"doc": {"_meta": {"n": 2}}})
+        with self.assertRaises(TransportError):
+            self.es.indices.put_mapping(index="test", body={"_meta": {"n": 3}})
+        with self.assertRaises(TransportError):
+            self.es.indices.put_mapping(index="test", doc_type="other", body={"_meta": {}})
+        with self.assertRaises(TransportError):
+            self.es.indices.create(index="typeless", body={"mappings": {"_meta": {"n": 1}}})
+
+        query = {"simple_query_string": {"query": "cat dog", "fields": ["doc_text"]}}
+        response = self.es.search(index="test", body={"query": query, "size": 2})
+        self.assertEqual(response["hits"]["total"], 5)
+        self.assertEqual([hit["_id"] for hit in response["hits"]["hits"]], ["d3", "d5"])
+        self.assertEqual(response["hits"]["hits"][0]["_source"],
+                         {"doc_text": "the cat and the dog"})
+
+        responses = self.es.msearch(body=[{}, {"query": query, "size": 10}, {"index": "missing"},
+                                          {"query": query}], index="test")["responses"]
+        self.assertEqual(len(responses[0]["hits"]["hits"]), 5)
+        self.assertEqual(responses[1]["status"], 404)
+
+        term_vectors = self.es.mtermvectors(index="test", doc_type="doc", ids=["d1", "d9"])
+        self.assertEqual(list(term_vectors["docs"][0]["term_vectors"]["doc_text"]["terms"]),
+                         ["cat", "mat", "on", "sat", "the"])
+        self.assertEqual(term_vectors["docs"][0]["term_vectors"]["doc_text"]["terms"]["the"],
+                         {"term_freq": 2})
+        self.assertFalse(term_vectors["docs"][1]["found"])
+
+        # replaced and deleted documents are searched after the next refresh
+        self.es.bulk(body=[{"index": {"_index": "test", "_id": "d1"}}, {"doc_text": "bird"},
+                      {"delete": {"_index": "test", "_id": "d5"}}])
+        hits = self.es.search(index="test", body={"query": query, "size": 10})["hits"]["hits"]
+        self.assertEqual(sorted(hit["_id"] for hit in hits), ["d2", "d3", "d6"])
+
+        # scrolled searches return every document, page by page
+        scrolled = list(helpers.scan(self.es, index="test", query={"_source": False}, size=2))
+        self.assertEqual([hit["_id"] for hit in scrolled], ["d1", "d2", "d3", "d4", "d6"])
+        self.assertNotIn("_source", scrolled[0])
+        self.assertEqual(self.server.scrolls, {})
+
+        self.es.indices.delete(index="test")
+        self.assertFalse(self.es.indices.exists(index="test"))
+
+    def test_latency_and_failures(self):
+        """latency is injected into every request, failed requests are retried"""
+        self.es.indices.create(index="test")
+        self.server.latency_ms = 50.0
+        start = time.time()
+        self.es.search(index="test", body={"query": {"match_all": {}}})
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+        self.server.latency_ms = 0.0
+        self.server.error_rate = 1.0
+        self.server.request_counts.clear()
+        with self.assertRaises(TransportError):
+            self.es.search(index="test", body={"query": {"match_all": {}}})
+        # the request and 3 retries of the client
+        self.assertEqual(self.server.request_counts, {"_search": 4})
+
+        with self.assertRaises(ValueError):
+            ElasticsearchStandIn(0, error_rate=2.0)
+        with self.assertRaises(ValueError):
+            ElasticsearchStandIn(0, latency_ms=-1.0)
@@ -0,0 +1,101 @@
+import random
+import unittest
+import jenkspy
+import numpy as np
+from context import modules
+from modules.jenks import JenksBreaks
+
+
+class TestJenks(unittest.TestCase):
+    @classmethod
+    def setUp(self):
+        rng = random.Random(0)
+        # normalized score vectors with many zeros and tied scores
+        self.score_vectors = []
+        for _ in range(300):
+            positives = [rng.choice([rng.random(), rng.choice([0.25, 0.5, 1.0]),
+                                     round(rng.random(), 1) or 1.0])
+                         for _ in range(rng.randint(0, 40))]
+            max_score = max(positives, default=1.0)
+            scores = [0.0] * rng.randint(0, 80) + [score / max_score for score in positives]
+            rng.shuffle(scores)
+            self.score_vectors.append((scores, rng.randint(2, 7)))
+
+    def test_exact_breaks(self):
+        """breaks are identical to jenkspy, with and without skipping the zeros"""
+        for scores, nb_class in self.score_vectors:
+            if nb_class >= len(scores):
+                continue
+            expected = jenkspy.jenks_breaks(scores, nb_class)
+            jenks = JenksBreaks(nb_class)
+            self.assertEqual(jenks.get_breaks(scores), expected)
+
+            # always skip the zeros, with blocks of a few rows
+            jenks = JenksBreaks(nb_class)
+            jenks.min_speedup, jenks.min_cost, jenks.block_size = 0, 0, 7
+            self.assertEqual(jenks.get_breaks(scores), expected)
+            positives = [score for score in scores if score]
+            self.assertEqual(jenks.get_sparse_breaks(np.array(positives[::-1]), len(scores)),
+                             expected)
+
+        with self.assertRaises(ValueError):
+            JenksBreaks(5).get_breaks([0.0, 0.5, 1.0])
+
+    def test_cache(self):
+        """score vectors with the same profile are computed once"""
+        jenks = JenksBreaks(3)
+        breaks = jenks.get_breaks([0.0, 1.0, 0.0, 0.5, 0.0])
+        self.assertEqual(jenks.get_sparse_breaks(np.array([0.5, 0.0, 1.0]), 5), breaks)
+        self.assertEqual(len(jenks.cache), 1)
+        jenks.get_sparse_breaks(np.array([0.5, 1.0]), 6)
+        self.assertEqual(len(jenks.cache), 2)
+
+    def test_approximate_breaks(self):
+        """approximate breaks of many scores are close to the exact breaks"""
+        rng = np.random.RandomState(0)
+        scores = np.concatenate([np.zeros(5000), rng.beta(2, 5, 1000)])
+        exact = JenksBreaks(5).get_breaks(scores)
+
+        jenks = JenksBreaks(5, approx_bins=200)
+        approx = jenks.get_breaks(scores)
+        self.assertEqual(len(approx), 6)
+        self.assertEqual(approx[0], 0.0)
+        self.assertEqual(approx[-1], scores.max())
+        np.testing.assert_allclose(approx, exact, atol=0.05)
+        self.assertEqual(len(jenks.gvfs), 1)
+        positives = np.sort(scores[scores > 0.0])
+        exact_gvf = JenksBreaks.goodness_of_variance_fit(positives, 5000, exact)
+        self.assertLessEqual(jenks.gvfs[0], exact_gvf + 1e-12)
+        self.assertLess(exact_gvf - jenks.gvfs[0], 0.001)
+
+        # vectors with few positive scores are exact
+        self.assertEqual(jenks.get_breaks(scores[:5100]), JenksBreaks(5).get_breaks(scores[:5100]))
+        self.assertEqual(len(jenks.gvfs), 1)
+
+    def test_approximate_breaks_outlier(self):
+        """approximate breaks are real scores and keep an outlier in its own class"""
+        rng = np.random.RandomState(1)
+        scores = np.concatenate([np.zeros(23), rng.gamma(2.0, 1.0, 99), [30.0]])
+        exact = JenksBreaks(5).get_breaks(scores)
+        for approx_bins, equal in [(99, True), (20, False)]:
+            approx = JenksBreaks(5, approx_bins=approx_bins).get_breaks(scores)
+            self.assertTrue(set(approx) <= set(scores))
+            self.assertEqual(approx[-2:], exact[-2:])
+            if equal:
+                self.assertEqual(approx, exact)
+
+        # fewer distinct scores than classes: the lowest classes are empty
+        jenks = JenksBreaks(5, approx_bins=6)
+        self.assertEqual(jenks.get_breaks(np.repeat([0.0, 0.5, 1.0], 10)),
+                         [0.0, 0.0, 0.0, 0.0, 0.5, 1.0])
+
+    def test_goodness_of_variance_fit(self):
+        """GVF of weighted zeros equals the GVF of the expanded scores"""
+        positives = np.array([0.2, 0.3, 0.9, 1.0])
+        gvf = JenksBreaks.goodness_of_variance_fit(positives, 3, [0.0, 0.3, 1.0])
+        scores = np.array([0.0, 0.0, 0.0, 0.2, 0.3, 0.9, 1.0])
+        classes = [scores[:5], scores[5:]]
+        expected = 1.0 - (sum(((c - c.mean()) ** 2).sum() for c in classes)
+                          / ((scores - scores.mean()) ** 2).sum())
+        self.assertAlmostEqual(gvf, expected)
+        self.assertEqual(JenksBreaks.goodness_of_variance_fit(np.array([]), 4, [0.0, 0.0]), 1.0)
@@ -0,0 +1,115 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from elasticsearch.connection import Urllib3HttpConnection
+from context import modules
+from modules import Profiler, LocalSearch
+from modules.search import ProfiledConnection
+
+
+class TestProfiler(unittest.TestCase):
+    def test_spans(self):
+        """spans are aggregated by name, nested and used as decorators"""
+        @Profiler.span("decorated")
+        def decorated(value):
+            return value * 2
+
+        records = []
+        profiler = Profiler(trace_memory=True, cprofile_stages=["inner"])
+        profiler.add_listener(lambda name, record: records.append(name))
+        with profiler:
+            with Profiler.span("outer"):
+                for _ in range(3):
+                    with Profiler.span("inner"):
+                        data = [0] * 100000
+                self.assertEqual(decorated(2), 4)
+        del data
+
+        report = profiler.get_report()
+        self.assertEqual(list(report["stages"]), ["inner", "decorated", "outer"])
+        self.assertEqual(records, ["inner"] * 3 + ["decorated", "outer"])
+        self.assertEqual(report["stages"]["inner"]["calls"], 3)
+        self.assertGreaterEqual(report["stages"]["outer"]["seconds"],
+                                report["stages"]["inner"]["seconds"])
+        # the peak of a nested span is part of the peak of the outer span
+        self.assertGreater(report["stages"]["inner"]["peak_memory_mb"], 0.7)
+        self.assertGreaterEqual(report["stages"]["outer"]["peak_memory_mb"],
+                                report["stages"]["inner"]["peak_memory_mb"])
+        self.assertGreater(report["stages"]["outer"]["peak_rss_mb"], 0.0)
+        self.assertIn("cprofile", report["stages"]["inner"])
+        self.assertNotIn("cprofile", report["stages"]["outer"])
+        self.assertGreater(report["wall_seconds"], 0.0)
+
+        # nothing is recorded when no profiler is active
+        self.assertIsNone(Profiler.active)
+        with Profiler.span("inactive"):
+            Profiler.count("inactive")
+        self.assertEqual(decorated(3), 6)
+        self.assertNotIn("inactive", profiler.get_report()["stages"])
+        self.assertEqual(profiler.get_report()["stages"]["decorated"]["calls"], 1)
+
+        with profiler:
+            with self.assertRaises(RuntimeError):
+                Profiler().start()
+
+    def test_counters_and_histograms(self):
+        """counters add up, histograms have percentiles and power-of-two buckets"""
+        with Profiler() as profiler:
+            Profiler.count("requests")
+            Profiler.count("requests", 2)
+            for value in [0.5, 1.0, 3.0, 3.0, 100.0]:
+                Profiler.observe("latency_ms", value)
+            Profiler.observe("latency_ms", 2.0, count=5)
+        report = profiler.get_report()
+        self.assertEqual(report["counters"], {"requests": 3})
+        histogram = report["histograms"]["latency_ms"]
+        self.assertEqual(histogram["count"], 10)
+        self.assertAlmostEqual(histogram["sum"], 117.5)
+        self.assertEqual(histogram["p50"], 2.0)
+        self.assertEqual(histogram["max"], 100.0)
+        self.assertEqual(histogram["buckets"], {"1": 2, "2": 5, "4": 2, "128": 1})
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            report_file = os.path.join(tmp_dir, "profile.json")
+            profiler.write_report(report_file, {"settings": {"n_ret": 100}})
+            with open(report_file) as report_f:
+                written = json.load(report_f)
+        self.assertEqual(written["counters"], {"requests": 3})
+        self.assertEqual(written["settings"], {"n_ret": 100})
+
+    def test_pipeline(self):
+        """the stages of the pipeline are spans, searches are counted"""
+        docs = [("d1", ["a b c"]), ("d2", ["b c d"]), ("d3", ["x y z"])]
+        queries = [("q1", "a b"), ("q2", "z"), ("q3", "nothing")]
+        with Profiler() as profiler:
+            LocalSearch(docs, docs, queries, n_ret=10, relv_mode="percentile")
+        report = profiler.get_report()
+        for stage in ["bulk_index", "search", "relevance_labels", "create_qrel_file",
+                      "create_res_file"]:
+            self.assertIn(stage, report["stages"])
+        self.assertEqual(report["stages"]["search"]["calls"], 2)
+        self.assertEqual(report["counters"]["indexed_docs"], 6)
+        self.assertEqual(report["counters"]["search_queries"], 6)
+        self.assertEqual(report["counters"]["search_hits"], 6)
+        self.assertEqual(report["histograms"]["search_latency_ms"]["count"], 6)
+
+    def test_es_connection(self):
+        """ElasticSearch requests and bytes are counted by endpoint"""
+        connection = ProfiledConnection()
+        response = (200, {}, '{"responses": []}')
+        with mock.patch.object(Urllib3HttpConnection, 'perform_request',
+                               return_value=response):
+            self.assertEqual(connection.perform_request("POST", "/clireval/_msearch",
+                                                        body=b'{}\n{"size": 10}\n'), response)
+            with Profiler() as profiler:
+                connection.perform_request("POST", "/clireval/_msearch",
+                                           body=b'{}\n{"size": 10}\n')
+                connection.perform_request("POST", "/_bulk", body='{"index": {}}\n')
+                connection.perform_request("HEAD", "/clireval")
+        report = profiler.get_report()
+        self.assertEqual(report["counters"], {
+            "es_requests": 3, "es_requests._msearch": 1, "es_request_bytes": 30,
+            "es_response_bytes": 51, "es_requests._bulk": 1, "es_requests._index": 1})
+        self.assertEqual(report["histograms"]["es_request_latency_ms"]["count"], 3)
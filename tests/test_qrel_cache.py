@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from context import modules
+from modules.qrel_cache import QrelCache
+
+
+class TestQrelCache(unittest.TestCase):
+    @classmethod
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.docs = [("1", ["sent"]), ("2", ["sent 2"])]
+        self.queries = [("1", "sent"), ("2", "sent 2")]
+        self.settings = {"relv_mode": "jenks", "jenks_nb_class": 5}
+
+        with tempfile.NamedTemporaryFile(mode='w', delete=False) as qrel_f:
+            print("1\t0\t1\t1", file=qrel_f)
+            self.qrel_file = qrel_f.name
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        os.remove(self.qrel_file)
+
+    def test_get_key(self):
+        """keys change with documents, queries and settings"""
+        key = QrelCache.get_key(self.docs, self.queries, self.settings)
+        self.assertEqual(key, QrelCache.get_key(self.docs, self.queries, dict(self.settings)))
+        self.assertNotEqual(key, QrelCache.get_key(self.docs[:1], self.queries, self.settings))
+        self.assertNotEqual(key, QrelCache.get_key(self.docs, self.queries[:1], self.settings))
+        self.assertNotEqual(key, QrelCache.get_key(
+            self.docs, self.queries, {"relv_mode": "jenks", "jenks_nb_class": 2}))
+
+    def test_store_and_load(self):
+        """a stored entry is returned on the next lookup"""
+        cache = QrelCache(self.cache_dir)
+        key = QrelCache.get_key(self.docs, self.queries, self.settings)
+
+        with tempfile.TemporaryFile(mode='w+') as qrel_f:
+            self.assertIsNone(cache.load(key, qrel_f))
+
+        cache.store(key, self.qrel_file, self.queries)
+        with tempfile.TemporaryFile(mode='w+') as qrel_f:
+            self.assertEqual(cache.load(key, qrel_f), self.queries)
+            qrel_f.seek(0)
+            self.assertEqual(qrel_f.read(), "1\t0\t1\t1\n")
+
+    def test_evict(self):
+        """least recently used entries are evicted when the cache is full"""
+        cache = QrelCache(self.cache_dir)
+        for i in range(3):
+            cache.store("key%d" % i, self.qrel_file, self.queries)
+            for path in cache.get_paths("key%d" % i):
+                os.utime(path, (i, i))
+
+        # key0 becomes the most recently used entry
+        with tempfile.TemporaryFile(mode='w+') as qrel_f:
+            cache.load("key0", qrel_f)
+
+        entry_size = sum(os.path.getsize(path) for path in cache.get_paths("key0"))
+        cache.max_size = 2 * entry_size
+        cache.evict()
+
+        remaining = sorted(f for f in os.listdir(self.cache_dir) if f.endswith(".qrel"))
+        self.assertEqual(remaining, ["key0.qrel", "key2.qrel"])
+
+
+class TestSearchQrelCache(unittest.TestCase):
+
+    def test_cached_reference(self):
+        """a second run with the same reference only searches the translated documents"""
+        docs = [("1", ["a b"]), ("2", ["b c"]), ("3", ["c d"]), ("4", ["d e"])]
+        cache_dir = tempfile.mkdtemp()
+        kwargs = {"n_ret": 10, "relv_mode": "percentile", "qrel_cache_dir": cache_dir}
+
+        outputs = []
+        with mock.patch.object(modules.LocalSearch, "search",
+                               autospec=True,
+                               side_effect=modules.LocalSearch.search) as search:
+            for _ in range(2):
+                search.reset_mock()
+                files = modules.LocalSearch(docs, docs, docs, **kwargs).get_qrel_and_res_files()
+                contents = []
+                for file_path in files:
+                    with open(file_path) as f:
+                        contents.append(f.read())
+                    os.remove(file_path)
+                outputs.append((contents, search.call_count))
+        shutil.rmtree(cache_dir)
+
+        self.assertEqual(outputs[0][0], outputs[1][0])
+        self.assertEqual(outputs[0][1], 2)
+        self.assertEqual(outputs[1][1], 1)
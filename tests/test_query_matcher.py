@@ -0,0 +1,67 @@
+import random
+import unittest
+from context import modules
+from modules.query_matcher import SubstringIndex
+
+
+class TestSubstringIndex(unittest.TestCase):
+
+    def test_find(self):
+        """the index finds the same patterns as a substring test of every pattern"""
+        rng = random.Random(0)
+        for _ in range(50):
+            patterns = ["".join(rng.choice("abc") for _ in range(rng.randint(1, 4)))
+                        for _ in range(rng.randint(1, 10))]
+            substring_index = SubstringIndex(patterns)
+            for _ in range(10):
+                text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 20)))
+                self.assertEqual(substring_index.find(text),
+                                 {i for i, pattern in enumerate(patterns) if pattern in text})
+
+    def test_find_long_patterns(self):
+        """patterns longer than the window are verified after the window lookup"""
+        text = "the quick brown fox jumps over the lazy dog"
+        patterns = [text, text[4:30], text[4:31] + "x", "the quick brown fox jumps!", "lazy dog"]
+        self.assertEqual(SubstringIndex(patterns).find(text), {0, 1, 4})
+
+    def test_empty_pattern(self):
+        """an empty pattern occurs in every text"""
+        self.assertEqual(SubstringIndex(["", "x"]).find(""), {0})
+
+
+class TestQueryMatcher(unittest.TestCase):
+    @classmethod
+    def setUp(self):
+        self.queries = [("1", "sent"), ("2", "sent 2"), ("3", "sent"), ("4", "other")]
+        self.docs = [("a", ["sent 2", "other"]),
+                     ("b", ["a sent", "sent"]),
+                     ("c", ["no match"]),
+                     ("d", "sent 2")]
+
+    def test_match_modes(self):
+        """sentence, substring and auto semantics"""
+        matcher = modules.QueryMatcher(self.queries, "sentence")
+        self.assertEqual([matcher.match(doc) for _, doc in self.docs],
+                         [[1, 3], [0, 2], [], [1]])
+
+        matcher = modules.QueryMatcher(self.queries, "substring")
+        self.assertEqual([matcher.match(doc) for _, doc in self.docs],
+                         [[0, 1, 2, 3], [0, 2], [], [0, 1, 2]])
+
+        # auto gives the same result as `query in doc`
+        matcher = modules.QueryMatcher(self.queries)
+        self.assertEqual([matcher.match(doc) for _, doc in self.docs],
+                         [[i for i, (_, query) in enumerate(self.queries) if query in doc]
+                          for _, doc in self.docs])
+
+        with self.assertRaises(ValueError):
+            modules.QueryMatcher(self.queries, "regex")
+
+    def test_get_match_matrix(self):
+        """the match matrix is 1.0 where a document matches a query"""
+        matcher = modules.QueryMatcher(self.queries)
+        match_matrix = matcher.get_match_matrix(self.docs)
+        self.assertEqual(match_matrix.shape, (4, 4))
+        self.assertEqual(match_matrix.toarray().tolist(),
+                         [[1.0 if query in doc else 0.0 for _, doc in self.docs]
+                          for _, query in self.queries])
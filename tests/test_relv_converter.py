@@ -125,3 +125,99 @@ class TestRelvConverter(unittest.TestCase):
                     **{"relv_mode": "percentile", "n_percentile": 50})
         test_helper(scores2, [0, 0, 0, 1, 1, 1],
                     **{"relv_mode": "percentile", "n_percentile": 50})
+
+    def test_get_relevance_label_matrix(self):
+        """batch conversion gives the same labels as converting every row separately"""
+        score_matrix = np.array([
+            [0.0, 0.1, 0.3, 0.4, 0.6, 0.5, 0.8, 0.7, 0.9, 1.0],
+            [0.77, 30.788, 71.48, 101.5, 123.77, 144.1, 0.0, 0.0, 0.0, 0.0],
+            [3.0, 0.0, 0.0, 3.0, 1.5, 0.0, 0.0, 0.0, 0.0, 0.0]])
+
+        for kwargs in [{"relv_mode": "jenks", "jenks_nb_class": 2},
+                       {"relv_mode": "jenks", "jenks_nb_class": 5},
+                       {"relv_mode": "percentile", "n_percentile": 25},
+                       {"relv_mode": "percentile", "n_percentile": 100}]:
+            labels = modules.RelvConverter.get_relevance_label_matrix(score_matrix, **kwargs)
+            self.assertEqual(labels.dtype, np.int8)
+            self.assertEqual(
+                labels.tolist(),
+                [modules.RelvConverter(row, **kwargs).get_relevance_labels()
+                 for row in score_matrix])
+
+        with self.assertRaises(TypeError):
+            modules.RelvConverter.get_relevance_label_matrix(np.ones((2, 2), dtype=int))
+        with self.assertRaises(ValueError):
+            modules.RelvConverter.get_relevance_label_matrix(
+                score_matrix, normalized=True, relv_mode="percentile")
+
+    def test_get_sparse_relevance_labels(self):
+        """sparse conversion gives the same labels as the dense batch conversion"""
+        score_matrix = np.array([
+            [0.0, 0.1, 0.3, 0.4, 0.6, 0.5, 0.8, 0.7, 0.9, 1.0],
+            [0.77, 30.788, 71.48, 101.5, 123.77, 144.1, 0.0, 0.0, 0.0, 0.0],
+            [3.0, 0.0, 0.0, 3.0, 1.5, 0.0, 0.0, 0.0, 0.0, 0.0],
+            [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]])
+        sparse_scores = modules.SparseScores.from_dense(score_matrix)
+
+        for kwargs in [{"relv_mode": "jenks", "jenks_nb_class": 2},
+                       {"relv_mode": "jenks", "jenks_nb_class": 3},
+                       {"relv_mode": "percentile", "n_percentile": 25},
+                       {"relv_mode": "percentile", "n_percentile": 90},
+                       {"relv_mode": "percentile", "n_percentile": 100}]:
+            zero_labels, labels = modules.RelvConverter.get_sparse_relevance_labels(
+                sparse_scores, **kwargs)
+            self.assertEqual(zero_labels.dtype, np.int8)
+            self.assertEqual(labels.dtype, np.int8)
+
+            label_matrix = np.repeat(zero_labels[:, None], score_matrix.shape[1], axis=1)
+            label_matrix[sparse_scores.get_row_ids(), sparse_scores.indices] = labels
+            self.assertEqual(
+                label_matrix.tolist(),
+                modules.RelvConverter.get_relevance_label_matrix(score_matrix, **kwargs).tolist())
+
+        # the 10th percentile of a row with 7 zeros is 0.0, so zeros are relevant
+        zero_labels, _ = modules.RelvConverter.get_sparse_relevance_labels(
+            sparse_scores, relv_mode="percentile", n_percentile=90)
+        self.assertEqual(zero_labels.tolist(), [0, 1, 1, 1])
+
+        with self.assertRaises(ValueError):
+            modules.RelvConverter.get_sparse_relevance_labels(
+                sparse_scores, normalized=True, relv_mode="percentile")
+
+    def test_workers(self):
+        """worker processes give the same labels as a single process"""
+        rng = np.random.RandomState(0)
+        score_matrix = rng.random_sample((30, 20)) * (rng.random_sample((30, 20)) < 0.3)
+        sparse_scores = modules.SparseScores.from_dense(score_matrix)
+
+        for kwargs in [{"relv_mode": "jenks", "jenks_nb_class": 3},
+                       {"relv_mode": "percentile", "n_percentile": 25}]:
+            expected = modules.RelvConverter.get_sparse_relevance_labels(sparse_scores, **kwargs)
+            zero_labels, labels = modules.RelvConverter.get_sparse_relevance_labels(
+                sparse_scores, workers=3, **kwargs)
+            np.testing.assert_array_equal(zero_labels, expected[0])
+            np.testing.assert_array_equal(labels, expected[1])
+
+        with self.assertRaises(ValueError):
+            modules.RelvConverter.get_sparse_relevance_labels(sparse_scores, workers=0)
+
+    def test_jenks_approx_bins(self):
+        """approximate jenks breaks only apply to rows with more scores than bins"""
+        rng = np.random.RandomState(0)
+        score_matrix = np.zeros((3, 2000))
+        score_matrix[0, :50] = rng.random_sample(50)
+        score_matrix[1, :1000] = rng.random_sample(1000)
+        sparse_scores = modules.SparseScores.from_dense(score_matrix)
+
+        exact = modules.RelvConverter.get_sparse_relevance_labels(sparse_scores)
+        approx = modules.RelvConverter.get_sparse_relevance_labels(
+            sparse_scores, jenks_approx_bins=100)
+        np.testing.assert_array_equal(approx[0], exact[0])
+        row_ids = sparse_scores.get_row_ids()
+        np.testing.assert_array_equal(approx[1][row_ids == 0], exact[1][row_ids == 0])
+        self.assertGreater(np.mean(approx[1] == exact[1]), 0.9)
+
+        for approx_bins, error in [("10", TypeError), (-1, ValueError), (5, ValueError)]:
+            with self.assertRaises(error):
+                modules.RelvConverter.get_sparse_relevance_labels(
+                    sparse_scores, jenks_approx_bins=approx_bins)
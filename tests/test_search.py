@@ -26,12 +26,13 @@ class TestSearch(unittest.TestCase):
                                          {"_id": "6", "_score": 0.0}
                                          ]}}
 
-        self.term_vectors = {"docs": [{"term_vectors": {"doc_text": {"terms": ["sent"]}}},
-                                      {"term_vectors": {"doc_text": {"terms": ["sent"]}}},
-                                      {"term_vectors": {"doc_text": {"terms": ["sent"]}}},
-                                      {"term_vectors": {"doc_text": {"terms": ["sent", "2"]}}},
-                                      {"term_vectors": {"doc_text": {"terms": ["sent", "2"]}}},
-                                      {"term_vectors": {"doc_text": {"terms": ["sent", "2"]}}}]}
+        self.term_vectors = {"docs": [
+            {"term_vectors": {"doc_text": {"terms": {"sent": {"term_freq": 1}}}}},
+            {"term_vectors": {"doc_text": {"terms": {"sent": {"term_freq": 1}}}}},
+            {"term_vectors": {"doc_text": {"terms": {"sent": {"term_freq": 1}}}}},
+            {"term_vectors": {"doc_text": {"terms": {"2": {"term_freq": 1}, "sent": {"term_freq": 1}}}}},
+            {"term_vectors": {"doc_text": {"terms": {"2": {"term_freq": 1}, "sent": {"term_freq": 1}}}}},
+            {"term_vectors": {"doc_text": {"terms": {"2": {"term_freq": 1}, "sent": {"term_freq": 1}}}}}]}
 
         self.unique_terms = ["sent", "2"]
 
@@ -43,8 +44,12 @@ class TestSearch(unittest.TestCase):
 
         # mock instance methods
         self.elasticsearch.return_value.search.return_value = self.search_results
+        self.elasticsearch.return_value.msearch.side_effect = \
+            lambda body, **kwargs: {"responses": [self.search_results] * (len(body) // 2)}
         self.elasticsearch.return_value.mtermvectors.return_value = self.term_vectors
-        self.helpers.bulk.return_value = (len(self.docs), None)
+        self.helpers.streaming_bulk.side_effect = \
+            lambda es, actions, **kwargs: ((True, {}) for _ in actions)
+        self.helpers.parallel_bulk.side_effect = self.helpers.streaming_bulk.side_effect
 
         self.search_mod = modules.Search(self.docs,
                                          self.docs,
@@ -131,6 +136,27 @@ class TestSearch(unittest.TestCase):
                     unique_terms_percentile_res_file,
                     **{"relv_mode": "percentile", "query_mode": "unique_terms"})
 
+        # concurrent pipeline writes the same files
+        test_helper(self.default_ref_qrel_file,
+                    self.default_ref_res_file,
+                    **{"relv_mode": "jenks", "query_mode": "sentences",
+                       "concurrency": 4, "search_batch_size": 2})
+        test_helper(default_unique_terms_qrel_file,
+                    default_unique_terms_res_file,
+                    **{"relv_mode": "jenks", "query_mode": "unique_terms",
+                       "concurrency": 4})
+        test_helper(query_in_document_qrel_file,
+                    query_in_document_res_file,
+                    **{"relv_mode": "query_in_document",
+                       "query_mode": "sentences",
+                       "concurrency": 2})
+
+        # files written by the background writer are the same
+        test_helper(self.default_ref_qrel_file,
+                    self.default_ref_res_file,
+                    **{"relv_mode": "jenks", "query_mode": "sentences",
+                       "background_writes": True})
+
         # query_mode = unique_terms is not supported when relv_mode =
         # query_in_document
         with self.assertRaises(Exception):
@@ -150,6 +176,26 @@ class TestSearch(unittest.TestCase):
         with open(tmp_f.name) as f1, open(self.default_ref_qrel_file) as f2:
             self.assertEqual(f1.read().strip(), f2.read().strip())
 
+    def test_create_qrel_file_nonzero_only(self):
+        """only documents with a non-zero label are written to the qrel file"""
+        for relv_mode in ["jenks", "query_in_document"]:
+            with tempfile.TemporaryFile(mode='w+') as full_f, \
+                    tempfile.TemporaryFile(mode='w+') as nonzero_f:
+                search_results = self.search_mod.search(self.docs)
+                self.search_mod.create_qrel_file(
+                    self.docs, self.docs, search_results, full_f, relv_mode=relv_mode)
+                self.search_mod.create_qrel_file(
+                    self.docs, self.docs, search_results, nonzero_f, relv_mode=relv_mode,
+                    qrel_nonzero_only=True)
+                full_f.seek(0)
+                nonzero_f.seek(0)
+                full_lines = full_f.read().splitlines()
+                nonzero_lines = nonzero_f.read().splitlines()
+
+            self.assertTrue(nonzero_lines)
+            self.assertEqual(nonzero_lines, [line for line in full_lines
+                                             if not line.endswith("\t0")])
+
     def test_create_res_file(self):
         """test whether a valid trec_eval res file is created"""
 
@@ -160,12 +206,221 @@ class TestSearch(unittest.TestCase):
         with open(tmp_f.name) as f1, open(self.default_ref_res_file) as f2:
             self.assertEqual(f1.read().strip(), f2.read().strip())
 
+    def test_npz_files(self):
+        """npz qrel and res files give the same metrics as the text files"""
+        search = modules.Search(self.docs, self.docs, self.docs, trec_format="npz")
+        qrel_file, res_file = search.get_qrel_and_res_files()
+        self.assertEqual(
+            modules.TrecEval(qrel_file, res_file).get_metrics(),
+            modules.TrecEval(self.default_ref_qrel_file, self.default_ref_res_file).get_metrics())
+
+    def test_bulk_index(self):
+        """documents are sent as index operations and the index is refreshed once"""
+        actions = []
+
+        def streaming_bulk(es, bulk_actions, **kwargs):
+            actions.extend(bulk_actions)
+            return [(True, {})] * len(actions)
+        self.helpers.streaming_bulk.side_effect = streaming_bulk
+
+        self.assertEqual(self.search_mod.bulk_index(self.docs, "test_index"), len(self.docs))
+        kwargs = self.helpers.streaming_bulk.call_args[1]
+        self.assertEqual(actions[3], {"_id": "4", "_index": "test_index", "_type": "doc",
+                                      "_source": {"doc_text": "s\ne\nn\nt\n \n2"}})
+        self.assertEqual(kwargs["max_chunk_bytes"], modules.Search.BULK_CHUNK_BYTES)
+        self.elasticsearch.return_value.indices.refresh.assert_called_with(index="test_index")
+
+        search = modules.Search(self.docs, self.docs, self.docs,
+                                index_threads=4, bulk_chunk_bytes=1024)
+        self.assertEqual(self.helpers.parallel_bulk.call_args[1]["thread_count"], 4)
+        self.assertEqual(self.helpers.parallel_bulk.call_args[1]["max_chunk_bytes"], 1024)
+        self.assertEqual(search.bulk_index(self.docs[:2]), 2)
+
+        with self.assertRaises(ValueError):
+            modules.Search(self.docs, self.docs, self.docs, index_threads=0)
+
+    def test_persistent_index(self):
+        """a complete persistent index is reused, an incomplete one is reloaded"""
+        es = self.elasticsearch.return_value
+        search = modules.Search(self.docs, self.docs, self.docs, persistent_indices=True)
+        fingerprint = search.get_index_fingerprint(self.docs)
+        index = "clireval_" + fingerprint[:search.FINGERPRINT_LENGTH]
+        es.reset_mock()
+
+        meta = {"fingerprint": fingerprint, "n_docs": len(self.docs), "complete": True}
+        es.indices.exists.return_value = True
+        # ElasticSearch 6 nests the mapping under its type
+        es.indices.get_mapping.return_value = {index: {"mappings": {"doc": {"_meta": meta}}}}
+        es.count.return_value = {"count": len(self.docs)}
+        self.assertEqual(search.index(self.docs), index)
+        es.indices.create.assert_not_called()
+        self.assertEqual(es.indices.put_mapping.call_args[1]["doc_type"], "doc")
+        self.assertTrue(es.indices.put_mapping.call_args[1]["body"]["_meta"]["last_used"])
+        self.assertEqual(search.list_persistent_indices(), {index: meta})
+
+        # typeless ElasticSearch 7 mappings
+        es.indices.get_mapping.return_value = {index: {"mappings": {"_meta": meta}}}
+        es.indices.create.reset_mock()
+        self.assertEqual(search.index(self.docs), index)
+        es.indices.create.assert_not_called()
+
+        meta["complete"] = False
+        self.assertEqual(search.index(self.docs), index)
+        es.indices.create.assert_called_once()
+        self.assertEqual(es.indices.put_mapping.call_args[1]["doc_type"], "doc")
+        self.assertTrue(es.indices.put_mapping.call_args[1]["body"]["_meta"]["complete"])
+
+        # the fingerprint depends on the documents and the analyzer
+        self.assertNotEqual(search.get_index_fingerprint(self.docs[1:]), fingerprint)
+        search.analyzer = "german"
+        self.assertNotEqual(search.get_index_fingerprint(self.docs), fingerprint)
+
+    def test_incremental_index(self):
+        """an incremental index with a typed (ElasticSearch 6) mapping is diffed, not reloaded"""
+        es = self.elasticsearch.return_value
+        search = modules.Search.from_connection(incremental=True)
+        es.reset_mock()
+        meta = {"incremental": True, "settings": search.get_index_settings(), "complete": True}
+        es.indices.exists.return_value = True
+        es.indices.get_mapping.return_value = {"clireval_mt": {"mappings": {"doc": {"_meta": meta}}}}
+        old_docs = self.docs[:4] + [("7", "gone")]
+        self.helpers.scan.return_value = [
+            {"_id": doc_id, "_source": {"doc_hash": search.get_doc_hash(
+                "changed" if doc_id == "2" else doc_text)}} for doc_id, doc_text in old_docs]
+        sent = []
+        self.helpers.streaming_bulk.side_effect = \
+            lambda es, actions, **kwargs: ((True, sent.append(action)) for action in actions)
+
+        search.index(self.docs, "clireval_mt")
+        es.indices.create.assert_not_called()
+        self.assertEqual([(action.get("_op_type", "index"), action["_id"]) for action in sent],
+                         [("index", "2"), ("index", "5"), ("index", "6"), ("delete", "7")])
+        self.assertEqual(sent[0]["_source"]["doc_hash"], search.get_doc_hash("sent"))
+        es.indices.forcemerge.assert_called_once()
+
+        # the first run loads the index and stores its marker under the doc type
+        es.indices.get_mapping.return_value = {"clireval_mt": {"mappings": {"doc": {}}}}
+        search.index(self.docs, "clireval_mt")
+        es.indices.create.assert_called_once()
+        self.assertEqual(es.indices.put_mapping.call_args[1]["doc_type"], "doc")
+        self.assertEqual(es.indices.put_mapping.call_args[1]["body"]["_meta"], meta)
+
     def test_get_terms(self):
         """test whether get_terms can retrieve term vectors from elasticsearch"""
         terms = self.search_mod.get_terms(self.docs)
         terms = set([term[-1] for term in terms])
         self.assertEqual(terms, set(self.unique_terms))
 
+    def test_get_terms_chunked(self):
+        """term vectors are requested in chunks and the vocabulary can be cached"""
+        es = self.elasticsearch.return_value
+        term_vectors = dict(zip([doc_id for doc_id, _ in self.docs], self.term_vectors["docs"]))
+        es.mtermvectors.side_effect = \
+            lambda ids, **kwargs: {"docs": [term_vectors[doc_id] for doc_id in ids]}
+        expected = self.search_mod.get_terms(self.docs)
+
+        for concurrency in [1, 2]:
+            es.mtermvectors.reset_mock()
+            self.search_mod.concurrency = concurrency
+            with mock.patch.object(modules.Search, "TERMVECTOR_CHUNK_SIZE", 4):
+                vocabulary = self.search_mod.get_vocabulary(self.docs)
+            self.assertEqual(es.mtermvectors.call_count, 2)
+            self.assertEqual(vocabulary.get_queries(), expected)
+            self.assertEqual(vocabulary.doc_freqs.tolist(), [6, 3])
+
+        with tempfile.TemporaryDirectory() as vocab_cache_dir:
+            self.search_mod.vocab_cache_dir = vocab_cache_dir
+            self.assertEqual(self.search_mod.get_terms(self.docs), expected)
+            es.mtermvectors.reset_mock()
+            self.assertEqual(self.search_mod.get_terms(self.docs), expected)
+            es.mtermvectors.assert_not_called()
+
+    def test_search_terms(self):
+        """single terms scored from term vectors match a local BM25 search"""
+        es = self.elasticsearch.return_value
+        term_vectors = dict(zip([doc_id for doc_id, _ in self.docs], self.term_vectors["docs"]))
+        es.mtermvectors.side_effect = \
+            lambda ids, **kwargs: {"docs": [term_vectors[doc_id] for doc_id in ids]}
+
+        search = modules.Search(self.docs, self.docs, self.docs, n_ret=4,
+                                query_mode="unique_terms", unique_terms_scoring="term_vectors")
+        es.msearch.reset_mock()
+        queries = [(0, "sent"), (1, "2"), (2, "unknown")]
+        bm25_index = modules.BM25Index()
+        bm25_index.index(self.docs)
+        self.assertEqual(search.search_documents(queries, self.docs),
+                         bm25_index.search(queries, 4)[0])
+        es.msearch.assert_not_called()
+
+        with self.assertRaises(ValueError):
+            modules.Search(self.docs, self.docs, self.docs, unique_terms_scoring="guess")
+
+    def test_search_batched(self):
+        """test that _msearch batches return the same results as one request per query"""
+        es = self.elasticsearch.return_value
+
+        self.search_mod.search_batch_size = 1
+        sequential_results = self.search_mod.search(self.docs)
+        self.assertEqual(es.search.call_count, len(self.docs))
+
+        for batch_size, n_requests in [(4, 2), (6, 1)]:
+            es.msearch.reset_mock()
+            self.search_mod.search_batch_size = batch_size
+            self.assertEqual(self.search_mod.search(self.docs), sequential_results)
+            self.assertEqual(es.msearch.call_count, n_requests)
+
+        # auto-tuned batch size
+        es.msearch.reset_mock()
+        self.search_mod.search_batch_size = 0
+        self.assertEqual(self.search_mod.search(self.docs), sequential_results)
+        self.assertEqual(es.msearch.call_count, 1)
+
+        with self.assertRaises(ValueError):
+            modules.Search(self.docs, self.docs, self.docs, search_batch_size=-1)
+
+    def test_async_pipeline_indices(self):
+        """test that the concurrent pipeline uses separate reference and translation indices"""
+        es = self.elasticsearch.return_value
+        es.msearch.reset_mock()
+        modules.Search(self.docs, self.docs, self.docs, concurrency=2, search_batch_size=4)
+
+        indices = set(call[1]["index"] for call in es.msearch.call_args_list)
+        self.assertEqual(indices, set(["clireval_ref", "clireval_mt"]))
+        # 6 queries in chunks of 4 for each of the two indices
+        self.assertEqual(es.msearch.call_count, 4)
+
+        with self.assertRaises(ValueError):
+            modules.Search(self.docs, self.docs, self.docs, concurrency=0)
+
+    def test_multiple_systems(self):
+        """test that every system gets its own index and res file"""
+        es = self.elasticsearch.return_value
+        for concurrency in [1, 2]:
+            es.indices.create.reset_mock()
+            search = modules.Search(self.docs,
+                                    {"sys1": self.docs, "sys2": self.docs},
+                                    self.docs,
+                                    concurrency=concurrency)
+            res_files = search.get_res_files()
+            self.assertEqual(list(res_files.keys()), ["sys1", "sys2"])
+
+            indices = [call[1]["index"] for call in es.indices.create.call_args_list]
+            self.assertIn("clireval_mt_0", indices)
+            self.assertIn("clireval_mt_1", indices)
+
+            for res_file in res_files.values():
+                with open(res_file) as f_res, open(self.default_ref_res_file) as f_res_ref:
+                    self.assertEqual(f_res.read(), f_res_ref.read())
+
+    def test_search_batched_error(self):
+        """test that a failed query in a _msearch batch raises an exception"""
+        es = self.elasticsearch.return_value
+        es.msearch.side_effect = None
+        es.msearch.return_value = {"responses": [{"error": "failed"}]}
+
+        with self.assertRaises(Exception):
+            self.search_mod.search(self.docs[:1])
+
     def test_search(self):
         """test search results on mock queries and docs"""
 
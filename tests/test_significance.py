@@ -0,0 +1,110 @@
+import os
+import time
+import unittest
+from unittest import mock
+import numpy as np
+from context import modules
+from fixtures import MT_DOCS, REF_DOCS
+from modules import SignificanceTest
+
+
+class TestSignificanceTest(unittest.TestCase):
+    @classmethod
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.n_queries = 200
+        base = rng.random(self.n_queries)
+        noise = rng.normal(0.0, 0.05, self.n_queries)
+        self.systems = {
+            "base": {str(i): {"map": base[i], "ndcg": base[i]} for i in range(self.n_queries)},
+            "better": {str(i): {"map": base[i] + 0.05 + noise[i], "ndcg": base[i]}
+                       for i in range(self.n_queries)},
+            # a query without results counts as 0.0
+            "noisy": {str(i): {"map": base[i] + noise[i], "ndcg": base[i]}
+                      for i in range(1, self.n_queries)}}
+
+    def test_run(self):
+        """p-values and confidence intervals of every pair of systems and metric"""
+        comparisons = SignificanceTest(self.systems).run(2000, seed=1)
+        self.assertEqual([(c["metric"], c["system_a"], c["system_b"]) for c in comparisons],
+                         [("map", "base", "better"), ("map", "base", "noisy"),
+                          ("map", "better", "noisy"), ("ndcg", "base", "better"),
+                          ("ndcg", "base", "noisy"), ("ndcg", "better", "noisy")])
+        better, noisy, identical = comparisons[0], comparisons[1], comparisons[3]
+        self.assertAlmostEqual(better["difference"], better["mean_a"] - better["mean_b"])
+        self.assertLess(better["ci_high"], 0.0)
+        self.assertLess(better["ci_low"], better["difference"])
+        self.assertLess(better["bootstrap_p"], 0.01)
+        self.assertLess(better["randomization_p"], 0.01)
+        # the observed sample counts as one more sample
+        self.assertGreaterEqual(min(c["bootstrap_p"] for c in comparisons), 1 / 2001)
+        self.assertGreaterEqual(min(c["randomization_p"] for c in comparisons), 1 / 2001)
+        self.assertGreater(noisy["bootstrap_p"], 0.01)
+        self.assertGreater(noisy["randomization_p"], 0.01)
+        self.assertLess(noisy["ci_low"], noisy["difference"])
+        self.assertGreater(noisy["ci_high"], noisy["difference"])
+        self.assertEqual((identical["ci_low"], identical["ci_high"]), (0.0, 0.0))
+        self.assertEqual((identical["bootstrap_p"], identical["randomization_p"]), (1.0, 1.0))
+
+        # the same seed gives the same results
+        test = SignificanceTest(self.systems, ["map"])
+        self.assertEqual(test.run(500, seed=2), test.run(500, seed=2))
+        report = test.get_report(500, 0.1, seed=2)
+        self.assertEqual((report["samples"], report["confidence"], report["n_queries"]),
+                         (500, 0.9, self.n_queries))
+        with self.assertRaises(ValueError):
+            test.run(0)
+        with self.assertRaises(ValueError):
+            test.run(100, alpha=1.0)
+        with self.assertRaises(ValueError):
+            SignificanceTest({"base": self.systems["base"]})
+        with self.assertRaises(ValueError):
+            SignificanceTest(self.systems, ["num_q"])
+        with self.assertRaises(ValueError):
+            SignificanceTest(self.systems, ["gm_map"])
+
+    def test_sampling(self):
+        """sample statistics are the means of the sampled index and swap matrices"""
+        diffs = np.random.default_rng(3).normal(size=(3, 50))
+        with mock.patch.object(SignificanceTest, "bootstrap_block", 200), \
+                mock.patch.object(SignificanceTest, "randomization_block", 50):
+            means = SignificanceTest.bootstrap(diffs, 7, np.random.default_rng(4))
+            rng = np.random.default_rng(4)
+            indices = np.concatenate([rng.integers(0, 50, size=(1, 50)) for _ in range(7)])
+            np.testing.assert_allclose(means, diffs[:, indices].mean(axis=2))
+
+            means = SignificanceTest.randomization(diffs, 5, np.random.default_rng(5))
+            rng = np.random.default_rng(5)
+            swaps = np.concatenate([np.unpackbits(np.frombuffer(rng.bytes(7), dtype=np.uint8),
+                                                  count=50) for _ in range(5)]).reshape(5, 50)
+            np.testing.assert_allclose(means, (diffs[:, None, :] * (1 - 2 * swaps.astype(int))).mean(axis=2))
+
+    def test_from_files(self):
+        """per-query metrics of results files, compared with the native engine"""
+        script_path = os.path.dirname(os.path.abspath(__file__))
+        qrel_file = os.path.join(script_path, 'test_data/default.qrel')
+        res_file = os.path.join(script_path, 'test_data/default.res')
+        test = SignificanceTest.from_files(qrel_file, {"a": res_file, "b": res_file})
+        metrics = modules.NativeTrecEval.from_files(qrel_file, res_file).get_metrics(
+            ["map", "ndcg"])
+        for comparison in test.run(100, seed=0):
+            self.assertAlmostEqual(comparison["mean_a"], metrics[comparison["metric"]])
+            self.assertEqual(comparison["difference"], 0.0)
+
+    def test_from_evaluate(self):
+        """per-query metrics of several systems of modules.evaluate"""
+        metrics, per_query = modules.evaluate(REF_DOCS, {"mt": MT_DOCS, "ref": REF_DOCS},
+                                              n_ret=4, relv_mode="percentile", per_query=True)
+        comparison = SignificanceTest(per_query, ["map"]).run(100, seed=0)[0]
+        self.assertAlmostEqual(comparison["mean_a"], metrics["mt"]["map"], places=4)
+        self.assertAlmostEqual(comparison["mean_b"], metrics["ref"]["map"], places=4)
+
+    def test_speed(self):
+        """10000 samples of 5000 queries take about a second"""
+        rng = np.random.default_rng(6)
+        systems = {system: {str(i): {"map": value} for i, value in enumerate(rng.random(5000))}
+                   for system in ["a", "b"]}
+        test = SignificanceTest(systems, ["map"])
+        start = time.time()
+        test.run(10000, seed=0)
+        self.assertLess(time.time() - start, 5.0)
@@ -0,0 +1,55 @@
+import unittest
+import numpy as np
+from context import modules
+
+
+class TestSparseScores(unittest.TestCase):
+    @classmethod
+    def setUp(self):
+        self.query_ids = ["q1", "q2", "q3"]
+        self.doc_ids = ["1", "2", "3", "4"]
+        self.search_results = [("q1", "3", 3.0), ("q1", "1", 6.0),
+                               ("q3", "2", 2.0), ("q3", "4", 1.0),
+                               ("q3", "2", 4.0), ("q4", "1", 1.0), ("q1", "5", 1.0)]
+        self.score_matrix = np.array([[6.0, 0.0, 3.0, 0.0],
+                                      [0.0, 0.0, 0.0, 0.0],
+                                      [0.0, 4.0, 0.0, 1.0]])
+
+    def test_from_results(self):
+        """unknown ids are ignored, the last score of a repeated pair is kept"""
+        scores = modules.SparseScores.from_results(
+            self.search_results, self.query_ids, self.doc_ids)
+        self.assertEqual(scores.shape, (3, 4))
+        self.assertEqual(scores.nnz, 4)
+        self.assertEqual(scores.indptr.tolist(), [0, 2, 2, 4])
+        self.assertEqual(scores.indices.tolist(), [0, 2, 1, 3])
+        self.assertEqual(scores.get_row_ids().tolist(), [0, 0, 2, 2])
+        np.testing.assert_array_equal(scores.toarray(), self.score_matrix)
+        np.testing.assert_array_equal(scores.get_row(2), self.score_matrix[2])
+
+        scores = modules.SparseScores.from_results([], self.query_ids, self.doc_ids)
+        np.testing.assert_array_equal(scores.toarray(), np.zeros((3, 4)))
+
+        with self.assertRaises(ValueError):
+            modules.SparseScores([0, 1], [0], [1.0, 2.0], (1, 4))
+
+    def test_normalize(self):
+        """rows are divided by their maximum"""
+        scores = modules.SparseScores.from_dense(self.score_matrix).normalize()
+        np.testing.assert_array_equal(
+            scores.toarray(),
+            modules.RelvConverter.normalize_matrix(self.score_matrix))
+
+    def test_get_order_statistics(self):
+        """order statistics count the implicit zeros"""
+        scores = modules.SparseScores.from_dense(self.score_matrix)
+        sorted_matrix = np.sort(self.score_matrix, axis=1)
+        for k in range(self.score_matrix.shape[1]):
+            np.testing.assert_array_equal(scores.get_order_statistics(k), sorted_matrix[:, k])
+
+    def test_get_rows(self):
+        """row ranges are matrices of their own"""
+        scores = modules.SparseScores.from_dense(self.score_matrix)
+        for start, end in [(0, 3), (1, 3), (0, 1), (2, 2)]:
+            np.testing.assert_array_equal(scores.get_rows(start, end).toarray(),
+                                          self.score_matrix[start:end])
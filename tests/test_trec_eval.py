@@ -1,10 +1,13 @@
 import os
+import json
+import math
+import tempfile
 import unittest
 from context import modules
 
 
 class TestTrecEval(unittest.TestCase):
-    """This suite of tests assume that trec_eval is downloaded and compiled"""
+    """Metrics of the native engine match the output of trec_eval -m all_trec -M1000"""
     @classmethod
     def setUp(self):
         script_path = os.path.dirname(os.path.abspath(__file__))
@@ -30,3 +33,120 @@ class TestTrecEval(unittest.TestCase):
             self.assertEqual(
                 self.metrics_dict[metric_name],
                 metrics[metric_name])
+
+    def test_select_metrics(self):
+        """only the selected metrics and measure families are reported"""
+        metrics = modules.TrecEval(self.qrel_file, self.res_file,
+                                   metrics=["P", "map", "num_rel_ret"]).get_metrics()
+        self.assertEqual(list(metrics.keys()),
+                         ["num_rel_ret", "map", "P_5", "P_10", "P_15", "P_20", "P_30",
+                          "P_100", "P_200", "P_500", "P_1000"])
+        self.assertEqual(metrics["num_rel_ret"], 30)
+        self.assertEqual(metrics["P_10"], self.metrics_dict["P_10"])
+
+        with self.assertRaises(ValueError):
+            modules.TrecEval(self.qrel_file, self.res_file, metrics=["P_7"])
+
+    def test_trec_eval_engine(self):
+        """the trec_eval engine needs the trec_eval binary"""
+        trec_eval_bin = modules.TrecEval.trec_eval_bin
+        modules.TrecEval.trec_eval_bin = "/nonexistent/trec_eval"
+        try:
+            with self.assertRaises(Exception):
+                modules.TrecEval(self.qrel_file, self.res_file, engine="trec_eval")
+        finally:
+            modules.TrecEval.trec_eval_bin = trec_eval_bin
+
+
+class TestNativeTrecEval(unittest.TestCase):
+    @classmethod
+    def setUp(self):
+        self.qrels = {"1": {"a": 2, "b": 0, "c": 1, "d": 1},
+                      "2": {"a": 1}}
+        self.results = {"1": {"a": 1.0, "b": 3.0, "x": 2.0, "c": 2.0},
+                    "2": {"b": 5.0},
+                    "3": {"a": 1.0}}
+        self.trec_eval = modules.NativeTrecEval(self.qrels, self.results)
+
+    def test_ranking(self):
+        """documents are ranked by score, then by docno (descending)"""
+        self.assertEqual(self.trec_eval.query_ids, ["1", "2"])
+        # ranking of query 1: b (3.0), x (2.0), c (2.0), a (1.0)
+        self.assertEqual(self.trec_eval.labels[0].tolist(), [0, -1, 1, 2])
+        self.assertEqual(self.trec_eval.num_rel.tolist(), [3, 1])
+        self.assertEqual(self.trec_eval.num_nonrel.tolist(), [1, 0])
+
+    def test_per_query_metrics(self):
+        """per-query values follow the trec_eval definitions"""
+        metrics = self.trec_eval.get_per_query_metrics(
+            ["map", "recip_rank", "P_5", "Rprec", "bpref", "ndcg", "set_F"])
+        query_1 = metrics["1"]
+        self.assertAlmostEqual(query_1["map"], (1 / 3 + 2 / 4) / 3)
+        self.assertAlmostEqual(query_1["recip_rank"], 1 / 3)
+        self.assertAlmostEqual(query_1["P_5"], 2 / 5)
+        self.assertAlmostEqual(query_1["Rprec"], 1 / 3)
+        # one judged non-relevant document is ranked above both relevant documents
+        self.assertAlmostEqual(query_1["bpref"], 0.0)
+        dcg = 1 / math.log2(4) + 2 / math.log2(5)
+        ideal_dcg = 2 + 1 / math.log2(3) + 1 / math.log2(4)
+        self.assertAlmostEqual(query_1["ndcg"], dcg / ideal_dcg)
+        self.assertAlmostEqual(query_1["set_F"], 2 * 0.5 * (2 / 3) / (0.5 + 2 / 3))
+        self.assertEqual(metrics["2"]["map"], 0.0)
+
+    def test_summary_metrics(self):
+        """summary values are means, sums of counts and geometric means"""
+        metrics = self.trec_eval.get_metrics(["num_q", "num_ret", "map", "gm_map"])
+        self.assertEqual(metrics["num_q"], 2)
+        self.assertEqual(metrics["num_ret"], 5)
+        self.assertAlmostEqual(metrics["map"], (1 / 3 + 2 / 4) / 6)
+        self.assertAlmostEqual(metrics["gm_map"], math.sqrt((1 / 3 + 2 / 4) / 3 * 0.00001))
+
+    def test_max_retrieved(self):
+        """rankings are truncated to max_retrieved documents"""
+        run = {"1": {str(i): float(i) for i in range(1200)}}
+        qrels = {"1": {"0": 1}}
+        trec_eval = modules.NativeTrecEval(qrels, run)
+        self.assertEqual(trec_eval.labels.shape, (1, 1000))
+        self.assertEqual(trec_eval.get_metrics(["num_rel_ret"])["num_rel_ret"], 0)
+
+
+class TestTrecEvalOutput(unittest.TestCase):
+
+    def test_print_system_metrics(self):
+        """test the combined output of several systems"""
+        system_metrics = {"sys1": {"map": 0.5, "P_5": 0.2},
+                          "sys2": {"map": 0.25, "P_5": 0.4}}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_file = os.path.join(tmp_dir, "metrics.json")
+            tsv_file = os.path.join(tmp_dir, "metrics.tsv")
+            modules.TrecEval.print_system_metrics(system_metrics, "json", json_file)
+            modules.TrecEval.print_system_metrics(system_metrics, "tsv", tsv_file)
+
+            with open(json_file) as f:
+                self.assertEqual(json.load(f), system_metrics)
+            with open(tsv_file) as f:
+                self.assertEqual(f.read(),
+                                 "metric\tsys1\tsys2\nmap\t0.5\t0.25\nP_5\t0.2\t0.4\n")
+
+    def test_print_significance(self):
+        """significance tests follow the metrics of the systems"""
+        system_metrics = {"sys1": {"map": 0.5}, "sys2": {"map": 0.25}}
+        significance = {"samples": 10, "confidence": 0.95, "n_queries": 2, "comparisons": [
+            {"metric": "map", "system_a": "sys1", "system_b": "sys2", "difference": 0.25,
+             "bootstrap_p": 0.5}]}
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            json_file = os.path.join(tmp_dir, "metrics.json")
+            tsv_file = os.path.join(tmp_dir, "metrics.tsv")
+            modules.TrecEval.print_system_metrics(system_metrics, "json", json_file,
+                                                  significance)
+            modules.TrecEval.print_system_metrics(system_metrics, "tsv", tsv_file, significance)
+
+            with open(json_file) as f:
+                self.assertEqual(json.load(f), {"metrics": system_metrics,
+                                                "significance": significance})
+            with open(tsv_file) as f:
+                self.assertEqual(f.read(), "metric\tsys1\tsys2\nmap\t0.5\t0.25\n\n"
+                                 "metric\tsystem_a\tsystem_b\tdifference\tbootstrap_p\n"
+                                 "map\tsys1\tsys2\t0.25\t0.5\n")
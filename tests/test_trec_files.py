@@ -0,0 +1,99 @@
+import io
+import random
+import tempfile
+import unittest
+import numpy as np
+from context import modules
+from modules.trec_files import is_npz_file, write_trec_file
+
+
+class TestTrecFiles(unittest.TestCase):
+    @classmethod
+    def setUp(self):
+        rng = random.Random(0)
+        self.query_ids = ["q%i" % i for i in range(20)]
+        self.doc_ids = ["d%i" % i for i in range(15)]
+
+        # default labels: unjudged, 0 and 2
+        default_labels = np.array([rng.choice([-1, 0, 2]) for _ in self.query_ids])
+        rows, cols, labels = [], [], []
+        for i in range(len(self.query_ids)):
+            for j in rng.sample(range(len(self.doc_ids)), rng.randint(0, 5)):
+                rows.append(i)
+                cols.append(j)
+                labels.append(rng.randint(0, 4))
+        self.qrels = modules.Qrels(
+            self.query_ids, self.doc_ids, default_labels,
+            modules.SparseScores.from_coo(rows, cols, np.array(labels, dtype=np.int8),
+                                          (len(self.query_ids), len(self.doc_ids))))
+
+        # rankings with tied scores and unjudged documents
+        self.results = [(query_id, doc_id, rng.choice([0.5, 1.0, rng.random() * 10]))
+                        for query_id in self.query_ids[2:] + ["unjudged"]
+                        for doc_id in rng.sample(self.doc_ids + ["x", "y"], 8)]
+
+    def test_qrels_text(self):
+        """qrel lines are identical to the per-line format"""
+        lines = []
+        for i, query_id in enumerate(self.query_ids):
+            row = self.qrels.labels.get_row(i)
+            stored = set(self.qrels.labels.indices[
+                self.qrels.labels.indptr[i]:self.qrels.labels.indptr[i + 1]].tolist())
+            for j, doc_id in enumerate(self.doc_ids):
+                label = row[j] if j in stored else self.qrels.default_labels[i]
+                if label >= 0:
+                    lines.append("%s\t0\t%s\t%s\n" % (query_id, doc_id, label))
+
+        for chunk_size in [1, 1 << 22]:
+            self.qrels.chunk_size = chunk_size
+            qrel_f = io.StringIO()
+            write_trec_file(qrel_f, self.qrels)
+            self.assertEqual(qrel_f.getvalue(), "".join(lines))
+
+    def test_run_text(self):
+        """res lines are identical to the per-line format"""
+        run = modules.Run(self.results)
+        run.chunk_size = 7
+        res_f = io.StringIO()
+        write_trec_file(res_f, run)
+        self.assertEqual(res_f.getvalue(), "".join(
+            "%s\tQ0\t%s\t%s\t%.5f\tSTANDARD\n" % (query_id, doc_id, 0, score)
+            for query_id, doc_id, score in self.results))
+
+        with self.assertRaises(ValueError):
+            write_trec_file(res_f, run, "csv")
+
+    def test_npz(self):
+        """npz files round-trip and give the same metrics as text files"""
+        with tempfile.NamedTemporaryFile(suffix='.npz') as qrel_npz, \
+                tempfile.NamedTemporaryFile(suffix='.npz') as res_npz, \
+                tempfile.NamedTemporaryFile(mode='w') as qrel_txt, \
+                tempfile.NamedTemporaryFile(mode='w') as res_txt:
+            write_trec_file(qrel_npz, self.qrels, "npz")
+            write_trec_file(res_npz, modules.Run(self.results), "npz")
+            write_trec_file(qrel_txt, self.qrels)
+            write_trec_file(res_txt, modules.Run(self.results))
+            for trec_f in [qrel_npz, res_npz, qrel_txt, res_txt]:
+                trec_f.flush()
+            self.assertTrue(is_npz_file(qrel_npz.name))
+            self.assertFalse(is_npz_file(qrel_txt.name))
+
+            qrels = modules.Qrels.load_npz(qrel_npz.name)
+            self.assertEqual(qrels.to_dict(), self.qrels.to_dict())
+            run = modules.Run.load_npz(res_npz.name)
+            self.assertEqual(run.to_dict(), modules.Run(self.results).to_dict())
+            with self.assertRaises(ValueError):
+                modules.Run.load_npz(qrel_npz.name)
+
+            expected = modules.NativeTrecEval.from_files(qrel_txt.name, res_txt.name)
+            for qrel_f, res_f in [(qrel_npz, res_npz), (qrel_npz, res_txt),
+                                  (qrel_txt, res_npz)]:
+                trec_eval = modules.NativeTrecEval.from_files(qrel_f.name, res_f.name)
+                self.assertEqual(trec_eval.query_ids, expected.query_ids)
+                for name in ["labels", "num_ret", "num_rel", "num_nonrel", "ideal_gains"]:
+                    np.testing.assert_array_equal(getattr(trec_eval, name),
+                                                  getattr(expected, name))
+                self.assertEqual(trec_eval.get_metrics(), expected.get_metrics())
+
+            with self.assertRaises(ValueError):
+                modules.TrecEval(qrel_npz.name, res_npz.name, engine='trec_eval')
@@ -0,0 +1,27 @@
+import os
+import tempfile
+import unittest
+from context import modules
+
+
+class TestVocabulary(unittest.TestCase):
+
+    def test_add_docs(self):
+        """terms keep their order of first appearance and count documents"""
+        vocabulary = modules.Vocabulary()
+        vocabulary.add_docs([["b", "c"], ["a", "c"]])
+        vocabulary.add_docs([])
+        vocabulary.add_docs([["c", "d"]])
+        self.assertEqual(len(vocabulary), 4)
+        self.assertEqual(vocabulary.get_queries(), [(0, "b"), (1, "c"), (2, "a"), (3, "d")])
+        self.assertEqual(vocabulary.doc_freqs.tolist(), [1, 3, 1, 1])
+
+    def test_save_and_load(self):
+        """a saved vocabulary is loaded unchanged"""
+        vocabulary = modules.Vocabulary(["x", "ä"], [2, 1])
+        with tempfile.TemporaryDirectory() as vocab_dir:
+            vocab_file = os.path.join(vocab_dir, "vocab.json")
+            vocabulary.save(vocab_file)
+            loaded = modules.Vocabulary.load(vocab_file)
+        self.assertEqual(loaded.get_terms(), ["x", "ä"])
+        self.assertEqual(loaded.doc_freqs.tolist(), [2, 1])